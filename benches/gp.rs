@@ -0,0 +1,147 @@
+use criterion::{
+    black_box, criterion_group, criterion_main, BenchmarkId, Criterion,
+};
+
+use rusty_machine::learning::gp::{ConstMean, GaussianProcess};
+use rusty_machine::learning::{toolkit::kernel, SupModel};
+use rusty_machine::linalg::{Matrix, Vector};
+
+use EOkit::gaussian_processes::engine::{RbfKernel, Workspace};
+
+fn ndvi_like(n: usize) -> (Vec<f64>, Vec<f64>) {
+    let x = (0..n).map(|i| i as f64 * 5.).collect();
+    let y = (0..n)
+        .map(|i| {
+            0.3 * (i as f64 * 2. * std::f64::consts::PI / 73.).sin()
+                + ((i * 7919) % 101) as f64 * 0.001
+        })
+        .collect();
+    (x, y)
+}
+
+fn bench_gp_engines(c: &mut Criterion) {
+    let mut group = c.benchmark_group("gp");
+    let forecast_amount = 10;
+
+    for n in [50, 100, 200, 400].iter() {
+        let (x, y) = ndvi_like(*n);
+        let x_f32: Vec<f32> = x.iter().map(|x| *x as f32).collect();
+        let y_f32: Vec<f32> = y.iter().map(|y| *y as f32).collect();
+
+        let mut workspace = Workspace::default();
+        let mut output = vec![0.; n + forecast_amount];
+
+        group.bench_with_input(
+            BenchmarkId::new("engine_f64", n),
+            n,
+            |b, _| {
+                b.iter(|| {
+                    workspace
+                        .predict(
+                            RbfKernel::new(30., 0.5),
+                            0.1,
+                            0,
+                            black_box(&x),
+                            black_box(&y),
+                            &x,
+                            8,
+                            &mut output,
+                        )
+                        .unwrap()
+                })
+            },
+        );
+
+        let mut workspace_f32 = Workspace::default();
+        let mut output_f32 = vec![0_f32; n + forecast_amount];
+
+        group.bench_with_input(
+            BenchmarkId::new("engine_f32", n),
+            n,
+            |b, _| {
+                b.iter(|| {
+                    workspace_f32
+                        .predict(
+                            RbfKernel::new(30., 0.5),
+                            0.1,
+                            0,
+                            black_box(&x_f32),
+                            black_box(&y_f32),
+                            &x_f32,
+                            8,
+                            &mut output_f32,
+                        )
+                        .unwrap()
+                })
+            },
+        );
+
+        group.bench_with_input(
+            BenchmarkId::new("rusty_machine", n),
+            n,
+            |b, _| {
+                b.iter(|| {
+                    let ker = kernel::SquaredExp::new(30., 0.5);
+                    let mut gp =
+                        GaussianProcess::new(ker, ConstMean::default(), 0.1);
+                    gp.train(
+                        &Matrix::new(*n, 1, black_box(x.clone())),
+                        &Vector::new(black_box(y.clone())),
+                    )
+                    .unwrap();
+
+                    let last = x[n - 1];
+                    let mut points = x.clone();
+                    points.extend(
+                        (1..forecast_amount + 1).map(|i| last + 8. * i as f64),
+                    );
+                    gp.predict(&Matrix::new(points.len(), 1, points)).unwrap()
+                })
+            },
+        );
+    }
+
+    group.finish();
+}
+
+fn bench_sparse_gp(c: &mut Criterion) {
+    // Exact inference grows with the cube of the length, the sparse
+    // approximation linearly for a fixed number of inducing points.
+    let mut group = c.benchmark_group("gp_sparse");
+    group.sample_size(10);
+
+    for n in [250, 500, 1000, 2000, 4000].iter() {
+        let (x, y) = ndvi_like(*n);
+        let mut workspace = Workspace::default();
+        let mut output = vec![0.; *n];
+
+        for inducing_points in [0, 50, 200].iter() {
+            let name = match inducing_points {
+                0 => "exact".to_string(),
+                k => format!("inducing_{}", k),
+            };
+
+            group.bench_with_input(BenchmarkId::new(name, n), n, |b, _| {
+                b.iter(|| {
+                    workspace
+                        .predict(
+                            RbfKernel::new(30., 0.5),
+                            0.1,
+                            *inducing_points,
+                            black_box(&x),
+                            black_box(&y),
+                            &x,
+                            8,
+                            &mut output,
+                        )
+                        .unwrap()
+                })
+            });
+        }
+    }
+
+    group.finish();
+}
+
+criterion_group!(benches, bench_gp_engines, bench_sparse_gp);
+criterion_main!(benches);
@@ -0,0 +1,236 @@
+use criterion::{
+    black_box, criterion_group, criterion_main, BenchmarkId, Criterion,
+    Throughput,
+};
+
+use EOkit::gaussian_processes::gp::multiple_gps;
+use EOkit::math_utils::convolve::{
+    convolve_1d_with, output_length, ConvMethod, ConvType,
+};
+use EOkit::smoothers::sav_golay::multiple_sav_golays;
+use EOkit::smoothers::whittaker::multiple_whittakers;
+
+const SERIES_LENGTHS: [usize; 3] = [73, 365, 730];
+const BATCH_SIZES: [usize; 2] = [100, 1000];
+const THREADS: [i64; 3] = [1, 4, -1];
+
+/// `n_series` NDVI-like series of length `n`, back to back: a seasonal
+/// cycle of 5-day revisits with pixel to pixel phase shifts, deterministic
+/// noise and every 13th value pulled down as if cloudy.
+fn ndvi_batch(n_series: usize, n: usize) -> (Vec<f64>, Vec<usize>) {
+    let values = (0..n_series * n)
+        .map(|k| {
+            let (pixel, i) = (k / n, k % n);
+            let phase = (pixel % 17) as f64 * 0.1;
+            let clear = 0.45
+                + 0.3
+                    * (i as f64 * 2. * std::f64::consts::PI / 73. + phase)
+                        .sin()
+                + ((k * 7919) % 101) as f64 * 0.0005;
+            if (k * 31) % 13 == 0 {
+                clear * 0.3
+            } else {
+                clear
+            }
+        })
+        .collect();
+
+    let starts = (0..n_series).map(|pixel| pixel * n).collect();
+
+    (values, starts)
+}
+
+fn batch_id(n: usize, n_series: usize, n_threads: i64) -> String {
+    format!("n{}_batch{}_threads{}", n, n_series, n_threads)
+}
+
+fn bench_multiple_whittakers(c: &mut Criterion) {
+    let mut group = c.benchmark_group("multiple_whittakers");
+    group.sample_size(10);
+
+    for n in SERIES_LENGTHS.iter() {
+        for n_series in BATCH_SIZES.iter() {
+            let (mut y, mut starts) = ndvi_batch(*n_series, *n);
+            let mut weights = vec![1.; y.len()];
+            let mut output = vec![0.; y.len()];
+            group.throughput(Throughput::Elements(y.len() as u64));
+
+            for n_threads in THREADS.iter() {
+                group.bench_function(
+                    BenchmarkId::new(
+                        "d2",
+                        batch_id(*n, *n_series, *n_threads),
+                    ),
+                    |b| {
+                        b.iter(|| {
+                            multiple_whittakers(
+                                std::ptr::null_mut(),
+                                false,
+                                black_box(y.as_mut_ptr()),
+                                weights.as_mut_ptr(),
+                                std::ptr::null_mut(),
+                                starts.as_mut_ptr(),
+                                starts.len(),
+                                output.as_mut_ptr(),
+                                output.len(),
+                                10.,
+                                2,
+                                std::ptr::null_mut(),
+                                *n_threads,
+                                -1,
+                            )
+                        })
+                    },
+                );
+            }
+        }
+    }
+
+    group.finish();
+}
+
+fn bench_multiple_sav_golays(c: &mut Criterion) {
+    let mut group = c.benchmark_group("multiple_sav_golays");
+    group.sample_size(10);
+
+    for n in SERIES_LENGTHS.iter() {
+        for n_series in BATCH_SIZES.iter() {
+            let (mut y, mut starts) = ndvi_batch(*n_series, *n);
+            let mut output = vec![0.; y.len()];
+            group.throughput(Throughput::Elements(y.len() as u64));
+
+            for n_threads in THREADS.iter() {
+                group.bench_function(
+                    BenchmarkId::new(
+                        "window7_order2",
+                        batch_id(*n, *n_series, *n_threads),
+                    ),
+                    |b| {
+                        b.iter(|| {
+                            multiple_sav_golays(
+                                black_box(y.as_mut_ptr()),
+                                std::ptr::null_mut(),
+                                starts.as_mut_ptr(),
+                                starts.len(),
+                                output.as_mut_ptr(),
+                                output.len(),
+                                7,
+                                2,
+                                0,
+                                1.,
+                                std::ptr::null_mut(),
+                                *n_threads,
+                                -1,
+                            )
+                        })
+                    },
+                );
+            }
+        }
+    }
+
+    group.finish();
+}
+
+fn bench_multiple_gps(c: &mut Criterion) {
+    let mut group = c.benchmark_group("multiple_gps");
+    group.sample_size(10);
+    let forecast_amount = 4;
+
+    // Exact GPs are cubic in the series length, so the longest series are
+    // left to the sparse benchmarks.
+    for n in SERIES_LENGTHS[..2].iter() {
+        for n_series in BATCH_SIZES.iter() {
+            let (mut y, mut starts) = ndvi_batch(*n_series, *n);
+            let mut x: Vec<f64> =
+                (0..y.len()).map(|k| (k % n) as f64 * 5.).collect();
+            let mut output = vec![0.; y.len() + n_series * forecast_amount];
+            group.throughput(Throughput::Elements(y.len() as u64));
+
+            for n_threads in THREADS.iter() {
+                group.bench_function(
+                    BenchmarkId::new(
+                        "exact",
+                        batch_id(*n, *n_series, *n_threads),
+                    ),
+                    |b| {
+                        b.iter(|| {
+                            multiple_gps::<f64>(
+                                x.as_mut_ptr(),
+                                black_box(y.as_mut_ptr()),
+                                std::ptr::null_mut(),
+                                y.len(),
+                                starts.as_mut_ptr(),
+                                starts.len(),
+                                output.as_mut_ptr(),
+                                output.len(),
+                                5,
+                                forecast_amount as i64,
+                                30.,
+                                0.5,
+                                0.1,
+                                0,
+                                std::ptr::null_mut(),
+                                false,
+                                std::ptr::null_mut(),
+                                *n_threads,
+                                -1,
+                            )
+                        })
+                    },
+                );
+            }
+        }
+    }
+
+    group.finish();
+}
+
+fn bench_convolve(c: &mut Criterion) {
+    let mut group = c.benchmark_group("convolve_1d");
+
+    for n in [365, 3650].iter() {
+        let (signal, _) = ndvi_batch(1, *n);
+
+        for kernel_length in [11, 129].iter() {
+            let kernel: Vec<f64> =
+                (0..*kernel_length).map(|i| 1. / (1. + i as f64)).collect();
+            let mut output =
+                vec![0.; output_length(*n, *kernel_length, &ConvType::Full)];
+
+            for (name, method) in
+                [("direct", ConvMethod::Direct), ("fft", ConvMethod::Fft)]
+                    .iter()
+            {
+                group.bench_function(
+                    BenchmarkId::new(
+                        *name,
+                        format!("n{}_kernel{}", n, kernel_length),
+                    ),
+                    |b| {
+                        b.iter(|| {
+                            convolve_1d_with(
+                                black_box(&signal),
+                                &kernel,
+                                ConvType::Full,
+                                *method,
+                                &mut output,
+                            )
+                        })
+                    },
+                );
+            }
+        }
+    }
+
+    group.finish();
+}
+
+criterion_group!(
+    benches,
+    bench_multiple_whittakers,
+    bench_multiple_sav_golays,
+    bench_multiple_gps,
+    bench_convolve
+);
+criterion_main!(benches);
@@ -0,0 +1,63 @@
+use criterion::{
+    black_box, criterion_group, criterion_main, BenchmarkId, Criterion,
+};
+
+use EOkit::math_utils::banded::SymBandMatrix;
+use EOkit::smoothers::whittaker::{smooth_series, whittaker_sparse_reference};
+
+fn ndvi_like(n: usize) -> Vec<f64> {
+    (0..n)
+        .map(|i| {
+            0.5 + 0.3 * (i as f64 * 2. * std::f64::consts::PI / 73.).sin()
+                + ((i * 7919) % 101) as f64 * 0.001
+        })
+        .collect()
+}
+
+fn bench_whittaker_solvers(c: &mut Criterion) {
+    let mut group = c.benchmark_group("whittaker");
+
+    for n in [73, 365, 730, 3650].iter() {
+        let y_input = ndvi_like(*n);
+        let weights = vec![1.; *n];
+        let mut system = SymBandMatrix::default();
+        let mut output = vec![0.; *n];
+
+        group.bench_with_input(BenchmarkId::new("banded", n), n, |b, _| {
+            b.iter(|| {
+                smooth_series(
+                    None,
+                    black_box(&y_input),
+                    black_box(&weights),
+                    None,
+                    10.,
+                    2,
+                    &mut system,
+                    &mut output,
+                )
+                .unwrap()
+            })
+        });
+
+        group.bench_with_input(
+            BenchmarkId::new("sparse_ldl", n),
+            n,
+            |b, _| {
+                b.iter(|| {
+                    whittaker_sparse_reference(
+                        None,
+                        black_box(&y_input),
+                        black_box(&weights),
+                        10.,
+                        2,
+                    )
+                })
+            },
+        );
+    }
+
+    group.finish();
+}
+
+criterion_group!(benches, bench_whittaker_solvers);
+criterion_main!(benches);
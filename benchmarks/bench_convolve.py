@@ -0,0 +1,87 @@
+"""Benchmark EOkit's convolution and Savitzky-golay filter.
+
+Compares EOkit.math_utils.convolve against numpy.convolve, and the
+Savitzky-golay smoothers against scipy.signal.savgol_filter, on series
+lengths typical of EO time series (a year of 5-day revisits up to ten years of
+daily data). Requires SciPy.
+
+    python benchmarks/bench_convolve.py
+
+"""
+
+import timeit
+
+import numpy as np
+from scipy.signal import savgol_filter
+
+from EOkit import math_utils
+from EOkit.smoothers import sav_golay
+
+SERIES_LENGTHS = [73, 365, 730, 3650]
+KERNEL_LENGTHS = [5, 7, 11, 15, 129, 513]
+SAV_GOLAY_WINDOWS = [5, 7, 11]
+N_PIXELS = 10000
+REPEATS = 5
+
+
+def best_of(func, number):
+    return min(timeit.repeat(func, number=number, repeat=REPEATS)) / number
+
+
+def bench_convolve():
+    rng = np.random.default_rng(0)
+
+    print("convolve (valid mode), microseconds per call")
+    print(f"{'series':>8} {'kernel':>8} {'numpy':>10} {'eokit':>10} {'speedup':>8}")
+
+    for series_length in SERIES_LENGTHS:
+        signal = rng.standard_normal(series_length)
+
+        for kernel_length in KERNEL_LENGTHS:
+            if kernel_length > series_length:
+                continue
+
+            kernel = rng.standard_normal(kernel_length)
+
+            numpy_time = best_of(
+                lambda: np.convolve(signal, kernel, "valid"), number=200
+            )
+            eokit_time = best_of(
+                lambda: math_utils.convolve(signal, kernel, "valid"), number=200
+            )
+
+            print(
+                f"{series_length:>8} {kernel_length:>8} {numpy_time * 1e6:>10.2f} "
+                f"{eokit_time * 1e6:>10.2f} {numpy_time / eokit_time:>8.2f}"
+            )
+
+
+def bench_sav_golay():
+    rng = np.random.default_rng(0)
+
+    print()
+    print(f"Savitzky-golay over {N_PIXELS} pixels, milliseconds per batch")
+    print(f"{'series':>8} {'window':>8} {'scipy':>10} {'eokit':>10} {'speedup':>8}")
+
+    for series_length in SERIES_LENGTHS:
+        stack = rng.standard_normal((N_PIXELS, series_length))
+        stack_list = list(stack)
+
+        for window in SAV_GOLAY_WINDOWS:
+            scipy_time = best_of(
+                lambda: savgol_filter(stack, window, 2, axis=-1), number=1
+            )
+            eokit_time = best_of(
+                lambda: sav_golay.multiple_sav_golays(stack_list, window, 2),
+                number=1,
+            )
+
+            print(
+                f"{series_length:>8} {window:>8} {scipy_time * 1e3:>10.2f} "
+                f"{eokit_time * 1e3:>10.2f} {scipy_time / eokit_time:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    bench_convolve()
+    bench_sav_golay()
@@ -0,0 +1,71 @@
+"""Benchmark the sparse Gaussian process mode against exact inference.
+
+Runs multiple_gps on NDVI-like series from a year of 5-day revisits up to
+daily multi-sensor series, once with exact inference and once per number of
+inducing points. Reports the time per pixel and the largest difference from
+the exact posterior mean, so the accuracy knob can be read off directly.
+
+    python benchmarks/bench_sparse_gp.py
+
+"""
+
+import timeit
+
+import numpy as np
+
+from EOkit import gaussian_processes
+
+SERIES_LENGTHS = [73, 365, 1000, 3000]
+INDUCING_POINTS = [25, 50, 100, 200]
+N_PIXELS = 8
+REPEATS = 3
+
+
+def best_of(func, number):
+    return min(timeit.repeat(func, number=number, repeat=REPEATS)) / number
+
+
+def ndvi_like(rng, series_length):
+    days = np.arange(series_length, dtype=np.float64)
+    season = 0.5 + 0.3 * np.sin(days * 2 * np.pi / 365.0)
+
+    return days, season + rng.normal(0.0, 0.05, (N_PIXELS, series_length))
+
+
+def bench_sparse_gp():
+    rng = np.random.default_rng(0)
+
+    print("multiple_gps, milliseconds per pixel")
+    print(f"{'series':>8} {'inducing':>10} {'time':>10} {'speedup':>8} {'max err':>10}")
+
+    for series_length in SERIES_LENGTHS:
+        days, stack = ndvi_like(rng, series_length)
+        x_inputs = [days] * N_PIXELS
+        y_inputs = list(stack)
+
+        def run(inducing_points):
+            return gaussian_processes.multiple_gps(
+                x_inputs, y_inputs, 1, 0, inducing_points=inducing_points
+            )
+
+        exact = np.concatenate(run(None))
+        exact_time = best_of(lambda: run(None), number=1) / N_PIXELS
+
+        print(f"{series_length:>8} {'exact':>10} {exact_time * 1e3:>10.3f}")
+
+        for inducing_points in INDUCING_POINTS:
+            if inducing_points >= series_length:
+                continue
+
+            sparse = np.concatenate(run(inducing_points))
+            sparse_time = best_of(lambda: run(inducing_points), number=1) / N_PIXELS
+
+            print(
+                f"{series_length:>8} {inducing_points:>10} "
+                f"{sparse_time * 1e3:>10.3f} {exact_time / sparse_time:>8.2f} "
+                f"{np.max(np.abs(sparse - exact)):>10.2e}"
+            )
+
+
+if __name__ == "__main__":
+    bench_sparse_gp()
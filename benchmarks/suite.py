@@ -0,0 +1,378 @@
+"""Benchmark suite for EOkit's kernels and their Python wrappers.
+
+Times the single_* and multiple_* GP, Whittaker and Savitzky-golay wrappers,
+math_utils.convolve and the fixed cost of a wrapper call, on synthetic
+NDVI-like series over a grid of series lengths, batch sizes and thread
+counts. Results are written as JSON, and can be compared against a stored
+baseline from an earlier run, exiting with status 1 on any regression.
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --quick --baseline results.json
+    python benchmarks/suite.py --only whittaker --threads 1 4
+
+The Rust kernels on their own are covered by the criterion benches in
+benches/ (cargo bench).
+
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import sys
+import timeit
+
+import numpy as np
+
+import EOkit
+from EOkit import gaussian_processes, math_utils
+from EOkit.smoothers import sav_golay, whittaker
+
+SERIES_LENGTHS = [73, 365, 730, 3650]
+BATCH_SIZES = [100, 1000, 10000]
+THREADS = [1, 2, 4, -1]
+
+QUICK_SERIES_LENGTHS = [73, 365]
+QUICK_BATCH_SIZES = [100, 1000]
+QUICK_THREADS = [1, -1]
+
+# Exact GPs are cubic in the series length, so longer series are left to
+# bench_sparse_gp.py.
+GP_MAX_LENGTH = 365
+
+# Length of the series timed for the fixed cost of a wrapper call.
+OVERHEAD_LENGTH = 16
+
+CONVOLVE_KERNELS = [11, 129]
+REPEATS = 5
+SEED = 0
+
+
+def ndvi_like(rng, n_series, series_length, cloud_fraction=0.1):
+    """Return the days and an (n_series, series_length) stack of NDVI-like data.
+
+    Every pixel follows a seasonal cycle sampled every 5 days, with its own
+    amplitude and phase, plus noise. A cloud_fraction of the values are pulled
+    down towards zero as if cloud contaminated.
+    """
+    days = np.arange(series_length, dtype=np.float64) * 5.0
+
+    amplitude = rng.uniform(0.2, 0.4, (n_series, 1))
+    phase = rng.uniform(0.0, 2 * np.pi, (n_series, 1))
+    season = 0.45 + amplitude * np.sin(days * 2 * np.pi / 365.0 + phase)
+
+    stack = season + rng.normal(0.0, 0.03, (n_series, series_length))
+
+    cloudy = rng.random((n_series, series_length)) < cloud_fraction
+    stack[cloudy] *= rng.uniform(0.1, 0.5, cloudy.sum())
+
+    return days, np.clip(stack, -1.0, 1.0)
+
+
+def time_call(func):
+    """Return the best and mean seconds per call of func."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times = np.array(timer.repeat(repeat=REPEATS, number=number)) / number
+
+    return float(times.min()), float(times.mean())
+
+
+def single_cases(rng, series_lengths):
+    """Yield (name, params, n_series, func, args, kwargs) per single series case."""
+    for series_length in series_lengths:
+        days, stack = ndvi_like(rng, 1, series_length)
+        y = stack[0]
+        weights = np.ones(series_length)
+        params = {"series_length": series_length}
+
+        yield (
+            "single_whittaker",
+            params,
+            1,
+            whittaker.single_whittaker,
+            (days, y, weights, 10.0, 2),
+            {},
+        )
+        yield "single_sav_golay", params, 1, sav_golay.single_sav_golay, (y, 7, 2), {}
+
+        if series_length <= GP_MAX_LENGTH:
+            yield (
+                "single_gp",
+                params,
+                1,
+                gaussian_processes.single_gp,
+                (days, y, 5, 4),
+                {},
+            )
+
+        for kernel_length in CONVOLVE_KERNELS:
+            if kernel_length > series_length:
+                continue
+
+            yield (
+                "convolve",
+                dict(params, kernel_length=kernel_length),
+                1,
+                math_utils.convolve,
+                (y, rng.standard_normal(kernel_length), "full"),
+                {},
+            )
+
+
+def multiple_cases(rng, series_lengths, batch_sizes, threads):
+    """Yield (name, params, n_series, func, args, kwargs) per batch case."""
+    for series_length in series_lengths:
+        for batch_size in batch_sizes:
+            days, stack = ndvi_like(rng, batch_size, series_length)
+            y_inputs = list(stack)
+            weights_inputs = [np.ones(series_length)] * batch_size
+            x_inputs = [days] * batch_size
+
+            for n_threads in threads:
+                params = {
+                    "series_length": series_length,
+                    "batch_size": batch_size,
+                    "n_threads": n_threads,
+                }
+                kwargs = {"n_threads": n_threads}
+
+                yield (
+                    "multiple_whittakers",
+                    params,
+                    batch_size,
+                    whittaker.multiple_whittakers,
+                    (y_inputs, weights_inputs, 10.0, 2),
+                    kwargs,
+                )
+                yield (
+                    "multiple_sav_golays",
+                    params,
+                    batch_size,
+                    sav_golay.multiple_sav_golays,
+                    (y_inputs, 7, 2),
+                    kwargs,
+                )
+
+                if series_length <= GP_MAX_LENGTH:
+                    yield (
+                        "multiple_gps",
+                        params,
+                        batch_size,
+                        gaussian_processes.multiple_gps,
+                        (x_inputs, y_inputs, 5, 4),
+                        kwargs,
+                    )
+
+
+def overhead_cases(rng):
+    """Yield (name, params, n_series, func, args, kwargs) for the call overhead.
+
+    On a series this short the kernels take next to no time, so what is left
+    is argument checking, conversion and the FFI call.
+    """
+    days, stack = ndvi_like(rng, 1, OVERHEAD_LENGTH)
+    y = stack[0]
+    weights = np.ones(OVERHEAD_LENGTH)
+    params = {"series_length": OVERHEAD_LENGTH}
+    one_thread = {"n_threads": 1}
+
+    yield (
+        "overhead_single_whittaker",
+        params,
+        1,
+        whittaker.single_whittaker,
+        (days, y, weights, 10.0, 2),
+        {},
+    )
+    yield (
+        "overhead_single_sav_golay",
+        params,
+        1,
+        sav_golay.single_sav_golay,
+        (y, 5, 2),
+        {},
+    )
+    yield (
+        "overhead_multiple_whittakers",
+        params,
+        1,
+        whittaker.multiple_whittakers,
+        ([y], [weights], 10.0, 2),
+        one_thread,
+    )
+    yield (
+        "overhead_multiple_sav_golays",
+        params,
+        1,
+        sav_golay.multiple_sav_golays,
+        ([y], 5, 2),
+        one_thread,
+    )
+    yield (
+        "overhead_multiple_gps",
+        params,
+        1,
+        gaussian_processes.multiple_gps,
+        ([days], [y], 5, 0),
+        one_thread,
+    )
+
+
+def run_suite(series_lengths, batch_sizes, threads, only=None):
+    """Run every benchmark case and return a list of result records."""
+    rng = np.random.default_rng(SEED)
+
+    cases = itertools.chain(
+        single_cases(rng, series_lengths),
+        multiple_cases(rng, series_lengths, batch_sizes, threads),
+        overhead_cases(rng),
+    )
+
+    results = []
+
+    for name, params, n_series, func, args, kwargs in cases:
+        if only and not any(pattern in name for pattern in only):
+            continue
+
+        best, mean = time_call(lambda: func(*args, **kwargs))
+
+        record = {
+            "name": name,
+            "params": params,
+            "best_seconds": best,
+            "mean_seconds": mean,
+            "series_per_second": n_series / best,
+        }
+        results.append(record)
+
+        print(f"{result_key(record):<72} {best * 1e3:>12.4f} ms", flush=True)
+
+    return results
+
+
+def result_key(record):
+    """Identify a result by its benchmark name and parameters."""
+    params = ",".join(
+        f"{key}={value}" for key, value in sorted(record["params"].items())
+    )
+
+    return f"{record['name']}[{params}]"
+
+
+def metadata():
+    """Describe the machine and versions the results were measured with."""
+    return {
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "eokit_threads": EOkit.get_num_threads(),
+        "seed": SEED,
+        "repeats": REPEATS,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print the change from baseline of every result and return the regressions.
+
+    A result regresses if its best time is more than tolerance, as a fraction,
+    slower than the baseline's. Results missing from either side are listed
+    but not counted.
+    """
+    baseline_times = {
+        result_key(record): record["best_seconds"] for record in baseline["results"]
+    }
+
+    print()
+    print(f"{'benchmark':<72} {'baseline':>12} {'current':>12} {'change':>8}")
+
+    regressions = []
+
+    for record in results:
+        key = result_key(record)
+        current = record["best_seconds"]
+
+        if key not in baseline_times:
+            print(f"{key:<72} {'-':>12} {current * 1e3:>12.4f} {'new':>8}")
+            continue
+
+        previous = baseline_times.pop(key)
+        change = current / previous - 1.0
+        flag = " REGRESSION" if change > tolerance else ""
+
+        print(
+            f"{key:<72} {previous * 1e3:>12.4f} {current * 1e3:>12.4f} "
+            f"{change:>+8.1%}{flag}"
+        )
+
+        if change > tolerance:
+            regressions.append(key)
+
+    for key in baseline_times:
+        print(f"{key:<72} {'':>12} {'-':>12} {'missing':>8}")
+
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--quick", action="store_true", help="run a small grid for a fast check"
+    )
+    parser.add_argument("--series-lengths", type=int, nargs="+")
+    parser.add_argument("--batch-sizes", type=int, nargs="+")
+    parser.add_argument(
+        "--threads", type=int, nargs="+", help="thread counts, -1 for the shared pool"
+    )
+    parser.add_argument(
+        "--only", nargs="+", help="only run benchmarks whose name contains one of these"
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="slowdown, as a fraction, counted as a regression (default 0.1)",
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    series_lengths = args.series_lengths or (
+        QUICK_SERIES_LENGTHS if args.quick else SERIES_LENGTHS
+    )
+    batch_sizes = args.batch_sizes or (QUICK_BATCH_SIZES if args.quick else BATCH_SIZES)
+    threads = args.threads or (QUICK_THREADS if args.quick else THREADS)
+
+    results = run_suite(series_lengths, batch_sizes, threads, args.only)
+
+    report = {"metadata": metadata(), "results": results}
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+        regressions = compare(results, baseline, args.tolerance)
+
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}.")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3 @@
+from EOkit.array_utils import Scaling, SeriesStatus
+from EOkit.parallel import get_num_threads, set_num_threads
+from EOkit.ragged import RaggedSeries
@@ -1,5 +1,42 @@
+from collections import namedtuple
+from enum import IntEnum
+
 import numpy as np
 
+# Codes of the dtypes the cube functions read and write without converting
+# the array first.
+_DTYPE_CODES = {
+    np.dtype(np.float64): 0,
+    np.dtype(np.float32): 1,
+    np.dtype(np.int16): 2,
+    np.dtype(np.uint16): 3,
+}
+
+Scaling = namedtuple(
+    "Scaling", ["scale", "offset", "nodata"], defaults=(1.0, 0.0, None)
+)
+Scaling.__doc__ = """How stored values map to the values smoothed.
+
+A stored value s stands for s * scale + offset, and nodata, if not None, marks
+a missing value. For instance Scaling(1e-4, 0.0, -3000) for int16 NDVI.
+"""
+
+
+class SeriesStatus(IntEnum):
+    """Outcome of each series of a batch, as returned with return_status=True.
+
+    A series that could not be processed is all NaN in the result and the rest
+    of the batch is unaffected.
+    """
+
+    OK = 0
+    # Fewer values than the method needs.
+    TOO_SHORT = 1
+    # No valid value to fit, or non-finite x values.
+    NON_FINITE = 2
+    # The system of the series could not be factorised.
+    SOLVER_FAILURE = 3
+
 
 def check_type(array):
 
@@ -9,9 +46,167 @@ def check_type(array):
     return array
 
 
+def check_float_type(array):
+    """Keep float32 and float64 arrays as they are, converting others to float64."""
+
+    if array.dtype not in (np.float32, np.float64):
+        return array.astype(np.float64)
+
+    return array
+
+
+def check_encoded_type(array):
+    """Keep arrays the cube functions read natively, converting others to float64."""
+
+    if array.dtype not in _DTYPE_CODES:
+        return array.astype(np.float64)
+
+    return array
+
+
+def encoding_arguments(array, scaling=None):
+    """Return the dtype code, scale, offset and nodata of array for Rust.
+
+    A nodata of NaN stands for no nodata value.
+    """
+
+    if array.dtype not in _DTYPE_CODES:
+        raise ValueError(
+            "Arrays of dtype {} can not be read or written in place, use "
+            "one of {}.".format(
+                array.dtype.name, ", ".join(d.name for d in _DTYPE_CODES)
+            )
+        )
+
+    scale, offset, nodata = Scaling() if scaling is None else Scaling(*scaling)
+
+    return (
+        _DTYPE_CODES[array.dtype],
+        float(scale),
+        float(offset),
+        np.nan if nodata is None else float(nodata),
+    )
+
+
+def encoded_output(out, shape, out_dtype, scaling, out_scaling, dtype=np.float64):
+    """Return the array a cube function writes to and the scaling to write with.
+
+    The result has out_dtype, or that of out, or dtype if neither is given.
+    Integer results take the scaling of the input unless out_scaling is given.
+    """
+
+    if out_dtype is None:
+        out_dtype = dtype if out is None else out.dtype
+
+    result = output_array(out, shape, np.dtype(out_dtype))
+
+    if out_scaling is None and result.dtype.kind in "iu":
+        out_scaling = scaling
+
+    return result, out_scaling
+
+
 def check_contig(array):
 
     if not array.flags["C_CONTIGUOUS"]:
         return np.ascontiguousarray(array)
 
     return array
+
+
+def check_filter_parameters(window_size, order, deriv=0):
+    """Check the window, polynomial order and derivative of a Savitzky-Golay filter."""
+
+    if window_size < 1:
+        raise ValueError("window_size must be at least 1, got {}.".format(window_size))
+
+    if order < 0:
+        raise ValueError("order must be at least 0, got {}.".format(order))
+
+    if not 0 <= deriv <= order:
+        raise ValueError(
+            "deriv must be between 0 and order ({}), got {}.".format(order, deriv)
+        )
+
+
+def check_axis(axis, ndim):
+
+    if not -ndim <= axis < ndim:
+        raise ValueError(
+            "axis {} is out of bounds for {} dimensions".format(axis, ndim)
+        )
+
+    return axis % ndim
+
+
+def element_strides(array):
+    """Return the strides of an array in elements rather than bytes."""
+
+    if any(stride % array.itemsize for stride in array.strides):
+        raise ValueError("Array strides must be a multiple of its item size.")
+
+    return np.array(
+        [stride // array.itemsize for stride in array.strides], dtype=np.intp
+    )
+
+
+def flat_mask(mask, size):
+    """Return a list or array of validity masks as one flat uint8 buffer."""
+
+    if isinstance(mask, (list, tuple)):
+        if len(mask) == 0:
+            mask = np.empty(0, dtype=bool)
+        else:
+            mask = np.concatenate([np.asarray(m, dtype=bool).ravel() for m in mask])
+
+    mask = np.ascontiguousarray(mask, dtype=bool).ravel()
+
+    if mask.size != size:
+        raise ValueError("The mask must hold one entry per value.")
+
+    return mask.view(np.uint8)
+
+
+def broadcast_mask(mask, shape):
+    """Return a validity mask broadcast to shape as a uint8 array."""
+
+    return np.broadcast_to(np.asarray(mask, dtype=bool), shape).view(np.uint8)
+
+
+def output_array(out, shape, dtype=np.float64):
+    """Return out after checking it can take a result, or a new array."""
+
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+
+    if out.shape != tuple(shape) or out.dtype != dtype:
+        raise ValueError(
+            "out must be a {} array of shape {}.".format(
+                np.dtype(dtype).name, tuple(shape)
+            )
+        )
+
+    if not out.flags["WRITEABLE"]:
+        raise ValueError("out must be writable.")
+
+    return out
+
+
+def pixel_block(values, n_pixels, count, dtype=np.float64):
+    """Return per-pixel values of count acquisitions as a (n_pixels, count) array.
+
+    A 1D array of one value per pixel is accepted for a single acquisition.
+    """
+
+    values = np.asarray(values, dtype=dtype)
+
+    if values.ndim == 1 and count == 1:
+        values = values[:, None]
+
+    if values.shape != (n_pixels, count):
+        raise ValueError(
+            "Expected one value per pixel and acquisition, of shape "
+            "({}, {}).".format(n_pixels, count)
+        )
+
+    return check_contig(values)
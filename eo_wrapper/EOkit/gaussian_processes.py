@@ -9,7 +9,18 @@ sufficient for most EO applications.
 """
 
 import numpy as np
-from EOkit.array_utils import check_contig
+from EOkit.array_utils import (
+    broadcast_mask,
+    check_axis,
+    check_contig,
+    check_encoded_type,
+    element_strides,
+    encoded_output,
+    encoding_arguments,
+    flat_mask,
+    pixel_block,
+)
+from EOkit.ragged import RaggedSeries, as_ragged
 from .EOkit import lib
 from cffi import FFI
 
@@ -24,6 +35,9 @@ def single_gp(
     length_scale=50.0,
     amplitude=0.5,
     noise=0.01,
+    inducing_points=None,
+    return_std=False,
+    std_forecast_only=False,
 ):
     """Run a single RBF kernel GP on 1D data.
 
@@ -57,12 +71,27 @@ def single_gp(
         The amplitude of the RBF kernel, by default 0.5
     noise : float, optional
         Noise of the GP regresion, by default 0.01
+    inducing_points : int, optional
+        Use the sparse (DTC/VFE) approximation with this many inducing points
+        spread evenly over the x range of each series. It scales linearly
+        rather than cubically with the series length, and more inducing
+        points are more accurate. Series no longer than inducing_points, and
+        the default of None, use exact inference, by default None
+    return_std : bool, optional
+        Also return the posterior standard deviation of every prediction. It
+        comes from the same factorisation as the mean, and is that of the
+        latent function, so it excludes the noise, by default False
+    std_forecast_only : bool, optional
+        Only compute the standard deviations of the forecasts, which skips the
+        work for the smoothed values, by default False
 
     Returns
     -------
     ndarray of type float, size (N)
         A numpy array containing the smoothed/forecasted values. In the future
         this may also include the X variable for ease.
+    ndarray of type float, size (N) or (forecast_amount)
+        The posterior standard deviations, only returned with return_std.
 
     Examples
     --------
@@ -92,6 +121,10 @@ def single_gp(
     y_input_ptr = ffi.cast("double *", y_input_mean_removed.ctypes.data)
     result_ptr = ffi.cast("double *", result.ctypes.data)
 
+    std = _std_buffer(
+        return_std, std_forecast_only, result.size, forecast_amount, np.float64
+    )
+
     lib.rust_single_gp(
         x_input_ptr,
         y_input_ptr,
@@ -103,8 +136,14 @@ def single_gp(
         length_scale,
         amplitude,
         noise,
+        _inducing(inducing_points),
+        _std_pointer(std, "double *"),
+        bool(std_forecast_only),
     )
 
+    if return_std:
+        return result + np.mean(y_input), std
+
     return result + np.mean(y_input)
 
 
@@ -117,6 +156,12 @@ def multiple_gps(
     amplitude=0.5,
     noise=0.1,
     n_threads=-1,
+    chunk_size=-1,
+    mask=None,
+    inducing_points=None,
+    return_std=False,
+    std_forecast_only=False,
+    return_status=False,
 ):
     """Run multiple RBF kernel GPs on 1D data.
 
@@ -131,17 +176,30 @@ def multiple_gps(
     that the inputs can be of different lengths, which makes it easier when
     removing cloud cover or other types of null value.
 
+    When every series has exactly the same x values, as for pixels of one
+    raster stack, the GP posterior mean is the same linear operator for all of
+    them. It is then factorised once and applied to blocks of series as one
+    matrix product, instead of fitting a GP per series.
+
+    float32 inputs are smoothed in single precision and give float32 outputs,
+    which halves the memory traffic. Anything else runs in float64.
+
     Notes
     -----
-    NO NANS/INFS SHOULD ENTER THIS FUNCTION.
+    Missing values do not need to be removed first. NaNs, infs and values
+    flagged in mask are left out when each GP is trained, but a prediction is
+    still made at their x values. Series that are empty, without any valid
+    value, with non-finite x values or whose kernel matrix cannot be
+    factorised are NaN, and the rest of the batch is unaffected.
 
     Parameters
     ----------
-    x_inputs : list of ndarrays of type float, size (N)
-        A list of NumPy arrays containing the x_input variable.
-    y_inputs : list of ndarrays of type float, size (N)
+    x_inputs : list of ndarrays of type float, size (N), RaggedSeries or None
+        A list of NumPy arrays containing the x_input variable. May be None
+        when y_inputs is a RaggedSeries that carries x values.
+    y_inputs : list of ndarrays of type float, size (N) or RaggedSeries
         A list of NumPy arrays containing the y input (the variable to be
-        forecast/smoothed). Remove NaNs first.
+        forecast/smoothed).
     forecast_spacing : float
         The spacing of the forecast. E.g. the temporal resolution of the
         forecast.
@@ -155,89 +213,785 @@ def multiple_gps(
     noise : float, optional
         Noise of the GP regresion, by default 0.01
     n_threads : int, optional
-        Amount of worker threads spawned to complete the task. The default is -1
-        which uses all logical processor cores. To tone this down, use something
-        between 1 and the number of processor cores you have. Setting this value
-        to a number larger than the amount of logical cores you have will most
-        likely degreade performance.
+        Amount of worker threads used to complete the task. The default is -1
+        which runs on the shared worker pool, sized by EOkit.set_num_threads or
+        the EOKIT_NUM_THREADS environment variable. Any other value runs on a
+        pool of exactly that many threads, which is kept alive until a call
+        asks for another size. Setting this value to a number larger than the
+        amount of logical cores you have will most likely degreade performance.
+    chunk_size : int, optional
+        Number of series handed to a worker thread at a time. The default is -1
+        which groups series into chunks of similar estimated cost, starting
+        with the most expensive ones. Larger chunks lower the scheduling
+        overhead for very many short series, by default -1
+    mask : list of ndarrays of type bool, size (N), optional
+        Validity of each value, where False marks a value as missing. The
+        default of None treats every finite value as valid, by default None
+    inducing_points : int, optional
+        Use the sparse (DTC/VFE) approximation with this many inducing points
+        spread evenly over the x range of each series. It scales linearly
+        rather than cubically with the series length, and more inducing
+        points are more accurate. Series no longer than inducing_points, and
+        the default of None, use exact inference, by default None
+    return_std : bool, optional
+        Also return the posterior standard deviation of every prediction. It
+        comes from the same factorisation as the mean, and is that of the
+        latent function, so it excludes the noise, by default False
+    std_forecast_only : bool, optional
+        Only compute the standard deviations of the forecasts, which skips the
+        work for the smoothed values, by default False
+    return_status : bool, optional
+        Also return the SeriesStatus of every series, by default False
 
     Returns
     -------
-    list of ndarrays of type float, size (N)
+    list of ndarrays of type float, size (N) or RaggedSeries
         A list of numpy arrays containing the smoothed/forecasted values.
-        In the future this may also include the X variable for ease.
+        When y_inputs is a RaggedSeries the result is a RaggedSeries whose x
+        holds the input x values followed by the forecast x values.
+    list of ndarrays of type float or RaggedSeries
+        The posterior standard deviations in the same container as the
+        values, holding only the forecasts with std_forecast_only. Only
+        returned with return_std.
+    ndarray of type uint8, size (number of series)
+        The SeriesStatus code of every series, only with return_status.
 
     """
-    number_of_inputs = len(x_inputs)
+    y_series, x_values = _ragged_inputs(x_inputs, y_inputs)
+    result_offsets = _result_offsets(y_series, forecast_amount)
 
-    index_runner = 0
+    dtype = y_series.values.dtype
+    x_values = x_values.astype(dtype, copy=False)
+    pointer, gps = _precision(dtype, lib.rust_multiple_gps, lib.rust_multiple_gps_f32)
 
-    start_indices = [0]
+    result = np.empty(int(result_offsets[-1]), dtype=dtype)
 
-    for x_input in x_inputs[:-1]:
-        length_of_input = len(x_input)
-        index_runner += length_of_input
-        start_indices.append(index_runner)
+    n_series = len(y_series)
+    std = _std_buffer(
+        return_std,
+        std_forecast_only,
+        result.size,
+        n_series * forecast_amount,
+        dtype,
+    )
 
-    start_indices = np.array(start_indices, dtype=np.uint64)
+    start_indices = y_series.start_indices
+
+    if mask is None:
+        mask_ptr = ffi.NULL
+    else:
+        mask = flat_mask(mask, y_series.values.size)
+        mask_ptr = ffi.cast("uint8_t *", mask.ctypes.data)
+
+    if return_status:
+        statuses = np.zeros(n_series, dtype=np.uint8)
+        status_ptr = ffi.cast("uint8_t *", statuses.ctypes.data)
+    else:
+        status_ptr = ffi.NULL
+
+    gps(
+        ffi.cast(pointer, x_values.ctypes.data),
+        ffi.cast(pointer, y_series.values.ctypes.data),
+        mask_ptr,
+        x_values.size,
+        ffi.cast("uintptr_t *", start_indices.ctypes.data),
+        start_indices.size,
+        ffi.cast(pointer, result.ctypes.data),
+        result.size,
+        forecast_spacing,
+        forecast_amount,
+        length_scale,
+        amplitude,
+        noise,
+        _inducing(inducing_points),
+        _std_pointer(std, pointer),
+        bool(std_forecast_only),
+        status_ptr,
+        n_threads,
+        chunk_size,
+    )
 
-    y_inputs_list, y_inputs_means = [], []
+    smoothed = _ragged_result(
+        y_inputs,
+        result,
+        result_offsets,
+        x_values,
+        y_series.offsets,
+        forecast_spacing,
+        forecast_amount,
+    )
 
-    for y in y_inputs:
-        mean = y.mean()
-        y_inputs_list.append(y - mean)
-        y_inputs_means.append(mean)
+    returned = (smoothed,)
 
-    y_input_array = np.concatenate(y_inputs_list).ravel().astype(np.float64)
-    x_input_array = np.concatenate(x_inputs).ravel().astype(np.float64)
+    if return_std:
+        split = _forecast_result if std_forecast_only else _ragged_result
+        returned += (
+            split(
+                y_inputs,
+                std,
+                result_offsets,
+                x_values,
+                y_series.offsets,
+                forecast_spacing,
+                forecast_amount,
+            ),
+        )
 
-    result = np.empty(
-        x_input_array.size + (forecast_amount * number_of_inputs),
-        dtype=np.float64,
-    )
+    if return_status:
+        returned += (statuses,)
 
-    x_input_array = check_contig(x_input_array)
+    return returned if len(returned) > 1 else smoothed
 
-    y_input_array = check_contig(y_input_array)
 
-    result = check_contig(result)
+def fit_gp_hyperparameters(
+    x_inputs,
+    y_inputs,
+    forecast_spacing=0,
+    forecast_amount=0,
+    length_scale=30,
+    amplitude=0.5,
+    noise=0.1,
+    shared=False,
+    max_iterations=50,
+    n_threads=-1,
+    chunk_size=-1,
+    mask=None,
+    return_status=False,
+):
+    """Fit the RBF kernel parameters of multiple GPs and smooth with them.
+
+    The length scale, amplitude and noise are chosen by maximising the log
+    marginal likelihood of each series in Rust, using analytic gradients and
+    a quasi-Newton (BFGS) optimiser in log space started from the given
+    values. Each likelihood evaluation factorises the kernel matrix once and
+    gets the gradient from the same factor. The series are then smoothed and
+    forecast with the fitted parameters as in multiple_gps.
+
+    By default each series gets its own parameters, fitted in parallel. With
+    shared=True one set of parameters maximises the summed likelihood of the
+    whole batch, and the likelihood of every series is evaluated in parallel
+    at each step. A series whose kernel matrix cannot be factorised at the
+    starting parameters is left out of that sum rather than stopping the
+    fit, and is all NaN with the status SOLVER_FAILURE.
 
-    x_input_ptr = ffi.cast("double *", x_input_array.ctypes.data)
-    y_input_ptr = ffi.cast("double *", y_input_array.ctypes.data)
-    result_ptr = ffi.cast("double *", result.ctypes.data)
-    start_indices_ptr = ffi.cast("uintptr_t *", start_indices.ctypes.data)
+    Notes
+    -----
+    Fitting uses exact inference, so each step costs O(N³) per series. Each
+    series has its mean removed, and missing values are left out as in
+    multiple_gps. Series with fewer than two valid values keep the starting
+    parameters.
 
-    lib.rust_multiple_gps(
-        x_input_ptr,
-        y_input_ptr,
-        x_input_array.size,
-        start_indices_ptr,
+    Parameters
+    ----------
+    x_inputs : list of ndarrays of type float, size (N), RaggedSeries or None
+        A list of NumPy arrays containing the x_input variable. May be None
+        when y_inputs is a RaggedSeries that carries x values.
+    y_inputs : list of ndarrays of type float, size (N) or RaggedSeries
+        A list of NumPy arrays containing the y input (the variable to be
+        forecast/smoothed).
+    forecast_spacing : float, optional
+        The spacing of the forecast, by default 0
+    forecast_amount : float, optional
+        The amount of forecasts of resultion forecast_spacing, by default 0
+    length_scale : float, optional
+        Starting lengthscale of the RBF kernel, by default 30
+    amplitude : float, optional
+        Starting amplitude of the RBF kernel, by default 0.5
+    noise : float, optional
+        Starting noise of the GP regresion, by default 0.1
+    shared : bool, optional
+        Fit one set of parameters for the whole batch rather than one per
+        series, by default False
+    max_iterations : int, optional
+        Maximum number of optimiser iterations, by default 50
+    n_threads : int, optional
+        Amount of worker threads used to complete the task. The default is -1
+        which runs on the shared worker pool, by default -1
+    chunk_size : int, optional
+        Number of series handed to a worker thread at a time, by default -1
+    mask : list of ndarrays of type bool, size (N), optional
+        Validity of each value, where False marks a value as missing. The
+        default of None treats every finite value as valid, by default None
+    return_status : bool, optional
+        Also return the SeriesStatus of every series, by default False
+
+    Returns
+    -------
+    smoothed : list of ndarrays of type float, size (N) or RaggedSeries
+        The smoothed/forecasted values, as returned by multiple_gps.
+    length_scales : ndarray of type float, size (number of series)
+        The fitted length scale of each series.
+    amplitudes : ndarray of type float, size (number of series)
+        The fitted amplitude of each series.
+    noises : ndarray of type float, size (number of series)
+        The fitted noise of each series.
+    statuses : ndarray of type uint8, size (number of series)
+        The SeriesStatus code of every series, only with return_status.
+
+    """
+    y_series, x_values = _ragged_inputs(x_inputs, y_inputs)
+    result_offsets = _result_offsets(y_series, forecast_amount)
+
+    # The likelihood is optimised in float64 whatever the input precision.
+    y_values = check_contig(y_series.values.astype(np.float64, copy=False))
+    x_values = check_contig(x_values.astype(np.float64, copy=False))
+
+    result = np.empty(int(result_offsets[-1]), dtype=np.float64)
+
+    n_series = len(y_series)
+    length_scales = np.empty(n_series, dtype=np.float64)
+    amplitudes = np.empty(n_series, dtype=np.float64)
+    noises = np.empty(n_series, dtype=np.float64)
+
+    start_indices = y_series.start_indices
+
+    if mask is None:
+        mask_ptr = ffi.NULL
+    else:
+        mask = flat_mask(mask, y_values.size)
+        mask_ptr = ffi.cast("uint8_t *", mask.ctypes.data)
+
+    if return_status:
+        statuses = np.zeros(n_series, dtype=np.uint8)
+        status_ptr = ffi.cast("uint8_t *", statuses.ctypes.data)
+    else:
+        status_ptr = ffi.NULL
+
+    lib.rust_fit_multiple_gps(
+        ffi.cast("double *", x_values.ctypes.data),
+        ffi.cast("double *", y_values.ctypes.data),
+        mask_ptr,
+        x_values.size,
+        ffi.cast("uintptr_t *", start_indices.ctypes.data),
         start_indices.size,
-        result_ptr,
+        ffi.cast("double *", result.ctypes.data),
         result.size,
         forecast_spacing,
         forecast_amount,
         length_scale,
         amplitude,
         noise,
+        ffi.cast("double *", length_scales.ctypes.data),
+        ffi.cast("double *", amplitudes.ctypes.data),
+        ffi.cast("double *", noises.ctypes.data),
+        bool(shared),
+        max_iterations,
+        status_ptr,
         n_threads,
+        chunk_size,
     )
 
-    results = []
+    smoothed = _ragged_result(
+        y_inputs,
+        result,
+        result_offsets,
+        x_values,
+        y_series.offsets,
+        forecast_spacing,
+        forecast_amount,
+    )
+
+    if return_status:
+        return smoothed, length_scales, amplitudes, noises, statuses
+
+    return smoothed, length_scales, amplitudes, noises
+
+
+class OnlineGP:
+    """RBF kernel GPs of many pixels, updated as new acquisitions arrive.
+
+    Rather than fitting every pixel's whole history again each time an
+    acquisition lands, the state keeps the last window valid observations of
+    each pixel together with the Cholesky factor of their kernel matrix. A new
+    observation appends one row to the factor, and the oldest one is dropped
+    by a rank-1 update once the window is full, which costs O(window²) per
+    pixel instead of a refit. The results are those of multiple_gps fitted to
+    the stored observations.
+
+    All of the state lives in NumPy arrays, and can be written to disk with
+    save and read back with load between runs. The factor takes
+    window * (window + 1) / 2 floats per pixel.
+
+    Parameters
+    ----------
+    n_pixels : int
+        Number of pixels, each of which gets one value per acquisition.
+    window : int, optional
+        Number of valid observations kept per pixel, by default 64
+    forecast_spacing : float, optional
+        The spacing of the forecast, by default 0
+    forecast_amount : int, optional
+        The amount of forecasts of resolution forecast_spacing after the last
+        acquisition, by default 0
+    length_scale : float, optional
+        The lengthscale of the RBF kernel, by default 30
+    amplitude : float, optional
+        The amplitude of the RBF kernel, by default 0.5
+    noise : float, optional
+        Noise of the GP regresion, by default 0.1
 
-    start_indices[1:] += (
-        np.arange(1, len(start_indices[1:]) + 1) * forecast_amount
-    ).astype(np.uint64)
+    Examples
+    --------
+    >>> state = gaussian_processes.OnlineGP(ndvi.shape[1], window=32)
+    >>> for day, acquisition in zip(days, ndvi):
+    ...     smoothed = state.update(day, acquisition)
+    >>> state.save("gp_state.npz")
 
-    for i in range(0, len(start_indices)):
+    """
 
-        if i + 1 >= len(start_indices):
+    def __init__(
+        self,
+        n_pixels,
+        window=64,
+        forecast_spacing=0,
+        forecast_amount=0,
+        length_scale=30,
+        amplitude=0.5,
+        noise=0.1,
+    ):
+        if window < 1:
+            raise ValueError("window must be a positive integer.")
+
+        self.n_pixels = int(n_pixels)
+        self.window = int(window)
+        self.forecast_spacing = forecast_spacing
+        self.forecast_amount = int(forecast_amount)
+        self.length_scale = float(length_scale)
+        self.amplitude = float(amplitude)
+        self.noise = float(noise)
+
+        self.x = np.full((self.n_pixels, self.window), np.nan)
+        self.y = np.full((self.n_pixels, self.window), np.nan)
+        packed_size = self.window * (self.window + 1) // 2
+        self.factor = np.zeros((self.n_pixels, packed_size))
+        self.lengths = np.zeros(self.n_pixels, dtype=np.uintp)
+
+    def update(
+        self, x, y, mask=None, n_threads=-1, chunk_size=-1, return_status=False
+    ):
+        """Fold in new acquisitions and return the updated fits.
+
+        Missing values, NaNs, infs and values flagged in mask, are skipped, so
+        a cloudy pixel keeps its previous observations. A valid value at a
+        non-finite x, or one the kernel matrix cannot take, such as a repeated
+        x with no noise, is not stored either, and the fit of its pixel is all
+        NaN for this update.
+
+        Parameters
+        ----------
+        x : float or ndarray of type float, size (K)
+            The x values (e.g. days) of the new acquisitions, in order.
+        y : ndarray of type float, size (n_pixels) or (n_pixels, K)
+            The value of every pixel in each new acquisition.
+        mask : ndarray of type bool, same shape as y, optional
+            Validity of each value, where False marks a value as missing, by
+            default None
+        n_threads : int, optional
+            Amount of worker threads used to complete the task, by default -1
+        chunk_size : int, optional
+            Number of pixels handed to a worker thread at a time, by default -1
+        return_status : bool, optional
+            Also return the SeriesStatus of every pixel, NON_FINITE for pixels
+            without any stored observation, by default False
+
+        Returns
+        -------
+        ndarray of type float, size (n_pixels, window + forecast_amount)
+            For each pixel the posterior mean at the stored x values, oldest
+            first and NaN past the number of stored observations, followed by
+            the forecasts after the last new acquisition.
+        ndarray of type uint8, size (n_pixels)
+            The SeriesStatus code of every pixel, only with return_status.
+
+        """
+        new_x = check_contig(np.atleast_1d(np.asarray(x, dtype=np.float64)))
+        new_y = pixel_block(y, self.n_pixels, new_x.size)
+
+        if mask is None:
+            mask_ptr = ffi.NULL
+        else:
+            mask = pixel_block(mask, self.n_pixels, new_x.size, dtype=bool)
+            mask = mask.view(np.uint8)
+            mask_ptr = ffi.cast("uint8_t *", mask.ctypes.data)
 
-            single_result = result[start_indices[int(i)] :]
+        result = np.empty(
+            (self.n_pixels, self.window + self.forecast_amount), dtype=np.float64
+        )
+
+        if return_status:
+            statuses = np.zeros(self.n_pixels, dtype=np.uint8)
+            status_ptr = ffi.cast("uint8_t *", statuses.ctypes.data)
         else:
+            status_ptr = ffi.NULL
+
+        lib.rust_online_gps(
+            ffi.cast("double *", self.x.ctypes.data),
+            ffi.cast("double *", self.y.ctypes.data),
+            ffi.cast("double *", self.factor.ctypes.data),
+            ffi.cast("uintptr_t *", self.lengths.ctypes.data),
+            self.n_pixels,
+            self.window,
+            ffi.cast("double *", new_x.ctypes.data),
+            ffi.cast("double *", new_y.ctypes.data),
+            mask_ptr,
+            new_x.size,
+            ffi.cast("double *", result.ctypes.data),
+            self.forecast_spacing,
+            self.forecast_amount,
+            self.length_scale,
+            self.amplitude,
+            self.noise,
+            status_ptr,
+            n_threads,
+            chunk_size,
+        )
+
+        if return_status:
+            return result, statuses
+
+        return result
+
+    def save(self, path):
+        """Write the state and its parameters to an .npz file."""
+        np.savez(
+            path,
+            x=self.x,
+            y=self.y,
+            factor=self.factor,
+            lengths=self.lengths,
+            parameters=np.array(
+                [
+                    self.forecast_spacing,
+                    self.forecast_amount,
+                    self.length_scale,
+                    self.amplitude,
+                    self.noise,
+                ],
+                dtype=np.float64,
+            ),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Read a state written by save."""
+        with np.load(path) as data:
+            spacing, amount, length_scale, amplitude, noise = data["parameters"]
+            n_pixels, window = data["x"].shape
+
+            state = cls(
+                n_pixels,
+                window,
+                int(spacing),
+                int(amount),
+                length_scale,
+                amplitude,
+                noise,
+            )
+            state.x[...] = data["x"]
+            state.y[...] = data["y"]
+            state.factor[...] = data["factor"]
+            state.lengths[...] = data["lengths"]
+
+        return state
+
+
+def _ragged_inputs(x_inputs, y_inputs):
+    """Return the y values as a RaggedSeries and the matching flat x values."""
+    y_series = as_ragged(y_inputs)
+
+    if x_inputs is None:
+        if y_series.x is None:
+            raise ValueError("x_inputs is required unless y_inputs carries x.")
+        return y_series, y_series.x
+
+    x_series = as_ragged(x_inputs)
+
+    if not y_series.same_layout(x_series):
+        raise ValueError("x_inputs and y_inputs must have equal lengths.")
+
+    return y_series, x_series.values
+
+
+def _result_offsets(y_series, forecast_amount):
+    """Offsets of the outputs, each series being forecast_amount longer."""
+    # The Rust side accounts for the forecasts when it places the outputs, so
+    # only the result offsets change.
+    n_series = len(y_series)
+
+    return y_series.offsets + (
+        np.arange(n_series + 1, dtype=np.uint64) * np.uint64(forecast_amount)
+    )
+
+
+def _ragged_result(
+    y_inputs,
+    result,
+    result_offsets,
+    x_values,
+    offsets,
+    forecast_spacing,
+    forecast_amount,
+):
+    """Return the outputs in the same kind of container as y_inputs."""
+    if not isinstance(y_inputs, RaggedSeries):
+        return RaggedSeries(result, result_offsets).to_list()
+
+    return RaggedSeries(
+        result,
+        result_offsets,
+        _forecast_x(x_values, offsets, forecast_spacing, forecast_amount),
+    )
 
-            single_result = result[start_indices[int(i)] : int(start_indices[i + 1])]
 
-        results.append(single_result + y_inputs_means[i])
+def _forecast_result(
+    y_inputs,
+    forecasts,
+    result_offsets,
+    x_values,
+    offsets,
+    forecast_spacing,
+    forecast_amount,
+):
+    """Like _ragged_result for outputs that only hold the forecasts."""
+    n_series = offsets.size - 1
+    forecast_offsets = np.arange(n_series + 1, dtype=np.uint64) * np.uint64(
+        forecast_amount
+    )
+
+    if not isinstance(y_inputs, RaggedSeries):
+        return RaggedSeries(forecasts, forecast_offsets).to_list()
+
+    # The forecasts close every series of the full output.
+    output_x = _forecast_x(x_values, offsets, forecast_spacing, forecast_amount)
+    ends = result_offsets[1:].astype(np.intp)
+    forecast_index = ends[:, None] - forecast_amount + np.arange(forecast_amount)
+
+    return RaggedSeries(
+        forecasts, forecast_offsets, output_x[forecast_index.ravel()]
+    )
+
+
+def _std_buffer(return_std, std_forecast_only, full_size, forecast_size, dtype):
+    """Allocate the standard deviation output, or None when not asked for."""
+    if not return_std:
+        return None
+
+    size = forecast_size if std_forecast_only else full_size
+
+    return np.empty(size, dtype=dtype)
+
+
+def _std_pointer(std, pointer):
+    """Pointer to the standard deviation output, NULL to skip computing it."""
+    if std is None:
+        return ffi.NULL
+
+    return ffi.cast(pointer, std.ctypes.data)
+
+
+def _inducing(inducing_points):
+    """Translate the inducing_points argument, where 0 asks for exact inference."""
+    if inducing_points is None:
+        return 0
+
+    if inducing_points < 1:
+        raise ValueError("inducing_points must be a positive integer or None.")
+
+    return int(inducing_points)
+
+
+def _precision(dtype, rust_f64, rust_f32):
+    """Pick the pointer type and Rust function matching a float dtype."""
+    if dtype == np.float32:
+        return "float *", rust_f32
+
+    return "double *", rust_f64
+
+
+def _forecast_x(x_values, offsets, forecast_spacing, forecast_amount):
+    """Lay out the x values of the multiple_gps outputs without a Python loop."""
+    lengths = np.diff(offsets).astype(np.intp)
+    n_series = lengths.size
+
+    # Series i is shifted along by i * forecast_amount in the output.
+    series_ids = np.repeat(np.arange(n_series), lengths)
+    is_input = np.zeros(x_values.size + n_series * forecast_amount, dtype=bool)
+    is_input[np.arange(x_values.size) + series_ids * forecast_amount] = True
+
+    last_x = np.full(n_series, np.nan)
+    non_empty = lengths > 0
+    last_x[non_empty] = x_values[offsets[1:].astype(np.intp)[non_empty] - 1]
+    steps = np.arange(1, forecast_amount + 1) * float(forecast_spacing)
+
+    output_x = np.empty(is_input.size, dtype=np.float64)
+    output_x[is_input] = x_values
+    output_x[~is_input] = (last_x[:, None] + steps[None, :]).ravel()
+
+    return output_x
+
+
+def cube_gps(
+    x_input,
+    y_cube,
+    forecast_spacing,
+    forecast_amount,
+    length_scale=30,
+    amplitude=0.5,
+    noise=0.1,
+    axis=0,
+    n_threads=-1,
+    chunk_size=-1,
+    mask=None,
+    inducing_points=None,
+    out=None,
+    scaling=None,
+    out_dtype=None,
+    out_scaling=None,
+    return_status=False,
+):
+    """Run RBF kernel GPs along one axis of an N-D array.
+
+    This is the array equivalent of multiple_gps for stacks where every pixel
+    shares the same acquisition times, such as a (time, y, x) raster cube or a
+    (pixels, time) table. The GPs run directly over the NumPy buffer with
+    whatever strides it has. The mean of each pixel is removed before fitting
+    and added back afterwards, inside the Rust workers. As the x values are
+    shared, the kernel is factorised once and complete pixels are predicted in
+    blocks by a matrix product. A float32 cube is smoothed in single
+    precision and gives a float32 result. So are int16 and uint16 cubes,
+    which are read as they are and scaled series by series in the workers.
+
+    Notes
+    -----
+    Missing values can be left in the cube as NaN or flagged in mask, and are
+    handled as in multiple_gps.
+
+    Parameters
+    ----------
+    x_input : ndarray of type float, size (N)
+        The x values shared by every pixel, N being the length of axis.
+    y_cube : ndarray of type float64, float32, int16 or uint16, any shape
+        The values to be forecast/smoothed. Other dtypes are converted to
+        float64.
+    forecast_spacing : float
+        The spacing of the forecast. E.g. the temporal resolution of the
+        forecast.
+    forecast_amount : float
+        The amount of forecasts of resultion forecast_spacing. Set to 0 for no
+        forecasts (just smoothing).
+    length_scale : float, optional
+        The lengthscale of the RBF kernel. Larger = Smoother, by default 30
+    amplitude : float, optional
+        The amplitude of the RBF kernel, by default 0.5
+    noise : float, optional
+        Noise of the GP regresion, by default 0.1
+    axis : int, optional
+        The time axis, by default 0
+    n_threads : int, optional
+        Amount of worker threads used to complete the task. The default is -1
+        which runs on the shared worker pool, by default -1
+    chunk_size : int, optional
+        Number of series handed to a worker thread at a time, by default -1
+    mask : ndarray of type bool, optional
+        Validity of each value, broadcastable to the shape of y_cube, where
+        False marks a value as missing, by default None
+    inducing_points : int, optional
+        Use the sparse (DTC/VFE) approximation with this many inducing points
+        spread evenly over the x range of each series. It scales linearly
+        rather than cubically with the series length, and more inducing
+        points are more accurate. Series no longer than inducing_points, and
+        the default of None, use exact inference, by default None
+    out : ndarray of type float, optional
+        Array to write the result into, of the result's shape and the
+        precision of y_cube. It can have any strides, such as a view into a
+        memory-mapped stack. The default of None allocates a new array, by
+        default None
+    scaling : Scaling or tuple, optional
+        The (scale, offset, nodata) of y_cube, where a stored value s stands
+        for s * scale + offset and nodata marks missing values. The default of
+        None reads values as they are, by default None
+    out_dtype : dtype, optional
+        The dtype of the result, one of float64, float32, int16 or uint16. The
+        default of None takes that of out, or the precision of the smoothing,
+        by default None
+    out_scaling : Scaling or tuple, optional
+        The (scale, offset, nodata) the result is stored with, rounded and
+        clipped for integer dtypes. The default of None takes scaling for
+        integer results and stores float results as they are, by default None
+    return_status : bool, optional
+        Also return the SeriesStatus of every series, by default False
+
+    Returns
+    -------
+    ndarray of type out_dtype
+        The smoothed/forecast values. Same shape
+        as y_cube except along axis, which is forecast_amount longer. In out
+        if given.
+    ndarray of type uint8, shape of y_cube without axis
+        The SeriesStatus code of every series, only with return_status.
+
+    """
+    y_cube = check_encoded_type(np.asarray(y_cube))
+    axis = check_axis(axis, y_cube.ndim)
+
+    # Only float64 cubes are smoothed in double precision.
+    precision = np.float64 if y_cube.dtype == np.float64 else np.float32
+
+    x_input = check_contig(np.asarray(x_input).astype(precision, copy=False))
+
+    if x_input.shape != (y_cube.shape[axis],):
+        raise ValueError("x_input must be 1D and as long as y_cube along axis.")
+
+    result_shape = list(y_cube.shape)
+    result_shape[axis] += forecast_amount
+    result, out_scaling = encoded_output(
+        out, result_shape, out_dtype, scaling, out_scaling, precision
+    )
+    pointer, gps = _precision(precision, lib.rust_cube_gps, lib.rust_cube_gps_f32)
+
+    shape = np.array(y_cube.shape, dtype=np.uintp)
+    y_strides = element_strides(y_cube)
+    result_strides = element_strides(result)
+
+    if mask is None:
+        mask_ptr = ffi.NULL
+        mask_strides = y_strides
+    else:
+        mask = broadcast_mask(mask, y_cube.shape)
+        mask_ptr = ffi.cast("uint8_t *", mask.ctypes.data)
+        mask_strides = element_strides(mask)
+
+    if return_status:
+        statuses = np.zeros(np.delete(y_cube.shape, axis), dtype=np.uint8)
+        status_ptr = ffi.cast("uint8_t *", statuses.ctypes.data)
+    else:
+        status_ptr = ffi.NULL
+
+    gps(
+        ffi.cast(pointer, x_input.ctypes.data),
+        ffi.cast("uint8_t *", y_cube.ctypes.data),
+        *encoding_arguments(y_cube, scaling),
+        ffi.cast("intptr_t *", y_strides.ctypes.data),
+        mask_ptr,
+        ffi.cast("intptr_t *", mask_strides.ctypes.data),
+        ffi.cast("uint8_t *", result.ctypes.data),
+        *encoding_arguments(result, out_scaling),
+        ffi.cast("intptr_t *", result_strides.ctypes.data),
+        ffi.cast("uintptr_t *", shape.ctypes.data),
+        y_cube.ndim,
+        axis,
+        forecast_spacing,
+        forecast_amount,
+        length_scale,
+        amplitude,
+        noise,
+        _inducing(inducing_points),
+        status_ptr,
+        n_threads,
+        chunk_size,
+    )
+
+    if return_status:
+        return result, statuses
 
-    return results
+    return result
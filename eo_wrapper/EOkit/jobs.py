@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""This module runs the wrappers without blocking the calling thread.
+
+Every wrapper blocks until its whole batch is finished. submit instead starts
+one on a background thread and returns a BatchFuture straight away, which is a
+concurrent.futures.Future that can also be awaited from asyncio code. The Rust
+calls release the GIL and run on the shared worker pool, so the caller is free
+to read the next tile or serve requests in the meantime.
+
+The Rust workers count the series they complete, which BatchFuture.progress
+reads and an optional callback receives, and check for cancellation before
+every series. Cancelling a running batch skips the series not yet started.
+
+Examples
+--------
+>>> from EOkit import jobs
+>>> future = jobs.submit_whittakers(
+...     y_inputs, weights_inputs, 10, 2, progress=lambda done, total: print(done)
+... )
+>>> smoothed = future.result()
+
+From a coroutine:
+
+>>> smoothed = await jobs.submit_gps(x_inputs, y_inputs, 5, 2)
+
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+from EOkit.EOkit import lib
+from EOkit.gaussian_processes import multiple_gps
+from EOkit.ndvi import chen_reconstruction
+from EOkit.smoothers.sav_golay import multiple_sav_golays
+from EOkit.smoothers.whittaker import multiple_whittakers
+from cffi import FFI
+
+ffi = FFI()
+
+# Threads that wait on the Rust calls. The work itself runs on the shared
+# worker pool, so a handful is enough to keep several batches in flight.
+_SUBMIT_THREADS = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Positions of the counters shared with the Rust workers.
+_COMPLETED, _TOTAL, _CANCELLED = range(3)
+
+
+class BatchFuture(Future):
+    """The pending result of a submitted batch.
+
+    A concurrent.futures.Future that can be awaited and cancelled while it
+    runs. The batch stays pending until it finishes, so cancel succeeds at
+    any point before then. The series already being processed when it is
+    cancelled finish in the background.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._counters = np.zeros(3, dtype=np.uint64)
+        self._started = False
+
+    def progress(self):
+        """Return the number of series completed and the number started.
+
+        The number started grows as a wrapper starts each of its batches, so
+        it is only the final total once the future is done.
+        """
+        return int(self._counters[_COMPLETED]), int(self._counters[_TOTAL])
+
+    def running(self):
+        return self._started and not self.done()
+
+    def cancel(self):
+        cancelled = super().cancel()
+        if cancelled:
+            self._counters[_CANCELLED] = 1
+        return cancelled
+
+    def __await__(self):
+        return asyncio.wrap_future(self).__await__()
+
+
+def submit(function, *args, progress=None, progress_interval=0.1, **kwargs):
+    """Run a wrapper in the background and return a future of its result.
+
+    Parameters
+    ----------
+    function : callable
+        Any EOkit wrapper, such as whittaker.multiple_whittakers or
+        cube_gps, called as function(*args, **kwargs).
+    progress : callable, optional
+        Called as progress(completed, total) with the series completed and
+        started so far, every progress_interval seconds while the batch runs
+        and once more before the future is done. It runs on a background
+        thread. If it raises, reporting stops and the future fails with its
+        exception, by default None
+    progress_interval : float, optional
+        Seconds between calls of progress, by default 0.1
+    *args, **kwargs
+        Passed on to function.
+
+    Returns
+    -------
+    BatchFuture
+        The future of function's result, also awaitable from asyncio.
+
+    """
+    future = BatchFuture()
+
+    if progress is not None:
+        threading.Thread(
+            target=_report,
+            args=(future, progress, progress_interval),
+            daemon=True,
+        ).start()
+
+    _get_executor().submit(_run, future, function, args, kwargs, progress)
+
+    return future
+
+
+def submit_whittakers(*args, progress=None, **kwargs):
+    """Run whittaker.multiple_whittakers without blocking, see submit."""
+    return submit(multiple_whittakers, *args, progress=progress, **kwargs)
+
+
+def submit_sav_golays(*args, progress=None, **kwargs):
+    """Run sav_golay.multiple_sav_golays without blocking, see submit."""
+    return submit(multiple_sav_golays, *args, progress=progress, **kwargs)
+
+
+def submit_gps(*args, progress=None, **kwargs):
+    """Run gaussian_processes.multiple_gps without blocking, see submit."""
+    return submit(multiple_gps, *args, progress=progress, **kwargs)
+
+
+def submit_chens(*args, progress=None, **kwargs):
+    """Run ndvi.chen_reconstruction without blocking, see submit."""
+    return submit(chen_reconstruction, *args, progress=progress, **kwargs)
+
+
+def _get_executor():
+    """Return the threads that run submitted batches, started on first use."""
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_SUBMIT_THREADS, thread_name_prefix="eokit-submit"
+            )
+
+    return _executor
+
+
+def _run(future, function, args, kwargs, progress):
+    """Run function with the counters of future attached to this thread."""
+    if future.cancelled():
+        return
+
+    future._started = True
+    counters = future._counters
+
+    lib.rust_attach_batch_control(ffi.cast("uint64_t *", counters.ctypes.data))
+    try:
+        result, error = function(*args, **kwargs), None
+    except BaseException as raised:
+        result, error = None, raised
+    finally:
+        lib.rust_attach_batch_control(ffi.NULL)
+
+    # A raising callback fails the future rather than leave it pending.
+    if progress is not None:
+        try:
+            progress(*future.progress())
+        except BaseException as raised:
+            if error is None:
+                result, error = None, raised
+
+    # False if cancelled meanwhile, in which case the result is incomplete.
+    if not future.set_running_or_notify_cancel():
+        return
+
+    if error is None:
+        future.set_result(result)
+    else:
+        future.set_exception(error)
+
+
+def _report(future, progress, interval):
+    """Call progress every interval seconds until future is done.
+
+    Reporting stops if progress raises. The final call made by _run passes
+    the exception on to the future.
+    """
+    done = threading.Event()
+    future.add_done_callback(lambda _: done.set())
+
+    while not done.wait(interval):
+        try:
+            progress(*future.progress())
+        except Exception:
+            return
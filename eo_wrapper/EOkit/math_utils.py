@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""This module houses wrappers for the numerical building blocks.
+
+These are the same routines the smoothers use internally. They are exposed
+mostly so they can be compared and benchmarked against NumPy and SciPy.
+
+"""
+
+import numpy as np
+from EOkit.EOkit import lib
+from EOkit.array_utils import check_type, check_contig
+from cffi import FFI
+
+ffi = FFI()
+
+_MODES = {"full": 0, "valid": 1, "same": 2}
+_METHODS = {"auto": 0, "direct": 1, "fft": 2}
+
+
+def convolve(a, v, mode="full", method="auto"):
+    """Discrete linear convolution of two 1D arrays.
+
+    Behaves like numpy.convolve. Short kernels are applied directly, while
+    long kernels use an overlap-add FFT. The choice is made from the input
+    sizes unless method is given.
+
+    Parameters
+    ----------
+    a : ndarray of type float, size (N)
+        First input.
+    v : ndarray of type float, size (M)
+        Second input.
+    mode : {"full", "valid", "same"}, optional
+        Size of the output, as in numpy.convolve, by default "full"
+    method : {"auto", "direct", "fft"}, optional
+        How to compute the convolution, by default "auto"
+
+    Returns
+    -------
+    ndarray of type float
+        The convolution of a and v.
+
+    Examples
+    --------
+    >>> math_utils.convolve(np.arange(1., 11.), np.array([1., 2., 3., 4.]), "valid")
+    array([20., 30., 40., 50., 60., 70., 80.])
+
+    """
+    a = check_contig(check_type(np.asarray(a)))
+    v = check_contig(check_type(np.asarray(v)))
+
+    if a.size == 0 or v.size == 0:
+        raise ValueError("a and v cannot be empty.")
+
+    if mode == "full":
+        output_size = a.size + v.size - 1
+    elif mode == "valid":
+        output_size = max(a.size, v.size) - min(a.size, v.size) + 1
+    elif mode == "same":
+        output_size = max(a.size, v.size)
+    else:
+        raise ValueError("mode must be one of 'full', 'valid' or 'same'.")
+
+    if method not in _METHODS:
+        raise ValueError("method must be one of 'auto', 'direct' or 'fft'.")
+
+    result = np.empty(output_size, dtype=np.float64)
+
+    a_ptr = ffi.cast("double *", a.ctypes.data)
+    v_ptr = ffi.cast("double *", v.ctypes.data)
+    result_ptr = ffi.cast("double *", result.ctypes.data)
+
+    lib.rust_convolve_1d(
+        a_ptr,
+        a.size,
+        v_ptr,
+        v.size,
+        result_ptr,
+        result.size,
+        _MODES[mode],
+        _METHODS[method],
+    )
+
+    return result
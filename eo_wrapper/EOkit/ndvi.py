@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""This module houses the NDVI time series reconstruction wrappers.
+
+Clouds, aerosols and shadows almost always lower NDVI, so a cloud hit
+observation sits below the true seasonal curve. The reconstruction here
+lifts the curve to the upper envelope of the series instead of smoothing
+through the dips.
+
+"""
+
+import numpy as np
+from EOkit.EOkit import lib
+from EOkit.array_utils import (
+    broadcast_mask,
+    check_axis,
+    check_encoded_type,
+    check_filter_parameters,
+    check_type,
+    element_strides,
+    encoded_output,
+    encoding_arguments,
+    flat_mask,
+)
+from EOkit.ragged import RaggedSeries, as_ragged
+from cffi import FFI
+
+ffi = FFI()
+
+
+def chen_reconstruction(
+    y_inputs,
+    trend_window=9,
+    trend_order=2,
+    window_size=9,
+    order=4,
+    max_iterations=10,
+    axis=0,
+    n_threads=-1,
+    chunk_size=-1,
+    mask=None,
+    return_iterations=False,
+    out=None,
+    scaling=None,
+    out_dtype=None,
+    out_scaling=None,
+    return_status=False,
+):
+    """Reconstruct NDVI series by the iterative Savitzky-Golay method of Chen.
+
+    Missing values are first filled in linearly, and a Savitzky-Golay filter
+    of trend_window and trend_order fits the long-term trend. Values below
+    the trend are taken as cloud contaminated and weighted down by their
+    distance from it. Each pass then replaces the values below the current
+    fit by the fit and filters again with window_size and order, until the
+    fitting effect index, the weighted sum of absolute differences between
+    the fit and the original values, stops decreasing. The fit with the
+    smallest index is returned.
+
+    Every pass runs in the Rust worker that owns the series, on buffers
+    reused between series, so there is no round trip to Python per pass.
+
+    Parameters
+    ----------
+    y_inputs : list of ndarrays of type float, size (N), RaggedSeries or ndarray
+        The NDVI series. A list or RaggedSeries is reconstructed series by
+        series, and an N-D array such as a (time, y, x) cube along axis.
+    trend_window : int, optional
+        The window of the long-term trend filter, by default 9
+    trend_order : int, optional
+        The polynomial order of the long-term trend filter, by default 2
+    window_size : int, optional
+        The window of the filter applied at every pass, by default 9
+    order : int, optional
+        The polynomial order of the filter applied at every pass, by default 4
+    max_iterations : int, optional
+        Upper limit on the number of passes, by default 10
+    axis : int, optional
+        The time axis of an array input, by default 0
+    n_threads : int, optional
+        Amount of worker threads used to complete the task. The default is -1
+        which runs on the shared worker pool, by default -1
+    chunk_size : int, optional
+        Number of series handed to a worker thread at a time, by default -1
+    mask : list of ndarrays of type bool or ndarray of type bool, optional
+        Validity of each value, where False marks a value as missing, such as
+        a cloud mask. For an array input it must broadcast to its shape. The
+        default of None treats every finite value as valid, by default None
+    return_iterations : bool, optional
+        Also return the number of passes of each series, for list and
+        RaggedSeries inputs only, by default False
+    out : ndarray of type float, optional
+        Array to write the result of an array input into, of its shape. It
+        can have any strides, such as a view into a memory-mapped stack. The
+        default of None allocates a new array, by default None
+    scaling : Scaling or tuple, optional
+        The (scale, offset, nodata) of an array input of type float32, int16
+        or uint16, which is read without a float64 copy. A stored value s
+        stands for s * scale + offset and nodata marks missing values. The
+        default of None reads values as they are, by default None
+    out_dtype : dtype, optional
+        The dtype of the result of an array input, one of float64, float32,
+        int16 or uint16. The default of None takes that of out, or float64, by
+        default None
+    out_scaling : Scaling or tuple, optional
+        The (scale, offset, nodata) the result of an array input is stored
+        with. The default of None takes scaling for integer results, by
+        default None
+    return_status : bool, optional
+        Also return the SeriesStatus of every series, by default False
+
+    Returns
+    -------
+    list of ndarrays of type float, size (N), RaggedSeries or ndarray
+        The reconstructed series, in the same form as y_inputs. Series without
+        any valid value, or no longer than half the larger window, are all
+        NaN.
+    ndarray of type uint64, size (number of series)
+        The number of passes of each series, only with return_iterations.
+    ndarray of type uint8, size (number of series)
+        The SeriesStatus code of every series, only with return_status. For
+        an array input it has the shape of y_inputs without axis.
+
+    References
+    ----------
+    .. [1] J. Chen, P. Jönsson, M. Tamura, Z. Gu, B. Matsushita, L. Eklundh,
+       A simple method for reconstructing a high-quality NDVI time-series data
+       set based on the Savitzky-Golay filter. Remote Sensing of Environment,
+       2004, 91 (3-4), pp 332-344.
+
+    """
+    check_filter_parameters(trend_window, trend_order)
+    check_filter_parameters(window_size, order)
+
+    if isinstance(y_inputs, np.ndarray):
+        if return_iterations:
+            raise ValueError("return_iterations needs a list or RaggedSeries.")
+
+        return _cube_chens(
+            y_inputs,
+            trend_window,
+            trend_order,
+            window_size,
+            order,
+            max_iterations,
+            axis,
+            n_threads,
+            chunk_size,
+            mask,
+            out,
+            scaling,
+            out_dtype,
+            out_scaling,
+            return_status,
+        )
+
+    if out is not None or scaling is not None or out_dtype is not None:
+        raise ValueError("out, scaling and out_dtype need an array input.")
+
+    y_series = as_ragged(y_inputs)
+
+    y_values = check_type(y_series.values)
+
+    result = np.empty(y_series.values.size, dtype=np.float64)
+
+    start_indices = y_series.start_indices
+
+    iterations = np.zeros(start_indices.size, dtype=np.uint64)
+
+    if mask is None:
+        mask_ptr = ffi.NULL
+    else:
+        mask = flat_mask(mask, y_series.values.size)
+        mask_ptr = ffi.cast("uint8_t *", mask.ctypes.data)
+
+    if return_status:
+        statuses = np.zeros(start_indices.size, dtype=np.uint8)
+        status_ptr = ffi.cast("uint8_t *", statuses.ctypes.data)
+    else:
+        status_ptr = ffi.NULL
+
+    lib.rust_multiple_chens(
+        ffi.cast("double *", y_values.ctypes.data),
+        mask_ptr,
+        ffi.cast("uintptr_t *", start_indices.ctypes.data),
+        start_indices.size,
+        ffi.cast("double *", result.ctypes.data),
+        result.size,
+        ffi.cast("uint64_t *", iterations.ctypes.data),
+        trend_window,
+        trend_order,
+        window_size,
+        order,
+        max_iterations,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    )
+
+    results = RaggedSeries(result, y_series.offsets, y_series.x)
+
+    if not isinstance(y_inputs, RaggedSeries):
+        results = results.to_list()
+
+    returned = (results,)
+
+    if return_iterations:
+        returned += (iterations,)
+
+    if return_status:
+        returned += (statuses,)
+
+    return returned if len(returned) > 1 else results
+
+
+def _cube_chens(
+    y_cube,
+    trend_window,
+    trend_order,
+    window_size,
+    order,
+    max_iterations,
+    axis,
+    n_threads,
+    chunk_size,
+    mask,
+    out,
+    scaling,
+    out_dtype,
+    out_scaling,
+    return_status,
+):
+    """Run chen_reconstruction along one axis of an N-D array."""
+    y_cube = check_encoded_type(np.asarray(y_cube))
+    axis = check_axis(axis, y_cube.ndim)
+
+    result, out_scaling = encoded_output(
+        out, y_cube.shape, out_dtype, scaling, out_scaling
+    )
+
+    shape = np.array(y_cube.shape, dtype=np.uintp)
+    y_strides = element_strides(y_cube)
+    result_strides = element_strides(result)
+
+    if mask is None:
+        mask_ptr = ffi.NULL
+        mask_strides = y_strides
+    else:
+        mask = broadcast_mask(mask, y_cube.shape)
+        mask_ptr = ffi.cast("uint8_t *", mask.ctypes.data)
+        mask_strides = element_strides(mask)
+
+    if return_status:
+        statuses = np.zeros(np.delete(y_cube.shape, axis), dtype=np.uint8)
+        status_ptr = ffi.cast("uint8_t *", statuses.ctypes.data)
+    else:
+        status_ptr = ffi.NULL
+
+    lib.rust_cube_chens(
+        ffi.cast("uint8_t *", y_cube.ctypes.data),
+        *encoding_arguments(y_cube, scaling),
+        ffi.cast("intptr_t *", y_strides.ctypes.data),
+        mask_ptr,
+        ffi.cast("intptr_t *", mask_strides.ctypes.data),
+        ffi.cast("uint8_t *", result.ctypes.data),
+        *encoding_arguments(result, out_scaling),
+        ffi.cast("intptr_t *", result_strides.ctypes.data),
+        ffi.cast("uintptr_t *", shape.ctypes.data),
+        y_cube.ndim,
+        axis,
+        trend_window,
+        trend_order,
+        window_size,
+        order,
+        max_iterations,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    )
+
+    if return_status:
+        return result, statuses
+
+    return result
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""This module controls the worker pool shared by the multithreaded wrappers.
+
+Every function prefixed with "multiple" runs on one long-lived pool of worker
+threads inside the Rust library. The pool is created the first time it is
+needed and sized from the EOKIT_NUM_THREADS environment variable, falling back
+to the number of logical processor cores. A call with any other n_threads runs
+on a pool of that size, which is kept for the next call until one asks for a
+different size or set_num_threads is called.
+
+"""
+
+from .EOkit import lib
+
+
+def set_num_threads(n_threads):
+    """Resize the shared worker pool.
+
+    Parameters
+    ----------
+    n_threads : int
+        Number of worker threads. Use -1 to go back to the default, which is
+        EOKIT_NUM_THREADS if set, otherwise the number of logical cores.
+
+    Examples
+    --------
+    >>> import EOkit
+    >>> EOkit.set_num_threads(4)
+    >>> EOkit.get_num_threads()
+    4
+
+    """
+    lib.rust_set_num_threads(int(n_threads))
+
+
+def get_num_threads():
+    """Return the number of threads in the shared worker pool.
+
+    Returns
+    -------
+    int
+        The number of worker threads used when n_threads is -1.
+
+    """
+    return int(lib.rust_get_num_threads())
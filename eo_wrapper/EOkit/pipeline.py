@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""This module houses the fused pipeline of smoothers.
+
+A typical job chains smoothers, for instance a Whittaker to fill gaps, then a
+Savitzky-Golay derivative and then a GP forecast. Calling each wrapper in turn
+copies the whole batch in and out of Rust at every stage. A Pipeline instead
+runs every stage of a pixel one after another inside the same Rust worker,
+on buffers reused from pixel to pixel, and only hands back the stages asked
+for.
+
+Examples
+--------
+>>> pipeline = Pipeline(
+...     [
+...         Whittaker(10.0, 2, keep=True),
+...         SavGolay(7, 2, deriv=1),
+...         GP(forecast_amount=5, keep=True),
+...     ]
+... )
+>>> smoothed, forecasts = pipeline.run(y_inputs, x_inputs)
+
+"""
+
+import numpy as np
+from EOkit.EOkit import lib
+from EOkit.array_utils import check_filter_parameters, check_type, flat_mask
+from EOkit.ragged import RaggedSeries, as_ragged
+from cffi import FFI
+
+ffi = FFI()
+
+# Number of parameters of each stage on the Rust side.
+_STAGE_PARAMETERS = 6
+
+
+class Whittaker:
+    """Whittaker smoothing stage, as in smoothers.whittaker.multiple_whittakers.
+
+    Every value gets a weight of one, and missing values are interpolated.
+
+    Parameters
+    ----------
+    lambda_ : float
+        Smoothing coefficient. Larger = smoother.
+    d : int, optional
+        Order of smoothing, by default 2
+    keep : bool, optional
+        Return the output of this stage, by default False
+    """
+
+    kind = 0
+
+    def __init__(self, lambda_, d=2, keep=False):
+        self.lambda_ = lambda_
+        self.d = d
+        self.keep = keep
+
+    def parameters(self):
+        return [self.lambda_, self.d]
+
+
+class SavGolay:
+    """Savitzky-Golay filter stage, as in smoothers.sav_golay.multiple_sav_golays.
+
+    Parameters
+    ----------
+    window_size : int
+        The size of the sliding window.
+    order : int
+        Order of polynomial to fit the data with.
+    deriv : int, optional
+        Order of the derivative to smooth, by default 0
+    delta : int, optional
+        The spacing of the samples, by default 1
+    keep : bool, optional
+        Return the output of this stage, by default False
+    """
+
+    kind = 1
+
+    def __init__(self, window_size, order, deriv=0, delta=1, keep=False):
+        check_filter_parameters(window_size, order, deriv)
+
+        self.window_size = window_size
+        self.order = order
+        self.deriv = deriv
+        self.delta = delta
+        self.keep = keep
+
+    def parameters(self):
+        return [self.window_size, self.order, self.deriv, self.delta]
+
+
+class GP:
+    """RBF kernel GP stage, as in gaussian_processes.multiple_gps.
+
+    Only allowed as the last stage, as its output is longer than its input by
+    forecast_amount values.
+
+    Parameters
+    ----------
+    length_scale : float, optional
+        Length scale of the RBF kernel, by default 30
+    amplitude : float, optional
+        Amplitude of the RBF kernel, by default 0.5
+    noise : float, optional
+        Variance of the observation noise, by default 0.1
+    forecast_spacing : int, optional
+        Step in x between forecasts, by default 1
+    forecast_amount : int, optional
+        Number of forecasts after the last x value of each series, by default 0
+    inducing_points : int, optional
+        Number of inducing points of the sparse mode. The default of None runs
+        exact inference, by default None
+    keep : bool, optional
+        Return the output of this stage, by default False
+    """
+
+    kind = 2
+
+    def __init__(
+        self,
+        length_scale=30,
+        amplitude=0.5,
+        noise=0.1,
+        forecast_spacing=1,
+        forecast_amount=0,
+        inducing_points=None,
+        keep=False,
+    ):
+        if inducing_points is not None and inducing_points < 1:
+            raise ValueError("inducing_points must be a positive integer or None.")
+
+        self.length_scale = length_scale
+        self.amplitude = amplitude
+        self.noise = noise
+        self.forecast_spacing = forecast_spacing
+        self.forecast_amount = forecast_amount
+        self.inducing_points = inducing_points
+        self.keep = keep
+
+    def parameters(self):
+        return [
+            self.length_scale,
+            self.amplitude,
+            self.noise,
+            self.forecast_spacing,
+            self.forecast_amount,
+            0 if self.inducing_points is None else self.inducing_points,
+        ]
+
+
+class Pipeline:
+    """Stages run one after another on every series in a single Rust call.
+
+    Parameters
+    ----------
+    stages : list of Whittaker, SavGolay and GP
+        The stages in the order they run. Only the last one can be a GP.
+
+    """
+
+    def __init__(self, stages):
+        stages = list(stages)
+
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage.")
+
+        if any(isinstance(stage, GP) for stage in stages[:-1]):
+            raise ValueError("Only the last stage of a pipeline can be a GP.")
+
+        # The filters are set up in the Rust workers, where a bad parameter
+        # could not be reported, so stages changed since they were made are
+        # checked again.
+        for stage in stages:
+            if isinstance(stage, SavGolay):
+                check_filter_parameters(stage.window_size, stage.order, stage.deriv)
+
+        self.stages = stages
+
+    def run(
+        self,
+        y_inputs,
+        x_inputs=None,
+        mask=None,
+        n_threads=-1,
+        chunk_size=-1,
+        return_status=False,
+    ):
+        """Run the pipeline on a batch of series.
+
+        Parameters
+        ----------
+        y_inputs : list of ndarrays of type float, size (N) or RaggedSeries
+            The series to process.
+        x_inputs : list of ndarrays of type float, size (N) or RaggedSeries, optional
+            The x values of each series, used by the Whittaker and GP stages.
+            The default of None takes them from y_inputs if it is a
+            RaggedSeries with x values, and otherwise uses the index of each
+            value within its series, by default None
+        mask : list of ndarrays of type bool, size (N), optional
+            Validity of each input value, where False marks a value as
+            missing. Only the first stage sees it, by default None
+        n_threads : int, optional
+            Amount of worker threads used to complete the task. The default is
+            -1 which runs on the shared worker pool, by default -1
+        chunk_size : int, optional
+            Number of series handed to a worker thread at a time, by default -1
+        return_status : bool, optional
+            Also return the SeriesStatus of every series, that of the first
+            stage it failed in. The outputs of a failed series are NaN from
+            that stage on, by default False
+
+        Returns
+        -------
+        list of ndarrays of type float or RaggedSeries, or a list of those
+            The output of every stage created with keep=True, in stage order,
+            or of the last stage if none is. A single output is returned on
+            its own. GP outputs hold forecast_amount more values per series.
+        ndarray of type uint8, size (number of series)
+            The SeriesStatus code of every series, only with return_status.
+        """
+        y_series = as_ragged(y_inputs)
+        y_values = check_type(y_series.values)
+
+        start_indices = y_series.start_indices
+        n_series = start_indices.size
+
+        if x_inputs is not None:
+            x_series = as_ragged(x_inputs)
+            if not y_series.same_layout(x_series):
+                raise ValueError("x_inputs and y_inputs must have equal lengths.")
+            x_values = check_type(x_series.values)
+        elif y_series.x is not None:
+            x_values = check_type(y_series.x)
+        else:
+            x_values = None
+
+        if mask is None:
+            mask_ptr = ffi.NULL
+        else:
+            mask = flat_mask(mask, y_series.values.size)
+            mask_ptr = ffi.cast("uint8_t *", mask.ctypes.data)
+
+        kept = [stage.keep for stage in self.stages]
+        if not any(kept):
+            kept[-1] = True
+
+        kinds = np.array([stage.kind for stage in self.stages], dtype=np.int64)
+        parameters = np.zeros((len(self.stages), _STAGE_PARAMETERS))
+        for row, stage in zip(parameters, self.stages):
+            values = stage.parameters()
+            row[: len(values)] = values
+
+        results = [
+            np.empty(y_values.size + n_series * _extension(stage), dtype=np.float64)
+            if keep
+            else None
+            for stage, keep in zip(self.stages, kept)
+        ]
+        outputs = ffi.new("double *[]", [_pointer(result) for result in results])
+
+        if return_status:
+            statuses = np.zeros(n_series, dtype=np.uint8)
+            status_ptr = ffi.cast("uint8_t *", statuses.ctypes.data)
+        else:
+            status_ptr = ffi.NULL
+
+        lib.rust_multiple_pipelines(
+            _pointer(x_values),
+            ffi.cast("double *", y_values.ctypes.data),
+            mask_ptr,
+            ffi.cast("uintptr_t *", start_indices.ctypes.data),
+            n_series,
+            y_values.size,
+            ffi.cast("int64_t *", kinds.ctypes.data),
+            ffi.cast("double *", parameters.ctypes.data),
+            len(self.stages),
+            outputs,
+            status_ptr,
+            n_threads,
+            chunk_size,
+        )
+
+        outputs = []
+        for stage, result in zip(self.stages, results):
+            if result is None:
+                continue
+
+            extension = _extension(stage)
+            offsets = y_series.offsets + (
+                np.arange(n_series + 1, dtype=np.uint64) * np.uint64(extension)
+            )
+            series = RaggedSeries(
+                result, offsets, y_series.x if extension == 0 else None
+            )
+            outputs.append(
+                series if isinstance(y_inputs, RaggedSeries) else series.to_list()
+            )
+
+        if len(outputs) == 1:
+            outputs = outputs[0]
+
+        if return_status:
+            return outputs, statuses
+
+        return outputs
+
+
+def _extension(stage):
+    """Number of values a stage adds to the end of each series."""
+    return stage.forecast_amount if isinstance(stage, GP) else 0
+
+
+def _pointer(array):
+    """Return a double pointer to array, or NULL for None."""
+    if array is None:
+        return ffi.NULL
+
+    return ffi.cast("double *", array.ctypes.data)
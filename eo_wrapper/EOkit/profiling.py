@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""This module records where the time goes in a batch.
+
+Profiling is off by default, and while off each timer in the Rust library
+costs a single atomic load. Once enabled, every thread that does work keeps
+its own timers per stage (scheduling, gathering, factorising, solving,
+filtering, scattering and so on), counters of the series and points it
+processed and its busy time. The Rust allocations made while profiling are
+counted too, in builds with the count-allocations cargo feature, which the
+Python package is built with.
+
+The Python side of the wrappers, such as concatenating the series and
+splitting the results, is timed the same way, and both can be read back as a
+dict with stats or written as a Chrome trace with export_chrome_trace, to be
+opened in chrome://tracing or https://ui.perfetto.dev.
+
+Examples
+--------
+>>> from EOkit import profiling
+>>> with profiling.profile(trace=True):
+...     smoothed = whittaker.multiple_whittakers(y_inputs, weights_inputs, 10, 2)
+>>> profiling.stats()["counters"]["series"]
+10000
+>>> profiling.export_chrome_trace("whittaker.json")
+
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from EOkit.EOkit import lib
+from cffi import FFI
+
+ffi = FFI()
+
+_OFF, _STATS, _TRACE = range(3)
+
+# Events kept per Python thread while tracing, later ones are dropped, as in
+# the Rust library.
+_MAX_EVENTS = 1 << 18
+
+_level = _OFF
+_lock = threading.Lock()
+
+# Start of the trace clock, in time.perf_counter seconds.
+_epoch = time.perf_counter()
+
+# Per Python thread name, the calls and seconds of each stage and the trace
+# events as (stage, start µs, duration µs).
+_python_stages = {}
+_python_events = {}
+_python_dropped = 0
+
+
+def enable(trace=False):
+    """Start recording, clearing what was recorded if profiling was off.
+
+    Parameters
+    ----------
+    trace : bool, optional
+        Also keep every timed stage as an event for export_chrome_trace,
+        by default False
+
+    """
+    global _level
+
+    if _level == _OFF:
+        _clear_python()
+
+    _level = _TRACE if trace else _STATS
+    lib.rust_profile_set_level(_level)
+
+
+def disable():
+    """Stop recording. What was recorded can still be read."""
+    global _level
+
+    _level = _OFF
+    lib.rust_profile_set_level(_OFF)
+
+
+def reset():
+    """Clear every timer, counter and event recorded so far.
+
+    The worker threads of pools that have since been replaced, for instance
+    by set_num_threads, are no longer reported after a reset.
+    """
+    lib.rust_profile_reset()
+    _clear_python()
+
+
+@contextlib.contextmanager
+def profile(trace=False):
+    """Record what runs inside the with block, then stop recording.
+
+    Parameters
+    ----------
+    trace : bool, optional
+        Also keep the events for export_chrome_trace, by default False
+
+    """
+    enable(trace)
+    try:
+        yield
+    finally:
+        disable()
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time the with block as the stage name of the calling thread."""
+    if _level == _OFF:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, start, time.perf_counter() - start)
+
+
+def stats():
+    """Return what was recorded since profiling was enabled or reset.
+
+    Returns
+    -------
+    dict
+        "stages" maps every stage to its "calls" and "seconds" summed over
+        all threads, "counters" the series and points processed, and
+        "busy_seconds" every worker thread to the time it spent running
+        series. "allocations" is the number of allocations made by the Rust
+        library, 0 unless it was built with the count-allocations feature,
+        and "threads" has the stages and counters of every thread.
+
+    """
+    report = _report(events=False)
+    threads = report["threads"] + _python_threads()
+
+    stages = {}
+    counters = {}
+    busy = {}
+
+    for thread in threads:
+        for name, totals in thread["stages"].items():
+            total = stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+            total["calls"] += totals["calls"]
+            total["seconds"] += totals["seconds"]
+
+        for name, value in thread["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+
+        if "busy" in thread["stages"]:
+            busy[thread["name"]] = (
+                busy.get(thread["name"], 0.0) + thread["stages"]["busy"]["seconds"]
+            )
+
+    return {
+        "stages": stages,
+        "counters": counters,
+        "busy_seconds": busy,
+        "allocations": report["allocations"],
+        "threads": [
+            {key: thread[key] for key in ("name", "stages", "counters")}
+            for thread in threads
+        ],
+    }
+
+
+def export_chrome_trace(path):
+    """Write the recorded events as a Chrome trace-event JSON file.
+
+    Profiling must have been enabled with trace=True for there to be events.
+
+    Parameters
+    ----------
+    path : str or os.PathLike
+        The file to write.
+
+    """
+    report = _report(events=True)
+    pid = os.getpid()
+
+    events = []
+    dropped = _python_dropped
+
+    for tid, thread in enumerate(report["threads"] + _python_threads(events=True)):
+        events.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": thread["name"]},
+            }
+        )
+        events.extend(
+            {
+                "name": name,
+                "cat": "eokit",
+                "ph": "X",
+                "ts": start,
+                "dur": duration,
+                "pid": pid,
+                "tid": tid,
+            }
+            for name, start, duration in thread["events"]
+        )
+        dropped += thread.get("dropped_events", 0)
+
+    with open(path, "w") as file:
+        json.dump(
+            {
+                "traceEvents": events,
+                "displayTimeUnit": "ms",
+                "otherData": {"dropped_events": dropped},
+            },
+            file,
+        )
+
+
+def _report(events):
+    """Return the Rust library's report, parsed."""
+    capacity = 0
+    buffer = np.empty(0, dtype=np.uint8)
+
+    while True:
+        length = lib.rust_profile_report(
+            ffi.cast("uint8_t *", buffer.ctypes.data), capacity, events
+        )
+        if length <= capacity:
+            return json.loads(buffer[:length].tobytes())
+
+        # The report may grow between calls while other threads record.
+        capacity = length + length // 2
+        buffer = np.empty(capacity, dtype=np.uint8)
+
+
+def _python_threads(events=False):
+    """Return the Python stages in the layout of the Rust report."""
+    with _lock:
+        return [
+            {
+                "name": "python: {}".format(name),
+                "stages": {
+                    stage: {"calls": calls, "seconds": seconds}
+                    for stage, (calls, seconds) in stages.items()
+                },
+                "counters": {},
+                "events": list(_python_events.get(name, [])) if events else [],
+            }
+            for name, stages in _python_stages.items()
+        ]
+
+
+def _record(name, start, duration):
+    """Add a timed stage of the calling thread."""
+    global _python_dropped
+
+    thread = threading.current_thread().name
+
+    with _lock:
+        totals = _python_stages.setdefault(thread, {}).setdefault(name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += duration
+
+        if _level == _TRACE:
+            events = _python_events.setdefault(thread, [])
+            if len(events) < _MAX_EVENTS:
+                events.append((name, (start - _epoch) * 1e6, duration * 1e6))
+            else:
+                _python_dropped += 1
+
+
+def _clear_python():
+    """Clear the Python stages and restart their clock with the Rust one."""
+    global _epoch, _python_dropped
+
+    with _lock:
+        _python_stages.clear()
+        _python_events.clear()
+        _python_dropped = 0
+        _epoch = time.perf_counter()
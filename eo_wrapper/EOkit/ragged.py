@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""This module houses the ragged array type shared by the batch wrappers.
+
+Pixels rarely have the same number of valid observations, so the "multiple"
+functions work on many series of different lengths. A RaggedSeries keeps all
+of them in one contiguous buffer together with the offsets of each series,
+which is exactly the layout the Rust library works on. Passing one straight
+through avoids concatenating the inputs and slicing the outputs on every call.
+
+"""
+
+import numpy as np
+from EOkit.array_utils import check_contig, check_float_type
+from EOkit.profiling import stage
+
+
+class RaggedSeries:
+    """Many 1D series of different lengths stored back to back.
+
+    Series i is ``values[offsets[i]:offsets[i + 1]]``. Indexing returns views
+    into the values (and x) buffers, so no data is copied.
+
+    Parameters
+    ----------
+    values : ndarray of type float, size (M)
+        The values of every series, one after another. float32 and float64
+        values are kept as they are, anything else is converted to float64.
+    offsets : ndarray of type uint64, size (N + 1)
+        Where each series starts in values, followed by the total length.
+        Must start at 0, never decrease and end at M.
+    x : ndarray of type float, size (M), optional
+        The x values (e.g. days) that go with values, by default None
+
+    Examples
+    --------
+    >>> series = RaggedSeries.from_list([np.arange(3.0), np.arange(5.0)])
+    >>> series.lengths
+    array([3, 5], dtype=uint64)
+    >>> series[1]
+    array([0., 1., 2., 3., 4.])
+
+    """
+
+    def __init__(self, values, offsets, x=None):
+
+        values = check_contig(check_float_type(np.asarray(values).ravel()))
+        offsets = check_contig(np.asarray(offsets).astype(np.uint64, copy=False))
+
+        if offsets.ndim != 1 or offsets.size == 0:
+            raise ValueError("offsets must be a 1D array of at least one entry.")
+
+        if offsets[0] != 0 or offsets[-1] != values.size:
+            raise ValueError(
+                "offsets must start at 0 and end at the number of values."
+            )
+
+        if np.any(offsets[1:] < offsets[:-1]):
+            raise ValueError("offsets must not decrease.")
+
+        if x is not None:
+            x = check_contig(check_float_type(np.asarray(x).ravel()))
+
+            if x.size != values.size:
+                raise ValueError("x must hold as many entries as values.")
+
+        self.values = values
+        self.offsets = offsets
+        self.x = x
+
+    @classmethod
+    def from_list(cls, series, x=None):
+        """Build a RaggedSeries from a list of 1D arrays.
+
+        Parameters
+        ----------
+        series : list of ndarrays of type float
+            The series to store.
+        x : list of ndarrays of type float, optional
+            The x values matching each series, by default None
+
+        Returns
+        -------
+        RaggedSeries
+        """
+        lengths = [len(s) for s in series]
+
+        offsets = np.zeros(len(lengths) + 1, dtype=np.uint64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        values = _concatenate(series)
+
+        if x is not None:
+            x = _concatenate(x)
+
+        return cls(values, offsets, x)
+
+    @classmethod
+    def from_lengths(cls, values, lengths, x=None):
+        """Build a RaggedSeries from a values buffer and per-series lengths."""
+        offsets = np.zeros(len(lengths) + 1, dtype=np.uint64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        return cls(values, offsets, x)
+
+    @property
+    def lengths(self):
+        """The number of values in each series."""
+        return np.diff(self.offsets)
+
+    @property
+    def start_indices(self):
+        """Where each series starts in values, as passed to the Rust library."""
+        return self.offsets[:-1]
+
+    def series_x(self, i):
+        """Return a view of the x values of series i."""
+        if self.x is None:
+            raise ValueError("This RaggedSeries has no x values.")
+
+        start, end = self._bounds(i)
+
+        return self.x[start:end]
+
+    def to_list(self):
+        """Return the series as a list of views into values."""
+        with stage("split"):
+            return [self[i] for i in range(len(self))]
+
+    def same_layout(self, other):
+        """Check whether other splits its values at the same offsets."""
+        return np.array_equal(self.offsets, other.offsets)
+
+    def _bounds(self, i):
+
+        n_series = len(self)
+
+        if not -n_series <= i < n_series:
+            raise IndexError(
+                "index {} is out of range for {} series".format(i, n_series)
+            )
+
+        i %= n_series
+
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def __len__(self):
+        return self.offsets.size - 1
+
+    def __getitem__(self, i):
+        start, end = self._bounds(i)
+
+        return self.values[start:end]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return "RaggedSeries(n_series={}, n_values={}, has_x={})".format(
+            len(self), self.values.size, self.x is not None
+        )
+
+
+def as_ragged(series, x=None):
+    """Return series as a RaggedSeries, converting a list if needed."""
+    if isinstance(series, RaggedSeries):
+        return series
+
+    return RaggedSeries.from_list(series, x)
+
+
+def _concatenate(series):
+
+    if len(series) == 0:
+        return np.empty(0, dtype=np.float64)
+
+    with stage("concatenate"):
+        return check_float_type(np.concatenate([np.asarray(s).ravel() for s in series]))
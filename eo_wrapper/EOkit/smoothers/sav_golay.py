@@ -1,11 +1,27 @@
+from collections import namedtuple
+
 import numpy as np
 from EOkit.EOkit import lib
-from EOkit.array_utils import check_type, check_contig
+from EOkit.array_utils import (
+    broadcast_mask,
+    check_axis,
+    check_encoded_type,
+    check_filter_parameters,
+    check_type,
+    check_contig,
+    element_strides,
+    encoded_output,
+    encoding_arguments,
+    flat_mask,
+)
+from EOkit.ragged import RaggedSeries, as_ragged
 from cffi import FFI
 
 
 ffi = FFI()
 
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
 
 def single_sav_golay(y_input, window_size, order, deriv=0, delta=1):
     """Run a single Savitzky-golay filter on 1D data.
@@ -50,6 +66,8 @@ def single_sav_golay(y_input, window_size, order, deriv=0, delta=1):
        Chemistry, 1964, 36 (8), pp 1627-1639.
 
     """
+    check_filter_parameters(window_size, order, deriv)
+
     # TODO! Condense all this stuff into a function accross the smoothers.
     data_len = len(y_input)
 
@@ -69,7 +87,17 @@ def single_sav_golay(y_input, window_size, order, deriv=0, delta=1):
     return result
 
 
-def multiple_sav_golays(y_inputs, window_size, order, deriv=0, delta=1, n_threads=-1):
+def multiple_sav_golays(
+    y_inputs,
+    window_size,
+    order,
+    deriv=0,
+    delta=1,
+    n_threads=-1,
+    chunk_size=-1,
+    mask=None,
+    return_status=False,
+):
     """Run many Savitzky-golay smoothers on 1D data in a multithread manner.
 
     This runs an identical algorithm to the single_sav_golay function. However,
@@ -80,9 +108,16 @@ def multiple_sav_golays(y_inputs, window_size, order, deriv=0, delta=1, n_thread
     I have used a list here as apposed to a 2-D array so that arrays of different
     lengths can be supplied.
 
+    Missing values do not need to be removed first. Windows containing NaNs,
+    infs or values flagged in mask are replaced by a polynomial fit to the
+    valid values they do contain, so every timestamp is still filtered.
+    Windows with fewer than order + 1 valid values give NaN. A series that is
+    too short for the window or has no valid value is all NaN, without
+    stopping the rest of the batch.
+
     Parameters
     ----------
-    y_inputs : list of ndarrays of type float, size (N)
+    y_inputs : list of ndarrays of type float, size (N) or RaggedSeries
         A list of numpy arrays containing the values to be smoothed.
     window_size : int
         The size of the sliding window. Generally, the larger the window of data
@@ -95,16 +130,32 @@ def multiple_sav_golays(y_inputs, window_size, order, deriv=0, delta=1, n_thread
     delta : int, optional
         The spacing of the samples to which the filter is applied, by default 1
     n_threads : int, optional
-        Amount of worker threads spawned to complete the task. The default is -1
-        which uses all logical processor cores. To tone this down, use something
-        between 1 and the number of processor cores you have. Setting this value
-        to a number larger than the amount of logical cores you have will most
-        likely degreade performance, by default -1
+        Amount of worker threads used to complete the task. The default is -1
+        which runs on the shared worker pool, sized by EOkit.set_num_threads or
+        the EOKIT_NUM_THREADS environment variable. Any other value runs on a
+        pool of exactly that many threads, which is kept alive until a call
+        asks for another size. Setting this value to a number larger than the
+        amount of logical cores you have will most likely degreade
+        performance, by default -1
+    chunk_size : int, optional
+        Number of series handed to a worker thread at a time. The default is -1
+        which groups series into chunks of similar estimated cost, starting
+        with the most expensive ones. Larger chunks lower the scheduling
+        overhead for very many short series, by default -1
+    mask : list of ndarrays of type bool, size (N), optional
+        Validity of each value, where False marks a value as missing. The
+        default of None treats every finite value as valid, by default None
+    return_status : bool, optional
+        Also return the SeriesStatus of every series, by default False
 
     Returns
     -------
-    list of ndarrays of type float, size (N)
-        A list of numpy arrays containing the smoothed data at y_inputs.
+    list of ndarrays of type float, size (N) or RaggedSeries
+        A list of numpy arrays containing the smoothed data at y_inputs. When
+        y_inputs is a RaggedSeries the result is a RaggedSeries with the same
+        offsets and x values.
+    ndarray of type uint8, size (len(y_inputs))
+        The SeriesStatus code of every series, only if return_status is True.
 
     References
     ----------
@@ -113,54 +164,211 @@ def multiple_sav_golays(y_inputs, window_size, order, deriv=0, delta=1, n_thread
        Chemistry, 1964, 36 (8), pp 1627-1639.
 
     """
+    check_filter_parameters(window_size, order, deriv)
 
-    index_runner = 0
+    y_series = as_ragged(y_inputs)
 
-    start_indices = [0]
+    # The filter runs in float64, whatever the RaggedSeries holds.
+    y_values = check_type(y_series.values)
 
-    for y_input in y_inputs[:-1]:
-        length_of_input = len(y_input)
-        index_runner += length_of_input
-        start_indices.append(index_runner)
+    result = np.empty(y_series.values.size, dtype=np.float64)
 
-    start_indices = np.array(start_indices, dtype=np.uint64)
+    start_indices = y_series.start_indices
 
-    y_input_array = np.concatenate(y_inputs).ravel().astype(np.float64)
+    if mask is None:
+        mask_ptr = ffi.NULL
+    else:
+        mask = flat_mask(mask, y_series.values.size)
+        mask_ptr = ffi.cast("uint8_t *", mask.ctypes.data)
 
-    result = np.empty(y_input_array.size, dtype=np.float64)
-
-    y_input_array = check_contig(y_input_array)
-    result = check_contig(result)
-    start_indices = check_contig(start_indices)
-
-    y_input_ptr = ffi.cast("double *", y_input_array.ctypes.data)
-    result_ptr = ffi.cast("double *", result.ctypes.data)
-    start_indices_ptr = ffi.cast("uintptr_t *", start_indices.ctypes.data)
+    if return_status:
+        statuses = np.zeros(start_indices.size, dtype=np.uint8)
+        status_ptr = ffi.cast("uint8_t *", statuses.ctypes.data)
+    else:
+        status_ptr = ffi.NULL
 
     lib.rust_multiple_sav_golays(
-        y_input_ptr,
-        start_indices_ptr,
+        ffi.cast("double *", y_values.ctypes.data),
+        mask_ptr,
+        ffi.cast("uintptr_t *", start_indices.ctypes.data),
         start_indices.size,
-        result_ptr,
+        ffi.cast("double *", result.ctypes.data),
         result.size,
         window_size,
         order,
         deriv,
         delta,
+        status_ptr,
         n_threads,
+        chunk_size,
     )
 
-    results = []
+    results = RaggedSeries(result, y_series.offsets, y_series.x)
 
-    for i in range(0, len(start_indices)):
+    if not isinstance(y_inputs, RaggedSeries):
+        results = results.to_list()
 
-        if i + 1 >= len(start_indices):
+    if return_status:
+        return results, statuses
 
-            single_result = result[start_indices[int(i)] :]
-        else:
+    return results
 
-            single_result = result[start_indices[int(i)] : int(start_indices[i + 1])]
 
-        results.append(single_result)
+def cube_sav_golays(
+    y_cube,
+    window_size,
+    order,
+    deriv=0,
+    delta=1,
+    axis=0,
+    n_threads=-1,
+    chunk_size=-1,
+    mask=None,
+    out=None,
+    scaling=None,
+    out_dtype=None,
+    out_scaling=None,
+    return_status=False,
+):
+    """Run a Savitzky-golay filter along one axis of an N-D array.
+
+    This is the array equivalent of multiple_sav_golays for stacks where every
+    pixel has the same number of observations, such as a (time, y, x) raster
+    cube or a (pixels, time) table. The filter runs directly over the NumPy
+    buffer with whatever strides it has, so there is no concatenation or
+    splitting in Python and no copy of the input. float32, int16 and uint16
+    cubes are read as they are and converted series by series in the workers.
+
+    Missing values can be left in the cube as NaN or flagged in mask, and are
+    handled as in multiple_sav_golays.
 
-    return results
+    Parameters
+    ----------
+    y_cube : ndarray of type float64, float32, int16 or uint16, any shape
+        The values to be smoothed. Other dtypes are converted to float64.
+    window_size : int
+        The size of the sliding window.
+    order : int
+        Order of polynomial to fit the data with. Needs to be less than
+        window_size - 1.
+    deriv : int, optional
+        Order of the derivative to smooth, by default 0
+    delta : int, optional
+        The spacing of the samples to which the filter is applied, by default 1
+    axis : int, optional
+        The time axis to filter along, by default 0
+    n_threads : int, optional
+        Amount of worker threads used to complete the task. The default is -1
+        which runs on the shared worker pool, by default -1
+    chunk_size : int, optional
+        Number of series handed to a worker thread at a time, by default -1
+    mask : ndarray of type bool, optional
+        Validity of each value, broadcastable to the shape of y_cube, where
+        False marks a value as missing, by default None
+    out : ndarray of type float, optional
+        Array to write the result into, of the result's shape. It can have any
+        strides, such as a view into a memory-mapped stack. The default of None
+        allocates a new array, by default None
+    scaling : Scaling or tuple, optional
+        The (scale, offset, nodata) of y_cube, where a stored value s stands
+        for s * scale + offset and nodata marks missing values. The default of
+        None reads values as they are, by default None
+    out_dtype : dtype, optional
+        The dtype of the result, one of float64, float32, int16 or uint16. The
+        default of None takes that of out, or float64, by default None
+    out_scaling : Scaling or tuple, optional
+        The (scale, offset, nodata) the result is stored with, rounded and
+        clipped for integer dtypes. The default of None takes scaling for
+        integer results and stores float results as they are, by default None
+    return_status : bool, optional
+        Also return the SeriesStatus of every series, by default False
+
+    Returns
+    -------
+    ndarray of type out_dtype, same shape as y_cube
+        The filtered values, in out if given.
+    ndarray of type uint8, shape of y_cube without axis
+        The SeriesStatus code of every series, only with return_status.
+
+    """
+    check_filter_parameters(window_size, order, deriv)
+
+    y_cube = check_encoded_type(np.asarray(y_cube))
+    axis = check_axis(axis, y_cube.ndim)
+
+    result, out_scaling = encoded_output(
+        out, y_cube.shape, out_dtype, scaling, out_scaling
+    )
+
+    shape = np.array(y_cube.shape, dtype=np.uintp)
+    y_strides = element_strides(y_cube)
+    result_strides = element_strides(result)
+
+    if mask is None:
+        mask_ptr = ffi.NULL
+        mask_strides = y_strides
+    else:
+        mask = broadcast_mask(mask, y_cube.shape)
+        mask_ptr = ffi.cast("uint8_t *", mask.ctypes.data)
+        mask_strides = element_strides(mask)
+
+    if return_status:
+        statuses = np.zeros(np.delete(y_cube.shape, axis), dtype=np.uint8)
+        status_ptr = ffi.cast("uint8_t *", statuses.ctypes.data)
+    else:
+        status_ptr = ffi.NULL
+
+    lib.rust_cube_sav_golays(
+        ffi.cast("uint8_t *", y_cube.ctypes.data),
+        *encoding_arguments(y_cube, scaling),
+        ffi.cast("intptr_t *", y_strides.ctypes.data),
+        mask_ptr,
+        ffi.cast("intptr_t *", mask_strides.ctypes.data),
+        ffi.cast("uint8_t *", result.ctypes.data),
+        *encoding_arguments(result, out_scaling),
+        ffi.cast("intptr_t *", result_strides.ctypes.data),
+        ffi.cast("uintptr_t *", shape.ctypes.data),
+        y_cube.ndim,
+        axis,
+        window_size,
+        order,
+        deriv,
+        delta,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    )
+
+    if return_status:
+        return result, statuses
+
+    return result
+
+
+def coefficient_cache_info():
+    """Report on the cache of Savitzky-golay filter coefficients.
+
+    The filter coefficients only depend on window_size, order, deriv and delta.
+    They are computed once per combination and kept in a small least recently
+    used cache inside the Rust library, shared by the single and multiple
+    functions.
+
+    Returns
+    -------
+    CacheInfo
+        A named tuple of (hits, misses, maxsize, currsize), in the same style
+        as functools.lru_cache.
+
+    """
+    info = np.zeros(4, dtype=np.uint64)
+
+    info_ptr = ffi.cast("uint64_t *", info.ctypes.data)
+
+    lib.rust_sav_golay_cache_info(info_ptr)
+
+    return CacheInfo(*(int(value) for value in info))
+
+
+def clear_coefficient_cache():
+    """Empty the filter coefficient cache and reset its statistics."""
+    lib.rust_clear_sav_golay_cache()
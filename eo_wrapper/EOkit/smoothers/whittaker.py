@@ -10,13 +10,34 @@ applications.
 
 import numpy as np
 from EOkit.EOkit import lib
-from EOkit.array_utils import check_type, check_contig
+from EOkit.array_utils import (
+    broadcast_mask,
+    check_axis,
+    check_type,
+    check_contig,
+    check_encoded_type,
+    element_strides,
+    encoded_output,
+    encoding_arguments,
+    flat_mask,
+    pixel_block,
+)
+from EOkit.ragged import RaggedSeries, as_ragged
 from cffi import FFI
 
 ffi = FFI()
 
+# Candidate lambdas of lambda_="auto", 10 per decade from 1e-2 to 1e6.
+_LAMBDA_GRID = np.logspace(-2, 6, 81)
 
-def single_whittaker(x_input, y_input, weights_input, lambda_, d):
+_CRITERIA = {"gcv": 0, "vcurve": 1}
+
+_REWEIGHTINGS = {"asymmetric": 0, "envelope": 1, "bisquare": 2}
+
+
+def single_whittaker(
+    x_input, y_input, weights_input, lambda_, d, criterion="gcv", lambda_grid=None
+):
     """Run a single Whittaker smoother on 1D data.
 
     The Whittaker smoother is based on penalized least squares. The main paper
@@ -33,15 +54,24 @@ def single_whittaker(x_input, y_input, weights_input, lambda_, d):
     weights_input : ndarray of type float, size (N)
         The weight that should be given to each input, where 0. ignores a given
         point (useful for interpolation) and 1. applies the full weight.
-    lambda_ : float
-        Smoothing coefficient. Larger = smoother.
+    lambda_ : float or "auto"
+        Smoothing coefficient. Larger = smoother. "auto" picks it natively
+        among lambda_grid by criterion, see multiple_whittakers.
     d : float
         Order of the smoothing/interpolation. 1 = linear and so on.
+    criterion : {"gcv", "vcurve"}, optional
+        How lambda_="auto" scores the candidate lambdas, by generalized
+        cross-validation or by the V-curve, by default "gcv"
+    lambda_grid : ndarray of type float, optional
+        The candidate lambdas of lambda_="auto". The default of None tries 81
+        values evenly spaced in log10 from 1e-2 to 1e6, by default None
 
     Returns
     -------
     ndarray of type float, size (N)
         Smoothed data at y inputs.
+    float
+        The chosen lambda, only returned with lambda_="auto".
 
     Examples
     --------
@@ -77,6 +107,23 @@ def single_whittaker(x_input, y_input, weights_input, lambda_, d):
     weights_input_ptr = ffi.cast("double *", weights_input.ctypes.data)
     result_ptr = ffi.cast("double *", result.ctypes.data)
 
+    if _is_auto(lambda_):
+        grid, criterion = _auto_arguments(criterion, lambda_grid)
+
+        chosen = lib.rust_single_whittaker_auto(
+            x_input_ptr,
+            y_input_ptr,
+            weights_input_ptr,
+            result_ptr,
+            result.size,
+            ffi.cast("double *", grid.ctypes.data),
+            grid.size,
+            criterion,
+            d,
+        )
+
+        return result, chosen
+
     lib.rust_single_whittaker(
         x_input_ptr,
         y_input_ptr,
@@ -90,7 +137,19 @@ def single_whittaker(x_input, y_input, weights_input, lambda_, d):
     return result
 
 
-def multiple_whittakers(y_inputs, weights_inputs, lambda_, d, n_threads=-1):
+def multiple_whittakers(
+    y_inputs,
+    weights_inputs,
+    lambda_,
+    d,
+    n_threads=-1,
+    chunk_size=-1,
+    mask=None,
+    criterion="gcv",
+    lambda_grid=None,
+    x_inputs=None,
+    return_status=False,
+):
     """Run many Whittaker smoothers on 1D data in a multithreaded manner.
 
     This runs an identical algorithm to the single_whittaker function. However,
@@ -101,80 +160,732 @@ def multiple_whittakers(y_inputs, weights_inputs, lambda_, d, n_threads=-1):
     I have used a list here as apposed to a 2-D array so that arrays of different
     lengths can be supplied.
 
+    Missing values do not need to be removed first. NaNs, infs and values
+    flagged in mask are given a weight of zero inside the Rust workers, so
+    the smoother interpolates over them.
+
+    With lambda_="auto" every series gets its own lambda, the candidate of
+    lambda_grid with the best score. The difference penalty is built once per
+    series, and each candidate only refactorises the banded system. The
+    generalized cross-validation score needs the leverages (the diagonal of
+    the hat matrix), which come from the band of the inverse of the same
+    factor in O(N d²). The V-curve instead looks for where the log fit and log
+    roughness of the solution change the least between two candidates, and
+    settles between them.
+
+    Series sampled at irregular x (cloud gaps, changes of orbit) are smoothed
+    with divided differences of x_inputs, as in single_whittaker. When every
+    series shares one array of x values, its difference penalty is built once
+    and reused by every series.
+
+    A series with no more than d values, without any weighted value, with
+    non-finite x values or whose system cannot be factorised is all NaN, and
+    the rest of the batch is smoothed as usual. return_status=True tells which
+    series failed and why.
+
     Parameters
     ----------
-    y_inputs : list of ndarrays of type float, size (N)
+    y_inputs : list of ndarrays of type float, size (N) or RaggedSeries
         A list of numpy arrays containing the values to be smoothed.
-    weights_inputs : list of ndarrays of type float, size (N)
+    weights_inputs : list of ndarrays of type float, size (N) or RaggedSeries
         A list of numpy arrays containing the weights for the values to be
         smoothed. 0. ignores a given point (for interpolation) whereas 1.
         takes the point into full consideration.
+    lambda_ : float or "auto"
+        Smoothing coefficient. Larger = smoother. "auto" picks it for each
+        series.
+    d : float
+        Order of smoothing. 1. for linear.
+    n_threads : int, optional
+        Amount of worker threads used to complete the task. The default is -1
+        which runs on the shared worker pool, sized by EOkit.set_num_threads or
+        the EOKIT_NUM_THREADS environment variable. Any other value runs on a
+        pool of exactly that many threads, which is kept alive until a call
+        asks for another size. Setting this value to a number larger than the
+        amount of logical cores you have will most likely degreade performance.
+    chunk_size : int, optional
+        Number of series handed to a worker thread at a time. The default is -1
+        which groups series into chunks of similar estimated cost, starting
+        with the most expensive ones. Larger chunks lower the scheduling
+        overhead for very many short series, by default -1
+    mask : list of ndarrays of type bool, size (N), optional
+        Validity of each value, where False marks a value as missing. The
+        default of None treats every finite value as valid, by default None
+    criterion : {"gcv", "vcurve"}, optional
+        How lambda_="auto" scores the candidate lambdas, by generalized
+        cross-validation or by the V-curve, by default "gcv"
+    lambda_grid : ndarray of type float, optional
+        The candidate lambdas of lambda_="auto". The default of None tries 81
+        values evenly spaced in log10 from 1e-2 to 1e6, by default None
+    x_inputs : list of ndarrays of type float, size (N), RaggedSeries or ndarray
+        The x values of each series, as a list or RaggedSeries laid out like
+        y_inputs, or one 1D array shared by every series, which must then all
+        have its length. The default of None treats the series as evenly
+        spaced, by default None
+    return_status : bool, optional
+        Also return the SeriesStatus of every series, by default False
+
+    Returns
+    -------
+    list of ndarrays of type float, size (N) or RaggedSeries
+        A list of numpy arrays containing the smoothed data at y_inputs. When
+        y_inputs is a RaggedSeries the result is a RaggedSeries with the same
+        offsets and x values.
+    ndarray of type float, size (number of series)
+        The lambda chosen for each series, NaN for series without any valid
+        value. Only returned with lambda_="auto".
+    ndarray of type uint8, size (number of series)
+        The SeriesStatus code of every series, only with return_status.
+    """
+
+    y_series = as_ragged(y_inputs)
+    weights_series = as_ragged(weights_inputs)
+
+    if not y_series.same_layout(weights_series):
+        raise ValueError("y_inputs and weights_inputs must have equal lengths.")
+
+    # The smoother runs in float64, whatever the RaggedSeries holds.
+    y_values = check_type(y_series.values)
+    weights_values = check_type(weights_series.values)
+
+    result = np.empty(y_series.values.size, dtype=np.float64)
+
+    start_indices = y_series.start_indices
+
+    if mask is None:
+        mask_ptr = ffi.NULL
+    else:
+        mask = flat_mask(mask, y_series.values.size)
+        mask_ptr = ffi.cast("uint8_t *", mask.ctypes.data)
+
+    x_values, x_shared = _batch_x(x_inputs, y_series)
+    x_ptr = ffi.NULL if x_values is None else ffi.cast("double *", x_values.ctypes.data)
+
+    if return_status:
+        statuses = np.zeros(start_indices.size, dtype=np.uint8)
+        status_ptr = ffi.cast("uint8_t *", statuses.ctypes.data)
+    else:
+        status_ptr = ffi.NULL
+
+    if _is_auto(lambda_):
+        grid, criterion = _auto_arguments(criterion, lambda_grid)
+        lambdas = np.empty(start_indices.size, dtype=np.float64)
+
+        lib.rust_multiple_whittakers_auto(
+            x_ptr,
+            x_shared,
+            ffi.cast("double *", y_values.ctypes.data),
+            ffi.cast("double *", weights_values.ctypes.data),
+            mask_ptr,
+            ffi.cast("uintptr_t *", start_indices.ctypes.data),
+            start_indices.size,
+            ffi.cast("double *", result.ctypes.data),
+            result.size,
+            ffi.cast("double *", grid.ctypes.data),
+            grid.size,
+            criterion,
+            ffi.cast("double *", lambdas.ctypes.data),
+            d,
+            status_ptr,
+            n_threads,
+            chunk_size,
+        )
+    else:
+        lambdas = None
+
+        lib.rust_multiple_whittakers(
+            x_ptr,
+            x_shared,
+            ffi.cast("double *", y_values.ctypes.data),
+            ffi.cast("double *", weights_values.ctypes.data),
+            mask_ptr,
+            ffi.cast("uintptr_t *", start_indices.ctypes.data),
+            start_indices.size,
+            ffi.cast("double *", result.ctypes.data),
+            result.size,
+            lambda_,
+            d,
+            status_ptr,
+            n_threads,
+            chunk_size,
+        )
+
+    results = RaggedSeries(result, y_series.offsets, y_series.x)
+
+    if not isinstance(y_inputs, RaggedSeries):
+        results = results.to_list()
+
+    returned = (results,)
+
+    if lambdas is not None:
+        returned += (lambdas,)
+
+    if return_status:
+        returned += (statuses,)
+
+    return returned if len(returned) > 1 else results
+
+
+def robust_whittakers(
+    y_inputs,
+    weights_inputs,
+    lambda_,
+    d,
+    reweighting="asymmetric",
+    iterations=10,
+    tolerance=1e-4,
+    asymmetry=0.95,
+    n_threads=-1,
+    chunk_size=-1,
+    mask=None,
+    x_inputs=None,
+    return_iterations=False,
+    return_status=False,
+):
+    """Run iteratively reweighted Whittaker smoothers in a multithreaded manner.
+
+    Each series is smoothed as in multiple_whittakers, then smoothed again
+    with its weights updated from the residuals of the last fit, which pulls
+    the curve away from cloud contaminated or outlying values. Every refit
+    happens inside the Rust worker that owns the series. The difference
+    penalty is built once and only the weights on the diagonal change
+    between refits, so the whole robust fit is a single call into Rust.
+
+    The refits stop after iterations fits, or once the fit changes by at most
+    tolerance relative to the previous one.
+
+    Parameters
+    ----------
+    y_inputs : list of ndarrays of type float, size (N) or RaggedSeries
+        A list of numpy arrays containing the values to be smoothed.
+    weights_inputs : list of ndarrays of type float, size (N) or RaggedSeries
+        A list of numpy arrays containing the starting weights, which the
+        updated weights are multiplied with.
     lambda_ : float
         Smoothing coefficient. Larger = smoother.
     d : float
         Order of smoothing. 1. for linear.
+    reweighting : {"asymmetric", "envelope", "bisquare"}, optional
+        How the weights follow from the residuals y - z of the last fit.
+        "asymmetric" weights values above the fit by asymmetry and those
+        below it by 1 - asymmetry (asymmetric least squares). "envelope"
+        keeps values at or above the fit and weights those below it down
+        linearly to zero for the one furthest below, as in Chen et al.
+        (2004). "bisquare" applies Tukey's bisquare to the residuals scaled
+        by their median absolute deviation, dropping outliers on both sides,
+        by default "asymmetric"
+    iterations : int, optional
+        Upper limit on the number of fits of each series, by default 10
+    tolerance : float, optional
+        Relative change of the fit, in the 2-norm, below which the refits
+        stop. 0 always runs every iteration, by default 1e-4
+    asymmetry : float, optional
+        Weight of values above the fit with reweighting="asymmetric". Values
+        close to 1 follow the upper envelope, by default 0.95
     n_threads : int, optional
-        Amount of worker threads spawned to complete the task. The default is -1
-        which uses all logical processor cores. To tone this down, use something
-        between 1 and the number of processor cores you have. Setting this value
-        to a number larger than the amount of logical cores you have will most
-        likely degreade performance.
+        Amount of worker threads used to complete the task. The default is -1
+        which runs on the shared worker pool, by default -1
+    chunk_size : int, optional
+        Number of series handed to a worker thread at a time, by default -1
+    mask : list of ndarrays of type bool, size (N), optional
+        Validity of each value, where False marks a value as missing, by
+        default None
+    x_inputs : list of ndarrays of type float, size (N), RaggedSeries or ndarray
+        The x values of each series, or one 1D array shared by every series,
+        as in multiple_whittakers, by default None
+    return_iterations : bool, optional
+        Also return the number of fits of each series, by default False
+    return_status : bool, optional
+        Also return the SeriesStatus of every series, which is all NaN if it
+        could not be smoothed, by default False
 
     Returns
     -------
-    list of ndarrays of type float, size (N)
-        A list of numpy arrays containing the smoothed data at y_inputs.
+    list of ndarrays of type float, size (N) or RaggedSeries
+        The smoothed data at y_inputs, in the same form as y_inputs.
+    ndarray of type uint64, size (number of series)
+        The number of fits of each series, only with return_iterations.
+    ndarray of type uint8, size (number of series)
+        The SeriesStatus code of every series, only with return_status.
+
+    References
+    ----------
+    .. [1] P. H. C. Eilers, H. F. M. Boelens, Baseline correction with
+       asymmetric least squares smoothing, 2005.
+
     """
+    if reweighting not in _REWEIGHTINGS:
+        raise ValueError(
+            "reweighting must be one of {}.".format(sorted(_REWEIGHTINGS))
+        )
 
-    index_runner = 0
+    y_series = as_ragged(y_inputs)
+    weights_series = as_ragged(weights_inputs)
 
-    start_indices = [0]
+    if not y_series.same_layout(weights_series):
+        raise ValueError("y_inputs and weights_inputs must have equal lengths.")
 
-    for y_input in y_inputs[:-1]:
-        length_of_input = len(y_input)
-        index_runner += length_of_input
-        start_indices.append(index_runner)
+    y_values = check_type(y_series.values)
+    weights_values = check_type(weights_series.values)
 
-    start_indices = np.array(start_indices, dtype=np.uint64)
+    result = np.empty(y_series.values.size, dtype=np.float64)
 
-    y_input_array = np.concatenate(y_inputs).ravel().astype(np.float64)
-    weight_input_array = np.concatenate(weights_inputs).ravel().astype(np.float64)
+    start_indices = y_series.start_indices
 
-    result = np.empty(y_input_array.size, dtype=np.float64)
+    passes = np.zeros(start_indices.size, dtype=np.uint64)
 
-    y_input_array = check_contig(y_input_array)
-    weight_input_array = check_contig(weight_input_array)
-    result = check_contig(result)
-    start_indices = check_contig(start_indices)
+    if mask is None:
+        mask_ptr = ffi.NULL
+    else:
+        mask = flat_mask(mask, y_series.values.size)
+        mask_ptr = ffi.cast("uint8_t *", mask.ctypes.data)
 
-    y_input_ptr = ffi.cast("double *", y_input_array.ctypes.data)
-    weights_input_ptr = ffi.cast("double *", weight_input_array.ctypes.data)
-    result_ptr = ffi.cast("double *", result.ctypes.data)
-    start_indices_ptr = ffi.cast("uintptr_t *", start_indices.ctypes.data)
+    x_values, x_shared = _batch_x(x_inputs, y_series)
+    x_ptr = ffi.NULL if x_values is None else ffi.cast("double *", x_values.ctypes.data)
 
-    lib.rust_multiple_whittakers(
-        y_input_ptr,
-        weights_input_ptr,
-        start_indices_ptr,
+    if return_status:
+        statuses = np.zeros(start_indices.size, dtype=np.uint8)
+        status_ptr = ffi.cast("uint8_t *", statuses.ctypes.data)
+    else:
+        status_ptr = ffi.NULL
+
+    lib.rust_multiple_whittakers_robust(
+        x_ptr,
+        x_shared,
+        ffi.cast("double *", y_values.ctypes.data),
+        ffi.cast("double *", weights_values.ctypes.data),
+        mask_ptr,
+        ffi.cast("uintptr_t *", start_indices.ctypes.data),
         start_indices.size,
-        result_ptr,
+        ffi.cast("double *", result.ctypes.data),
         result.size,
         lambda_,
         d,
+        _REWEIGHTINGS[reweighting],
+        asymmetry,
+        iterations,
+        tolerance,
+        ffi.cast("uint64_t *", passes.ctypes.data),
+        status_ptr,
         n_threads,
+        chunk_size,
     )
 
-    results = []
+    results = RaggedSeries(result, y_series.offsets, y_series.x)
+
+    if not isinstance(y_inputs, RaggedSeries):
+        results = results.to_list()
+
+    returned = (results,)
+
+    if return_iterations:
+        returned += (passes,)
+
+    if return_status:
+        returned += (statuses,)
+
+    return returned if len(returned) > 1 else results
+
+
+def cube_whittakers(
+    y_cube,
+    weights_cube,
+    lambda_,
+    d,
+    axis=0,
+    n_threads=-1,
+    chunk_size=-1,
+    mask=None,
+    out=None,
+    scaling=None,
+    out_dtype=None,
+    out_scaling=None,
+    return_status=False,
+):
+    """Run a Whittaker smoother along one axis of an N-D array.
 
-    for i in range(0, len(start_indices)):
+    This is the array equivalent of multiple_whittakers for stacks where every
+    pixel has the same number of observations, such as a (time, y, x) raster
+    cube or a (pixels, time) table. The smoother runs directly over the NumPy
+    buffer with whatever strides it has, so there is no concatenation or
+    splitting in Python and no copy of the input. float32, int16 and uint16
+    cubes are read as they are, each series being converted to float64 by the
+    worker that smooths it, so scaled integer archives take no more memory
+    than on disk.
 
-        if i + 1 >= len(start_indices):
+    Cloudy or otherwise missing pixels can be left in the cube as NaN or
+    flagged in mask. They are given a weight of zero, so every timestamp
+    still gets a smoothed value.
 
-            single_result = result[start_indices[int(i)] :]
+    Parameters
+    ----------
+    y_cube : ndarray of type float64, float32, int16 or uint16, any shape
+        The values to be smoothed. Other dtypes are converted to float64.
+    weights_cube : ndarray of type float or None
+        Weights for y_cube. Anything that broadcasts to the shape of y_cube
+        is accepted, so a 1D array along axis can be used to weight every
+        pixel the same way. None weights every value by 1.
+    lambda_ : float
+        Smoothing coefficient. Larger = smoother.
+    d : float
+        Order of smoothing. 1. for linear.
+    axis : int, optional
+        The time axis to smooth along, by default 0
+    n_threads : int, optional
+        Amount of worker threads used to complete the task. The default is -1
+        which runs on the shared worker pool, by default -1
+    chunk_size : int, optional
+        Number of series handed to a worker thread at a time, by default -1
+    mask : ndarray of type bool, optional
+        Validity of each value, broadcastable to the shape of y_cube, where
+        False marks a value as missing, by default None
+    out : ndarray of type float, optional
+        Array to write the result into, of the result's shape. It can have any
+        strides, such as a view into a memory-mapped stack. The default of None
+        allocates a new array, by default None
+    scaling : Scaling or tuple, optional
+        The (scale, offset, nodata) of y_cube, where a stored value s stands
+        for s * scale + offset and nodata marks missing values. The default of
+        None reads values as they are, by default None
+    out_dtype : dtype, optional
+        The dtype of the result, one of float64, float32, int16 or uint16. The
+        default of None takes that of out, or float64, by default None
+    out_scaling : Scaling or tuple, optional
+        The (scale, offset, nodata) the result is stored with, rounded and
+        clipped for integer dtypes. The default of None takes scaling for
+        integer results and stores float results as they are, by default None
+    return_status : bool, optional
+        Also return the SeriesStatus of every series, by default False
+
+    Returns
+    -------
+    ndarray of type out_dtype, same shape as y_cube
+        The smoothed values, in out if given.
+    ndarray of type uint8, shape of y_cube without axis
+        The SeriesStatus code of every series, only with return_status.
+
+    Examples
+    --------
+    >>> cube = np.random.standard_normal((120, 256, 256))
+    >>> smoothed = whittaker.cube_whittakers(cube, None, 10, 2, axis=0)
+
+    An int16 NDVI stack, smoothed into int16 with the same scaling:
+
+    >>> ndvi = np.load("ndvi_int16.npy", mmap_mode="r")
+    >>> smoothed = whittaker.cube_whittakers(
+    ...     ndvi, None, 10, 2, scaling=(1e-4, 0.0, -3000), out_dtype=np.int16
+    ... )
+
+    """
+    y_cube = check_encoded_type(np.asarray(y_cube))
+    axis = check_axis(axis, y_cube.ndim)
+
+    result, out_scaling = encoded_output(
+        out, y_cube.shape, out_dtype, scaling, out_scaling
+    )
+
+    shape = np.array(y_cube.shape, dtype=np.uintp)
+    y_strides = element_strides(y_cube)
+    result_strides = element_strides(result)
+
+    if weights_cube is None:
+        weights_ptr = ffi.NULL
+        weights_strides = y_strides
+    else:
+        weights_cube = np.broadcast_to(
+            check_type(np.asarray(weights_cube)), y_cube.shape
+        )
+        weights_ptr = ffi.cast("double *", weights_cube.ctypes.data)
+        weights_strides = element_strides(weights_cube)
+
+    if mask is None:
+        mask_ptr = ffi.NULL
+        mask_strides = y_strides
+    else:
+        mask = broadcast_mask(mask, y_cube.shape)
+        mask_ptr = ffi.cast("uint8_t *", mask.ctypes.data)
+        mask_strides = element_strides(mask)
+
+    if return_status:
+        statuses = np.zeros(np.delete(y_cube.shape, axis), dtype=np.uint8)
+        status_ptr = ffi.cast("uint8_t *", statuses.ctypes.data)
+    else:
+        status_ptr = ffi.NULL
+
+    lib.rust_cube_whittakers(
+        ffi.cast("uint8_t *", y_cube.ctypes.data),
+        *encoding_arguments(y_cube, scaling),
+        ffi.cast("intptr_t *", y_strides.ctypes.data),
+        weights_ptr,
+        ffi.cast("intptr_t *", weights_strides.ctypes.data),
+        mask_ptr,
+        ffi.cast("intptr_t *", mask_strides.ctypes.data),
+        ffi.cast("uint8_t *", result.ctypes.data),
+        *encoding_arguments(result, out_scaling),
+        ffi.cast("intptr_t *", result_strides.ctypes.data),
+        ffi.cast("uintptr_t *", shape.ctypes.data),
+        y_cube.ndim,
+        axis,
+        lambda_,
+        d,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    )
+
+    if return_status:
+        return result, statuses
+
+    return result
+
+
+def _batch_x(x_inputs, y_series):
+    """Return the flat x values of a batch and whether every series shares them."""
+    if x_inputs is None:
+        return None, False
+
+    if isinstance(x_inputs, np.ndarray) and x_inputs.ndim == 1:
+        lengths = y_series.lengths
+
+        if np.any(lengths != x_inputs.size):
+            raise ValueError("Every series must have the length of the shared x.")
+
+        return check_contig(check_type(x_inputs)), True
+
+    x_series = as_ragged(x_inputs)
+
+    if not y_series.same_layout(x_series):
+        raise ValueError("y_inputs and x_inputs must have equal lengths.")
+
+    return check_type(x_series.values), False
+
+
+def _is_auto(lambda_):
+    """Whether lambda_ asks for the automatic choice of lambda."""
+    return isinstance(lambda_, str) and lambda_ == "auto"
+
+
+def _auto_arguments(criterion, lambda_grid):
+    """Return the candidate lambdas and the Rust code of the criterion."""
+    if criterion not in _CRITERIA:
+        raise ValueError("criterion must be one of {}.".format(sorted(_CRITERIA)))
+
+    grid = _LAMBDA_GRID if lambda_grid is None else lambda_grid
+    grid = check_contig(np.asarray(grid, dtype=np.float64).ravel())
+
+    if grid.size == 0 or np.any(~(grid > 0)):
+        raise ValueError("lambda_grid must hold positive values.")
+
+    return grid, _CRITERIA[criterion]
+
+
+class OnlineWhittaker:
+    """Whittaker smoothers of many pixels, updated as new acquisitions arrive.
+
+    Appending a value to a series adds one row to the banded system of the
+    smoother, and only changes the last d + 1 rows of its Cholesky factor. The
+    state keeps the last window rows of the factor and of the forward solve of
+    each pixel, so a new acquisition refactorises that tail and the back
+    substitution gives the last window smoothed values. These are exactly the
+    values multiple_whittakers gives for the whole history, at a cost per
+    acquisition that does not grow with it.
+
+    All of the state lives in NumPy arrays, and can be written to disk with
+    save and read back with load between runs. It takes about
+    (window + d) * (d + 2) floats per pixel.
+
+    Parameters
+    ----------
+    n_pixels : int
+        Number of pixels, each of which gets one value per acquisition.
+    lambda_ : float
+        Smoothing coefficient. Larger = smoother.
+    d : int, optional
+        Order of smoothing. 1 for linear, by default 2
+    window : int, optional
+        Number of most recent smoothed values returned per pixel, which must
+        be larger than 2 * d, by default 32
+    irregular : bool, optional
+        Use the acquisition x values for divided differences, as
+        single_whittaker does, rather than assume even spacing, by default
+        False
+
+    Examples
+    --------
+    >>> state = whittaker.OnlineWhittaker(ndvi.shape[1], 10.0)
+    >>> for day, acquisition in zip(days, ndvi):
+    ...     smoothed = state.update(day, acquisition)
+    >>> state.save("whittaker_state.npz")
+
+    """
+
+    def __init__(self, n_pixels, lambda_, d=2, window=32, irregular=False):
+        if window <= 2 * d:
+            raise ValueError("window must be larger than 2 * d.")
+
+        self.n_pixels = int(n_pixels)
+        self.lambda_ = float(lambda_)
+        self.d = int(d)
+        self.window = int(window)
+        self.irregular = bool(irregular)
+
+        width = self.d + 1
+        self.count = 0
+        self.x_tail = np.empty(0, dtype=np.float64)
+        self.factor = np.zeros((self.n_pixels, self.window, width))
+        self.forward = np.zeros((self.n_pixels, self.window))
+        self.pending = np.zeros((self.n_pixels, self.d, width))
+        self.rhs = np.zeros((self.n_pixels, self.d))
+        self.weight_totals = np.zeros(self.n_pixels)
+
+    def update(
+        self,
+        y,
+        weights=None,
+        x=None,
+        mask=None,
+        n_threads=-1,
+        chunk_size=-1,
+        return_status=False,
+    ):
+        """Append new acquisitions and return the updated smoothed values.
+
+        Missing values, NaNs, infs and values flagged in mask, are given a
+        weight of zero, so the smoother interpolates over them.
+
+        Parameters
+        ----------
+        y : ndarray of type float, size (n_pixels) or (n_pixels, K)
+            The value of every pixel in each of K new acquisitions.
+        weights : ndarray of type float, same shape as y, optional
+            The weight of each value. The default of None gives every value a
+            weight of 1, by default None
+        x : float or ndarray of type float, size (K), optional
+            The x values (e.g. days) of the new acquisitions, which are needed
+            when the state is irregular, by default None
+        mask : ndarray of type bool, same shape as y, optional
+            Validity of each value, where False marks a value as missing, by
+            default None
+        n_threads : int, optional
+            Amount of worker threads used to complete the task, by default -1
+        chunk_size : int, optional
+            Number of pixels handed to a worker thread at a time, by default -1
+        return_status : bool, optional
+            Also return the SeriesStatus of every pixel, NON_FINITE for pixels
+            without any weighted value so far, by default False
+
+        Returns
+        -------
+        ndarray of type float, size (n_pixels, window)
+            The smoothed values of the last window acquisitions of each pixel,
+            oldest first and NaN past the number of acquisitions so far.
+        ndarray of type uint8, size (n_pixels)
+            The SeriesStatus code of every pixel, only with return_status.
+
+        """
+        y = np.asarray(y)
+        new_count = 1 if y.ndim == 1 else y.shape[1]
+        new_y = pixel_block(y, self.n_pixels, new_count)
+
+        if self.irregular:
+            if x is None:
+                raise ValueError("x is required to update an irregular state.")
+
+            new_x = check_contig(np.atleast_1d(np.asarray(x, dtype=np.float64)))
+
+            if new_x.size != new_count:
+                raise ValueError("x must hold one value per acquisition.")
+
+            x_tail_ptr = ffi.cast("double *", self.x_tail.ctypes.data)
+            new_x_ptr = ffi.cast("double *", new_x.ctypes.data)
+        else:
+            x_tail_ptr = ffi.NULL
+            new_x_ptr = ffi.NULL
+
+        if weights is None:
+            weights_ptr = ffi.NULL
         else:
+            weights = pixel_block(weights, self.n_pixels, new_count)
+            weights_ptr = ffi.cast("double *", weights.ctypes.data)
 
-            single_result = result[start_indices[int(i)] : int(start_indices[i + 1])]
+        if mask is None:
+            mask_ptr = ffi.NULL
+        else:
+            mask = pixel_block(mask, self.n_pixels, new_count, dtype=bool)
+            mask = mask.view(np.uint8)
+            mask_ptr = ffi.cast("uint8_t *", mask.ctypes.data)
 
-        results.append(single_result)
+        result = np.empty((self.n_pixels, self.window), dtype=np.float64)
 
-    return results
+        if return_status:
+            statuses = np.zeros(self.n_pixels, dtype=np.uint8)
+            status_ptr = ffi.cast("uint8_t *", statuses.ctypes.data)
+        else:
+            status_ptr = ffi.NULL
+
+        lib.rust_online_whittakers(
+            x_tail_ptr,
+            self.count,
+            ffi.cast("double *", self.factor.ctypes.data),
+            ffi.cast("double *", self.forward.ctypes.data),
+            ffi.cast("double *", self.pending.ctypes.data),
+            ffi.cast("double *", self.rhs.ctypes.data),
+            ffi.cast("double *", self.weight_totals.ctypes.data),
+            self.n_pixels,
+            self.window,
+            new_x_ptr,
+            ffi.cast("double *", new_y.ctypes.data),
+            weights_ptr,
+            mask_ptr,
+            new_count,
+            ffi.cast("double *", result.ctypes.data),
+            self.lambda_,
+            self.d,
+            status_ptr,
+            n_threads,
+            chunk_size,
+        )
+
+        self.count += new_count
+
+        if self.irregular:
+            x_values = np.concatenate([self.x_tail, new_x])
+            self.x_tail = x_values[x_values.size - self.d :].copy()
+
+        if return_status:
+            return result, statuses
+
+        return result
+
+    def save(self, path):
+        """Write the state and its parameters to an .npz file."""
+        np.savez(
+            path,
+            factor=self.factor,
+            forward=self.forward,
+            pending=self.pending,
+            rhs=self.rhs,
+            weight_totals=self.weight_totals,
+            x_tail=self.x_tail,
+            parameters=np.array(
+                [self.lambda_, self.d, self.count, self.irregular], dtype=np.float64
+            ),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Read a state written by save."""
+        with np.load(path) as data:
+            lambda_, d, count, irregular = data["parameters"]
+            n_pixels, window, _ = data["factor"].shape
+
+            state = cls(n_pixels, lambda_, int(d), window, bool(irregular))
+            state.count = int(count)
+            state.x_tail = data["x_tail"].copy()
+            state.factor[...] = data["factor"]
+            state.forward[...] = data["forward"]
+            state.pending[...] = data["pending"]
+            state.rhs[...] = data["rhs"]
+            state.weight_totals[...] = data["weight_totals"]
+
+        return state
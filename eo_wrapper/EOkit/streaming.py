@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""This module houses the out-of-core driver for stacks larger than memory.
+
+The cube functions (cube_whittakers, cube_sav_golays, cube_gps and
+ndvi.chen_reconstruction) need the whole stack in memory and allocate a
+result just as large. stream_cube instead runs them tile by tile
+over a memory-mapped stack, and writes each tile of results straight into a
+memory-mapped output, so only a few tiles are ever held in memory.
+
+Tiles are slabs along the first axis that is not the time axis, which keeps
+each read of a C ordered stack contiguous. float32, int16 and uint16 tiles
+are kept in their own dtype, as the cube functions convert each series in the
+worker that smooths it. While the Rust workers smooth one tile, a background
+thread already reads the next one. The Rust
+calls release the GIL, so the two overlap.
+
+Examples
+--------
+>>> from EOkit.smoothers import whittaker
+>>> stream_cube(
+...     whittaker.cube_whittakers,
+...     "ndvi_stack.npy",
+...     output="ndvi_smoothed.npy",
+...     weights_cube=None,
+...     lambda_=10.0,
+...     d=2,
+...     memory_budget=512 * 2**20,
+... )
+
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from EOkit.array_utils import check_axis, check_encoded_type
+
+# Default bound on the memory held by tiles, in bytes.
+DEFAULT_MEMORY_BUDGET = 256 * 2 ** 20
+
+
+def stream_cube(
+    function,
+    y_input,
+    output=None,
+    axis=0,
+    output_length=None,
+    memory_budget=DEFAULT_MEMORY_BUDGET,
+    prefetch=True,
+    **kwargs
+):
+    """Run a cube function over a stack in tiles that fit a memory budget.
+
+    Parameters
+    ----------
+    function : callable
+        A cube function, called as function(tile, axis=axis, out=out_tile,
+        **kwargs) for every tile. Arguments that come before the cube, such
+        as the x values of cube_gps, can be bound with functools.partial.
+    y_input : str, os.PathLike, ndarray or buffer
+        The stack of series, of any dtype. A path is opened as a memory-mapped
+        .npy file. np.memmap arrays, including raw binary files opened with
+        np.memmap, and any object with the buffer protocol are read in place.
+    output : str, os.PathLike or ndarray, optional
+        Where the results go. A path creates a memory-mapped .npy file of the
+        result's shape and of the out_dtype keyword argument, float64 without
+        one, overwriting any existing file. An array (for instance an
+        np.memmap) must have that shape and a dtype function can write. The
+        default of None allocates the result in memory, by default None
+    axis : int, optional
+        The time axis of the stack, by default 0
+    output_length : int, optional
+        The length of the result along axis, for functions that extend each
+        series, such as cube_gps which adds forecast_amount values. The
+        default of None keeps the length of y_input, by default None
+    memory_budget : int, optional
+        Upper bound in bytes on the memory taken by the tiles being read and
+        computed, including the copy of the input tile, the tiles of any
+        other stack-shaped argument and the result pages, by default 256 MiB
+    prefetch : bool, optional
+        Read the next tile in a background thread while the current one is
+        computed. This holds two input tiles at once, which the tile size
+        accounts for, by default True
+    **kwargs
+        Passed on to function. Arrays, such as a mask or a weights cube, are
+        broadcast to the shape of y_input and cut into the same tiles, and
+        raise a ValueError if they do not broadcast. With
+        return_status=True the statuses of the tiles are gathered as well.
+
+    Returns
+    -------
+    ndarray
+        The results, as the memory-mapped output if one was given. Memory
+        mapped results are flushed to disk.
+    ndarray of type uint8, shape of y_input without axis
+        The SeriesStatus code of every series, only with return_status.
+
+    """
+    y_input = _open_input(y_input)
+
+    if y_input.ndim < 2:
+        raise ValueError("A stack needs a time axis and at least one other.")
+
+    axis = check_axis(axis, y_input.ndim)
+
+    output_shape = list(y_input.shape)
+    if output_length is not None:
+        output_shape[axis] = output_length
+    output_shape = tuple(output_shape)
+
+    output = _open_output(output, output_shape, kwargs.get("out_dtype"))
+
+    tiled = {
+        name: _broadcast_argument(name, value, y_input.shape)
+        for name, value in kwargs.items()
+        if isinstance(value, np.ndarray) and value.ndim > 0
+    }
+
+    tile_axis = 0 if axis != 0 else 1
+
+    return_status = kwargs.get("return_status", False)
+    if return_status:
+        statuses = np.zeros(np.delete(y_input.shape, axis), dtype=np.uint8)
+        # The tiles cut the statuses along the same axis, shifted past axis.
+        status_axis = tile_axis if tile_axis < axis else tile_axis - 1
+
+    if y_input.shape[tile_axis] == 0:
+        return (output, statuses) if return_status else output
+
+    step = _tile_size(y_input, output, tiled, tile_axis, memory_budget, prefetch)
+
+    def tile_slices(start):
+        index = [slice(None)] * y_input.ndim
+        index[tile_axis] = slice(start, min(start + step, y_input.shape[tile_axis]))
+        return tuple(index)
+
+    def read(start):
+        index = tile_slices(start)
+        tile_kwargs = {name: np.array(value[index]) for name, value in tiled.items()}
+        return check_encoded_type(np.array(y_input[index])), tile_kwargs
+
+    starts = range(0, y_input.shape[tile_axis], step)
+
+    with ThreadPoolExecutor(max_workers=1) as reader:
+        pending = reader.submit(read, starts[0]) if prefetch else None
+
+        for k, start in enumerate(starts):
+            if prefetch:
+                tile, tile_kwargs = pending.result()
+                if k + 1 < len(starts):
+                    pending = reader.submit(read, starts[k + 1])
+            else:
+                tile, tile_kwargs = read(start)
+
+            returned = function(
+                tile,
+                axis=axis,
+                out=output[tile_slices(start)],
+                **dict(kwargs, **tile_kwargs)
+            )
+
+            if return_status:
+                index = [slice(None)] * statuses.ndim
+                index[status_axis] = tile_slices(start)[tile_axis]
+                statuses[tuple(index)] = returned[1]
+
+    if isinstance(output, np.memmap):
+        output.flush()
+
+    if return_status:
+        return output, statuses
+
+    return output
+
+
+def _broadcast_argument(name, value, shape):
+    """Return the array argument name broadcast to the shape of the stack."""
+    try:
+        return np.broadcast_to(value, shape)
+    except ValueError:
+        raise ValueError(
+            "{} of shape {} does not broadcast to the stack's shape {}.".format(
+                name, value.shape, shape
+            )
+        ) from None
+
+
+def _open_input(y_input):
+    """Return the stack as an array, memory-mapping .npy paths."""
+    if isinstance(y_input, (str, os.PathLike)):
+        return np.load(y_input, mmap_mode="r")
+
+    return np.asarray(y_input)
+
+
+def _open_output(output, shape, dtype):
+    """Return the array the results are written to."""
+    dtype = np.float64 if dtype is None else dtype
+
+    if output is None:
+        return np.empty(shape, dtype=dtype)
+
+    if isinstance(output, (str, os.PathLike)):
+        return np.lib.format.open_memmap(
+            output, mode="w+", dtype=dtype, shape=shape
+        )
+
+    if output.shape != shape:
+        raise ValueError("output must have shape {}.".format(shape))
+
+    return output
+
+
+def _tile_size(y_input, output, tiled, tile_axis, memory_budget, prefetch):
+    """Number of slabs along tile_axis that fit in memory_budget."""
+    n_slabs = y_input.shape[tile_axis]
+    copies = 2 if prefetch else 1
+
+    # Bytes of one slab held at once: the input tile, in its own dtype if
+    # the cube functions read it and as float64 otherwise, and the tiles of
+    # the other stack-shaped arguments, once more while the next tile is
+    # read, and the result pages the tile writes.
+    slab = y_input.size // max(n_slabs, 1)
+    itemsize = check_encoded_type(y_input[:0]).itemsize
+    slab_bytes = copies * slab * (
+        itemsize + sum(value.itemsize for value in tiled.values())
+    )
+    slab_bytes += output.size // max(n_slabs, 1) * output.itemsize
+
+    return int(min(n_slabs, max(1, memory_budget // max(slab_bytes, 1))))
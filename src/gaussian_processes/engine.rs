@@ -0,0 +1,549 @@
+//! RBF kernel Gaussian process regression on 1D inputs.
+//!
+//! The kernel matrix is built in place in a per-thread workspace,
+//! factorised with the blocked Cholesky from `math_utils::dense` and used
+//! to predict without allocating. The engine is generic over `f32` and
+//! `f64`.
+//!
+//! Exact inference is cubic in the series length. For long series the
+//! sparse mode instead conditions on `k` inducing points spread evenly over
+//! the x range and returns the DTC (equivalently VFE) posterior mean, which
+//! costs `O(n k²)`. More inducing points are more accurate, and with the
+//! inducing points at the training points the two modes agree.
+
+use crate::math_utils::banded::NotPositiveDefinite;
+use crate::math_utils::dense::{
+    cholesky, cholesky_solve, solve_lower, solve_lower_transposed,
+};
+use crate::math_utils::real::Real;
+
+use std::cell::RefCell;
+
+/// Squared exponential kernel `amplitude * exp(-(a - b)² / (2 ls²))`.
+#[derive(Clone, Copy, Debug)]
+pub struct RbfKernel<T> {
+    amplitude: T,
+    // -1 / (2 length_scale²)
+    exponent_scale: T,
+}
+
+impl<T: Real> RbfKernel<T> {
+    pub fn new(length_scale: f64, amplitude: f64) -> RbfKernel<T> {
+        RbfKernel {
+            amplitude: T::from_f64(amplitude),
+            exponent_scale: T::from_f64(
+                -1_f64 / (2_f64 * length_scale * length_scale),
+            ),
+        }
+    }
+
+    #[inline]
+    pub fn eval(&self, a: T, b: T) -> T {
+        let d = a - b;
+        self.amplitude * (d * d * self.exponent_scale).exp()
+    }
+}
+
+/// Buffers reused by every GP a worker thread fits.
+#[derive(Default)]
+pub struct Workspace<T> {
+    system: Vec<T>,
+    alpha: Vec<T>,
+    inducing: Vec<T>,
+    factor: Vec<T>,
+    cross: Vec<T>,
+    pub training_x: Vec<T>,
+    pub training_y: Vec<T>,
+}
+
+/// Per-thread GP workspace and gather buffers for strided inputs.
+#[derive(Default)]
+pub struct GpBuffers<T> {
+    pub workspace: Workspace<T>,
+    pub input: Vec<T>,
+    pub mask: Vec<u8>,
+    pub output: Vec<T>,
+}
+
+/// Types the GP engine runs in, each with its own per-thread buffers.
+pub trait GpScalar: Real {
+    fn with_buffers<F, R>(f: F) -> R
+    where
+        F: FnOnce(&mut GpBuffers<Self>) -> R;
+}
+
+thread_local! {
+    static BUFFERS_F64: RefCell<GpBuffers<f64>> =
+        RefCell::new(GpBuffers::default());
+    static BUFFERS_F32: RefCell<GpBuffers<f32>> =
+        RefCell::new(GpBuffers::default());
+}
+
+impl GpScalar for f64 {
+    fn with_buffers<F, R>(f: F) -> R
+    where
+        F: FnOnce(&mut GpBuffers<f64>) -> R,
+    {
+        BUFFERS_F64.with(|buffers| f(&mut buffers.borrow_mut()))
+    }
+}
+
+impl GpScalar for f32 {
+    fn with_buffers<F, R>(f: F) -> R
+    where
+        F: FnOnce(&mut GpBuffers<f32>) -> R,
+    {
+        BUFFERS_F32.with(|buffers| f(&mut buffers.borrow_mut()))
+    }
+}
+
+/// Prediction point `j` of a series: its x values followed by
+/// `forecast_amount` points spaced `forecast_spacing` after the last one.
+#[inline]
+pub fn prediction_point<T: Real>(
+    x_input: &[T],
+    forecast_spacing: i64,
+    j: usize,
+) -> T {
+    let n = x_input.len();
+
+    if j < n {
+        x_input[j]
+    } else {
+        x_input[n - 1]
+            + T::from_f64(((j - n + 1) as i64 * forecast_spacing) as f64)
+    }
+}
+
+/// Fit a zero mean GP to `(training_x, training_y)` and write the posterior
+/// mean at the `x_input` values and the forecasts after them to `output`.
+///
+/// The noise is added to the diagonal of the kernel matrix.
+pub fn predict<T: Real>(
+    kernel: RbfKernel<T>,
+    noise: T,
+    training_x: &[T],
+    training_y: &[T],
+    x_input: &[T],
+    forecast_spacing: i64,
+    system: &mut Vec<T>,
+    alpha: &mut Vec<T>,
+    output: &mut [T],
+) -> Result<(), NotPositiveDefinite> {
+    let n = training_x.len();
+
+    // Only the lower triangle is needed by the factorisation.
+    system.clear();
+    system.resize(n * n, T::zero());
+    for i in 0..n {
+        let row = &mut system[i * n..i * n + i + 1];
+        for (j, k) in row.iter_mut().enumerate() {
+            *k = kernel.eval(training_x[i], training_x[j]);
+        }
+        row[i] += noise;
+    }
+
+    cholesky(system, n)?;
+
+    alpha.clear();
+    alpha.extend_from_slice(training_y);
+    cholesky_solve(system, n, alpha, 1);
+
+    for (j, out) in output.iter_mut().enumerate() {
+        let point = prediction_point(x_input, forecast_spacing, j);
+
+        *out = training_x
+            .iter()
+            .zip(alpha.iter())
+            .fold(T::zero(), |sum, (x, a)| sum + kernel.eval(point, *x) * *a);
+    }
+
+    Ok(())
+}
+
+/// Whether `inducing_points` asks for the sparse approximation of a GP on
+/// `n` training points. Zero, or at least `n` points, means exact inference.
+#[inline]
+pub fn is_sparse(inducing_points: usize, n: usize) -> bool {
+    inducing_points > 0 && inducing_points < n
+}
+
+/// `count` inducing points spread evenly from the smallest to the largest
+/// value of `x`.
+pub fn inducing_grid<T: Real>(x: &[T], count: usize, grid: &mut Vec<T>) {
+    let (mut low, mut high) = (x[0], x[0]);
+    for value in x {
+        if *value < low {
+            low = *value;
+        }
+        if *value > high {
+            high = *value;
+        }
+    }
+
+    grid.clear();
+
+    if count == 1 {
+        grid.push((low + high) / T::from_f64(2.));
+        return;
+    }
+
+    let step = (high - low) / T::from_f64((count - 1) as f64);
+    grid.extend((0..count).map(|i| low + step * T::from_f64(i as f64)));
+}
+
+/// Factorise the inducing point system of the DTC approximation.
+///
+/// With `K_uu = L Lᵀ` and `V = L⁻¹ K_un`, the system `noise K_uu + K_un
+/// K_nu` is `L (noise I + V Vᵀ) Lᵀ`. The middle factor is well conditioned
+/// even when `K_uu` is not, which keeps `f32` usable. Afterwards `factor`
+/// holds `L`, `cross` holds `V` (`k` by `n`) and `system` holds the Cholesky
+/// factor of `noise I + V Vᵀ`.
+///
+/// A dense grid of inducing points makes `K_uu` close to singular, so a
+/// jitter of `1e-6 * amplitude` is added to its diagonal.
+pub fn low_rank_system<T: Real>(
+    kernel: RbfKernel<T>,
+    noise: T,
+    inducing: &[T],
+    training_x: &[T],
+    factor: &mut Vec<T>,
+    cross: &mut Vec<T>,
+    system: &mut Vec<T>,
+) -> Result<(), NotPositiveDefinite> {
+    let (k, n) = (inducing.len(), training_x.len());
+
+    let jitter = T::from_f64(1e-6) * kernel.amplitude;
+
+    factor.clear();
+    factor.resize(k * k, T::zero());
+    for i in 0..k {
+        for j in 0..i + 1 {
+            factor[i * k + j] = kernel.eval(inducing[i], inducing[j]);
+        }
+        factor[i * k + i] += jitter;
+    }
+
+    cholesky(factor, k)?;
+
+    cross.clear();
+    for u in inducing {
+        cross.extend(training_x.iter().map(|x| kernel.eval(*u, *x)));
+    }
+
+    solve_lower(factor, k, cross, n);
+
+    system.clear();
+    system.resize(k * k, T::zero());
+    for i in 0..k {
+        let row_i = &cross[i * n..(i + 1) * n];
+        for j in 0..i + 1 {
+            let row_j = &cross[j * n..(j + 1) * n];
+            system[i * k + j] = row_i
+                .iter()
+                .zip(row_j)
+                .fold(T::zero(), |sum, (a, b)| sum + *a * *b);
+        }
+        system[i * k + i] += noise;
+    }
+
+    cholesky(system, k)
+}
+
+/// Sparse version of `predict`: the posterior mean of the GP conditioned on
+/// `inducing_points` inducing points, `K*u (noise K_uu + K_un K_nu)⁻¹ K_un y`.
+pub fn predict_sparse<T: Real>(
+    kernel: RbfKernel<T>,
+    noise: T,
+    inducing_points: usize,
+    training_x: &[T],
+    training_y: &[T],
+    x_input: &[T],
+    forecast_spacing: i64,
+    buffers: SparseBuffers<T>,
+    output: &mut [T],
+) -> Result<(), NotPositiveDefinite> {
+    let SparseBuffers {
+        system,
+        alpha,
+        inducing,
+        factor,
+        cross,
+    } = buffers;
+
+    let n = training_x.len();
+
+    inducing_grid(training_x, inducing_points, inducing);
+    low_rank_system(
+        kernel, noise, inducing, training_x, factor, cross, system,
+    )?;
+
+    // L⁻ᵀ (noise I + V Vᵀ)⁻¹ V y
+    alpha.clear();
+    alpha.extend(cross.chunks(n).map(|row| {
+        row.iter()
+            .zip(training_y)
+            .fold(T::zero(), |sum, (v, y)| sum + *v * *y)
+    }));
+    cholesky_solve(system, inducing_points, alpha, 1);
+    solve_lower_transposed(factor, inducing_points, alpha, 1);
+
+    for (j, out) in output.iter_mut().enumerate() {
+        let point = prediction_point(x_input, forecast_spacing, j);
+
+        *out = inducing
+            .iter()
+            .zip(alpha.iter())
+            .fold(T::zero(), |sum, (u, a)| sum + kernel.eval(point, *u) * *a);
+    }
+
+    Ok(())
+}
+
+/// Scratch buffers of `predict` and `predict_sparse`, borrowed from a
+/// `Workspace`.
+pub struct SparseBuffers<'a, T> {
+    pub system: &'a mut Vec<T>,
+    pub alpha: &'a mut Vec<T>,
+    pub inducing: &'a mut Vec<T>,
+    pub factor: &'a mut Vec<T>,
+    pub cross: &'a mut Vec<T>,
+}
+
+/// Run `predict_sparse` when `is_sparse(inducing_points, n)`, `predict`
+/// otherwise.
+fn predict_with<T: Real>(
+    kernel: RbfKernel<T>,
+    noise: T,
+    inducing_points: usize,
+    training_x: &[T],
+    training_y: &[T],
+    x_input: &[T],
+    forecast_spacing: i64,
+    buffers: SparseBuffers<T>,
+    output: &mut [T],
+) -> Result<(), NotPositiveDefinite> {
+    if is_sparse(inducing_points, training_x.len()) {
+        predict_sparse(
+            kernel,
+            noise,
+            inducing_points,
+            training_x,
+            training_y,
+            x_input,
+            forecast_spacing,
+            buffers,
+            output,
+        )
+    } else {
+        predict(
+            kernel,
+            noise,
+            training_x,
+            training_y,
+            x_input,
+            forecast_spacing,
+            buffers.system,
+            buffers.alpha,
+            output,
+        )
+    }
+}
+
+/// Posterior standard deviation of the latent function at the prediction
+/// points `first_point..first_point + output.len()`, from the factorisation
+/// the last `predict_with` on `training_x` left in `buffers`.
+///
+/// With `v = L⁻¹ k*` the exact variance is `k** - vᵀv`. With `a = L_uu⁻¹
+/// k_u*` the DTC variance is `k** - aᵀa + noise |L_B⁻¹ a|²`, `L_B` being the
+/// factor of `noise I + V Vᵀ`. All points are solved for together, one
+/// column each.
+pub fn predictive_std<T: Real>(
+    kernel: RbfKernel<T>,
+    noise: T,
+    inducing_points: usize,
+    training_x: &[T],
+    x_input: &[T],
+    forecast_spacing: i64,
+    first_point: usize,
+    buffers: SparseBuffers<T>,
+    output: &mut [T],
+) {
+    let SparseBuffers {
+        system,
+        inducing,
+        factor,
+        cross,
+        ..
+    } = buffers;
+
+    let count = output.len();
+    let sparse = is_sparse(inducing_points, training_x.len());
+    let basis: &[T] = if sparse { inducing } else { training_x };
+    let k = basis.len();
+
+    cross.clear();
+    for b in basis {
+        cross.extend((first_point..first_point + count).map(|j| {
+            kernel.eval(*b, prediction_point(x_input, forecast_spacing, j))
+        }));
+    }
+
+    let column_squares = |cross: &[T], output: &mut [T], scale: T| {
+        for row in cross.chunks(count) {
+            output
+                .iter_mut()
+                .zip(row)
+                .for_each(|(out, v)| *out += scale * *v * *v);
+        }
+    };
+
+    for (j, out) in output.iter_mut().enumerate() {
+        let point =
+            prediction_point(x_input, forecast_spacing, first_point + j);
+        *out = kernel.eval(point, point);
+    }
+
+    if sparse {
+        solve_lower(factor, k, cross, count);
+        column_squares(cross, output, -T::one());
+        solve_lower(system, k, cross, count);
+        column_squares(cross, output, noise);
+    } else {
+        solve_lower(system, k, cross, count);
+        column_squares(cross, output, -T::one());
+    }
+
+    // Rounding can leave tiny negative variances.
+    output.iter_mut().for_each(|variance| {
+        *variance = if *variance > T::zero() {
+            variance.sqrt()
+        } else {
+            T::zero()
+        }
+    });
+}
+
+impl<T: Real> Workspace<T> {
+    /// `predict` or `predict_sparse` with the buffers of this workspace,
+    /// training on its `training_x` and `training_y`.
+    pub fn predict_training(
+        &mut self,
+        kernel: RbfKernel<T>,
+        noise: T,
+        inducing_points: usize,
+        x_input: &[T],
+        forecast_spacing: i64,
+        output: &mut [T],
+    ) -> Result<(), NotPositiveDefinite> {
+        predict_with(
+            kernel,
+            noise,
+            inducing_points,
+            &self.training_x,
+            &self.training_y,
+            x_input,
+            forecast_spacing,
+            SparseBuffers {
+                system: &mut self.system,
+                alpha: &mut self.alpha,
+                inducing: &mut self.inducing,
+                factor: &mut self.factor,
+                cross: &mut self.cross,
+            },
+            output,
+        )
+    }
+
+    /// `predict` or `predict_sparse` with the buffers of this workspace.
+    pub fn predict(
+        &mut self,
+        kernel: RbfKernel<T>,
+        noise: T,
+        inducing_points: usize,
+        training_x: &[T],
+        training_y: &[T],
+        x_input: &[T],
+        forecast_spacing: i64,
+        output: &mut [T],
+    ) -> Result<(), NotPositiveDefinite> {
+        predict_with(
+            kernel,
+            noise,
+            inducing_points,
+            training_x,
+            training_y,
+            x_input,
+            forecast_spacing,
+            SparseBuffers {
+                system: &mut self.system,
+                alpha: &mut self.alpha,
+                inducing: &mut self.inducing,
+                factor: &mut self.factor,
+                cross: &mut self.cross,
+            },
+            output,
+        )
+    }
+
+    /// `predictive_std` after `predict_training`.
+    pub fn predictive_std_training(
+        &mut self,
+        kernel: RbfKernel<T>,
+        noise: T,
+        inducing_points: usize,
+        x_input: &[T],
+        forecast_spacing: i64,
+        first_point: usize,
+        output: &mut [T],
+    ) {
+        predictive_std(
+            kernel,
+            noise,
+            inducing_points,
+            &self.training_x,
+            x_input,
+            forecast_spacing,
+            first_point,
+            SparseBuffers {
+                system: &mut self.system,
+                alpha: &mut self.alpha,
+                inducing: &mut self.inducing,
+                factor: &mut self.factor,
+                cross: &mut self.cross,
+            },
+            output,
+        )
+    }
+
+    /// `predictive_std` after `predict` on `training_x`.
+    pub fn predictive_std(
+        &mut self,
+        kernel: RbfKernel<T>,
+        noise: T,
+        inducing_points: usize,
+        training_x: &[T],
+        x_input: &[T],
+        forecast_spacing: i64,
+        first_point: usize,
+        output: &mut [T],
+    ) {
+        predictive_std(
+            kernel,
+            noise,
+            inducing_points,
+            training_x,
+            x_input,
+            forecast_spacing,
+            first_point,
+            SparseBuffers {
+                system: &mut self.system,
+                alpha: &mut self.alpha,
+                inducing: &mut self.inducing,
+                factor: &mut self.factor,
+                cross: &mut self.cross,
+            },
+            output,
+        )
+    }
+}
@@ -1,119 +1,731 @@
-use rusty_machine::learning::gp::{ConstMean, GaussianProcess};
-use rusty_machine::learning::{toolkit::kernel, SupModel};
-use rusty_machine::linalg::{Matrix, Vector};
-
-use tokio::runtime::{self};
-use tokio::task::JoinHandle;
-
-pub fn multiple_gps(
-    x_input_ptr: *mut f64,
-    y_input_ptr: *mut f64,
+use crate::gaussian_processes::engine::{
+    is_sparse, GpScalar, RbfKernel, Workspace,
+};
+use crate::gaussian_processes::shared::SharedOperator;
+use crate::math_utils::missing::{collect_valid, is_valid, mask_from_raw};
+use crate::math_utils::real::Real;
+use crate::parallel::encoded::{EncodedArray, Encoding};
+use crate::parallel::pool::pool_for;
+use crate::parallel::profile::count;
+use crate::parallel::scheduler::{
+    run_batch, run_batch_counted, series_range, SharedMutSlice,
+};
+use crate::parallel::status::{SeriesStatus, StatusOutput};
+use crate::parallel::strided::{layout_from_raw, ArrayPtr};
+
+/// Number of series predicted by one matrix product when the series share
+/// their x values, unless a chunk size is given.
+const SHARED_BLOCK: usize = 64;
+
+/// Run a GP on every series of a ragged batch. Series `i` is written to the
+/// output `i * forecast_amount` further along than it starts in the input,
+/// and each series has its mean removed before fitting. Missing values,
+/// either non-finite or zero in the optional mask, are left out of the fit
+/// but still predicted.
+///
+/// When every series has the same x values the posterior mean is the same
+/// linear operator for all of them, so it is factorised once and applied to
+/// blocks of series as a matrix product. Series with missing values still
+/// get their own fit.
+///
+/// A positive `inducing_points` below the series length switches to the
+/// sparse approximation with that many inducing points, see `engine`.
+///
+/// A non-null `std_ptr` also receives the posterior standard deviation of
+/// every prediction, laid out like the output, from the same factorisation.
+/// With `std_forecast_only` it only holds the `forecast_amount` forecasts of
+/// each series, series `i` starting at `i * forecast_amount`.
+///
+/// The `SeriesStatus` of every series is written to `status_ptr` unless it
+/// is null, see `fit_series`.
+pub fn multiple_gps<T: GpScalar>(
+    x_input_ptr: *mut T,
+    y_input_ptr: *mut T,
+    mask_ptr: *mut u8,
     input_size: usize,
     input_indices_ptr: *mut usize,
     input_indices_size: usize,
-    output_ptr: *mut f64,
+    output_ptr: *mut T,
     output_size: usize,
     forecast_spacing: i64,
     forecast_amount: i64,
     length_scale: f64,
     amplitude: f64,
     noise: f64,
+    inducing_points: i64,
+    std_ptr: *mut T,
+    std_forecast_only: bool,
+    status_ptr: *mut u8,
     n_threads: i64,
+    chunk_size: i64,
 ) {
-    let rt = if n_threads < 0 {
-        runtime::Builder::new_multi_thread()
-            .build()
-            .expect("Could not build Tokio runtime.")
-    } else {
-        runtime::Builder::new_multi_thread()
-            .worker_threads(n_threads as usize)
-            .build()
-            .expect(
-                format!(
-                    "Could not build Tokio runtime with {} threads",
-                    n_threads
-                )
-                .as_str(),
-            )
-    };
+    let pool = pool_for(n_threads);
 
-    let x_input: &mut [f64] = unsafe {
+    let x_input: &mut [T] = unsafe {
         assert!(!x_input_ptr.is_null());
         std::slice::from_raw_parts_mut(x_input_ptr, input_size)
     };
 
-    let y_input: &mut [f64] = unsafe {
+    let y_input: &mut [T] = unsafe {
         assert!(!y_input_ptr.is_null());
         std::slice::from_raw_parts_mut(y_input_ptr, input_size)
     };
 
+    let mask = unsafe { mask_from_raw(mask_ptr, input_size) };
+
     let input_indices: &mut [usize] = unsafe {
         assert!(!input_indices_ptr.is_null());
         std::slice::from_raw_parts_mut(input_indices_ptr, input_indices_size)
     };
 
-    let output: &mut [f64] = unsafe {
+    let output: &mut [T] = unsafe {
         assert!(!output_ptr.is_null());
         std::slice::from_raw_parts_mut(output_ptr, output_size)
     };
 
-    let ker = kernel::SquaredExp::new(length_scale, amplitude);
+    let forecasts = forecast_amount as usize;
+
+    let statuses =
+        unsafe { StatusOutput::from_raw(status_ptr, input_indices_size) };
 
-    let zero_mean = ConstMean::default();
+    let std_output = if std_ptr.is_null() {
+        None
+    } else if std_forecast_only {
+        Some(unsafe {
+            std::slice::from_raw_parts_mut(
+                std_ptr,
+                input_indices_size * forecasts,
+            )
+        })
+    } else {
+        Some(unsafe { std::slice::from_raw_parts_mut(std_ptr, output_size) })
+    };
 
-    let mut handles: Vec<JoinHandle<Vector<f64>>> =
-        Vec::with_capacity(input_indices_size);
+    // Index of the first prediction of a series of `n` values that gets a
+    // standard deviation, and where the deviations of series `i` start.
+    let std_first = |n: usize| if std_forecast_only { n } else { 0 };
+    let std_start = |i: usize, output_start: usize| {
+        if std_forecast_only {
+            i * forecasts
+        } else {
+            output_start
+        }
+    };
 
-    for i in 0..input_indices_size {
-        let (x_input_slice, y_input_slice) =
-            if i + 1_usize >= input_indices_size {
-                (&x_input[input_indices[i]..], &y_input[input_indices[i]..])
-            } else {
-                (
-                    &x_input[input_indices[i]..input_indices[i + 1]],
-                    &y_input[input_indices[i]..input_indices[i + 1]],
-                )
+    let kernel = RbfKernel::new(length_scale, amplitude);
+    let noise = T::from_f64(noise);
+    let inducing_points = std::cmp::max(inducing_points, 0) as usize;
+
+    let operator = shared_length(x_input, input_indices).and_then(|n| {
+        let start = input_indices[0];
+        SharedOperator::new(
+            &x_input[start..start + n],
+            forecast_spacing,
+            forecast_amount,
+            kernel,
+            noise,
+            inducing_points,
+        )
+        .ok()
+    });
+
+    if let Some(operator) = operator {
+        let (n, m) = (operator.n(), operator.m());
+        let block = shared_block_size(chunk_size);
+        let output = SharedMutSlice::new(output);
+
+        // The deviations do not depend on y, so complete series share them.
+        let start = input_indices[0];
+        let shared_std = match std_output {
+            Some(_) => shared_std(
+                &x_input[start..start + n],
+                forecast_spacing,
+                m - std_first(n),
+                kernel,
+                noise,
+                inducing_points,
+                std_first(n),
+            ),
+            None => Vec::new(),
+        };
+        let std_output = std_output.map(SharedMutSlice::new);
+
+        let costs =
+            block_costs(input_indices_size, block, n, m, inducing_points);
+
+        let block_series = |b: usize| {
+            (std::cmp::min(input_indices_size, (b + 1) * block) - b * block)
+                as u64
+        };
+
+        run_batch_counted(&pool, &costs, 1, block_series, |b| {
+            let first = b * block;
+            let last = std::cmp::min(input_indices_size, first + block);
+
+            // Equal length series are back to back in the input, and each
+            // is followed by its forecasts in the output.
+            let start = input_indices[first];
+            let end = start + (last - first) * n;
+            count("points", (end - start) as u64);
+            let output_start = start + first * forecast_amount as usize;
+
+            // Every block owns a distinct range of the outputs.
+            let output_block = unsafe {
+                output
+                    .range_mut(output_start, output_start + (last - first) * m)
             };
+            let std_block = std_output.as_ref().map(|std| {
+                let std_length = m - std_first(n);
+                let std_start = std_start(first, output_start);
+                unsafe {
+                    std.range_mut(
+                        std_start,
+                        std_start + (last - first) * std_length,
+                    )
+                }
+            });
+
+            T::with_buffers(|buffers| {
+                predict_block(
+                    &operator,
+                    &x_input[start..start + n],
+                    &y_input[start..end],
+                    mask.map(|mask| &mask[start..end]),
+                    forecast_spacing,
+                    kernel,
+                    noise,
+                    inducing_points,
+                    &shared_std,
+                    std_block,
+                    std_first(n),
+                    &mut buffers.workspace,
+                    output_block,
+                    |row, status| unsafe { statuses.set(first + row, status) },
+                )
+            });
+        });
 
-        handles.push(rt.spawn(async move {
-            let mut x_input_vector = x_input_slice.to_vec();
+        return;
+    }
 
-            let training_x =
-                Matrix::new(x_input_slice.len(), 1, x_input_slice);
+    let costs: Vec<f64> = (0..input_indices_size)
+        .map(|i| {
+            let (start, end) = series_range(input_indices, input_size, i);
+            let n = end - start;
+            fit_cost(n, n + forecast_amount as usize, inducing_points)
+        })
+        .collect();
 
-            let training_y = Vector::new(y_input_slice);
-            // Has to be created in the thread - no clone trait.
-            let mut gp = GaussianProcess::new(ker, zero_mean, noise);
+    let output = SharedMutSlice::new(output);
+    let std_output = std_output.map(SharedMutSlice::new);
+
+    run_batch(&pool, &costs, chunk_size, |i| {
+        let (start, end) = series_range(input_indices, input_size, i);
+        count("points", (end - start) as u64);
+
+        let x_input_slice = &x_input[start..end];
+
+        let output_start = start + (i * forecast_amount as usize);
+        let output_end =
+            output_start + (end - start) + forecast_amount as usize;
+
+        // Every series owns a distinct range of the outputs.
+        let output_slice =
+            unsafe { output.range_mut(output_start, output_end) };
+        let std_slice = std_output.as_ref().map(|std| {
+            let std_start = std_start(i, output_start);
+            let std_length =
+                output_end - output_start - std_first(end - start);
+            unsafe { std.range_mut(std_start, std_start + std_length) }
+        });
+
+        let status = T::with_buffers(|buffers| {
+            fit_series(
+                x_input_slice,
+                &y_input[start..end],
+                mask.map(|mask| &mask[start..end]),
+                forecast_spacing,
+                kernel,
+                noise,
+                inducing_points,
+                std_slice,
+                std_first(end - start),
+                &mut buffers.workspace,
+                output_slice,
+            )
+        });
 
-            gp.train(&training_x, &training_y).unwrap();
+        unsafe { statuses.set(i, status) };
+    });
+}
 
-            let final_value = x_input_vector.last().unwrap();
+/// Run a GP on every series along `axis` of an N-dimensional array. All
+/// series share `x_input`, and the output is `forecast_amount` longer than
+/// the input along `axis`. Each series has its mean removed before fitting.
+/// A null mask pointer treats every finite value as valid.
+///
+/// Complete series are predicted in blocks with one shared operator, see
+/// `multiple_gps`. Series that cannot be fitted are NaN as there, and the
+/// status of every series, in C order over the remaining axes, is written
+/// to `status_ptr` unless it is null.
+pub fn cube_gps<T: GpScalar>(
+    x_input_ptr: *mut T,
+    y_input_ptr: *mut u8,
+    y_encoding: Encoding,
+    y_strides_ptr: *mut isize,
+    mask_ptr: *mut u8,
+    mask_strides_ptr: *mut isize,
+    output_ptr: *mut u8,
+    output_encoding: Encoding,
+    output_strides_ptr: *mut isize,
+    shape_ptr: *mut usize,
+    ndim: usize,
+    axis: usize,
+    forecast_spacing: i64,
+    forecast_amount: i64,
+    length_scale: f64,
+    amplitude: f64,
+    noise: f64,
+    inducing_points: i64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    let pool = pool_for(n_threads);
+
+    assert!(!y_input_ptr.is_null());
+    assert!(!output_ptr.is_null());
+
+    let y_layout =
+        unsafe { layout_from_raw(shape_ptr, y_strides_ptr, ndim, axis) };
+
+    let series_length = y_layout.series_length();
+    let m = series_length + forecast_amount as usize;
 
-            let mut forecast_days: Vec<f64> = (1..forecast_amount + 1_i64)
-                .map(|i| ((i * forecast_spacing) as f64) + final_value)
-                .collect();
+    let output_layout =
+        unsafe { layout_from_raw(shape_ptr, output_strides_ptr, ndim, axis) }
+            .with_series_length(m);
 
-            x_input_vector.append(&mut forecast_days);
+    let x_input: &mut [T] = unsafe {
+        assert!(!x_input_ptr.is_null());
+        std::slice::from_raw_parts_mut(x_input_ptr, series_length)
+    };
+
+    let mask_layout = if mask_ptr.is_null() {
+        None
+    } else {
+        Some(unsafe {
+            layout_from_raw(shape_ptr, mask_strides_ptr, ndim, axis)
+        })
+    };
+
+    let y_input = EncodedArray::new(y_input_ptr, y_encoding);
+    let mask_input = ArrayPtr(mask_ptr);
+    let output = EncodedArray::new(output_ptr, output_encoding);
+
+    let kernel = RbfKernel::new(length_scale, amplitude);
+    let noise = T::from_f64(noise);
+    let inducing_points = std::cmp::max(inducing_points, 0) as usize;
+
+    let operator = SharedOperator::new(
+        x_input,
+        forecast_spacing,
+        forecast_amount,
+        kernel,
+        noise,
+        inducing_points,
+    )
+    .ok();
+
+    // Without a shared operator every series gets its own fit.
+    let block = match operator {
+        Some(_) => shared_block_size(chunk_size),
+        None => 1,
+    };
 
-            let smoothed_and_forecast_x =
-                Matrix::new(x_input_vector.len(), 1, x_input_vector);
+    let n_series = y_layout.n_series();
+    let statuses = unsafe { StatusOutput::from_raw(status_ptr, n_series) };
 
-            return gp.predict(&smoothed_and_forecast_x).unwrap();
-        }));
+    let costs = match operator {
+        Some(_) => {
+            block_costs(n_series, block, series_length, m, inducing_points)
+        }
+        None => {
+            vec![fit_cost(series_length, m, inducing_points); n_series]
+        }
+    };
+
+    let block_series = |b: usize| {
+        (std::cmp::min(n_series, (b + 1) * block) - b * block) as u64
+    };
+
+    run_batch_counted(&pool, &costs, 1, block_series, |b| {
+        let first = b * block;
+        let last = std::cmp::min(n_series, first + block);
+
+        T::with_buffers(|buffers| {
+            buffers.input.clear();
+            buffers.mask.clear();
+
+            for series in first..last {
+                unsafe {
+                    y_input.gather_append(
+                        &y_layout,
+                        series,
+                        &mut buffers.input,
+                    );
+                    if let Some(layout) = &mask_layout {
+                        layout.gather_append(
+                            mask_input.0,
+                            series,
+                            &mut buffers.mask,
+                        );
+                    }
+                }
+            }
+
+            let mask = match mask_layout {
+                Some(_) => Some(&buffers.mask[..]),
+                None => None,
+            };
+
+            buffers.output.resize((last - first) * m, T::zero());
+
+            match &operator {
+                Some(operator) => predict_block(
+                    operator,
+                    x_input,
+                    &buffers.input,
+                    mask,
+                    forecast_spacing,
+                    kernel,
+                    noise,
+                    inducing_points,
+                    &[],
+                    None,
+                    0,
+                    &mut buffers.workspace,
+                    &mut buffers.output,
+                    |row, status| unsafe { statuses.set(first + row, status) },
+                ),
+                None => {
+                    let status = fit_series(
+                        x_input,
+                        &buffers.input,
+                        mask,
+                        forecast_spacing,
+                        kernel,
+                        noise,
+                        inducing_points,
+                        None,
+                        0,
+                        &mut buffers.workspace,
+                        &mut buffers.output,
+                    );
+                    unsafe { statuses.set(first, status) };
+                }
+            }
+
+            for (series, values) in (first..last).zip(buffers.output.chunks(m))
+            {
+                // Every series is written by exactly one worker.
+                unsafe { output.scatter(&output_layout, series, values) };
+            }
+        })
+    });
+}
+
+/// Common length of the series if there are several and they all have the
+/// same x values.
+fn shared_length<T: Real>(
+    x_input: &[T],
+    input_indices: &[usize],
+) -> Option<usize> {
+    if input_indices.len() < 2 {
+        return None;
     }
 
-    // TODO There will probably be a more efficient way of doing this.
-    for i in 0..input_indices_size {
-        let result = rt.block_on(&mut handles[i]).unwrap().into_vec();
+    let first = series_range(input_indices, x_input.len(), 0);
+    let n = first.1 - first.0;
+    let reference = &x_input[first.0..first.1];
 
-        let this_index = input_indices[i] + (i * forecast_amount as usize);
+    let shared = (1..input_indices.len()).all(|i| {
+        let (start, end) = series_range(input_indices, x_input.len(), i);
+        start == first.0 + i * n
+            && end - start == n
+            && x_input[start..end] == *reference
+    });
 
-        for result_index in 0..result.len() {
-            output[this_index + result_index] = result[result_index];
+    if shared && n > 0 {
+        Some(n)
+    } else {
+        None
+    }
+}
+
+fn shared_block_size(chunk_size: i64) -> usize {
+    if chunk_size > 0 {
+        chunk_size as usize
+    } else {
+        SHARED_BLOCK
+    }
+}
+
+/// Cost of fitting one series of `n` values and predicting `m`. Exact
+/// training is cubic in `n`, and the sparse approximation is linear in `n`
+/// but quadratic in the number of inducing points.
+fn fit_cost(n: usize, m: usize, inducing_points: usize) -> f64 {
+    let (n, m) = (n as f64, m as f64);
+
+    if is_sparse(inducing_points, n as usize) {
+        let k = inducing_points as f64;
+        n * k * k + k * m
+    } else {
+        n * n * n + n * m
+    }
+}
+
+/// Cost of each block of series predicted with a shared operator.
+fn block_costs(
+    n_series: usize,
+    block: usize,
+    n: usize,
+    m: usize,
+    inducing_points: usize,
+) -> Vec<f64> {
+    // A sparse operator is applied through its rank.
+    let per_series = if is_sparse(inducing_points, n) {
+        inducing_points * (n + m)
+    } else {
+        n * m
+    };
+
+    (0..n_series)
+        .step_by(block)
+        .map(|first| {
+            let rows = std::cmp::min(block, n_series - first);
+            (rows * per_series) as f64
+        })
+        .collect()
+}
+
+/// Predict a block of series stored back to back in `y_input`. Runs of
+/// complete series go through the shared operator as one matrix product,
+/// and series with missing values are fitted on their own.
+///
+/// Complete series get `shared_std` as their standard deviations, and the
+/// others compute their own from prediction `std_first` on, see
+/// `fit_series`. `status` is called with the row and status of every
+/// series.
+fn predict_block<T: Real, S: FnMut(usize, SeriesStatus)>(
+    operator: &SharedOperator<T>,
+    x_input: &[T],
+    y_input: &[T],
+    mask: Option<&[u8]>,
+    forecast_spacing: i64,
+    kernel: RbfKernel<T>,
+    noise: T,
+    inducing_points: usize,
+    shared_std: &[T],
+    mut std_output: Option<&mut [T]>,
+    std_first: usize,
+    workspace: &mut Workspace<T>,
+    output: &mut [T],
+    mut status: S,
+) {
+    let (n, m) = (operator.n(), operator.m());
+    let rows = y_input.len() / n;
+    let std_length = m - std_first;
+
+    let complete = |row: usize| {
+        let series_mask = mask.map(|mask| &mask[row * n..(row + 1) * n]);
+        y_input[row * n..(row + 1) * n]
+            .iter()
+            .enumerate()
+            .all(|(i, y)| is_valid(*y, series_mask, i))
+    };
+
+    let mut row = 0;
+    while row < rows {
+        if complete(row) {
+            let mut run_end = row + 1;
+            while run_end < rows && complete(run_end) {
+                run_end += 1;
+            }
+
+            operator.apply(
+                &y_input[row * n..run_end * n],
+                run_end - row,
+                &mut output[row * m..run_end * m],
+            );
+
+            if let Some(std) = &mut std_output {
+                std[row * std_length..run_end * std_length]
+                    .chunks_mut(std_length)
+                    .for_each(|std| std.copy_from_slice(shared_std));
+            }
+
+            (row..run_end).for_each(|row| status(row, SeriesStatus::Ok));
+
+            row = run_end;
+        } else {
+            let fitted = fit_series(
+                x_input,
+                &y_input[row * n..(row + 1) * n],
+                mask.map(|mask| &mask[row * n..(row + 1) * n]),
+                forecast_spacing,
+                kernel,
+                noise,
+                inducing_points,
+                std_output.as_mut().map(|std| {
+                    &mut std[row * std_length..(row + 1) * std_length]
+                }),
+                std_first,
+                workspace,
+                &mut output[row * m..(row + 1) * m],
+            );
+            status(row, fitted);
+
+            row += 1;
         }
     }
 }
 
+/// Fit a GP to the valid values of one series after removing their mean,
+/// and predict at every x value followed by the forecasts.
+///
+/// `std_output`, if given, receives the posterior standard deviations of
+/// the predictions from index `std_first` on.
+///
+/// An empty series, one without any valid value or with non-finite x values
+/// where it is valid, and one whose kernel matrix cannot be factorised is
+/// all NaN, standard deviations included, and gets the matching status.
+pub fn fit_series<T: Real>(
+    x_input: &[T],
+    y_input: &[T],
+    mask: Option<&[u8]>,
+    forecast_spacing: i64,
+    kernel: RbfKernel<T>,
+    noise: T,
+    inducing_points: usize,
+    std_output: Option<&mut [T]>,
+    std_first: usize,
+    workspace: &mut Workspace<T>,
+    output: &mut [T],
+) -> SeriesStatus {
+    let n_valid = collect_valid(
+        x_input,
+        y_input,
+        mask,
+        &mut workspace.training_x,
+        &mut workspace.training_y,
+    );
+
+    let status = if y_input.is_empty() {
+        SeriesStatus::TooShort
+    } else if n_valid == 0
+        || !workspace.training_x.iter().all(|x| x.is_finite())
+    {
+        SeriesStatus::NonFinite
+    } else {
+        SeriesStatus::Ok
+    };
+
+    if status != SeriesStatus::Ok {
+        fill_nan(output, std_output);
+        return status;
+    }
+
+    let mean = workspace.training_y.iter().copied().sum::<T>()
+        / T::from_f64(n_valid as f64);
+    workspace.training_y.iter_mut().for_each(|y| *y -= mean);
+
+    let predicted = workspace.predict_training(
+        kernel,
+        noise,
+        inducing_points,
+        x_input,
+        forecast_spacing,
+        output,
+    );
+
+    if predicted.is_err() {
+        fill_nan(output, std_output);
+        return SeriesStatus::SolverFailure;
+    }
+
+    output.iter_mut().for_each(|y| *y += mean);
+
+    if let Some(std) = std_output {
+        workspace.predictive_std_training(
+            kernel,
+            noise,
+            inducing_points,
+            x_input,
+            forecast_spacing,
+            std_first,
+            std,
+        );
+    }
+
+    SeriesStatus::Ok
+}
+
+/// Fill the predictions of a series that could not be fitted with NaN.
+fn fill_nan<T: Real>(output: &mut [T], std_output: Option<&mut [T]>) {
+    output.iter_mut().for_each(|y| *y = T::nan());
+    if let Some(std) = std_output {
+        std.iter_mut().for_each(|s| *s = T::nan());
+    }
+}
+
+/// Posterior standard deviations of predictions `first_point` to
+/// `first_point + count` for series with all of `x_input` valid, which are
+/// the same whatever their values.
+fn shared_std<T: GpScalar>(
+    x_input: &[T],
+    forecast_spacing: i64,
+    count: usize,
+    kernel: RbfKernel<T>,
+    noise: T,
+    inducing_points: usize,
+    first_point: usize,
+) -> Vec<T> {
+    let zeros = vec![T::zero(); x_input.len()];
+    let mut std = vec![T::zero(); count];
+
+    T::with_buffers(|buffers| {
+        let workspace = &mut buffers.workspace;
+        let mut mean = vec![T::zero(); x_input.len()];
+
+        workspace
+            .predict(
+                kernel,
+                noise,
+                inducing_points,
+                x_input,
+                &zeros,
+                x_input,
+                forecast_spacing,
+                &mut mean,
+            )
+            .expect("Could not factorise the kernel matrix.");
+
+        workspace.predictive_std(
+            kernel,
+            noise,
+            inducing_points,
+            x_input,
+            x_input,
+            forecast_spacing,
+            first_point,
+            &mut std,
+        );
+    });
+
+    std
+}
+
 pub fn single_gp(
     x_input_ptr: *mut f64,
     y_input_ptr: *mut f64,
@@ -125,6 +737,9 @@ pub fn single_gp(
     length_scale: f64,
     amplitude: f64,
     noise: f64,
+    inducing_points: i64,
+    std_ptr: *mut f64,
+    std_forecast_only: bool,
 ) {
     let x_input: &mut [f64] = unsafe {
         assert!(!x_input_ptr.is_null());
@@ -141,34 +756,45 @@ pub fn single_gp(
         std::slice::from_raw_parts_mut(output_ptr, output_size)
     };
 
-    let mut x_input_vector = x_input.to_vec();
-
-    let training_x = Matrix::new(input_size, 1, x_input);
-
-    let training_y = Vector::new(y_input);
-
-    let ker = kernel::SquaredExp::new(length_scale, amplitude);
-
-    let zero_mean = ConstMean::default();
-
-    let mut gp = GaussianProcess::new(ker, zero_mean, noise);
-
-    gp.train(&training_x, &training_y).unwrap();
-
-    let final_value = x_input_vector.last().unwrap();
-
-    let mut forecast_days: Vec<f64> = (1..forecast_amount + 1_i64)
-        .map(|i| ((i * forecast_spacing) as f64) + final_value)
-        .collect();
-
-    x_input_vector.append(&mut forecast_days);
-
-    let smoothed_and_forecast_x =
-        Matrix::new(x_input_vector.len(), 1, x_input_vector);
+    assert_eq!(output_size, input_size + forecast_amount as usize);
+
+    let kernel = RbfKernel::new(length_scale, amplitude);
+    let inducing_points = std::cmp::max(inducing_points, 0) as usize;
+    let first_point = if std_forecast_only { input_size } else { 0 };
+
+    f64::with_buffers(|buffers| {
+        buffers
+            .workspace
+            .predict(
+                kernel,
+                noise,
+                inducing_points,
+                x_input,
+                y_input,
+                x_input,
+                forecast_spacing,
+                output,
+            )
+            .expect("Could not factorise the kernel matrix.");
 
-    let smoothed_data = gp.predict(&smoothed_and_forecast_x).unwrap();
+        if !std_ptr.is_null() {
+            let std_output = unsafe {
+                std::slice::from_raw_parts_mut(
+                    std_ptr,
+                    output_size - first_point,
+                )
+            };
 
-    for i in 0..output_size {
-        output[i] = smoothed_data[i]
-    }
+            buffers.workspace.predictive_std(
+                kernel,
+                noise,
+                inducing_points,
+                x_input,
+                x_input,
+                forecast_spacing,
+                first_point,
+                std_output,
+            );
+        }
+    });
 }
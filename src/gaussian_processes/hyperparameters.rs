@@ -0,0 +1,587 @@
+//! Fitting the RBF GP hyperparameters by maximising the log marginal
+//! likelihood.
+//!
+//! The length scale, amplitude and noise are optimised in log space with
+//! BFGS and a backtracking line search. Every evaluation factorises the
+//! kernel matrix once and gets the likelihood and its analytic gradient from
+//! the same factor.
+
+use crate::gaussian_processes::engine::{GpScalar, RbfKernel};
+use crate::gaussian_processes::gp::{fit_series, multiple_gps};
+use crate::math_utils::banded::NotPositiveDefinite;
+use crate::math_utils::dense::{cholesky, cholesky_solve};
+use crate::math_utils::missing::{collect_valid, mask_from_raw};
+use crate::parallel::pool::pool_for;
+use crate::parallel::scheduler::{run_batch, series_range, SharedMutSlice};
+use crate::parallel::status::{SeriesStatus, StatusOutput};
+
+use std::cell::RefCell;
+
+/// Length scale, amplitude and noise, in that order.
+pub type Parameters = [f64; 3];
+
+// Bounds on the parameters, which keep the optimiser away from degenerate
+// kernels such as zero noise or a vanishing length scale.
+const LOWER_BOUNDS: Parameters = [1e-3, 1e-6, 1e-8];
+const UPPER_BOUNDS: Parameters = [1e6, 1e6, 1e6];
+
+// Backtracking halves the step at most this many times.
+const MAX_BACKTRACKS: usize = 30;
+
+// Sufficient decrease constant of the Armijo condition.
+const ARMIJO: f64 = 1e-4;
+
+// The optimisation stops once an iteration improves the objective by less
+// than this, relative to its size.
+const RELATIVE_TOLERANCE: f64 = 1e-9;
+
+/// Buffers reused by every likelihood evaluation of a worker thread.
+#[derive(Default)]
+pub struct LikelihoodWorkspace {
+    kernel: Vec<f64>,
+    system: Vec<f64>,
+    inverse: Vec<f64>,
+    alpha: Vec<f64>,
+}
+
+/// Per-thread likelihood workspace and the valid values of the series it
+/// is fitting.
+#[derive(Default)]
+struct FitBuffers {
+    workspace: LikelihoodWorkspace,
+    training_x: Vec<f64>,
+    training_y: Vec<f64>,
+}
+
+thread_local! {
+    static BUFFERS: RefCell<FitBuffers> = RefCell::new(FitBuffers::default());
+}
+
+/// Log marginal likelihood of a zero mean GP on `(x_input, y_input)`, and
+/// its gradient with respect to the logarithms of the parameters.
+///
+/// With `K = amplitude R + noise I` and `α = K⁻¹ y` the likelihood is
+/// `-yᵀα / 2 - log|K| / 2 - n log(2π) / 2`, and its derivative along a
+/// parameter `θ` is `tr((ααᵀ - K⁻¹) ∂K/∂θ) / 2`.
+pub fn log_marginal_likelihood(
+    x_input: &[f64],
+    y_input: &[f64],
+    log_parameters: &Parameters,
+    workspace: &mut LikelihoodWorkspace,
+) -> Result<(f64, Parameters), NotPositiveDefinite> {
+    let n = x_input.len();
+    let [length_scale, amplitude, noise] = exp(log_parameters);
+    let kernel = RbfKernel::<f64>::new(length_scale, amplitude);
+
+    let LikelihoodWorkspace {
+        kernel: kernel_matrix,
+        system,
+        inverse,
+        alpha,
+    } = workspace;
+
+    kernel_matrix.clear();
+    for a in x_input {
+        kernel_matrix.extend(x_input.iter().map(|b| kernel.eval(*a, *b)));
+    }
+
+    system.clear();
+    system.extend_from_slice(kernel_matrix);
+    for i in 0..n {
+        system[i * n + i] += noise;
+    }
+
+    cholesky(system, n)?;
+
+    alpha.clear();
+    alpha.extend_from_slice(y_input);
+    cholesky_solve(system, n, alpha, 1);
+
+    inverse.clear();
+    inverse.resize(n * n, 0.);
+    for i in 0..n {
+        inverse[i * n + i] = 1.;
+    }
+    cholesky_solve(system, n, inverse, n);
+
+    let log_determinant: f64 =
+        (0..n).map(|i| 2. * system[i * n + i].ln()).sum();
+    let fit: f64 = y_input.iter().zip(alpha.iter()).map(|(y, a)| y * a).sum();
+
+    let value = -0.5 * fit
+        - 0.5 * log_determinant
+        - 0.5 * n as f64 * (2. * std::f64::consts::PI).ln();
+
+    let mut gradient = [0.; 3];
+    let inverse_square_length = 1. / (length_scale * length_scale);
+
+    for i in 0..n {
+        let row = i * n;
+        for j in 0..n {
+            let weight = alpha[i] * alpha[j] - inverse[row + j];
+            let k = kernel_matrix[row + j];
+            let d = x_input[i] - x_input[j];
+
+            gradient[0] += weight * k * d * d * inverse_square_length;
+            gradient[1] += weight * k;
+        }
+        gradient[2] += (alpha[i] * alpha[i] - inverse[row + i]) * noise;
+    }
+
+    gradient.iter_mut().for_each(|g| *g *= 0.5);
+
+    Ok((value, gradient))
+}
+
+/// Maximise `objective`, which returns the value and gradient at a point in
+/// log parameter space or `None` where it cannot be evaluated, starting from
+/// `start`. Returns the best point found.
+pub fn maximise<F>(
+    mut objective: F,
+    start: Parameters,
+    max_iterations: usize,
+) -> Parameters
+where
+    F: FnMut(&Parameters) -> Option<(f64, Parameters)>,
+{
+    let lower = log(&LOWER_BOUNDS);
+    let upper = log(&UPPER_BOUNDS);
+    let project = |p: &Parameters| {
+        let mut projected = *p;
+        for i in 0..3 {
+            projected[i] = projected[i].max(lower[i]).min(upper[i]);
+        }
+        projected
+    };
+
+    let mut x = project(&start);
+
+    // Minimise the negated likelihood.
+    let (mut value, mut gradient) = match objective(&x) {
+        Some((value, gradient)) => (-value, negate(&gradient)),
+        None => return x,
+    };
+
+    let mut inverse_hessian = identity();
+
+    for _ in 0..max_iterations {
+        let mut direction = negate(&multiply(&inverse_hessian, &gradient));
+
+        if dot(&direction, &gradient) >= 0. {
+            inverse_hessian = identity();
+            direction = negate(&gradient);
+        }
+
+        // Never move a parameter by more than a factor of e in one step.
+        let largest = direction.iter().fold(0_f64, |m, d| m.max(d.abs()));
+        let mut step = if largest > 1. { 1. / largest } else { 1. };
+
+        let mut accepted = None;
+        for _ in 0..MAX_BACKTRACKS {
+            let mut candidate = x;
+            for i in 0..3 {
+                candidate[i] += step * direction[i];
+            }
+            let candidate = project(&candidate);
+
+            let moved = subtract(&candidate, &x);
+
+            if let Some((new_value, new_gradient)) = objective(&candidate) {
+                let new_value = -new_value;
+                if new_value <= value + ARMIJO * dot(&gradient, &moved) {
+                    accepted =
+                        Some((candidate, new_value, negate(&new_gradient)));
+                    break;
+                }
+            }
+
+            step *= 0.5;
+        }
+
+        let (new_x, new_value, new_gradient) = match accepted {
+            Some(accepted) => accepted,
+            None => break,
+        };
+
+        let s = subtract(&new_x, &x);
+        let y = subtract(&new_gradient, &gradient);
+        let improvement = value - new_value;
+
+        x = new_x;
+        value = new_value;
+        gradient = new_gradient;
+
+        if improvement <= RELATIVE_TOLERANCE * (1. + value.abs()) {
+            break;
+        }
+
+        let sy = dot(&s, &y);
+        if sy > 1e-12 {
+            inverse_hessian = bfgs_update(&inverse_hessian, &s, &y, sy);
+        }
+    }
+
+    x
+}
+
+/// Fit the hyperparameters of every series of a ragged batch, laid out as in
+/// `multiple_gps`, and write the fitted parameters and the smoothed and
+/// forecast output.
+///
+/// With `shared` one set of parameters maximises the summed likelihood of
+/// all series, whose terms are evaluated in parallel, and every entry of the
+/// parameter outputs gets it. Series with fewer than two valid values, and
+/// those whose kernel matrix cannot be factorised at the starting
+/// parameters, are left out of the sum. The latter are all NaN and get
+/// `SeriesStatus::SolverFailure`. Otherwise each series is fitted on its own
+/// in parallel, and series with fewer than two valid values keep the
+/// starting parameters. Each series has its mean removed, and missing values
+/// are left out as in `multiple_gps`.
+///
+/// The status of every series is written to `status_ptr` unless it is null.
+pub fn fit_multiple_gps(
+    x_input_ptr: *mut f64,
+    y_input_ptr: *mut f64,
+    mask_ptr: *mut u8,
+    input_size: usize,
+    input_indices_ptr: *mut usize,
+    input_indices_size: usize,
+    output_ptr: *mut f64,
+    output_size: usize,
+    forecast_spacing: i64,
+    forecast_amount: i64,
+    length_scale: f64,
+    amplitude: f64,
+    noise: f64,
+    length_scales_ptr: *mut f64,
+    amplitudes_ptr: *mut f64,
+    noises_ptr: *mut f64,
+    shared: bool,
+    max_iterations: i64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    let pool = pool_for(n_threads);
+
+    let x_input: &[f64] = unsafe {
+        assert!(!x_input_ptr.is_null());
+        std::slice::from_raw_parts(x_input_ptr, input_size)
+    };
+
+    let y_input: &[f64] = unsafe {
+        assert!(!y_input_ptr.is_null());
+        std::slice::from_raw_parts(y_input_ptr, input_size)
+    };
+
+    let mask = unsafe { mask_from_raw(mask_ptr, input_size) };
+
+    let input_indices: &[usize] = unsafe {
+        assert!(!input_indices_ptr.is_null());
+        std::slice::from_raw_parts(input_indices_ptr, input_indices_size)
+    };
+
+    let (length_scales, amplitudes, noises) = unsafe {
+        assert!(!length_scales_ptr.is_null());
+        assert!(!amplitudes_ptr.is_null());
+        assert!(!noises_ptr.is_null());
+        (
+            std::slice::from_raw_parts_mut(
+                length_scales_ptr,
+                input_indices_size,
+            ),
+            std::slice::from_raw_parts_mut(amplitudes_ptr, input_indices_size),
+            std::slice::from_raw_parts_mut(noises_ptr, input_indices_size),
+        )
+    };
+
+    let start = log(&[length_scale, amplitude, noise]);
+    let max_iterations = std::cmp::max(max_iterations, 0) as usize;
+
+    let costs: Vec<f64> = (0..input_indices_size)
+        .map(|i| {
+            let (start, end) = series_range(input_indices, input_size, i);
+            let n = (end - start) as f64;
+            n * n * n
+        })
+        .collect();
+
+    // Centre the valid values of series `i` in `buffers`, returning how
+    // many there are.
+    let gather = |i: usize, buffers: &mut FitBuffers| {
+        let (start, end) = series_range(input_indices, input_size, i);
+        let n_valid = collect_valid(
+            &x_input[start..end],
+            &y_input[start..end],
+            mask.map(|mask| &mask[start..end]),
+            &mut buffers.training_x,
+            &mut buffers.training_y,
+        );
+
+        if n_valid > 0 {
+            let mean = buffers.training_y.iter().sum::<f64>() / n_valid as f64;
+            buffers.training_y.iter_mut().for_each(|y| *y -= mean);
+        }
+
+        n_valid
+    };
+
+    let statuses =
+        unsafe { StatusOutput::from_raw(status_ptr, input_indices_size) };
+
+    if shared {
+        // Whether each series takes part in the fit. A series whose term
+        // cannot be evaluated at the start, such as one with repeated x
+        // values and no noise, would otherwise stop the fit of all of them.
+        let mut included = vec![true; input_indices_size];
+        {
+            let included_out = SharedMutSlice::new(&mut included);
+
+            run_batch(&pool, &costs, chunk_size, |i| {
+                let evaluates = BUFFERS.with(|buffers| {
+                    let buffers = &mut *buffers.borrow_mut();
+
+                    gather(i, buffers) < 2
+                        || log_marginal_likelihood(
+                            &buffers.training_x,
+                            &buffers.training_y,
+                            &start,
+                            &mut buffers.workspace,
+                        )
+                        .map_or(false, |(value, _)| value.is_finite())
+                });
+
+                // Every series writes only its own flag.
+                unsafe { included_out.range_mut(i, i + 1)[0] = evaluates };
+            });
+        }
+
+        let mut terms = vec![None; input_indices_size];
+
+        let fitted = maximise(
+            |log_parameters| {
+                let terms_out = SharedMutSlice::new(&mut terms);
+
+                run_batch(&pool, &costs, chunk_size, |i| {
+                    // Every series writes only its own term.
+                    let term =
+                        unsafe { &mut terms_out.range_mut(i, i + 1)[0] };
+
+                    *term = BUFFERS.with(|buffers| {
+                        let buffers = &mut *buffers.borrow_mut();
+
+                        // Too short to constrain the parameters, or left
+                        // out of the fit.
+                        if !included[i] || gather(i, buffers) < 2 {
+                            return Some((0., [0.; 3]));
+                        }
+
+                        log_marginal_likelihood(
+                            &buffers.training_x,
+                            &buffers.training_y,
+                            log_parameters,
+                            &mut buffers.workspace,
+                        )
+                        .ok()
+                    });
+                });
+
+                terms.iter().try_fold(
+                    (0., [0.; 3]),
+                    |(value, gradient), term| {
+                        let (v, g) = (*term)?;
+                        Some((value + v, add(&gradient, &g)))
+                    },
+                )
+            },
+            start,
+            max_iterations,
+        );
+
+        let [length_scale, amplitude, noise] = exp(&fitted);
+
+        let mut fit_statuses =
+            vec![SeriesStatus::Ok as u8; input_indices_size];
+
+        length_scales.iter_mut().for_each(|p| *p = length_scale);
+        amplitudes.iter_mut().for_each(|p| *p = amplitude);
+        noises.iter_mut().for_each(|p| *p = noise);
+
+        multiple_gps::<f64>(
+            x_input_ptr,
+            y_input_ptr,
+            mask_ptr,
+            input_size,
+            input_indices_ptr,
+            input_indices_size,
+            output_ptr,
+            output_size,
+            forecast_spacing,
+            forecast_amount,
+            length_scale,
+            amplitude,
+            noise,
+            0,
+            std::ptr::null_mut(),
+            false,
+            fit_statuses.as_mut_ptr(),
+            n_threads,
+            chunk_size,
+        );
+
+        let output: &mut [f64] = unsafe {
+            assert!(!output_ptr.is_null());
+            std::slice::from_raw_parts_mut(output_ptr, output_size)
+        };
+
+        for (i, status) in fit_statuses.iter().enumerate() {
+            let status = SeriesStatus::from_code(*status);
+
+            if status != SeriesStatus::Ok || included[i] {
+                unsafe { statuses.set(i, status) };
+                continue;
+            }
+
+            let (start, end) = series_range(input_indices, input_size, i);
+            let output_start = start + (i * forecast_amount as usize);
+            let output_end =
+                output_start + (end - start) + forecast_amount as usize;
+
+            output[output_start..output_end]
+                .iter_mut()
+                .for_each(|out| *out = f64::NAN);
+            unsafe { statuses.set(i, SeriesStatus::SolverFailure) };
+        }
+
+        return;
+    }
+
+    let output: &mut [f64] = unsafe {
+        assert!(!output_ptr.is_null());
+        std::slice::from_raw_parts_mut(output_ptr, output_size)
+    };
+
+    let output = SharedMutSlice::new(output);
+    let length_scales = SharedMutSlice::new(length_scales);
+    let amplitudes = SharedMutSlice::new(amplitudes);
+    let noises = SharedMutSlice::new(noises);
+
+    run_batch(&pool, &costs, chunk_size, |i| {
+        let fitted = BUFFERS.with(|buffers| {
+            let buffers = &mut *buffers.borrow_mut();
+
+            if gather(i, buffers) < 2 {
+                return start;
+            }
+
+            let FitBuffers {
+                workspace,
+                training_x,
+                training_y,
+            } = buffers;
+
+            maximise(
+                |log_parameters| {
+                    log_marginal_likelihood(
+                        training_x,
+                        training_y,
+                        log_parameters,
+                        workspace,
+                    )
+                    .ok()
+                },
+                start,
+                max_iterations,
+            )
+        });
+
+        let [length_scale, amplitude, noise] = exp(&fitted);
+
+        let (start, end) = series_range(input_indices, input_size, i);
+        let output_start = start + (i * forecast_amount as usize);
+        let output_end =
+            output_start + (end - start) + forecast_amount as usize;
+
+        // Every series owns a distinct range of the outputs.
+        unsafe {
+            length_scales.range_mut(i, i + 1)[0] = length_scale;
+            amplitudes.range_mut(i, i + 1)[0] = amplitude;
+            noises.range_mut(i, i + 1)[0] = noise;
+        }
+        let output_slice =
+            unsafe { output.range_mut(output_start, output_end) };
+
+        let status = f64::with_buffers(|buffers| {
+            fit_series(
+                &x_input[start..end],
+                &y_input[start..end],
+                mask.map(|mask| &mask[start..end]),
+                forecast_spacing,
+                RbfKernel::new(length_scale, amplitude),
+                noise,
+                0,
+                None,
+                0,
+                &mut buffers.workspace,
+                output_slice,
+            )
+        });
+
+        unsafe { statuses.set(i, status) };
+    });
+}
+
+fn log(p: &Parameters) -> Parameters {
+    [p[0].ln(), p[1].ln(), p[2].ln()]
+}
+
+fn exp(p: &Parameters) -> Parameters {
+    [p[0].exp(), p[1].exp(), p[2].exp()]
+}
+
+fn dot(a: &Parameters, b: &Parameters) -> f64 {
+    a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+}
+
+fn add(a: &Parameters, b: &Parameters) -> Parameters {
+    [a[0] + b[0], a[1] + b[1], a[2] + b[2]]
+}
+
+fn subtract(a: &Parameters, b: &Parameters) -> Parameters {
+    [a[0] - b[0], a[1] - b[1], a[2] - b[2]]
+}
+
+fn negate(a: &Parameters) -> Parameters {
+    [-a[0], -a[1], -a[2]]
+}
+
+fn identity() -> [Parameters; 3] {
+    [[1., 0., 0.], [0., 1., 0.], [0., 0., 1.]]
+}
+
+fn multiply(m: &[Parameters; 3], v: &Parameters) -> Parameters {
+    [dot(&m[0], v), dot(&m[1], v), dot(&m[2], v)]
+}
+
+/// BFGS update of the inverse Hessian approximation `h` after a step `s`
+/// that changed the gradient by `y`, with `sy = sᵀy > 0`.
+fn bfgs_update(
+    h: &[Parameters; 3],
+    s: &Parameters,
+    y: &Parameters,
+    sy: f64,
+) -> [Parameters; 3] {
+    // H' = (I - ρ s yᵀ) H (I - ρ y sᵀ) + ρ s sᵀ
+    let rho = 1. / sy;
+    let hy = multiply(h, y);
+    let yhy = dot(y, &hy);
+
+    let mut updated = *h;
+    for i in 0..3 {
+        for j in 0..3 {
+            updated[i][j] += -rho * (s[i] * hy[j] + hy[i] * s[j])
+                + (rho * rho * yhy + rho) * s[i] * s[j];
+        }
+    }
+    updated
+}
@@ -1 +1,5 @@
+pub mod engine;
 pub mod gp;
+pub mod hyperparameters;
+pub mod online;
+pub mod shared;
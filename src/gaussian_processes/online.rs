@@ -0,0 +1,329 @@
+use crate::gaussian_processes::engine::RbfKernel;
+use crate::math_utils::banded::NotPositiveDefinite;
+use crate::math_utils::missing::{is_valid, mask_from_raw};
+use crate::parallel::pool::pool_for;
+use crate::parallel::scheduler::{run_batch, SharedMutSlice};
+use crate::parallel::status::{SeriesStatus, StatusOutput};
+
+use std::cell::RefCell;
+
+thread_local! {
+    // Weights of the posterior mean, reused by every pixel a worker thread
+    // predicts.
+    static ALPHA: RefCell<Vec<f64>> = RefCell::new(Vec::new());
+}
+
+/// Offset of row `i` of a lower triangular matrix packed by rows.
+fn packed_row(i: usize) -> usize {
+    i * (i + 1) / 2
+}
+
+/// Number of values of a packed lower triangular `window` by `window`
+/// matrix.
+pub fn packed_size(window: usize) -> usize {
+    packed_row(window)
+}
+
+/// The GP fit of one pixel over its last `window` valid observations.
+///
+/// `factor` holds the lower Cholesky factor of `K + noise I` over the
+/// stored x values, packed by rows, so an observation is folded in by
+/// appending one row and the oldest is dropped by a rank-1 update.
+pub struct OnlineSeries<'a> {
+    pub x: &'a mut [f64],
+    pub y: &'a mut [f64],
+    pub factor: &'a mut [f64],
+    pub length: &'a mut usize,
+}
+
+impl<'a> OnlineSeries<'a> {
+    /// Add an observation, dropping the oldest one first when the window
+    /// is full. O(window²).
+    pub fn push(
+        &mut self,
+        kernel: RbfKernel<f64>,
+        noise: f64,
+        x: f64,
+        y: f64,
+    ) -> Result<(), NotPositiveDefinite> {
+        if *self.length == self.x.len() {
+            self.drop_oldest();
+        }
+
+        let n = *self.length;
+        let row = packed_row(n);
+
+        // The new row v solves L v = k(x_old, x).
+        for j in 0..n {
+            let mut sum = kernel.eval(self.x[j], x);
+            let row_j = packed_row(j);
+            for k in 0..j {
+                sum -= self.factor[row_j + k] * self.factor[row + k];
+            }
+            self.factor[row + j] = sum / self.factor[row_j + j];
+        }
+
+        let squares: f64 =
+            self.factor[row..row + n].iter().map(|v| v * v).sum();
+        let pivot = kernel.eval(x, x) + noise - squares;
+
+        if !(pivot > 0.) || !pivot.is_finite() {
+            return Err(NotPositiveDefinite { row: n });
+        }
+
+        self.factor[row + n] = pivot.sqrt();
+        self.x[n] = x;
+        self.y[n] = y;
+        *self.length = n + 1;
+
+        Ok(())
+    }
+
+    /// Remove the oldest observation. The trailing block `L₂₂` of the
+    /// factor with first column `l` has `L₂₂ L₂₂ᵀ + l lᵀ` as the kernel of
+    /// the remaining points, which is a rank-1 update of `L₂₂`.
+    fn drop_oldest(&mut self) {
+        let n = *self.length;
+        let mut column: Vec<f64> =
+            (1..n).map(|i| self.factor[packed_row(i)]).collect();
+
+        // Shift L₂₂ into the leading rows, which only ever moves values
+        // towards the start.
+        for i in 1..n {
+            let (from, to) = (packed_row(i) + 1, packed_row(i - 1));
+            self.factor.copy_within(from..from + i, to);
+        }
+        self.x.copy_within(1..n, 0);
+        self.y.copy_within(1..n, 0);
+
+        let n = n - 1;
+        for k in 0..n {
+            let diagonal = self.factor[packed_row(k) + k];
+            let updated = diagonal.hypot(column[k]);
+            let (cos, sin) = (updated / diagonal, column[k] / diagonal);
+            self.factor[packed_row(k) + k] = updated;
+
+            for i in k + 1..n {
+                let entry = &mut self.factor[packed_row(i) + k];
+                *entry = (*entry + sin * column[i]) / cos;
+                column[i] = cos * column[i] - sin * *entry;
+            }
+        }
+
+        *self.length = n;
+    }
+
+    /// Posterior mean at the stored x values followed by `output.len() -
+    /// window` forecasts after `last_x`, with the mean of the stored values
+    /// removed before the fit and added back afterwards. Slots past the
+    /// stored values are NaN, and so is everything without observations.
+    pub fn predict(
+        &self,
+        kernel: RbfKernel<f64>,
+        last_x: f64,
+        forecast_spacing: i64,
+        alpha: &mut Vec<f64>,
+        output: &mut [f64],
+    ) {
+        let n = *self.length;
+        let window = self.x.len();
+
+        output.iter_mut().for_each(|out| *out = f64::NAN);
+
+        if n == 0 {
+            return;
+        }
+
+        let mean = self.y[..n].iter().sum::<f64>() / n as f64;
+
+        // alpha = L⁻ᵀ L⁻¹ (y - mean)
+        alpha.clear();
+        alpha.extend(self.y[..n].iter().map(|y| y - mean));
+        for i in 0..n {
+            let row = packed_row(i);
+            let sum: f64 =
+                (0..i).map(|k| self.factor[row + k] * alpha[k]).sum();
+            alpha[i] = (alpha[i] - sum) / self.factor[row + i];
+        }
+        for i in (0..n).rev() {
+            let sum: f64 = (i + 1..n)
+                .map(|k| self.factor[packed_row(k) + i] * alpha[k])
+                .sum();
+            alpha[i] = (alpha[i] - sum) / self.factor[packed_row(i) + i];
+        }
+
+        let posterior = |point: f64| {
+            mean + self.x[..n]
+                .iter()
+                .zip(alpha.iter())
+                .map(|(x, a)| kernel.eval(*x, point) * a)
+                .sum::<f64>()
+        };
+
+        for i in 0..n {
+            output[i] = posterior(self.x[i]);
+        }
+
+        for (j, out) in output[window..].iter_mut().enumerate() {
+            let step = (j as i64 + 1) * forecast_spacing;
+            *out = posterior(last_x + step as f64);
+        }
+    }
+}
+
+/// Fold `new_count` acquisitions at `new_x` into the online GP state of
+/// `n_pixels` pixels, and write the updated posterior means and forecasts.
+///
+/// The state of pixel `p` is its last `window` valid observations, in
+/// `x[p * window..]` and `y[p * window..]` oldest first, their number in
+/// `lengths[p]` and the packed Cholesky factor of their kernel matrix in
+/// `factor[p * packed_size(window)..]`. Missing values, either non-finite
+/// or zero in the optional mask, are skipped. Each valid one costs
+/// O(window²) instead of the O(n³) of refitting the whole history.
+///
+/// `output` gets `window + forecast_amount` values per pixel: the posterior
+/// mean at each stored x value and then the forecasts after the last new
+/// acquisition, as `multiple_gps` would give for the stored observations.
+///
+/// A valid value at a non-finite x, or one that makes the factor lose
+/// positive definiteness, such as a repeated x with no noise, is not stored.
+/// The output of its pixel is all NaN for this update, and the status of
+/// every pixel is written to `status_ptr` unless it is null. Pixels without
+/// any stored observation are `SeriesStatus::NonFinite`.
+pub fn online_gps(
+    x_ptr: *mut f64,
+    y_ptr: *mut f64,
+    factor_ptr: *mut f64,
+    lengths_ptr: *mut usize,
+    n_pixels: usize,
+    window: usize,
+    new_x_ptr: *mut f64,
+    new_y_ptr: *mut f64,
+    mask_ptr: *mut u8,
+    new_count: usize,
+    output_ptr: *mut f64,
+    forecast_spacing: i64,
+    forecast_amount: i64,
+    length_scale: f64,
+    amplitude: f64,
+    noise: f64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    let pool = pool_for(n_threads);
+
+    let packed = packed_size(window);
+    let width = window + forecast_amount as usize;
+
+    let x: &mut [f64] = unsafe {
+        assert!(!x_ptr.is_null());
+        std::slice::from_raw_parts_mut(x_ptr, n_pixels * window)
+    };
+
+    let y: &mut [f64] = unsafe {
+        assert!(!y_ptr.is_null());
+        std::slice::from_raw_parts_mut(y_ptr, n_pixels * window)
+    };
+
+    let factor: &mut [f64] = unsafe {
+        assert!(!factor_ptr.is_null());
+        std::slice::from_raw_parts_mut(factor_ptr, n_pixels * packed)
+    };
+
+    let lengths: &mut [usize] = unsafe {
+        assert!(!lengths_ptr.is_null());
+        std::slice::from_raw_parts_mut(lengths_ptr, n_pixels)
+    };
+
+    let new_x: &[f64] = unsafe {
+        assert!(!new_x_ptr.is_null());
+        std::slice::from_raw_parts(new_x_ptr, new_count)
+    };
+
+    let new_y: &[f64] = unsafe {
+        assert!(!new_y_ptr.is_null());
+        std::slice::from_raw_parts(new_y_ptr, n_pixels * new_count)
+    };
+
+    let mask = unsafe { mask_from_raw(mask_ptr, n_pixels * new_count) };
+
+    let output: &mut [f64] = unsafe {
+        assert!(!output_ptr.is_null());
+        std::slice::from_raw_parts_mut(output_ptr, n_pixels * width)
+    };
+
+    let kernel = RbfKernel::new(length_scale, amplitude);
+    let last_x = match new_x.last() {
+        Some(x) => *x,
+        None => f64::NAN,
+    };
+
+    let costs = vec![(window * window) as f64; n_pixels];
+
+    let x = SharedMutSlice::new(x);
+    let y = SharedMutSlice::new(y);
+    let factor = SharedMutSlice::new(factor);
+    let lengths = SharedMutSlice::new(lengths);
+    let output = SharedMutSlice::new(output);
+    let statuses = unsafe { StatusOutput::from_raw(status_ptr, n_pixels) };
+
+    run_batch(&pool, &costs, chunk_size, |p| {
+        // Every pixel owns a distinct range of the state and output.
+        let mut series = unsafe {
+            OnlineSeries {
+                x: x.range_mut(p * window, (p + 1) * window),
+                y: y.range_mut(p * window, (p + 1) * window),
+                factor: factor.range_mut(p * packed, (p + 1) * packed),
+                length: &mut lengths.range_mut(p, p + 1)[0],
+            }
+        };
+        let output = unsafe { output.range_mut(p * width, (p + 1) * width) };
+
+        let start = p * new_count;
+        let values = &new_y[start..start + new_count];
+        let mask = mask.map(|mask| &mask[start..start + new_count]);
+
+        let mut status = SeriesStatus::Ok;
+
+        for (i, (x, y)) in new_x.iter().zip(values).enumerate() {
+            if !is_valid(*y, mask, i) {
+                continue;
+            }
+
+            // A failed push leaves the state without the new observation,
+            // so the pixel can still take later ones.
+            let pushed = if !x.is_finite() {
+                Err(SeriesStatus::NonFinite)
+            } else {
+                series
+                    .push(kernel, noise, *x, *y)
+                    .map_err(|_| SeriesStatus::SolverFailure)
+            };
+
+            if let (Err(failure), SeriesStatus::Ok) = (pushed, status) {
+                status = failure;
+            }
+        }
+
+        if status == SeriesStatus::Ok && *series.length == 0 {
+            status = SeriesStatus::NonFinite;
+        }
+
+        if status == SeriesStatus::Ok {
+            ALPHA.with(|alpha| {
+                series.predict(
+                    kernel,
+                    last_x,
+                    forecast_spacing,
+                    &mut alpha.borrow_mut(),
+                    output,
+                )
+            });
+        } else {
+            output.iter_mut().for_each(|out| *out = f64::NAN);
+        }
+
+        unsafe { statuses.set(p, status) };
+    });
+}
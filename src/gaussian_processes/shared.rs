@@ -0,0 +1,202 @@
+use crate::gaussian_processes::engine::{
+    inducing_grid, is_sparse, low_rank_system, prediction_point, RbfKernel,
+};
+use crate::math_utils::banded::NotPositiveDefinite;
+use crate::math_utils::dense::{
+    cholesky, cholesky_solve, gemm, solve_lower_transposed,
+};
+use crate::math_utils::real::Real;
+
+/// Posterior mean of an RBF kernel GP as one fixed linear operator, for a
+/// batch of series that share their x values and hyperparameters.
+///
+/// With `K` the kernel between the `n` training points and `K*` the kernel
+/// between the `m` prediction points and the training points, the posterior
+/// mean of a series `y` is `K* (K + noise I)⁻¹ y`. The matrix `(K + noise
+/// I)⁻¹ K*ᵀ` is built once with a single Cholesky factorisation, and every
+/// series of a block is then predicted by one matrix-matrix product.
+///
+/// With `k` inducing points the operator of the sparse approximation has
+/// rank `k`, and is kept as the product of an `n` by `k` and a `k` by `m`
+/// matrix so a block costs `O(k (n + m))` per series instead of `O(n m)`.
+pub struct SharedOperator<T> {
+    n: usize,
+    m: usize,
+    // n by m, or n by k for the sparse approximation, row-major.
+    operator: Vec<T>,
+    // k by m kernel between the inducing and the prediction points.
+    prediction: Option<Vec<T>>,
+    // 1 - column sums of the operator, which restores the removed means.
+    mean_weights: Vec<T>,
+}
+
+impl<T: Real> SharedOperator<T> {
+    /// Build the operator for series of `x_input.len()` values, using the
+    /// sparse approximation when `is_sparse(inducing_points, n)`.
+    pub fn new(
+        x_input: &[T],
+        forecast_spacing: i64,
+        forecast_amount: i64,
+        kernel: RbfKernel<T>,
+        noise: T,
+        inducing_points: usize,
+    ) -> Result<SharedOperator<T>, NotPositiveDefinite> {
+        let n = x_input.len();
+        let m = n + forecast_amount as usize;
+
+        if is_sparse(inducing_points, n) {
+            return SharedOperator::sparse(
+                x_input,
+                forecast_spacing,
+                m,
+                kernel,
+                noise,
+                inducing_points,
+            );
+        }
+
+        let mut system = vec![T::zero(); n * n];
+        for i in 0..n {
+            for j in 0..i + 1 {
+                system[i * n + j] = kernel.eval(x_input[i], x_input[j]);
+            }
+            system[i * n + i] += noise;
+        }
+
+        cholesky(&mut system, n)?;
+
+        // K*ᵀ, which the solve turns into the operator in place.
+        let mut operator = vec![T::zero(); n * m];
+        for i in 0..n {
+            for j in 0..m {
+                let point = prediction_point(x_input, forecast_spacing, j);
+                operator[i * m + j] = kernel.eval(x_input[i], point);
+            }
+        }
+
+        cholesky_solve(&system, n, &mut operator, m);
+
+        let mut mean_weights = vec![T::one(); m];
+        for row in operator.chunks(m) {
+            mean_weights.iter_mut().zip(row).for_each(|(w, a)| *w -= *a);
+        }
+
+        Ok(SharedOperator {
+            n,
+            m,
+            operator,
+            prediction: None,
+            mean_weights,
+        })
+    }
+
+    /// The DTC operator `K_nu (noise K_uu + K_un K_nu)⁻¹ K_u*` in its two
+    /// factors, see `engine::low_rank_system`.
+    fn sparse(
+        x_input: &[T],
+        forecast_spacing: i64,
+        m: usize,
+        kernel: RbfKernel<T>,
+        noise: T,
+        inducing_points: usize,
+    ) -> Result<SharedOperator<T>, NotPositiveDefinite> {
+        let (n, k) = (x_input.len(), inducing_points);
+
+        let mut inducing = Vec::with_capacity(k);
+        let mut factor = Vec::with_capacity(k * k);
+        let mut cross = Vec::with_capacity(k * n);
+        let mut system = Vec::with_capacity(k * k);
+
+        inducing_grid(x_input, k, &mut inducing);
+        low_rank_system(
+            kernel,
+            noise,
+            &inducing,
+            x_input,
+            &mut factor,
+            &mut cross,
+            &mut system,
+        )?;
+
+        // L⁻ᵀ (noise I + V Vᵀ)⁻¹ V, transposed to n by k.
+        cholesky_solve(&system, k, &mut cross, n);
+        solve_lower_transposed(&factor, k, &mut cross, n);
+        let mut operator = vec![T::zero(); n * k];
+        for (i, row) in cross.chunks(n).enumerate() {
+            for (j, value) in row.iter().enumerate() {
+                operator[j * k + i] = *value;
+            }
+        }
+
+        let mut prediction = vec![T::zero(); k * m];
+        for (i, u) in inducing.iter().enumerate() {
+            for j in 0..m {
+                let point = prediction_point(x_input, forecast_spacing, j);
+                prediction[i * m + j] = kernel.eval(*u, point);
+            }
+        }
+
+        // 1ᵀ (operator prediction) = (1ᵀ operator) prediction.
+        let mut column_sums = vec![T::zero(); k];
+        for row in operator.chunks(k) {
+            column_sums.iter_mut().zip(row).for_each(|(s, a)| *s += *a);
+        }
+
+        let mut mean_weights = vec![T::one(); m];
+        for (sum, row) in column_sums.iter().zip(prediction.chunks(m)) {
+            mean_weights
+                .iter_mut()
+                .zip(row)
+                .for_each(|(w, p)| *w -= *sum * *p);
+        }
+
+        Ok(SharedOperator {
+            n,
+            m,
+            operator,
+            prediction: Some(prediction),
+            mean_weights,
+        })
+    }
+
+    /// Number of training points of every series.
+    pub fn n(&self) -> usize {
+        self.n
+    }
+
+    /// Number of predicted values of every series, forecasts included.
+    pub fn m(&self) -> usize {
+        self.m
+    }
+
+    /// Predict `rows` complete series stored back to back in `y_input`,
+    /// writing `rows * m` values to `output`. Each series has its mean
+    /// removed before the fit and added back afterwards.
+    pub fn apply(&self, y_input: &[T], rows: usize, output: &mut [T]) {
+        match &self.prediction {
+            None => {
+                gemm(y_input, &self.operator, output, rows, self.n, self.m)
+            }
+            Some(prediction) => {
+                let k = prediction.len() / self.m;
+                let mut projected = vec![T::zero(); rows * k];
+
+                gemm(y_input, &self.operator, &mut projected, rows, self.n, k);
+                gemm(&projected, prediction, output, rows, k, self.m);
+            }
+        }
+
+        // (y - mean) A + mean = y A + mean (1 - 1ᵀA)
+        for (y_row, out_row) in
+            y_input.chunks(self.n).zip(output.chunks_mut(self.m))
+        {
+            let mean =
+                y_row.iter().copied().sum::<T>() / T::from_f64(self.n as f64);
+
+            out_row
+                .iter_mut()
+                .zip(&self.mean_weights)
+                .for_each(|(out, w)| *out += mean * *w);
+        }
+    }
+}
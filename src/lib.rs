@@ -1,18 +1,47 @@
-mod gaussian_processes;
+pub mod gaussian_processes;
 pub mod math_utils;
-mod ndvi;
+pub mod ndvi;
+pub mod parallel;
+pub mod pipeline;
 pub mod smoothers;
 
-use gaussian_processes::gp::{multiple_gps, single_gp};
+use gaussian_processes::gp::{cube_gps, multiple_gps, single_gp};
+use gaussian_processes::hyperparameters::fit_multiple_gps;
+use gaussian_processes::online::online_gps;
+use math_utils::convolve::{
+    convolve_1d_with, output_length, ConvMethod, ConvType,
+};
+use ndvi::chen::{cube_chens, multiple_chens};
+use parallel::control::attach_control;
+use parallel::encoded::Encoding;
+use parallel::pool::{get_num_threads, set_num_threads};
+use parallel::profile::{report, reset, set_level, Level};
+use pipeline::fused::multiple_pipelines;
 use smoothers::{
-    sav_golay::{multiple_sav_golays, single_sav_golay},
-    whittaker::{multiple_whittakers, single_whittaker},
+    online_whittaker::online_whittakers,
+    sav_golay::{
+        clear_coefficient_cache, coefficient_cache_info, cube_sav_golays,
+        multiple_sav_golays, single_sav_golay,
+    },
+    whittaker::{
+        cube_whittakers, multiple_whittakers, multiple_whittakers_auto,
+        multiple_whittakers_robust, single_whittaker, single_whittaker_auto,
+        Criterion, Reweighting,
+    },
 };
 
+// Only with the count-allocations feature, so that crates and targets
+// linking EOkit as a library can keep their own global allocator.
+#[cfg(feature = "count-allocations")]
+#[global_allocator]
+static ALLOCATOR: parallel::profile::CountingAllocator =
+    parallel::profile::CountingAllocator;
+
 #[no_mangle]
 pub extern "C" fn rust_multiple_gps(
     x_input_ptr: *mut f64,
     y_input_ptr: *mut f64,
+    mask_ptr: *mut u8,
     input_size: usize,
     input_indices_ptr: *mut usize,
     input_indices_size: usize,
@@ -23,11 +52,17 @@ pub extern "C" fn rust_multiple_gps(
     length_scale: f64,
     amplitude: f64,
     noise: f64,
+    inducing_points: i64,
+    std_ptr: *mut f64,
+    std_forecast_only: bool,
+    status_ptr: *mut u8,
     n_threads: i64,
+    chunk_size: i64,
 ) {
     multiple_gps(
         x_input_ptr,
         y_input_ptr,
+        mask_ptr,
         input_size,
         input_indices_ptr,
         input_indices_size,
@@ -38,7 +73,12 @@ pub extern "C" fn rust_multiple_gps(
         length_scale,
         amplitude,
         noise,
+        inducing_points,
+        std_ptr,
+        std_forecast_only,
+        status_ptr,
         n_threads,
+        chunk_size,
     );
 }
 
@@ -54,6 +94,9 @@ pub extern "C" fn rust_single_gp(
     length_scale: f64,
     amplitude: f64,
     noise: f64,
+    inducing_points: i64,
+    std_ptr: *mut f64,
+    std_forecast_only: bool,
 ) {
     single_gp(
         x_input_ptr,
@@ -66,31 +109,357 @@ pub extern "C" fn rust_single_gp(
         length_scale,
         amplitude,
         noise,
+        inducing_points,
+        std_ptr,
+        std_forecast_only,
+    );
+}
+
+#[no_mangle]
+pub extern "C" fn rust_cube_gps(
+    x_input_ptr: *mut f64,
+    y_input_ptr: *mut u8,
+    y_dtype: i64,
+    y_scale: f64,
+    y_offset: f64,
+    y_nodata: f64,
+    y_strides_ptr: *mut isize,
+    mask_ptr: *mut u8,
+    mask_strides_ptr: *mut isize,
+    output_ptr: *mut u8,
+    output_dtype: i64,
+    output_scale: f64,
+    output_offset: f64,
+    output_nodata: f64,
+    output_strides_ptr: *mut isize,
+    shape_ptr: *mut usize,
+    ndim: usize,
+    axis: usize,
+    forecast_spacing: i64,
+    forecast_amount: i64,
+    length_scale: f64,
+    amplitude: f64,
+    noise: f64,
+    inducing_points: i64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    cube_gps(
+        x_input_ptr,
+        y_input_ptr,
+        Encoding::from_raw(y_dtype, y_scale, y_offset, y_nodata),
+        y_strides_ptr,
+        mask_ptr,
+        mask_strides_ptr,
+        output_ptr,
+        Encoding::from_raw(
+            output_dtype,
+            output_scale,
+            output_offset,
+            output_nodata,
+        ),
+        output_strides_ptr,
+        shape_ptr,
+        ndim,
+        axis,
+        forecast_spacing,
+        forecast_amount,
+        length_scale,
+        amplitude,
+        noise,
+        inducing_points,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    );
+}
+
+#[no_mangle]
+pub extern "C" fn rust_multiple_gps_f32(
+    x_input_ptr: *mut f32,
+    y_input_ptr: *mut f32,
+    mask_ptr: *mut u8,
+    input_size: usize,
+    input_indices_ptr: *mut usize,
+    input_indices_size: usize,
+    output_ptr: *mut f32,
+    output_size: usize,
+    forecast_spacing: i64,
+    forecast_amount: i64,
+    length_scale: f64,
+    amplitude: f64,
+    noise: f64,
+    inducing_points: i64,
+    std_ptr: *mut f32,
+    std_forecast_only: bool,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    multiple_gps(
+        x_input_ptr,
+        y_input_ptr,
+        mask_ptr,
+        input_size,
+        input_indices_ptr,
+        input_indices_size,
+        output_ptr,
+        output_size,
+        forecast_spacing,
+        forecast_amount,
+        length_scale,
+        amplitude,
+        noise,
+        inducing_points,
+        std_ptr,
+        std_forecast_only,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    );
+}
+
+#[no_mangle]
+pub extern "C" fn rust_cube_gps_f32(
+    x_input_ptr: *mut f32,
+    y_input_ptr: *mut u8,
+    y_dtype: i64,
+    y_scale: f64,
+    y_offset: f64,
+    y_nodata: f64,
+    y_strides_ptr: *mut isize,
+    mask_ptr: *mut u8,
+    mask_strides_ptr: *mut isize,
+    output_ptr: *mut u8,
+    output_dtype: i64,
+    output_scale: f64,
+    output_offset: f64,
+    output_nodata: f64,
+    output_strides_ptr: *mut isize,
+    shape_ptr: *mut usize,
+    ndim: usize,
+    axis: usize,
+    forecast_spacing: i64,
+    forecast_amount: i64,
+    length_scale: f64,
+    amplitude: f64,
+    noise: f64,
+    inducing_points: i64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    cube_gps(
+        x_input_ptr,
+        y_input_ptr,
+        Encoding::from_raw(y_dtype, y_scale, y_offset, y_nodata),
+        y_strides_ptr,
+        mask_ptr,
+        mask_strides_ptr,
+        output_ptr,
+        Encoding::from_raw(
+            output_dtype,
+            output_scale,
+            output_offset,
+            output_nodata,
+        ),
+        output_strides_ptr,
+        shape_ptr,
+        ndim,
+        axis,
+        forecast_spacing,
+        forecast_amount,
+        length_scale,
+        amplitude,
+        noise,
+        inducing_points,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    );
+}
+
+#[no_mangle]
+pub extern "C" fn rust_fit_multiple_gps(
+    x_input_ptr: *mut f64,
+    y_input_ptr: *mut f64,
+    mask_ptr: *mut u8,
+    input_size: usize,
+    input_indices_ptr: *mut usize,
+    input_indices_size: usize,
+    output_ptr: *mut f64,
+    output_size: usize,
+    forecast_spacing: i64,
+    forecast_amount: i64,
+    length_scale: f64,
+    amplitude: f64,
+    noise: f64,
+    length_scales_ptr: *mut f64,
+    amplitudes_ptr: *mut f64,
+    noises_ptr: *mut f64,
+    shared: bool,
+    max_iterations: i64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    fit_multiple_gps(
+        x_input_ptr,
+        y_input_ptr,
+        mask_ptr,
+        input_size,
+        input_indices_ptr,
+        input_indices_size,
+        output_ptr,
+        output_size,
+        forecast_spacing,
+        forecast_amount,
+        length_scale,
+        amplitude,
+        noise,
+        length_scales_ptr,
+        amplitudes_ptr,
+        noises_ptr,
+        shared,
+        max_iterations,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    );
+}
+
+#[no_mangle]
+pub extern "C" fn rust_online_gps(
+    x_ptr: *mut f64,
+    y_ptr: *mut f64,
+    factor_ptr: *mut f64,
+    lengths_ptr: *mut usize,
+    n_pixels: usize,
+    window: usize,
+    new_x_ptr: *mut f64,
+    new_y_ptr: *mut f64,
+    mask_ptr: *mut u8,
+    new_count: usize,
+    output_ptr: *mut f64,
+    forecast_spacing: i64,
+    forecast_amount: i64,
+    length_scale: f64,
+    amplitude: f64,
+    noise: f64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    online_gps(
+        x_ptr,
+        y_ptr,
+        factor_ptr,
+        lengths_ptr,
+        n_pixels,
+        window,
+        new_x_ptr,
+        new_y_ptr,
+        mask_ptr,
+        new_count,
+        output_ptr,
+        forecast_spacing,
+        forecast_amount,
+        length_scale,
+        amplitude,
+        noise,
+        status_ptr,
+        n_threads,
+        chunk_size,
     );
 }
 
 #[no_mangle]
 pub extern "C" fn rust_multiple_whittakers(
+    x_input_ptr: *mut f64,
+    x_shared: bool,
     y_input_ptr: *mut f64,
     weights_input_ptr: *mut f64,
+    mask_ptr: *mut u8,
     input_indices_ptr: *mut usize,
     input_indices_size: usize,
     output_ptr: *mut f64,
     data_length: usize,
     lambda: f64,
     d: i64,
+    status_ptr: *mut u8,
     njobs: i64,
+    chunk_size: i64,
 ) {
     multiple_whittakers(
+        x_input_ptr,
+        x_shared,
         y_input_ptr,
         weights_input_ptr,
+        mask_ptr,
         input_indices_ptr,
         input_indices_size,
         output_ptr,
         data_length,
         lambda,
         d,
+        status_ptr,
         njobs,
+        chunk_size,
+    );
+}
+
+#[no_mangle]
+pub extern "C" fn rust_cube_whittakers(
+    y_input_ptr: *mut u8,
+    y_dtype: i64,
+    y_scale: f64,
+    y_offset: f64,
+    y_nodata: f64,
+    y_strides_ptr: *mut isize,
+    weights_input_ptr: *mut f64,
+    weights_strides_ptr: *mut isize,
+    mask_ptr: *mut u8,
+    mask_strides_ptr: *mut isize,
+    output_ptr: *mut u8,
+    output_dtype: i64,
+    output_scale: f64,
+    output_offset: f64,
+    output_nodata: f64,
+    output_strides_ptr: *mut isize,
+    shape_ptr: *mut usize,
+    ndim: usize,
+    axis: usize,
+    lambda: f64,
+    d: i64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    cube_whittakers(
+        y_input_ptr,
+        Encoding::from_raw(y_dtype, y_scale, y_offset, y_nodata),
+        y_strides_ptr,
+        weights_input_ptr,
+        weights_strides_ptr,
+        mask_ptr,
+        mask_strides_ptr,
+        output_ptr,
+        Encoding::from_raw(
+            output_dtype,
+            output_scale,
+            output_offset,
+            output_nodata,
+        ),
+        output_strides_ptr,
+        shape_ptr,
+        ndim,
+        axis,
+        lambda,
+        d,
+        status_ptr,
+        n_threads,
+        chunk_size,
     );
 }
 
@@ -115,6 +484,176 @@ pub extern "C" fn rust_single_whittaker(
     );
 }
 
+#[no_mangle]
+pub extern "C" fn rust_multiple_whittakers_auto(
+    x_input_ptr: *mut f64,
+    x_shared: bool,
+    y_input_ptr: *mut f64,
+    weights_input_ptr: *mut f64,
+    mask_ptr: *mut u8,
+    input_indices_ptr: *mut usize,
+    input_indices_size: usize,
+    output_ptr: *mut f64,
+    data_length: usize,
+    lambda_grid_ptr: *mut f64,
+    lambda_grid_size: usize,
+    criterion: i64,
+    lambdas_ptr: *mut f64,
+    d: i64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    multiple_whittakers_auto(
+        x_input_ptr,
+        x_shared,
+        y_input_ptr,
+        weights_input_ptr,
+        mask_ptr,
+        input_indices_ptr,
+        input_indices_size,
+        output_ptr,
+        data_length,
+        lambda_grid_ptr,
+        lambda_grid_size,
+        lambda_criterion(criterion),
+        lambdas_ptr,
+        d,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    );
+}
+
+#[no_mangle]
+pub extern "C" fn rust_single_whittaker_auto(
+    x_input_ptr: *mut f64,
+    y_input_ptr: *mut f64,
+    weights_input_ptr: *mut f64,
+    output_ptr: *mut f64,
+    data_length: usize,
+    lambda_grid_ptr: *mut f64,
+    lambda_grid_size: usize,
+    criterion: i64,
+    d: i64,
+) -> f64 {
+    single_whittaker_auto(
+        x_input_ptr,
+        y_input_ptr,
+        weights_input_ptr,
+        output_ptr,
+        data_length,
+        lambda_grid_ptr,
+        lambda_grid_size,
+        lambda_criterion(criterion),
+        d,
+    )
+}
+
+fn lambda_criterion(criterion: i64) -> Criterion {
+    match criterion {
+        1 => Criterion::VCurve,
+        _ => Criterion::Gcv,
+    }
+}
+
+#[no_mangle]
+pub extern "C" fn rust_multiple_whittakers_robust(
+    x_input_ptr: *mut f64,
+    x_shared: bool,
+    y_input_ptr: *mut f64,
+    weights_input_ptr: *mut f64,
+    mask_ptr: *mut u8,
+    input_indices_ptr: *mut usize,
+    input_indices_size: usize,
+    output_ptr: *mut f64,
+    data_length: usize,
+    lambda: f64,
+    d: i64,
+    scheme: i64,
+    asymmetry: f64,
+    iterations: i64,
+    tolerance: f64,
+    passes_ptr: *mut u64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    let reweighting = match scheme {
+        1 => Reweighting::Envelope,
+        2 => Reweighting::Bisquare,
+        _ => Reweighting::Asymmetric(asymmetry),
+    };
+
+    multiple_whittakers_robust(
+        x_input_ptr,
+        x_shared,
+        y_input_ptr,
+        weights_input_ptr,
+        mask_ptr,
+        input_indices_ptr,
+        input_indices_size,
+        output_ptr,
+        data_length,
+        lambda,
+        d,
+        reweighting,
+        iterations,
+        tolerance,
+        passes_ptr,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    );
+}
+
+#[no_mangle]
+pub extern "C" fn rust_online_whittakers(
+    x_tail_ptr: *mut f64,
+    count: usize,
+    factor_ptr: *mut f64,
+    forward_ptr: *mut f64,
+    pending_ptr: *mut f64,
+    rhs_ptr: *mut f64,
+    weight_totals_ptr: *mut f64,
+    n_pixels: usize,
+    window: usize,
+    new_x_ptr: *mut f64,
+    new_y_ptr: *mut f64,
+    weights_ptr: *mut f64,
+    mask_ptr: *mut u8,
+    new_count: usize,
+    output_ptr: *mut f64,
+    lambda: f64,
+    d: i64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    online_whittakers(
+        x_tail_ptr,
+        count,
+        factor_ptr,
+        forward_ptr,
+        pending_ptr,
+        rhs_ptr,
+        weight_totals_ptr,
+        n_pixels,
+        window,
+        new_x_ptr,
+        new_y_ptr,
+        weights_ptr,
+        mask_ptr,
+        new_count,
+        output_ptr,
+        lambda,
+        d,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    );
+}
+
 #[no_mangle]
 pub extern "C" fn rust_single_sav_golay(
     y_input_ptr: *mut f64,
@@ -139,6 +678,7 @@ pub extern "C" fn rust_single_sav_golay(
 #[no_mangle]
 pub extern "C" fn rust_multiple_sav_golays(
     y_input_ptr: *mut f64,
+    mask_ptr: *mut u8,
     input_indices_ptr: *mut usize,
     input_indices_size: usize,
     output_ptr: *mut f64,
@@ -147,10 +687,13 @@ pub extern "C" fn rust_multiple_sav_golays(
     order: i64,
     deriv: i64,
     delta: f64,
+    status_ptr: *mut u8,
     n_threads: i64,
+    chunk_size: i64,
 ) {
     multiple_sav_golays(
         y_input_ptr,
+        mask_ptr,
         input_indices_ptr,
         input_indices_size,
         output_ptr,
@@ -159,6 +702,296 @@ pub extern "C" fn rust_multiple_sav_golays(
         order,
         deriv,
         delta,
+        status_ptr,
         n_threads,
+        chunk_size,
     )
 }
+
+#[no_mangle]
+pub extern "C" fn rust_cube_sav_golays(
+    y_input_ptr: *mut u8,
+    y_dtype: i64,
+    y_scale: f64,
+    y_offset: f64,
+    y_nodata: f64,
+    y_strides_ptr: *mut isize,
+    mask_ptr: *mut u8,
+    mask_strides_ptr: *mut isize,
+    output_ptr: *mut u8,
+    output_dtype: i64,
+    output_scale: f64,
+    output_offset: f64,
+    output_nodata: f64,
+    output_strides_ptr: *mut isize,
+    shape_ptr: *mut usize,
+    ndim: usize,
+    axis: usize,
+    window_size: i64,
+    order: i64,
+    deriv: i64,
+    delta: f64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    cube_sav_golays(
+        y_input_ptr,
+        Encoding::from_raw(y_dtype, y_scale, y_offset, y_nodata),
+        y_strides_ptr,
+        mask_ptr,
+        mask_strides_ptr,
+        output_ptr,
+        Encoding::from_raw(
+            output_dtype,
+            output_scale,
+            output_offset,
+            output_nodata,
+        ),
+        output_strides_ptr,
+        shape_ptr,
+        ndim,
+        axis,
+        window_size,
+        order,
+        deriv,
+        delta,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    )
+}
+
+#[no_mangle]
+pub extern "C" fn rust_set_num_threads(n_threads: i64) {
+    set_num_threads(n_threads)
+}
+
+#[no_mangle]
+pub extern "C" fn rust_get_num_threads() -> i64 {
+    get_num_threads() as i64
+}
+
+#[no_mangle]
+pub extern "C" fn rust_attach_batch_control(counters_ptr: *mut u64) {
+    unsafe { attach_control(counters_ptr) }
+}
+
+#[no_mangle]
+pub extern "C" fn rust_profile_set_level(level: i64) {
+    set_level(match level {
+        1 => Level::Stats,
+        2 => Level::Trace,
+        _ => Level::Off,
+    })
+}
+
+#[no_mangle]
+pub extern "C" fn rust_profile_reset() {
+    reset()
+}
+
+// Writes the profiling report into `buffer_ptr` if it holds `capacity`
+// bytes, and returns its length either way.
+#[no_mangle]
+pub extern "C" fn rust_profile_report(
+    buffer_ptr: *mut u8,
+    capacity: usize,
+    events: bool,
+) -> usize {
+    let json = report(events);
+
+    if json.len() <= capacity {
+        let buffer: &mut [u8] = unsafe {
+            assert!(!buffer_ptr.is_null());
+            std::slice::from_raw_parts_mut(buffer_ptr, capacity)
+        };
+        buffer[..json.len()].copy_from_slice(json.as_bytes());
+    }
+
+    json.len()
+}
+
+#[no_mangle]
+pub extern "C" fn rust_sav_golay_cache_info(info_ptr: *mut u64) {
+    let info: &mut [u64] = unsafe {
+        assert!(!info_ptr.is_null());
+        std::slice::from_raw_parts_mut(info_ptr, 4)
+    };
+
+    info.copy_from_slice(&coefficient_cache_info());
+}
+
+#[no_mangle]
+pub extern "C" fn rust_clear_sav_golay_cache() {
+    clear_coefficient_cache()
+}
+
+#[no_mangle]
+pub extern "C" fn rust_multiple_chens(
+    y_input_ptr: *mut f64,
+    mask_ptr: *mut u8,
+    input_indices_ptr: *mut usize,
+    input_indices_size: usize,
+    output_ptr: *mut f64,
+    data_length: usize,
+    iterations_ptr: *mut u64,
+    trend_window: i64,
+    trend_order: i64,
+    window_size: i64,
+    order: i64,
+    max_iterations: i64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    multiple_chens(
+        y_input_ptr,
+        mask_ptr,
+        input_indices_ptr,
+        input_indices_size,
+        output_ptr,
+        data_length,
+        iterations_ptr,
+        trend_window,
+        trend_order,
+        window_size,
+        order,
+        max_iterations,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    );
+}
+
+#[no_mangle]
+pub extern "C" fn rust_cube_chens(
+    y_input_ptr: *mut u8,
+    y_dtype: i64,
+    y_scale: f64,
+    y_offset: f64,
+    y_nodata: f64,
+    y_strides_ptr: *mut isize,
+    mask_ptr: *mut u8,
+    mask_strides_ptr: *mut isize,
+    output_ptr: *mut u8,
+    output_dtype: i64,
+    output_scale: f64,
+    output_offset: f64,
+    output_nodata: f64,
+    output_strides_ptr: *mut isize,
+    shape_ptr: *mut usize,
+    ndim: usize,
+    axis: usize,
+    trend_window: i64,
+    trend_order: i64,
+    window_size: i64,
+    order: i64,
+    max_iterations: i64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    cube_chens(
+        y_input_ptr,
+        Encoding::from_raw(y_dtype, y_scale, y_offset, y_nodata),
+        y_strides_ptr,
+        mask_ptr,
+        mask_strides_ptr,
+        output_ptr,
+        Encoding::from_raw(
+            output_dtype,
+            output_scale,
+            output_offset,
+            output_nodata,
+        ),
+        output_strides_ptr,
+        shape_ptr,
+        ndim,
+        axis,
+        trend_window,
+        trend_order,
+        window_size,
+        order,
+        max_iterations,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    )
+}
+
+#[no_mangle]
+pub extern "C" fn rust_convolve_1d(
+    a_ptr: *mut f64,
+    a_size: usize,
+    v_ptr: *mut f64,
+    v_size: usize,
+    output_ptr: *mut f64,
+    output_size: usize,
+    mode: i64,
+    method: i64,
+) {
+    let a: &mut [f64] = unsafe {
+        assert!(!a_ptr.is_null());
+        std::slice::from_raw_parts_mut(a_ptr, a_size)
+    };
+
+    let v: &mut [f64] = unsafe {
+        assert!(!v_ptr.is_null());
+        std::slice::from_raw_parts_mut(v_ptr, v_size)
+    };
+
+    let output: &mut [f64] = unsafe {
+        assert!(!output_ptr.is_null());
+        std::slice::from_raw_parts_mut(output_ptr, output_size)
+    };
+
+    let conv = match mode {
+        0 => ConvType::Full,
+        1 => ConvType::Valid,
+        _ => ConvType::Same,
+    };
+
+    let method = match method {
+        1 => ConvMethod::Direct,
+        2 => ConvMethod::Fft,
+        _ => ConvMethod::Auto,
+    };
+
+    assert_eq!(output_size, output_length(a_size, v_size, &conv));
+
+    convolve_1d_with(a, v, conv, method, output);
+}
+
+#[no_mangle]
+pub extern "C" fn rust_multiple_pipelines(
+    x_input_ptr: *mut f64,
+    y_input_ptr: *mut f64,
+    mask_ptr: *mut u8,
+    input_indices_ptr: *mut usize,
+    input_indices_size: usize,
+    data_length: usize,
+    stage_kinds_ptr: *mut i64,
+    stage_parameters_ptr: *mut f64,
+    n_stages: usize,
+    outputs_ptr: *mut *mut f64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    multiple_pipelines(
+        x_input_ptr,
+        y_input_ptr,
+        mask_ptr,
+        input_indices_ptr,
+        input_indices_size,
+        data_length,
+        stage_kinds_ptr,
+        stage_parameters_ptr,
+        n_stages,
+        outputs_ptr,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    );
+}
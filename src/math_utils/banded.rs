@@ -0,0 +1,284 @@
+use crate::parallel::profile::span;
+
+/// Symmetric banded matrix stored by rows of its lower triangle.
+///
+/// Entry `(i, i - k)` for `k <= bandwidth` lives at
+/// `data[i * (bandwidth + 1) + k]`, so row `i` is contiguous from the
+/// diagonal outwards. After `factorize` the same storage holds the lower
+/// Cholesky factor `L` with `A = L Lᵀ`.
+#[derive(Clone, Debug, Default)]
+pub struct SymBandMatrix {
+    n: usize,
+    bandwidth: usize,
+    data: Vec<f64>,
+}
+
+#[derive(Debug)]
+pub struct NotPositiveDefinite {
+    pub row: usize,
+}
+
+impl SymBandMatrix {
+    pub fn zeros(n: usize, bandwidth: usize) -> SymBandMatrix {
+        let mut matrix = SymBandMatrix::default();
+        matrix.reset(n, bandwidth);
+        matrix
+    }
+
+    /// Resize to an `n` by `n` zero matrix, keeping the allocation.
+    pub fn reset(&mut self, n: usize, bandwidth: usize) {
+        self.n = n;
+        self.bandwidth = bandwidth;
+        self.data.clear();
+        self.data.resize(n * (bandwidth + 1), 0_f64);
+    }
+
+    pub fn n(&self) -> usize {
+        self.n
+    }
+
+    pub fn bandwidth(&self) -> usize {
+        self.bandwidth
+    }
+
+    pub fn get(&self, i: usize, j: usize) -> f64 {
+        let (i, j) = if i >= j { (i, j) } else { (j, i) };
+
+        if i - j > self.bandwidth {
+            0_f64
+        } else {
+            self.data[i * (self.bandwidth + 1) + (i - j)]
+        }
+    }
+
+    /// Add `value` to entries `(i, j)` and `(j, i)`, which must be inside
+    /// the band.
+    pub fn add(&mut self, i: usize, j: usize, value: f64) {
+        let (i, j) = if i >= j { (i, j) } else { (j, i) };
+
+        assert!(i - j <= self.bandwidth, "Entry is outside of the band.");
+
+        self.data[i * (self.bandwidth + 1) + (i - j)] += value;
+    }
+
+    pub fn add_diagonal(&mut self, values: &[f64]) {
+        assert_eq!(values.len(), self.n);
+
+        for (i, value) in values.iter().enumerate() {
+            self.data[i * (self.bandwidth + 1)] += value;
+        }
+    }
+
+    pub fn scale(&mut self, factor: f64) {
+        for value in self.data.iter_mut() {
+            *value *= factor;
+        }
+    }
+
+    /// Overwrite with `factor` times `other`, keeping the allocation.
+    pub fn assign_scaled(&mut self, other: &SymBandMatrix, factor: f64) {
+        self.n = other.n;
+        self.bandwidth = other.bandwidth;
+        self.data.clear();
+        self.data
+            .extend(other.data.iter().map(|value| value * factor));
+    }
+
+    /// `zᵀ A z`.
+    pub fn quadratic_form(&self, z: &[f64]) -> f64 {
+        assert_eq!(z.len(), self.n);
+
+        let width = self.bandwidth + 1;
+        let mut sum = 0_f64;
+
+        for i in 0..self.n {
+            let row = &self.data[i * width..(i + 1) * width];
+            sum += row[0] * z[i] * z[i];
+            for k in 1..std::cmp::min(width, i + 1) {
+                sum += 2_f64 * row[k] * z[i] * z[i - k];
+            }
+        }
+
+        sum
+    }
+
+    /// In-place Cholesky factorisation, O(n * bandwidth²).
+    pub fn factorize(&mut self) -> Result<(), NotPositiveDefinite> {
+        let _span = span("factorize");
+        let width = self.bandwidth + 1;
+
+        for i in 0..self.n {
+            let first = i.saturating_sub(self.bandwidth);
+
+            for j in first..i + 1 {
+                // L[i][j] = (A[i][j] - sum_k L[i][k] L[j][k]) / L[j][j]
+                let mut sum = self.data[i * width + (i - j)];
+
+                for k in first..j {
+                    sum -= self.data[i * width + (i - k)]
+                        * self.data[j * width + (j - k)];
+                }
+
+                if i == j {
+                    if !(sum > 0_f64) || !sum.is_finite() {
+                        return Err(NotPositiveDefinite { row: i });
+                    }
+                    self.data[i * width] = sum.sqrt();
+                } else {
+                    self.data[i * width + (i - j)] =
+                        sum / self.data[j * width];
+                }
+            }
+        }
+
+        Ok(())
+    }
+
+    /// The entries of `A⁻¹` inside the band of `A`, from the factor of
+    /// `factorize`, in O(n * bandwidth²).
+    ///
+    /// From `A⁻¹ L = L⁻ᵀ`, whose lower triangle is the diagonal `1 / L[i][i]`,
+    /// row `i` of the band only needs rows `i + 1` to `i + bandwidth`, so it
+    /// is filled in from the last row up (Hutchinson and de Hoog, 1985).
+    pub fn inverse_band(&self, inverse: &mut SymBandMatrix) {
+        let _span = span("inverse");
+
+        inverse.reset(self.n, self.bandwidth);
+
+        let width = self.bandwidth + 1;
+
+        for i in (0..self.n).rev() {
+            let last = std::cmp::min(self.n, i + width);
+            let pivot = self.data[i * width];
+
+            // Off-diagonal entries (j, i) first, as the diagonal uses them.
+            for j in (i + 1..last).rev() {
+                let mut sum = 0_f64;
+                for k in i + 1..last {
+                    sum += self.data[k * width + (k - i)] * inverse.get(j, k);
+                }
+                inverse.data[j * width + (j - i)] = -sum / pivot;
+            }
+
+            let mut sum = 0_f64;
+            for k in i + 1..last {
+                sum += self.data[k * width + (k - i)]
+                    * inverse.data[k * width + (k - i)];
+            }
+            inverse.data[i * width] = (1_f64 / pivot - sum) / pivot;
+        }
+    }
+
+    /// Solve `A x = b` in place using the factor from `factorize`.
+    pub fn solve(&self, b: &mut [f64]) {
+        let _span = span("solve");
+
+        assert_eq!(b.len(), self.n);
+
+        let width = self.bandwidth + 1;
+
+        // L z = b
+        for i in 0..self.n {
+            let first = i.saturating_sub(self.bandwidth);
+            let mut sum = b[i];
+            for k in first..i {
+                sum -= self.data[i * width + (i - k)] * b[k];
+            }
+            b[i] = sum / self.data[i * width];
+        }
+
+        // Lᵀ x = z
+        for i in (0..self.n).rev() {
+            let last = std::cmp::min(self.n, i + width);
+            let mut sum = b[i];
+            for k in i + 1..last {
+                sum -= self.data[k * width + (k - i)] * b[k];
+            }
+            b[i] = sum / self.data[i * width];
+        }
+    }
+}
+
+/// Coefficients of row `row` of the order `d` difference matrix, which
+/// cover columns `row..row + d + 1`.
+///
+/// With `x_input` these are divided differences, matching the recursive
+/// construction D_d = V_d diff(D_{d - 1}) with V_d = diag(1 / (x[i + d] -
+/// x[i])). Without it they are plain differences of evenly spaced data.
+pub fn difference_row(
+    x_input: Option<&[f64]>,
+    row: usize,
+    d: usize,
+    scratch: &mut Vec<f64>,
+    coefficients: &mut [f64],
+) {
+    assert_eq!(coefficients.len(), d + 1);
+
+    // scratch holds one set of level coefficients per start index, each
+    // padded to d + 1 entries.
+    let width = d + 1;
+    scratch.clear();
+    scratch.resize(width * width, 0_f64);
+    for start in 0..width {
+        scratch[start * width] = 1_f64;
+    }
+
+    for level in 1..width {
+        for start in 0..width - level {
+            let scale = match x_input {
+                Some(x) => 1_f64 / (x[row + start + level] - x[row + start]),
+                None => 1_f64,
+            };
+
+            // Entries are overwritten from the top so the previous level of
+            // start + 1 is still intact when it is read.
+            for k in (0..level + 1).rev() {
+                let shifted = if k >= 1 {
+                    scratch[(start + 1) * width + k - 1]
+                } else {
+                    0_f64
+                };
+                let current = if k < level {
+                    scratch[start * width + k]
+                } else {
+                    0_f64
+                };
+                scratch[start * width + k] = (shifted - current) * scale;
+            }
+        }
+    }
+
+    coefficients.copy_from_slice(&scratch[..width]);
+}
+
+/// `DᵀD` for the order `d` difference matrix of a series of length `n`,
+/// written into `penalty` in band storage.
+pub fn difference_penalty(
+    x_input: Option<&[f64]>,
+    n: usize,
+    d: usize,
+    penalty: &mut SymBandMatrix,
+) {
+    penalty.reset(n, d);
+
+    if n <= d {
+        return;
+    }
+
+    let mut scratch = Vec::with_capacity((d + 1) * (d + 1));
+    let mut coefficients = vec![0_f64; d + 1];
+
+    for row in 0..n - d {
+        difference_row(x_input, row, d, &mut scratch, &mut coefficients);
+
+        for a in 0..d + 1 {
+            for b in 0..a + 1 {
+                penalty.add(
+                    row + a,
+                    row + b,
+                    coefficients[a] * coefficients[b],
+                );
+            }
+        }
+    }
+}
@@ -1,43 +1,234 @@
+use crate::math_utils::fft::{Complex, FftPlan};
+
+use std::cell::RefCell;
+
+#[derive(Clone, Copy)]
 pub enum ConvType {
     Valid,
     Full,
+    Same,
+}
+
+#[derive(Clone, Copy)]
+pub enum ConvMethod {
+    Auto,
+    Direct,
+    Fft,
+}
+
+// Kernels shorter than this always use the direct method.
+const FFT_MIN_KERNEL: usize = 64;
+
+// Rough cost of one FFT butterfly relative to one multiply-add of the
+// direct method, used to pick between the two.
+const FFT_COST_FACTOR: f64 = 3.;
+
+// Outputs are accumulated in tiles this long so they stay in L1 cache
+// while every coefficient of the kernel is applied.
+const DIRECT_TILE: usize = 512;
+
+struct FftScratch {
+    plans: Vec<FftPlan>,
+    filter: Vec<Complex>,
+    block: Vec<Complex>,
+}
+
+thread_local! {
+    static FFT_SCRATCH: RefCell<FftScratch> = RefCell::new(FftScratch {
+        plans: Vec::new(),
+        filter: Vec::new(),
+        block: Vec::new(),
+    });
 }
 
 pub fn convolve_1d(a: &Vec<f64>, v: &Vec<f64>, conv: ConvType) -> Vec<f64> {
-    let na = a.len();
-    let nv = v.len();
+    let mut out_vec = vec![0.; output_length(a.len(), v.len(), &conv)];
+
+    convolve_1d_into(a, v, conv, &mut out_vec);
+
+    out_vec
+}
+
+/// Length of the result of convolving inputs of length `na` and `nv`.
+pub fn output_length(na: usize, nv: usize, conv: &ConvType) -> usize {
+    let (min_len, max_len) = (na.min(nv), na.max(nv));
 
-    // TODO Separate out into separate functions.
     match conv {
-        ConvType::Full => {
-            let n = na + nv - 1;
-            let mut out_vec: Vec<f64> = vec![0.; n];
+        ConvType::Full => na + nv - 1,
+        ConvType::Valid => max_len - min_len + 1,
+        ConvType::Same => max_len,
+    }
+}
 
-            for i in 0..n {
-                let jmn = if i >= nv - 1 { i - (nv - 1) } else { 0 };
-                let jmx = if i < na - 1 { i } else { na - 1 };
+/// Convolve into a caller provided buffer of length `output_length`,
+/// picking the direct or FFT method from the input sizes.
+pub fn convolve_1d_into(
+    a: &[f64],
+    v: &[f64],
+    conv: ConvType,
+    out: &mut [f64],
+) {
+    convolve_1d_with(a, v, conv, ConvMethod::Auto, out)
+}
 
-                for j in jmn..jmx + 1 {
-                    out_vec[i] += a[j] * v[i - j]
-                }
+pub fn convolve_1d_with(
+    a: &[f64],
+    v: &[f64],
+    conv: ConvType,
+    method: ConvMethod,
+    out: &mut [f64],
+) {
+    assert!(!a.is_empty() && !v.is_empty(), "Inputs cannot be empty.");
+    assert_eq!(out.len(), output_length(a.len(), v.len(), &conv));
+
+    // Convolution is commutative, so always slide the shorter input.
+    let (short, long) = if a.len() < v.len() { (a, v) } else { (v, a) };
+
+    // Position of the first requested value within the full convolution.
+    let offset = match conv {
+        ConvType::Full => 0,
+        ConvType::Valid => short.len() - 1,
+        ConvType::Same => (short.len() - 1) / 2,
+    };
+
+    let use_fft = match method {
+        ConvMethod::Direct => false,
+        ConvMethod::Fft => true,
+        ConvMethod::Auto => fft_is_cheaper(long.len(), short.len(), out.len()),
+    };
+
+    if use_fft {
+        convolve_fft(long, short, offset, out);
+    } else {
+        convolve_direct(long, short, offset, out);
+    }
+}
+
+fn fft_size(long_len: usize, short_len: usize) -> usize {
+    let full_len = long_len + short_len - 1;
+
+    std::cmp::min(
+        full_len.next_power_of_two(),
+        std::cmp::max((8 * short_len).next_power_of_two(), 1024),
+    )
+}
+
+fn fft_is_cheaper(long_len: usize, short_len: usize, out_len: usize) -> bool {
+    if short_len < FFT_MIN_KERNEL {
+        return false;
+    }
+
+    let size = fft_size(long_len, short_len);
+    let block = size - short_len + 1;
+    let n_blocks = (long_len + block - 1) / block;
+
+    // One forward and one inverse transform per block plus the filter.
+    let fft_cost = FFT_COST_FACTOR
+        * (2 * n_blocks + 1) as f64
+        * size as f64
+        * (size as f64).log2();
+    let direct_cost = (out_len * short_len) as f64;
+
+    fft_cost < direct_cost
+}
+
+/// out[i] = full[offset + i] where full[k] = sum_j short[j] * long[k - j].
+///
+/// Written as one contiguous multiply-add per kernel coefficient, which
+/// the compiler vectorises, rather than a dot product per output.
+fn convolve_direct(
+    long: &[f64],
+    short: &[f64],
+    offset: usize,
+    out: &mut [f64],
+) {
+    let long_len = long.len();
+    let out_len = out.len();
+
+    for value in out.iter_mut() {
+        *value = 0_f64;
+    }
+
+    for tile_start in (0..out_len).step_by(DIRECT_TILE) {
+        let tile_end = std::cmp::min(tile_start + DIRECT_TILE, out_len);
+
+        for (j, coefficient) in short.iter().enumerate() {
+            // Full indices k with j <= k < j + long_len have a term for j.
+            let first = std::cmp::max(tile_start, j.saturating_sub(offset));
+            let last =
+                std::cmp::min(tile_end, (j + long_len).saturating_sub(offset));
+
+            if first >= last {
+                continue;
+            }
+
+            let source_start = offset + first - j;
+            let source = &long[source_start..source_start + (last - first)];
+
+            for (value, x) in out[first..last].iter_mut().zip(source) {
+                *value += coefficient * x;
             }
-            return out_vec;
         }
-        ConvType::Valid => {
-            let min_v = if na < nv { a } else { v };
-            let max_v = if na < nv { v } else { a };
+    }
+}
 
-            let n = std::cmp::max(na, nv) - std::cmp::min(na, nv) + 1;
+/// Overlap-add FFT convolution for long kernels.
+fn convolve_fft(long: &[f64], short: &[f64], offset: usize, out: &mut [f64]) {
+    let size = fft_size(long.len(), short.len());
+    let block_len = size - short.len() + 1;
+    let out_len = out.len();
 
-            let mut out_vec: Vec<f64> = vec![0.; n];
+    for value in out.iter_mut() {
+        *value = 0_f64;
+    }
 
-            for i in 0..n {
-                for (k, j) in (0..(min_v.len())).rev().enumerate() {
-                    out_vec[i] += min_v[j] * max_v[k + i];
-                }
+    FFT_SCRATCH.with(|scratch| {
+        let mut scratch = scratch.borrow_mut();
+        let FftScratch {
+            plans,
+            filter,
+            block,
+        } = &mut *scratch;
+
+        let plan_index = match plans.iter().position(|p| p.size() == size) {
+            Some(index) => index,
+            None => {
+                plans.push(FftPlan::new(size));
+                plans.len() - 1
+            }
+        };
+        let plan = &plans[plan_index];
+
+        filter.clear();
+        filter.extend(short.iter().map(|x| Complex::new(*x, 0_f64)));
+        filter.resize(size, Complex::default());
+        plan.forward(filter);
+
+        for block_start in (0..long.len()).step_by(block_len) {
+            let block_end = std::cmp::min(block_start + block_len, long.len());
+
+            block.clear();
+            block.extend(
+                long[block_start..block_end]
+                    .iter()
+                    .map(|x| Complex::new(*x, 0_f64)),
+            );
+            block.resize(size, Complex::default());
+
+            plan.forward(block);
+            for (value, h) in block.iter_mut().zip(filter.iter()) {
+                *value = value.mul(*h);
             }
+            plan.inverse(block);
 
-            return out_vec;
+            // This block contributes to full indices starting at block_start.
+            let produced = block_end - block_start + short.len() - 1;
+            for t in 0..produced {
+                let k = block_start + t;
+                if k >= offset && k - offset < out_len {
+                    out[k - offset] += block[t].re;
+                }
+            }
         }
-    }
+    });
 }
@@ -0,0 +1,234 @@
+//! Dense row-major linear algebra used by the Gaussian processes.
+
+use crate::math_utils::banded::NotPositiveDefinite;
+use crate::math_utils::real::Real;
+use crate::parallel::profile::span;
+
+// Width of the column panels of the blocked Cholesky factorisation.
+const CHOLESKY_BLOCK: usize = 64;
+
+// Tile sizes of `gemm`, chosen so a tile of `b` and a row of `c` stay in
+// L1/L2 cache while the inner loop streams along a contiguous row.
+const GEMM_INNER_TILE: usize = 128;
+const GEMM_COLUMN_TILE: usize = 256;
+
+#[inline]
+fn dot<T: Real>(a: &[T], b: &[T]) -> T {
+    a.iter().zip(b).fold(T::zero(), |sum, (a, b)| sum + *a * *b)
+}
+
+/// In-place Cholesky factorisation of the symmetric positive definite
+/// `n` by `n` matrix `a`. Only the lower triangle is read, and afterwards it
+/// holds `L` with `A = L Lᵀ`. The strict upper triangle is zeroed.
+///
+/// The factorisation works on panels of `CHOLESKY_BLOCK` columns: factor
+/// the diagonal block, solve for the rows below it, then apply the panel to
+/// the trailing lower triangle. Every inner product runs along contiguous
+/// row segments of at most one panel, which keeps large kernels in cache.
+pub fn cholesky<T: Real>(
+    a: &mut [T],
+    n: usize,
+) -> Result<(), NotPositiveDefinite> {
+    let _span = span("factorize");
+
+    assert_eq!(a.len(), n * n);
+
+    for start in (0..n).step_by(CHOLESKY_BLOCK) {
+        let end = std::cmp::min(n, start + CHOLESKY_BLOCK);
+
+        // Diagonal block, all earlier panels already applied.
+        for i in start..end {
+            for j in start..i + 1 {
+                let sum = a[i * n + j]
+                    - dot(
+                        &a[i * n + start..i * n + j],
+                        &a[j * n + start..j * n + j],
+                    );
+
+                if i == j {
+                    if !(sum > T::zero()) || !sum.is_finite() {
+                        return Err(NotPositiveDefinite { row: i });
+                    }
+                    a[i * n + i] = sum.sqrt();
+                } else {
+                    a[i * n + j] = sum / a[j * n + j];
+                }
+            }
+        }
+
+        // Rows below the diagonal block: L[i, panel] = A[i, panel] L_kkᵀ⁻¹.
+        for i in end..n {
+            for j in start..end {
+                let sum = a[i * n + j]
+                    - dot(
+                        &a[i * n + start..i * n + j],
+                        &a[j * n + start..j * n + j],
+                    );
+                a[i * n + j] = sum / a[j * n + j];
+            }
+        }
+
+        // Trailing lower triangle: A[i, j] -= L[i, panel] · L[j, panel].
+        for i in end..n {
+            let (head, tail) = a.split_at_mut(i * n);
+            let row_i = &mut tail[..n];
+
+            for j in end..i + 1 {
+                let update = if j == i {
+                    dot(&row_i[start..end], &row_i[start..end])
+                } else {
+                    dot(&row_i[start..end], &head[j * n + start..j * n + end])
+                };
+                row_i[j] -= update;
+            }
+        }
+    }
+
+    for i in 0..n {
+        a[i * n + i + 1..(i + 1) * n]
+            .iter_mut()
+            .for_each(|u| *u = T::zero());
+    }
+
+    Ok(())
+}
+
+/// Solve `L Lᵀ X = B` in place for the `n` by `cols` right hand sides in
+/// `b`, using the factor from `cholesky`.
+pub fn cholesky_solve<T: Real>(l: &[T], n: usize, b: &mut [T], cols: usize) {
+    let _span = span("solve");
+
+    if cols == 1 {
+        assert_eq!(l.len(), n * n);
+        assert_eq!(b.len(), n);
+
+        cholesky_solve_vector(l, n, b);
+        return;
+    }
+
+    solve_lower(l, n, b, cols);
+    solve_lower_transposed(l, n, b, cols);
+}
+
+/// Solve `L Z = B` in place for the `n` by `cols` right hand sides in `b`,
+/// with `l` lower triangular as left by `cholesky`.
+pub fn solve_lower<T: Real>(l: &[T], n: usize, b: &mut [T], cols: usize) {
+    let _span = span("solve");
+
+    assert_eq!(l.len(), n * n);
+    assert_eq!(b.len(), n * cols);
+
+    // One row of Z at a time as combinations of earlier rows.
+    for i in 0..n {
+        let (done, rest) = b.split_at_mut(i * cols);
+        let row_i = &mut rest[..cols];
+
+        for k in 0..i {
+            let factor = l[i * n + k];
+            if factor != T::zero() {
+                let row_k = &done[k * cols..(k + 1) * cols];
+                row_i.iter_mut().zip(row_k).for_each(|(b, z)| {
+                    *b -= factor * *z;
+                });
+            }
+        }
+
+        let diagonal = l[i * n + i];
+        row_i.iter_mut().for_each(|b| *b /= diagonal);
+    }
+}
+
+/// Solve `Lᵀ X = B` in place for the `n` by `cols` right hand sides in `b`,
+/// with `l` lower triangular as left by `cholesky`.
+pub fn solve_lower_transposed<T: Real>(
+    l: &[T],
+    n: usize,
+    b: &mut [T],
+    cols: usize,
+) {
+    let _span = span("solve");
+
+    assert_eq!(l.len(), n * n);
+    assert_eq!(b.len(), n * cols);
+
+    // From the last row up.
+    for i in (0..n).rev() {
+        let (head, tail) = b.split_at_mut((i + 1) * cols);
+        let row_i = &mut head[i * cols..];
+
+        for k in i + 1..n {
+            let factor = l[k * n + i];
+            if factor != T::zero() {
+                let row_k = &tail[(k - i - 1) * cols..(k - i) * cols];
+                row_i.iter_mut().zip(row_k).for_each(|(b, x)| {
+                    *b -= factor * *x;
+                });
+            }
+        }
+
+        let diagonal = l[i * n + i];
+        row_i.iter_mut().for_each(|b| *b /= diagonal);
+    }
+}
+
+/// Single right hand side version of `cholesky_solve`.
+fn cholesky_solve_vector<T: Real>(l: &[T], n: usize, b: &mut [T]) {
+    for i in 0..n {
+        b[i] = (b[i] - dot(&l[i * n..i * n + i], &b[..i])) / l[i * n + i];
+    }
+
+    // Lᵀ x = z by columns of L, so the inner loop stays contiguous.
+    for i in (0..n).rev() {
+        b[i] /= l[i * n + i];
+        let x = b[i];
+        for (b, l) in b[..i].iter_mut().zip(&l[i * n..i * n + i]) {
+            *b -= *l * x;
+        }
+    }
+}
+
+/// `C = A B` for row-major `a` (`rows` by `inner`), `b` (`inner` by `cols`)
+/// and `c` (`rows` by `cols`).
+///
+/// The product is tiled over the inner and column dimensions so each tile
+/// of `b` is reused for every row of `a` while it is in cache, and the
+/// innermost loop is a contiguous axpy the compiler vectorises.
+pub fn gemm<T: Real>(
+    a: &[T],
+    b: &[T],
+    c: &mut [T],
+    rows: usize,
+    inner: usize,
+    cols: usize,
+) {
+    let _span = span("gemm");
+
+    assert_eq!(a.len(), rows * inner);
+    assert_eq!(b.len(), inner * cols);
+    assert_eq!(c.len(), rows * cols);
+
+    c.iter_mut().for_each(|c| *c = T::zero());
+
+    for col_start in (0..cols).step_by(GEMM_COLUMN_TILE) {
+        let col_end = std::cmp::min(cols, col_start + GEMM_COLUMN_TILE);
+
+        for inner_start in (0..inner).step_by(GEMM_INNER_TILE) {
+            let inner_end =
+                std::cmp::min(inner, inner_start + GEMM_INNER_TILE);
+
+            for r in 0..rows {
+                let a_row = &a[r * inner..(r + 1) * inner];
+                let c_row = &mut c[r * cols + col_start..r * cols + col_end];
+
+                for k in inner_start..inner_end {
+                    let factor = a_row[k];
+                    let b_row = &b[k * cols + col_start..k * cols + col_end];
+
+                    c_row.iter_mut().zip(b_row).for_each(|(c, b)| {
+                        *c += factor * *b;
+                    });
+                }
+            }
+        }
+    }
+}
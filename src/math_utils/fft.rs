@@ -0,0 +1,113 @@
+use std::f64::consts::PI;
+
+#[derive(Clone, Copy, Debug, Default)]
+pub struct Complex {
+    pub re: f64,
+    pub im: f64,
+}
+
+impl Complex {
+    pub fn new(re: f64, im: f64) -> Complex {
+        Complex { re, im }
+    }
+
+    pub fn mul(self, other: Complex) -> Complex {
+        Complex {
+            re: self.re * other.re - self.im * other.im,
+            im: self.re * other.im + self.im * other.re,
+        }
+    }
+}
+
+/// Precomputed twiddle factors and bit-reversal table for one
+/// power-of-two transform size.
+pub struct FftPlan {
+    size: usize,
+    twiddles: Vec<Complex>,
+    reversed: Vec<usize>,
+}
+
+impl FftPlan {
+    pub fn new(size: usize) -> FftPlan {
+        assert!(size.is_power_of_two(), "FFT size must be a power of two.");
+
+        let twiddles = (0..size / 2)
+            .map(|k| {
+                let angle = -2_f64 * PI * k as f64 / size as f64;
+                Complex::new(angle.cos(), angle.sin())
+            })
+            .collect();
+
+        let bits = size.trailing_zeros();
+        let reversed = (0..size)
+            .map(|i| {
+                if bits == 0 {
+                    0
+                } else {
+                    i.reverse_bits() >> (usize::BITS - bits)
+                }
+            })
+            .collect();
+
+        FftPlan {
+            size,
+            twiddles,
+            reversed,
+        }
+    }
+
+    pub fn size(&self) -> usize {
+        self.size
+    }
+
+    /// In-place forward transform.
+    pub fn forward(&self, data: &mut [Complex]) {
+        self.transform(data, false);
+    }
+
+    /// In-place inverse transform, including the 1/N scaling.
+    pub fn inverse(&self, data: &mut [Complex]) {
+        self.transform(data, true);
+
+        let scale = 1_f64 / self.size as f64;
+        for value in data.iter_mut() {
+            value.re *= scale;
+            value.im *= scale;
+        }
+    }
+
+    fn transform(&self, data: &mut [Complex], inverse: bool) {
+        assert_eq!(data.len(), self.size);
+
+        for i in 0..self.size {
+            let j = self.reversed[i];
+            if i < j {
+                data.swap(i, j);
+            }
+        }
+
+        let mut length = 2;
+        while length <= self.size {
+            let half = length / 2;
+            let stride = self.size / length;
+
+            for start in (0..self.size).step_by(length) {
+                for k in 0..half {
+                    let mut twiddle = self.twiddles[k * stride];
+                    if inverse {
+                        twiddle.im = -twiddle.im;
+                    }
+
+                    let even = data[start + k];
+                    let odd = data[start + k + half].mul(twiddle);
+
+                    data[start + k] =
+                        Complex::new(even.re + odd.re, even.im + odd.im);
+                    data[start + k + half] =
+                        Complex::new(even.re - odd.re, even.im - odd.im);
+                }
+            }
+            length *= 2;
+        }
+    }
+}
@@ -0,0 +1,50 @@
+//! Missing value handling shared by the smoothers and GPs. A value is
+//! missing when it is not finite, or when an optional validity mask is zero
+//! at its position.
+
+use crate::math_utils::real::Real;
+
+/// Whether value `i` of a series should be used.
+#[inline]
+pub fn is_valid<T: Real>(value: T, mask: Option<&[u8]>, i: usize) -> bool {
+    value.is_finite() && mask.map_or(true, |mask| mask[i] != 0)
+}
+
+/// Copy the valid `(x, y)` pairs of a series into `x_valid` and `y_valid`
+/// and return how many there are.
+pub fn collect_valid<T: Real>(
+    x_input: &[T],
+    y_input: &[T],
+    mask: Option<&[u8]>,
+    x_valid: &mut Vec<T>,
+    y_valid: &mut Vec<T>,
+) -> usize {
+    x_valid.clear();
+    y_valid.clear();
+
+    for (i, (x, y)) in x_input.iter().zip(y_input).enumerate() {
+        if is_valid(*y, mask, i) {
+            x_valid.push(*x);
+            y_valid.push(*y);
+        }
+    }
+
+    y_valid.len()
+}
+
+/// Validity mask passed over the FFI, where a null pointer means no mask.
+///
+/// # Safety
+///
+/// A non-null `mask_ptr` must point to `length` values that outlive the
+/// returned slice.
+pub unsafe fn mask_from_raw<'a>(
+    mask_ptr: *const u8,
+    length: usize,
+) -> Option<&'a [u8]> {
+    if mask_ptr.is_null() {
+        None
+    } else {
+        Some(std::slice::from_raw_parts(mask_ptr, length))
+    }
+}
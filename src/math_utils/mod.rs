@@ -1 +1,6 @@
+pub mod banded;
 pub mod convolve;
+pub mod dense;
+pub mod fft;
+pub mod missing;
+pub mod real;
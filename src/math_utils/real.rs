@@ -0,0 +1,98 @@
+//! Floating point types the numerical kernels are generic over.
+
+use std::fmt::Debug;
+use std::iter::Sum;
+use std::ops::{
+    Add, AddAssign, Div, DivAssign, Mul, MulAssign, Neg, Sub, SubAssign,
+};
+
+/// `f32` or `f64`.
+pub trait Real:
+    Copy
+    + Debug
+    + Default
+    + PartialOrd
+    + Send
+    + Sync
+    + Sum
+    + Add<Output = Self>
+    + Sub<Output = Self>
+    + Mul<Output = Self>
+    + Div<Output = Self>
+    + Neg<Output = Self>
+    + AddAssign
+    + SubAssign
+    + MulAssign
+    + DivAssign
+    + 'static
+{
+    fn zero() -> Self;
+    fn one() -> Self;
+    fn nan() -> Self;
+    fn epsilon() -> Self;
+    fn from_f64(value: f64) -> Self;
+    fn to_f64(self) -> f64;
+    fn sqrt(self) -> Self;
+    fn exp(self) -> Self;
+    fn abs(self) -> Self;
+    fn is_finite(self) -> bool;
+}
+
+macro_rules! impl_real {
+    ($t:ident) => {
+        impl Real for $t {
+            #[inline]
+            fn zero() -> Self {
+                0 as $t
+            }
+
+            #[inline]
+            fn one() -> Self {
+                1 as $t
+            }
+
+            #[inline]
+            fn nan() -> Self {
+                $t::NAN
+            }
+
+            #[inline]
+            fn epsilon() -> Self {
+                $t::EPSILON
+            }
+
+            #[inline]
+            fn from_f64(value: f64) -> Self {
+                value as $t
+            }
+
+            #[inline]
+            fn to_f64(self) -> f64 {
+                self as f64
+            }
+
+            #[inline]
+            fn sqrt(self) -> Self {
+                $t::sqrt(self)
+            }
+
+            #[inline]
+            fn exp(self) -> Self {
+                $t::exp(self)
+            }
+
+            #[inline]
+            fn abs(self) -> Self {
+                $t::abs(self)
+            }
+
+            #[inline]
+            fn is_finite(self) -> bool {
+                $t::is_finite(self)
+            }
+        }
+    };
+}
+
+impl_real!(f32);
+impl_real!(f64);
@@ -0,0 +1,419 @@
+use crate::math_utils::missing::{is_valid, mask_from_raw};
+use crate::parallel::encoded::{EncodedArray, Encoding};
+use crate::parallel::pool::pool_for;
+use crate::parallel::profile::count;
+use crate::parallel::scheduler::{run_batch, series_range, SharedMutSlice};
+use crate::parallel::status::{SeriesStatus, StatusOutput};
+use crate::parallel::strided::{
+    layout_from_raw, with_series_buffers, ArrayPtr,
+};
+use crate::smoothers::sav_golay::{
+    filter_series, half_window, sav_golay_coefficients,
+};
+
+use std::cell::RefCell;
+use std::sync::Arc;
+
+thread_local! {
+    // Working series of the reconstruction, reused by every series a worker
+    // thread handles.
+    static BUFFERS: RefCell<ChenBuffers> =
+        RefCell::new(ChenBuffers::default());
+}
+
+/// The two Savitzky-Golay filters and iteration limit of the upper envelope
+/// reconstruction of Chen et al. (2004).
+pub struct ChenFilter {
+    trend: Arc<Vec<f64>>,
+    trend_half_window: usize,
+    trend_order: usize,
+    coefficients: Arc<Vec<f64>>,
+    half_window: usize,
+    order: usize,
+    max_iterations: usize,
+}
+
+/// Scratch space of `ChenFilter::reconstruct`.
+#[derive(Default)]
+pub struct ChenBuffers {
+    original: Vec<f64>,
+    weights: Vec<f64>,
+    current: Vec<f64>,
+    fit: Vec<f64>,
+    best: Vec<f64>,
+}
+
+impl ChenFilter {
+    pub fn new(
+        trend_window: i64,
+        trend_order: i64,
+        window_size: i64,
+        order: i64,
+        max_iterations: i64,
+    ) -> ChenFilter {
+        ChenFilter {
+            trend: sav_golay_coefficients(trend_window, trend_order, 0, 1.),
+            trend_half_window: half_window(trend_window),
+            trend_order: trend_order as usize,
+            coefficients: sav_golay_coefficients(window_size, order, 0, 1.),
+            half_window: half_window(window_size),
+            order: order as usize,
+            max_iterations: max_iterations.max(1) as usize,
+        }
+    }
+
+    /// Reconstruct the upper envelope of one series into `output` and
+    /// return the number of filter passes it took.
+    ///
+    /// Missing values, either non-finite or zero in `mask`, are first
+    /// filled in linearly from their valid neighbours. The trend filter
+    /// then gives each value a weight, one at or above the trend and
+    /// falling with its distance below it otherwise. Each pass replaces
+    /// the values below the last fit by the fit and filters again, which
+    /// pulls the curve up to the envelope of the cloud free values. The
+    /// passes stop as soon as the fitting effect index, the weighted sum of
+    /// `|fit - original|`, stops decreasing, and the fit with the smallest
+    /// index is kept.
+    ///
+    /// A series too short for either window or without valid values is all
+    /// NaN, and its status is returned instead.
+    pub fn reconstruct(
+        &self,
+        y_input: &[f64],
+        mask: Option<&[u8]>,
+        buffers: &mut ChenBuffers,
+        output: &mut [f64],
+    ) -> Result<usize, SeriesStatus> {
+        let n = y_input.len();
+        let ChenBuffers {
+            original,
+            weights,
+            current,
+            fit,
+            best,
+        } = buffers;
+
+        if n <= std::cmp::max(self.trend_half_window, self.half_window) {
+            output.iter_mut().for_each(|out| *out = f64::NAN);
+            return Err(SeriesStatus::TooShort);
+        }
+
+        if !fill_missing(y_input, mask, original) {
+            output.iter_mut().for_each(|out| *out = f64::NAN);
+            return Err(SeriesStatus::NonFinite);
+        }
+
+        // The long-term trend, kept in best until the first pass.
+        best.resize(n, 0_f64);
+        filter_series(
+            &self.trend,
+            self.trend_half_window,
+            self.trend_order,
+            0,
+            1.,
+            original,
+            None,
+            best,
+        );
+
+        let largest_gap = original
+            .iter()
+            .zip(best.iter())
+            .map(|(y, trend)| trend - y)
+            .fold(0_f64, f64::max);
+
+        weights.clear();
+        weights.extend(original.iter().zip(best.iter()).map(|(y, trend)| {
+            if y >= trend || largest_gap == 0_f64 {
+                1_f64
+            } else {
+                1_f64 - (trend - y) / largest_gap
+            }
+        }));
+
+        fit.resize(n, 0_f64);
+        let mut best_index = f64::INFINITY;
+        let mut passes = 0;
+
+        while passes < self.max_iterations {
+            // best holds the trend before the first pass and the last
+            // accepted fit after it.
+            current.clear();
+            current.extend(
+                original.iter().zip(best.iter()).map(|(y, z)| y.max(*z)),
+            );
+
+            filter_series(
+                &self.coefficients,
+                self.half_window,
+                self.order,
+                0,
+                1.,
+                current,
+                None,
+                fit,
+            );
+            passes += 1;
+
+            let index: f64 = fit
+                .iter()
+                .zip(original.iter())
+                .zip(weights.iter())
+                .map(|((z, y), w)| (z - y).abs() * w)
+                .sum();
+
+            if passes > 1 && !(index < best_index) {
+                break;
+            }
+
+            best_index = index;
+            std::mem::swap(fit, best);
+        }
+
+        output.copy_from_slice(best);
+
+        Ok(passes)
+    }
+}
+
+/// Copy `y_input` into `filled` with missing values linearly interpolated
+/// between their valid neighbours, and held constant past the first and
+/// last valid value. Returns false if there is no valid value.
+fn fill_missing(
+    y_input: &[f64],
+    mask: Option<&[u8]>,
+    filled: &mut Vec<f64>,
+) -> bool {
+    filled.clear();
+
+    let mut previous: Option<usize> = None;
+
+    for (i, y) in y_input.iter().enumerate() {
+        if !is_valid(*y, mask, i) {
+            continue;
+        }
+
+        match previous {
+            None => filled.resize(i, *y),
+            Some(p) => {
+                let step = (y - y_input[p]) / (i - p) as f64;
+                filled.extend(
+                    (p + 1..i).map(|k| y_input[p] + step * (k - p) as f64),
+                );
+            }
+        }
+
+        filled.push(*y);
+        previous = Some(i);
+    }
+
+    match previous {
+        None => false,
+        Some(p) => {
+            filled.resize(y_input.len(), y_input[p]);
+            true
+        }
+    }
+}
+
+/// Reconstruct every series of a ragged batch, each in its own worker with
+/// every pass on the same buffers. The number of passes of each series is
+/// written to `iterations_ptr` unless it is null, and its `SeriesStatus` to
+/// `status_ptr` unless it is null.
+pub fn multiple_chens(
+    y_input_ptr: *mut f64,
+    mask_ptr: *mut u8,
+    input_indices_ptr: *mut usize,
+    input_indices_size: usize,
+    output_ptr: *mut f64,
+    data_length: usize,
+    iterations_ptr: *mut u64,
+    trend_window: i64,
+    trend_order: i64,
+    window_size: i64,
+    order: i64,
+    max_iterations: i64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    let pool = pool_for(n_threads);
+
+    let y_input: &mut [f64] = unsafe {
+        assert!(!y_input_ptr.is_null());
+        std::slice::from_raw_parts_mut(y_input_ptr, data_length)
+    };
+
+    let mask = unsafe { mask_from_raw(mask_ptr, data_length) };
+
+    let input_indices: &mut [usize] = unsafe {
+        assert!(!input_indices_ptr.is_null());
+        std::slice::from_raw_parts_mut(input_indices_ptr, input_indices_size)
+    };
+
+    let output: &mut [f64] = unsafe {
+        assert!(!output_ptr.is_null());
+        std::slice::from_raw_parts_mut(output_ptr, data_length)
+    };
+
+    let iterations = if iterations_ptr.is_null() {
+        None
+    } else {
+        Some(SharedMutSlice::new(unsafe {
+            std::slice::from_raw_parts_mut(iterations_ptr, input_indices_size)
+        }))
+    };
+
+    let statuses =
+        unsafe { StatusOutput::from_raw(status_ptr, input_indices_size) };
+
+    let filter = ChenFilter::new(
+        trend_window,
+        trend_order,
+        window_size,
+        order,
+        max_iterations,
+    );
+
+    let costs: Vec<f64> = (0..input_indices_size)
+        .map(|i| {
+            let (start, end) = series_range(input_indices, data_length, i);
+            (end - start) as f64
+        })
+        .collect();
+
+    let output = SharedMutSlice::new(output);
+
+    run_batch(&pool, &costs, chunk_size, |i| {
+        let (start, end) = series_range(input_indices, data_length, i);
+        count("points", (end - start) as u64);
+
+        // Every series owns a distinct range of the outputs.
+        let output_slice = unsafe { output.range_mut(start, end) };
+
+        let reconstructed = BUFFERS.with(|buffers| {
+            filter.reconstruct(
+                &y_input[start..end],
+                mask.map(|mask| &mask[start..end]),
+                &mut buffers.borrow_mut(),
+                output_slice,
+            )
+        });
+
+        let (passes, status) = match reconstructed {
+            Ok(passes) => (passes, SeriesStatus::Ok),
+            Err(status) => (0, status),
+        };
+
+        if let Some(iterations) = &iterations {
+            unsafe { iterations.range_mut(i, i + 1)[0] = passes as u64 };
+        }
+
+        unsafe { statuses.set(i, status) };
+    });
+}
+
+/// Reconstruct every series along `axis` of an N-dimensional array with any
+/// strides. A null mask pointer treats every finite value as valid.
+///
+/// Series that cannot be reconstructed are NaN as in `multiple_chens`, and
+/// the status of every series, in C order over the remaining axes, is
+/// written to `status_ptr` unless it is null.
+pub fn cube_chens(
+    y_input_ptr: *mut u8,
+    y_encoding: Encoding,
+    y_strides_ptr: *mut isize,
+    mask_ptr: *mut u8,
+    mask_strides_ptr: *mut isize,
+    output_ptr: *mut u8,
+    output_encoding: Encoding,
+    output_strides_ptr: *mut isize,
+    shape_ptr: *mut usize,
+    ndim: usize,
+    axis: usize,
+    trend_window: i64,
+    trend_order: i64,
+    window_size: i64,
+    order: i64,
+    max_iterations: i64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    let pool = pool_for(n_threads);
+
+    assert!(!y_input_ptr.is_null());
+    assert!(!output_ptr.is_null());
+
+    let y_layout =
+        unsafe { layout_from_raw(shape_ptr, y_strides_ptr, ndim, axis) };
+
+    let mask_layout = if mask_ptr.is_null() {
+        None
+    } else {
+        Some(unsafe {
+            layout_from_raw(shape_ptr, mask_strides_ptr, ndim, axis)
+        })
+    };
+
+    let output_layout =
+        unsafe { layout_from_raw(shape_ptr, output_strides_ptr, ndim, axis) };
+
+    let y_input = EncodedArray::new(y_input_ptr, y_encoding);
+    let mask_input = ArrayPtr(mask_ptr);
+    let output = EncodedArray::new(output_ptr, output_encoding);
+
+    let filter = ChenFilter::new(
+        trend_window,
+        trend_order,
+        window_size,
+        order,
+        max_iterations,
+    );
+
+    let series_length = y_layout.series_length();
+    let costs = vec![series_length as f64; y_layout.n_series()];
+    let statuses =
+        unsafe { StatusOutput::from_raw(status_ptr, y_layout.n_series()) };
+
+    run_batch(&pool, &costs, chunk_size, |series| {
+        with_series_buffers(|buffers| {
+            unsafe { y_input.gather(&y_layout, series, &mut buffers.input) };
+
+            let mask = match &mask_layout {
+                Some(layout) => {
+                    unsafe {
+                        layout.gather(mask_input.0, series, &mut buffers.mask)
+                    };
+                    Some(&buffers.mask[..])
+                }
+                None => None,
+            };
+
+            buffers.output.resize(series_length, 0_f64);
+
+            let input = &buffers.input;
+            let series_output = &mut buffers.output;
+
+            let reconstructed = BUFFERS.with(|chen| {
+                filter.reconstruct(
+                    input,
+                    mask,
+                    &mut chen.borrow_mut(),
+                    series_output,
+                )
+            });
+
+            let status = match reconstructed {
+                Ok(_) => SeriesStatus::Ok,
+                Err(status) => status,
+            };
+
+            // Every series is written by exactly one worker.
+            unsafe {
+                output.scatter(&output_layout, series, &buffers.output);
+                statuses.set(series, status);
+            }
+        })
+    });
+}
@@ -0,0 +1,74 @@
+//! Progress reporting and cancellation of batches run on behalf of another
+//! thread.
+//!
+//! A caller that wants to follow a batch attaches three `u64` counters to
+//! the thread it starts the batch from: the number of series completed, the
+//! number of series started so far, and a flag set to cancel. `run_batch`
+//! picks them up on that thread, so no batch function needs extra
+//! arguments. The caller reads the first two and writes the third while the
+//! batch runs, from any thread.
+
+use std::cell::Cell;
+use std::sync::atomic::{AtomicU64, Ordering};
+
+const COMPLETED: usize = 0;
+const TOTAL: usize = 1;
+const CANCELLED: usize = 2;
+
+/// Number of `u64` counters a control block holds.
+pub const CONTROL_SIZE: usize = 3;
+
+thread_local! {
+    // Counters of the batches started from this thread, null for none.
+    static CONTROL: Cell<*const AtomicU64> = Cell::new(std::ptr::null());
+}
+
+/// The counters of a batch, shared by its workers.
+#[derive(Clone, Copy)]
+pub struct BatchControl {
+    counters: *const AtomicU64,
+}
+
+unsafe impl Send for BatchControl {}
+unsafe impl Sync for BatchControl {}
+
+impl BatchControl {
+    fn counter(&self, index: usize) -> &AtomicU64 {
+        unsafe { &*self.counters.add(index) }
+    }
+
+    pub fn add_total(&self, series: u64) {
+        self.counter(TOTAL).fetch_add(series, Ordering::Relaxed);
+    }
+
+    pub fn add_completed(&self, series: u64) {
+        self.counter(COMPLETED).fetch_add(series, Ordering::Relaxed);
+    }
+
+    pub fn is_cancelled(&self) -> bool {
+        self.counter(CANCELLED).load(Ordering::Relaxed) != 0
+    }
+}
+
+/// Report the batches started from this thread into `counters`, or stop
+/// reporting if it is null.
+///
+/// # Safety
+///
+/// `counters` must point to `CONTROL_SIZE` aligned `u64` that stay valid
+/// until the next call on this thread, and are only accessed atomically by
+/// other threads meanwhile.
+pub unsafe fn attach_control(counters: *mut u64) {
+    CONTROL.with(|control| control.set(counters as *const AtomicU64));
+}
+
+/// The counters attached to this thread, if any.
+pub fn current_control() -> Option<BatchControl> {
+    let counters = CONTROL.with(|control| control.get());
+
+    if counters.is_null() {
+        None
+    } else {
+        Some(BatchControl { counters })
+    }
+}
@@ -0,0 +1,209 @@
+//! Arrays stored as float32 or as scaled 16-bit integers.
+//!
+//! Vegetation index archives are commonly int16 or uint16 with a scale
+//! factor and a nodata value. Rather than converting the whole array to
+//! float64 up front, the cube functions convert each series as a worker
+//! gathers it, and convert the results back as they are scattered.
+
+use crate::math_utils::real::Real;
+use crate::parallel::profile::{count, span};
+use crate::parallel::strided::StridedLayout;
+
+/// Element type of an array passed over the FFI.
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub enum Dtype {
+    F64,
+    F32,
+    I16,
+    U16,
+}
+
+/// How the stored values of an array map to the values smoothed: stored
+/// `s` stands for `s * scale + offset`, and `nodata` for a missing value.
+#[derive(Clone, Copy, Debug)]
+pub struct Encoding {
+    pub dtype: Dtype,
+    pub scale: f64,
+    pub offset: f64,
+    pub nodata: Option<f64>,
+}
+
+impl Encoding {
+    /// Plain float64 values.
+    pub fn f64() -> Encoding {
+        Encoding {
+            dtype: Dtype::F64,
+            scale: 1_f64,
+            offset: 0_f64,
+            nodata: None,
+        }
+    }
+
+    /// The encoding passed over the FFI, where `dtype` is 0 for float64, 1
+    /// for float32, 2 for int16 and 3 for uint16, and a NaN `nodata` means
+    /// there is none.
+    pub fn from_raw(
+        dtype: i64,
+        scale: f64,
+        offset: f64,
+        nodata: f64,
+    ) -> Encoding {
+        Encoding {
+            dtype: match dtype {
+                0 => Dtype::F64,
+                1 => Dtype::F32,
+                2 => Dtype::I16,
+                3 => Dtype::U16,
+                _ => panic!("Unknown dtype code {}.", dtype),
+            },
+            scale,
+            offset,
+            nodata: if nodata.is_nan() { None } else { Some(nodata) },
+        }
+    }
+
+    /// The value a stored one stands for, NaN for nodata.
+    #[inline]
+    pub fn decode(&self, stored: f64) -> f64 {
+        if self.nodata == Some(stored) {
+            f64::NAN
+        } else {
+            stored * self.scale + self.offset
+        }
+    }
+
+    /// The stored value for `value`. Integers are rounded and clamped to
+    /// their range, and missing values become nodata, or zero without one.
+    #[inline]
+    pub fn encode(&self, value: f64) -> f64 {
+        let stored = (value - self.offset) / self.scale;
+
+        let (low, high) = match self.dtype {
+            Dtype::F64 | Dtype::F32 => return stored,
+            Dtype::I16 => (i16::MIN as f64, i16::MAX as f64),
+            Dtype::U16 => (0_f64, u16::MAX as f64),
+        };
+
+        if !stored.is_finite() {
+            return self.nodata.unwrap_or(0_f64);
+        }
+
+        stored.round().max(low).min(high)
+    }
+}
+
+/// An array of any `Dtype`, read and written one series at a time.
+#[derive(Clone, Copy)]
+pub struct EncodedArray {
+    ptr: *mut u8,
+    encoding: Encoding,
+}
+
+unsafe impl Send for EncodedArray {}
+unsafe impl Sync for EncodedArray {}
+
+impl EncodedArray {
+    pub fn new(ptr: *mut u8, encoding: Encoding) -> EncodedArray {
+        assert!(!ptr.is_null());
+        EncodedArray { ptr, encoding }
+    }
+
+    /// Decode `series` into `values`.
+    ///
+    /// # Safety
+    ///
+    /// The array must have `layout`, with strides in its own elements.
+    pub unsafe fn gather<T: Real>(
+        &self,
+        layout: &StridedLayout,
+        series: usize,
+        values: &mut Vec<T>,
+    ) {
+        values.clear();
+        self.gather_append(layout, series, values);
+    }
+
+    /// Like `gather`, but appends `series` to the end of `values`.
+    ///
+    /// # Safety
+    ///
+    /// As for `gather`.
+    pub unsafe fn gather_append<T: Real>(
+        &self,
+        layout: &StridedLayout,
+        series: usize,
+        values: &mut Vec<T>,
+    ) {
+        let _span = span("gather");
+        let first = values.len();
+
+        let e = self.encoding;
+        let ptr = self.ptr;
+
+        match e.dtype {
+            Dtype::F64 => {
+                layout.gather_map(ptr as *const f64, series, values, |s| {
+                    T::from_f64(e.decode(s))
+                })
+            }
+            Dtype::F32 => {
+                layout.gather_map(ptr as *const f32, series, values, |s| {
+                    T::from_f64(e.decode(s as f64))
+                })
+            }
+            Dtype::I16 => {
+                layout.gather_map(ptr as *const i16, series, values, |s| {
+                    T::from_f64(e.decode(s as f64))
+                })
+            }
+            Dtype::U16 => {
+                layout.gather_map(ptr as *const u16, series, values, |s| {
+                    T::from_f64(e.decode(s as f64))
+                })
+            }
+        }
+
+        count("points", (values.len() - first) as u64);
+    }
+
+    /// Encode `values` into `series`.
+    ///
+    /// # Safety
+    ///
+    /// The array must be writable and have `layout`, and no other thread
+    /// may write the same series.
+    pub unsafe fn scatter<T: Real>(
+        &self,
+        layout: &StridedLayout,
+        series: usize,
+        values: &[T],
+    ) {
+        let _span = span("scatter");
+
+        let e = self.encoding;
+        let ptr = self.ptr;
+
+        match e.dtype {
+            Dtype::F64 => {
+                layout.scatter_map(ptr as *mut f64, series, values, |v| {
+                    e.encode(v.to_f64())
+                })
+            }
+            Dtype::F32 => {
+                layout.scatter_map(ptr as *mut f32, series, values, |v| {
+                    e.encode(v.to_f64()) as f32
+                })
+            }
+            Dtype::I16 => {
+                layout.scatter_map(ptr as *mut i16, series, values, |v| {
+                    e.encode(v.to_f64()) as i16
+                })
+            }
+            Dtype::U16 => {
+                layout.scatter_map(ptr as *mut u16, series, values, |v| {
+                    e.encode(v.to_f64()) as u16
+                })
+            }
+        }
+    }
+}
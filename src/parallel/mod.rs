@@ -0,0 +1,7 @@
+pub mod control;
+pub mod encoded;
+pub mod pool;
+pub mod profile;
+pub mod scheduler;
+pub mod status;
+pub mod strided;
@@ -0,0 +1,107 @@
+use crate::parallel::profile::span;
+
+use rayon::{ThreadPool, ThreadPoolBuilder};
+use std::sync::{Arc, Mutex};
+
+/// Environment variable read when the shared pool is first built.
+pub const NUM_THREADS_ENV: &str = "EOKIT_NUM_THREADS";
+
+static GLOBAL_POOL: Mutex<Option<Arc<ThreadPool>>> = Mutex::new(None);
+
+// The pool built for the last explicit per-call n_threads that differs from
+// the global size. Kept alive so repeated calls with the same size do not
+// respawn threads, and replaced when another size is asked for, so a sweep
+// over sizes does not leave idle threads behind.
+static SIZED_POOL: Mutex<Option<Arc<ThreadPool>>> = Mutex::new(None);
+
+fn default_num_threads() -> usize {
+    std::env::var(NUM_THREADS_ENV)
+        .ok()
+        .and_then(|value| value.trim().parse::<usize>().ok())
+        .filter(|n| *n > 0)
+        .unwrap_or_else(|| {
+            std::thread::available_parallelism()
+                .map(|n| n.get())
+                .unwrap_or(1)
+        })
+}
+
+fn build_pool(n_threads: usize) -> Arc<ThreadPool> {
+    let _span = span("pool_setup");
+
+    Arc::new(
+        ThreadPoolBuilder::new()
+            .num_threads(n_threads)
+            .thread_name(|i| format!("eokit-worker-{}", i))
+            .build()
+            .unwrap_or_else(|e| {
+                panic!(
+                    "Could not build worker pool with {} threads: {}",
+                    n_threads, e
+                )
+            }),
+    )
+}
+
+/// The process-wide work-stealing pool, built lazily on first use.
+pub fn global_pool() -> Arc<ThreadPool> {
+    let mut pool = GLOBAL_POOL.lock().unwrap();
+    pool.get_or_insert_with(|| build_pool(default_num_threads()))
+        .clone()
+}
+
+/// Resize the shared pool. Values below 1 restore the default size, which
+/// is taken from `EOKIT_NUM_THREADS` or the number of logical cores.
+pub fn set_num_threads(n_threads: i64) {
+    let n_threads = if n_threads > 0 {
+        n_threads as usize
+    } else {
+        default_num_threads()
+    };
+
+    let mut pool = GLOBAL_POOL.lock().unwrap();
+
+    let needs_rebuild = match pool.as_ref() {
+        Some(current) => current.current_num_threads() != n_threads,
+        None => true,
+    };
+
+    // Work already running on the old pool keeps it alive until finished.
+    if needs_rebuild {
+        *pool = Some(build_pool(n_threads));
+    }
+
+    // A sized pool is only worth keeping while it differs from the shared
+    // one, and the next call with its size rebuilds it if need be.
+    *SIZED_POOL.lock().unwrap() = None;
+}
+
+pub fn get_num_threads() -> usize {
+    global_pool().current_num_threads()
+}
+
+/// Pool to run a batch on. Negative or zero `n_threads` means the shared
+/// pool, anything else reuses the cached pool of that size, or replaces it
+/// with one of exactly that size.
+pub fn pool_for(n_threads: i64) -> Arc<ThreadPool> {
+    let global = global_pool();
+
+    if n_threads < 1 || n_threads as usize == global.current_num_threads() {
+        return global;
+    }
+
+    let n_threads = n_threads as usize;
+
+    let mut sized = SIZED_POOL.lock().unwrap();
+
+    match sized.as_ref() {
+        Some(pool) if pool.current_num_threads() == n_threads => pool.clone(),
+        _ => {
+            // Batches still running on the previous pool keep it alive, and
+            // its threads exit once they finish.
+            let pool = build_pool(n_threads);
+            *sized = Some(pool.clone());
+            pool
+        }
+    }
+}
@@ -0,0 +1,327 @@
+//! Opt-in timers and counters of the native work.
+//!
+//! Every thread that records anything gets its own record, registered once
+//! in a global list, so the workers never contend with each other. Stages
+//! are timed by `span`, which returns a guard that records the time until
+//! it is dropped. A span nested in one of the same stage on the same thread
+//! is not timed again, so for instance the triangular solves inside a
+//! Cholesky solve are not counted twice.
+//!
+//! While profiling is off every `span` and `count` is a single relaxed
+//! atomic load. At `Level::Trace` every span is also kept as an event for
+//! a trace of the run, up to `MAX_EVENTS` per thread.
+
+use std::alloc::{GlobalAlloc, Layout, System};
+use std::cell::RefCell;
+use std::collections::BTreeMap;
+use std::fmt::Write;
+use std::sync::atomic::{AtomicU64, AtomicU8, Ordering};
+use std::sync::{Arc, Mutex};
+use std::time::Instant;
+
+/// Events kept per thread at `Level::Trace`, later ones are dropped.
+pub const MAX_EVENTS: usize = 1 << 18;
+
+#[derive(Clone, Copy, Debug, PartialEq, PartialOrd)]
+pub enum Level {
+    Off,
+    Stats,
+    Trace,
+}
+
+static LEVEL: AtomicU8 = AtomicU8::new(0);
+static ALLOCATIONS: AtomicU64 = AtomicU64::new(0);
+static EPOCH: Mutex<Option<Instant>> = Mutex::new(None);
+static THREADS: Mutex<Vec<Arc<Mutex<ThreadRecord>>>> = Mutex::new(Vec::new());
+
+thread_local! {
+    static LOCAL: RefCell<Option<LocalRecord>> = RefCell::new(None);
+}
+
+/// The system allocator, counting allocations while profiling is on. It is
+/// the global allocator of the Python extension, built with the
+/// `count-allocations` feature, and otherwise the allocation count stays 0.
+pub struct CountingAllocator;
+
+unsafe impl GlobalAlloc for CountingAllocator {
+    unsafe fn alloc(&self, layout: Layout) -> *mut u8 {
+        if LEVEL.load(Ordering::Relaxed) != 0 {
+            ALLOCATIONS.fetch_add(1, Ordering::Relaxed);
+        }
+        System.alloc(layout)
+    }
+
+    unsafe fn dealloc(&self, ptr: *mut u8, layout: Layout) {
+        System.dealloc(ptr, layout)
+    }
+
+    unsafe fn realloc(
+        &self,
+        ptr: *mut u8,
+        layout: Layout,
+        new_size: usize,
+    ) -> *mut u8 {
+        if LEVEL.load(Ordering::Relaxed) != 0 {
+            ALLOCATIONS.fetch_add(1, Ordering::Relaxed);
+        }
+        System.realloc(ptr, layout, new_size)
+    }
+}
+
+#[derive(Default)]
+struct StageTotals {
+    calls: u64,
+    nanos: u64,
+}
+
+struct Event {
+    stage: &'static str,
+    start: u64,
+    duration: u64,
+}
+
+struct ThreadRecord {
+    name: String,
+    epoch: Instant,
+    stages: BTreeMap<&'static str, StageTotals>,
+    counters: BTreeMap<&'static str, u64>,
+    events: Vec<Event>,
+    dropped_events: u64,
+}
+
+struct LocalRecord {
+    shared: Arc<Mutex<ThreadRecord>>,
+    active: Vec<&'static str>,
+}
+
+fn level() -> Level {
+    match LEVEL.load(Ordering::Relaxed) {
+        0 => Level::Off,
+        1 => Level::Stats,
+        _ => Level::Trace,
+    }
+}
+
+/// Turn profiling on or off. Turning it on from off starts a new run, so
+/// everything recorded before is cleared.
+pub fn set_level(new_level: Level) {
+    if level() == Level::Off && new_level != Level::Off {
+        reset();
+    }
+
+    LEVEL.store(new_level as u8, Ordering::Relaxed);
+}
+
+/// Clear every timer, counter and event, and restart the trace clock. The
+/// records of threads that have exited, such as the workers of a replaced
+/// pool, are dropped.
+pub fn reset() {
+    let epoch = Instant::now();
+    *EPOCH.lock().unwrap() = Some(epoch);
+    ALLOCATIONS.store(0, Ordering::Relaxed);
+
+    let mut threads = THREADS.lock().unwrap();
+
+    // A live thread holds a second reference in its thread local.
+    threads.retain(|record| Arc::strong_count(record) > 1);
+
+    for record in threads.iter() {
+        let mut record = record.lock().unwrap();
+        record.epoch = epoch;
+        record.stages.clear();
+        record.counters.clear();
+        record.events.clear();
+        record.dropped_events = 0;
+    }
+}
+
+/// Run `f` on this thread's record, creating and registering it first if
+/// need be.
+fn with_local<F: FnOnce(&mut LocalRecord)>(f: F) {
+    LOCAL.with(|local| {
+        let mut local = local.borrow_mut();
+
+        let local = local.get_or_insert_with(|| {
+            let thread = std::thread::current();
+            let name = match thread.name() {
+                Some(name) => name.to_string(),
+                None => format!("{:?}", thread.id()),
+            };
+
+            let epoch = EPOCH.lock().unwrap().unwrap_or_else(Instant::now);
+
+            let shared = Arc::new(Mutex::new(ThreadRecord {
+                name: name.replace('\\', "\\\\").replace('"', "\\\""),
+                epoch,
+                stages: BTreeMap::new(),
+                counters: BTreeMap::new(),
+                events: Vec::new(),
+                dropped_events: 0,
+            }));
+            THREADS.lock().unwrap().push(shared.clone());
+
+            LocalRecord {
+                shared,
+                active: Vec::new(),
+            }
+        });
+
+        f(local)
+    });
+}
+
+/// Times a stage until dropped.
+pub struct Span {
+    stage: &'static str,
+    start: Option<Instant>,
+}
+
+/// Start timing `stage` on this thread.
+#[inline]
+pub fn span(stage: &'static str) -> Span {
+    if LEVEL.load(Ordering::Relaxed) == 0 {
+        return Span { stage, start: None };
+    }
+
+    let mut entered = false;
+
+    with_local(|local| {
+        if !local.active.contains(&stage) {
+            local.active.push(stage);
+            entered = true;
+        }
+    });
+
+    Span {
+        stage,
+        start: if entered { Some(Instant::now()) } else { None },
+    }
+}
+
+impl Drop for Span {
+    fn drop(&mut self) {
+        let start = match self.start {
+            Some(start) => start,
+            None => return,
+        };
+
+        let duration = start.elapsed().as_nanos() as u64;
+        let trace = level() == Level::Trace;
+        let stage = self.stage;
+
+        with_local(|local| {
+            local.active.retain(|active| *active != stage);
+
+            let mut record = local.shared.lock().unwrap();
+            let totals = record.stages.entry(stage).or_default();
+            totals.calls += 1;
+            totals.nanos += duration;
+
+            if trace {
+                if record.events.len() < MAX_EVENTS {
+                    let since = start.saturating_duration_since(record.epoch);
+                    record.events.push(Event {
+                        stage,
+                        start: since.as_nanos() as u64,
+                        duration,
+                    });
+                } else {
+                    record.dropped_events += 1;
+                }
+            }
+        });
+    }
+}
+
+/// Add `amount` to `counter` on this thread.
+#[inline]
+pub fn count(counter: &'static str, amount: u64) {
+    if LEVEL.load(Ordering::Relaxed) == 0 {
+        return;
+    }
+
+    with_local(|local| {
+        *local
+            .shared
+            .lock()
+            .unwrap()
+            .counters
+            .entry(counter)
+            .or_insert(0) += amount;
+    });
+}
+
+/// Everything recorded, as JSON: the allocation count, which includes the
+/// profiler's own and is 0 without the `count-allocations` feature, and for
+/// every thread its name, the calls and seconds of each stage, its counters
+/// and, with `events`, its trace events as `[stage, start µs, duration µs]`
+/// since the last reset.
+pub fn report(events: bool) -> String {
+    let mut json = String::new();
+
+    write!(
+        json,
+        "{{\"level\":{},\"allocations\":{},\"threads\":[",
+        LEVEL.load(Ordering::Relaxed),
+        ALLOCATIONS.load(Ordering::Relaxed)
+    )
+    .unwrap();
+
+    for (i, record) in THREADS.lock().unwrap().iter().enumerate() {
+        let record = record.lock().unwrap();
+
+        if i > 0 {
+            json.push(',');
+        }
+
+        write!(json, "{{\"name\":\"{}\",\"stages\":{{", record.name).unwrap();
+        for (k, (stage, totals)) in record.stages.iter().enumerate() {
+            write!(
+                json,
+                "{}\"{}\":{{\"calls\":{},\"seconds\":{:e}}}",
+                if k > 0 { "," } else { "" },
+                stage,
+                totals.calls,
+                totals.nanos as f64 * 1e-9
+            )
+            .unwrap();
+        }
+
+        json.push_str("},\"counters\":{");
+        for (k, (counter, value)) in record.counters.iter().enumerate() {
+            write!(
+                json,
+                "{}\"{}\":{}",
+                if k > 0 { "," } else { "" },
+                counter,
+                value
+            )
+            .unwrap();
+        }
+
+        write!(
+            json,
+            "}},\"dropped_events\":{},\"events\":[",
+            record.dropped_events
+        )
+        .unwrap();
+        if events {
+            for (k, event) in record.events.iter().enumerate() {
+                write!(
+                    json,
+                    "{}[\"{}\",{:.3},{:.3}]",
+                    if k > 0 { "," } else { "" },
+                    event.stage,
+                    event.start as f64 * 1e-3,
+                    event.duration as f64 * 1e-3
+                )
+                .unwrap();
+            }
+        }
+        json.push_str("]}");
+    }
+
+    json.push_str("]}");
+
+    json
+}
@@ -0,0 +1,201 @@
+use crate::parallel::control::current_control;
+use crate::parallel::profile::{count, span};
+
+use rayon::ThreadPool;
+
+use std::marker::PhantomData;
+use std::sync::atomic::{AtomicUsize, Ordering};
+
+// With automatic chunking, aim for this many chunks per worker so the
+// cheap tail of the batch can still be balanced between threads.
+const CHUNKS_PER_WORKER: usize = 16;
+
+/// Bounds of series `i` in a concatenated buffer described by the start
+/// index of every series. The final series runs to the end of the buffer.
+pub fn series_range(
+    start_indices: &[usize],
+    total_length: usize,
+    i: usize,
+) -> (usize, usize) {
+    if i + 1_usize >= start_indices.len() {
+        (start_indices[i], total_length)
+    } else {
+        (start_indices[i], start_indices[i + 1])
+    }
+}
+
+/// Order in which series are processed, cut into chunks. Series are sorted
+/// by decreasing estimated cost so the most expensive work starts first and
+/// the cheap series fill in the gaps at the end of the batch.
+pub struct Schedule {
+    order: Vec<usize>,
+    bounds: Vec<usize>,
+}
+
+impl Schedule {
+    /// `chunk_size` is the number of series per chunk. Values below 1 pick
+    /// chunks of roughly equal cost, `CHUNKS_PER_WORKER` per worker.
+    pub fn new(costs: &[f64], n_workers: usize, chunk_size: i64) -> Schedule {
+        let mut order: Vec<usize> = (0..costs.len()).collect();
+
+        // Stable, so equally costed series keep their memory order.
+        order.sort_by(|a, b| {
+            costs[*b]
+                .partial_cmp(&costs[*a])
+                .unwrap_or(std::cmp::Ordering::Equal)
+        });
+
+        let mut bounds = vec![0];
+
+        if chunk_size > 0 {
+            let mut end = chunk_size as usize;
+            while end < order.len() {
+                bounds.push(end);
+                end += chunk_size as usize;
+            }
+        } else {
+            let total_cost: f64 = costs.iter().sum();
+            let target_cost = total_cost
+                / (std::cmp::max(n_workers, 1) * CHUNKS_PER_WORKER) as f64;
+
+            let mut chunk_cost = 0_f64;
+            for (position, series) in order.iter().enumerate() {
+                chunk_cost += costs[*series];
+                if chunk_cost >= target_cost && position + 1 < order.len() {
+                    bounds.push(position + 1);
+                    chunk_cost = 0_f64;
+                }
+            }
+        }
+
+        bounds.push(order.len());
+
+        Schedule { order, bounds }
+    }
+
+    pub fn n_chunks(&self) -> usize {
+        self.bounds.len() - 1
+    }
+
+    pub fn chunk(&self, chunk: usize) -> &[usize] {
+        &self.order[self.bounds[chunk]..self.bounds[chunk + 1]]
+    }
+}
+
+/// Run `work` once for every series on `pool`.
+///
+/// Each worker repeatedly claims the next chunk of the cost-sorted schedule,
+/// so there is one task per worker rather than one per series.
+pub fn run_batch<F>(pool: &ThreadPool, costs: &[f64], chunk_size: i64, work: F)
+where
+    F: Fn(usize) + Sync,
+{
+    run_batch_counted(pool, costs, chunk_size, |_| 1, work);
+}
+
+/// Like `run_batch`, for work items that each handle `series(i)` series,
+/// such as blocks of series predicted together.
+///
+/// With counters attached to the calling thread, see `control`, the number
+/// of series is added to the total up front and to the completed count as
+/// each item finishes. Once cancelled, the items not yet started are
+/// skipped and their outputs are left as they were.
+pub fn run_batch_counted<F, S>(
+    pool: &ThreadPool,
+    costs: &[f64],
+    chunk_size: i64,
+    series: S,
+    work: F,
+) where
+    F: Fn(usize) + Sync,
+    S: Fn(usize) -> u64 + Sync,
+{
+    if costs.is_empty() {
+        return;
+    }
+
+    let control = current_control();
+
+    if let Some(control) = &control {
+        control.add_total((0..costs.len()).map(&series).sum());
+    }
+
+    let work = |i: usize| {
+        match &control {
+            Some(control) => {
+                if control.is_cancelled() {
+                    return;
+                }
+                work(i);
+                control.add_completed(series(i));
+            }
+            None => work(i),
+        }
+        count("series", series(i));
+    };
+
+    let n_workers = pool.current_num_threads();
+    let schedule = {
+        let _span = span("schedule");
+        Schedule::new(costs, n_workers, chunk_size)
+    };
+    let n_chunks = schedule.n_chunks();
+
+    if n_chunks == 1 {
+        let _busy = span("busy");
+        schedule.chunk(0).iter().for_each(|series| work(*series));
+        return;
+    }
+
+    let next_chunk = AtomicUsize::new(0);
+
+    // Busy time of a worker runs from its first chunk to finding none left.
+    let run_worker = || {
+        let _busy = span("busy");
+        loop {
+            let chunk = next_chunk.fetch_add(1, Ordering::Relaxed);
+            if chunk >= n_chunks {
+                break;
+            }
+            schedule
+                .chunk(chunk)
+                .iter()
+                .for_each(|series| work(*series));
+        }
+    };
+
+    pool.scope(|s| {
+        for _ in 0..std::cmp::min(n_workers, n_chunks) {
+            s.spawn(|_| run_worker());
+        }
+    });
+}
+
+/// Output buffer shared between workers that each write to their own,
+/// non-overlapping range.
+pub struct SharedMutSlice<'a, T> {
+    ptr: *mut T,
+    len: usize,
+    _marker: PhantomData<&'a mut [T]>,
+}
+
+unsafe impl<'a, T: Send> Send for SharedMutSlice<'a, T> {}
+unsafe impl<'a, T: Send> Sync for SharedMutSlice<'a, T> {}
+
+impl<'a, T> SharedMutSlice<'a, T> {
+    pub fn new(slice: &'a mut [T]) -> SharedMutSlice<'a, T> {
+        SharedMutSlice {
+            ptr: slice.as_mut_ptr(),
+            len: slice.len(),
+            _marker: PhantomData,
+        }
+    }
+
+    /// # Safety
+    ///
+    /// No two live slices returned by this function may overlap.
+    pub unsafe fn range_mut(&self, start: usize, end: usize) -> &'a mut [T] {
+        assert!(start <= end && end <= self.len);
+        std::slice::from_raw_parts_mut(self.ptr.add(start), end - start)
+    }
+}
@@ -0,0 +1,74 @@
+//! Outcome of every series of a batch.
+//!
+//! A series that cannot be processed, because it is too short, has nothing
+//! valid to fit or its system cannot be factorised, is filled with NaN and
+//! given a status code, and the rest of the batch carries on. The codes are
+//! written to an optional array of one `u8` per series.
+
+use crate::parallel::scheduler::SharedMutSlice;
+
+#[derive(Clone, Copy, Debug, PartialEq, Eq)]
+pub enum SeriesStatus {
+    Ok = 0,
+    /// Fewer values than the method needs.
+    TooShort = 1,
+    /// No valid value to fit, or non-finite x values.
+    NonFinite = 2,
+    /// The system of the series could not be factorised.
+    SolverFailure = 3,
+}
+
+impl SeriesStatus {
+    /// The status written as `code`, with unknown codes taken as failures
+    /// of the solver.
+    pub fn from_code(code: u8) -> SeriesStatus {
+        match code {
+            0 => SeriesStatus::Ok,
+            1 => SeriesStatus::TooShort,
+            2 => SeriesStatus::NonFinite,
+            _ => SeriesStatus::SolverFailure,
+        }
+    }
+}
+
+/// Where the status of every series of a batch goes, if anywhere.
+pub struct StatusOutput<'a> {
+    statuses: Option<SharedMutSlice<'a, u8>>,
+}
+
+impl<'a> StatusOutput<'a> {
+    /// Statuses that are not kept.
+    pub fn none() -> StatusOutput<'a> {
+        StatusOutput { statuses: None }
+    }
+
+    /// Statuses written to `status_ptr`, or not kept if it is null.
+    ///
+    /// # Safety
+    ///
+    /// A non-null `status_ptr` must point to `n_series` values that outlive
+    /// the returned output.
+    pub unsafe fn from_raw(
+        status_ptr: *mut u8,
+        n_series: usize,
+    ) -> StatusOutput<'a> {
+        if status_ptr.is_null() {
+            StatusOutput::none()
+        } else {
+            StatusOutput {
+                statuses: Some(SharedMutSlice::new(
+                    std::slice::from_raw_parts_mut(status_ptr, n_series),
+                )),
+            }
+        }
+    }
+
+    /// # Safety
+    ///
+    /// No other thread may set the status of `series` at the same time.
+    pub unsafe fn set(&self, series: usize, status: SeriesStatus) {
+        if let Some(statuses) = &self.statuses {
+            statuses.range_mut(series, series + 1)[0] = status as u8;
+        }
+    }
+}
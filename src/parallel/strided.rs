@@ -0,0 +1,229 @@
+use std::cell::RefCell;
+
+/// An N-dimensional array viewed as a batch of 1D series along `axis`.
+///
+/// Strides are in elements and may be zero or negative, so broadcast and
+/// reversed NumPy views can be used without a copy.
+pub struct StridedLayout {
+    series_length: usize,
+    step: isize,
+    outer_shape: Vec<usize>,
+    outer_strides: Vec<isize>,
+}
+
+impl StridedLayout {
+    pub fn new(
+        shape: &[usize],
+        strides: &[isize],
+        axis: usize,
+    ) -> StridedLayout {
+        assert_eq!(shape.len(), strides.len());
+        assert!(axis < shape.len(), "Axis is out of range.");
+
+        let (outer_shape, outer_strides) = shape
+            .iter()
+            .zip(strides)
+            .enumerate()
+            .filter(|(dim, _)| *dim != axis)
+            .map(|(_, (size, stride))| (*size, *stride))
+            .unzip();
+
+        StridedLayout {
+            series_length: shape[axis],
+            step: strides[axis],
+            outer_shape,
+            outer_strides,
+        }
+    }
+
+    /// Same layout with a different length along the series axis, for
+    /// outputs that extend each series.
+    pub fn with_series_length(
+        mut self,
+        series_length: usize,
+    ) -> StridedLayout {
+        self.series_length = series_length;
+        self
+    }
+
+    pub fn n_series(&self) -> usize {
+        self.outer_shape.iter().product()
+    }
+
+    pub fn series_length(&self) -> usize {
+        self.series_length
+    }
+
+    /// Element offset of the first value of `series`, counting series in C
+    /// order over the remaining axes.
+    pub fn series_offset(&self, series: usize) -> isize {
+        let mut remainder = series;
+        let mut offset = 0_isize;
+
+        for (size, stride) in
+            self.outer_shape.iter().zip(&self.outer_strides).rev()
+        {
+            offset += (remainder % size) as isize * stride;
+            remainder /= size;
+        }
+
+        offset
+    }
+
+    /// Copy `series` out of the array starting at `ptr`.
+    ///
+    /// # Safety
+    ///
+    /// `ptr` must point to the first element of an array with this layout.
+    pub unsafe fn gather<T: Copy>(
+        &self,
+        ptr: *const T,
+        series: usize,
+        values: &mut Vec<T>,
+    ) {
+        values.clear();
+        self.gather_append(ptr, series, values);
+    }
+
+    /// Like `gather`, but appends `series` to the end of `values`.
+    ///
+    /// # Safety
+    ///
+    /// `ptr` must point to the first element of an array with this layout.
+    pub unsafe fn gather_append<T: Copy>(
+        &self,
+        ptr: *const T,
+        series: usize,
+        values: &mut Vec<T>,
+    ) {
+        let offset = self.series_offset(series);
+
+        values.extend(
+            (0..self.series_length)
+                .map(|i| *ptr.offset(offset + i as isize * self.step)),
+        );
+    }
+
+    /// Like `gather_append`, but converts every value with `convert`.
+    ///
+    /// # Safety
+    ///
+    /// `ptr` must point to the first element of an array with this layout.
+    pub unsafe fn gather_map<S: Copy, T>(
+        &self,
+        ptr: *const S,
+        series: usize,
+        values: &mut Vec<T>,
+        convert: impl Fn(S) -> T,
+    ) {
+        let offset = self.series_offset(series);
+
+        values.extend(
+            (0..self.series_length).map(|i| {
+                convert(*ptr.offset(offset + i as isize * self.step))
+            }),
+        );
+    }
+
+    /// Like `scatter`, but converts every value with `convert`.
+    ///
+    /// # Safety
+    ///
+    /// As for `scatter`.
+    pub unsafe fn scatter_map<S, T: Copy>(
+        &self,
+        ptr: *mut S,
+        series: usize,
+        values: &[T],
+        convert: impl Fn(T) -> S,
+    ) {
+        assert_eq!(values.len(), self.series_length);
+
+        let offset = self.series_offset(series);
+
+        for (i, value) in values.iter().enumerate() {
+            *ptr.offset(offset + i as isize * self.step) = convert(*value);
+        }
+    }
+
+    /// Write `values` into `series` of the array starting at `ptr`.
+    ///
+    /// # Safety
+    ///
+    /// `ptr` must point to the first element of a writable array with this
+    /// layout, and no other thread may write the same series.
+    pub unsafe fn scatter<T: Copy>(
+        &self,
+        ptr: *mut T,
+        series: usize,
+        values: &[T],
+    ) {
+        assert_eq!(values.len(), self.series_length);
+
+        let offset = self.series_offset(series);
+
+        for (i, value) in values.iter().enumerate() {
+            *ptr.offset(offset + i as isize * self.step) = *value;
+        }
+    }
+}
+
+/// Raw pointer to an array that workers read from or write to by series.
+pub struct ArrayPtr<T = f64>(pub *mut T);
+
+impl<T> Clone for ArrayPtr<T> {
+    fn clone(&self) -> Self {
+        *self
+    }
+}
+
+impl<T> Copy for ArrayPtr<T> {}
+
+unsafe impl<T> Send for ArrayPtr<T> {}
+unsafe impl<T> Sync for ArrayPtr<T> {}
+
+/// Per-thread buffers for one gathered input series, its weights, its
+/// validity mask and the result, reused across the series a worker handles.
+pub struct SeriesBuffers {
+    pub input: Vec<f64>,
+    pub weights: Vec<f64>,
+    pub mask: Vec<u8>,
+    pub output: Vec<f64>,
+}
+
+thread_local! {
+    static SERIES_BUFFERS: RefCell<SeriesBuffers> =
+        RefCell::new(SeriesBuffers {
+            input: Vec::new(),
+            weights: Vec::new(),
+            mask: Vec::new(),
+            output: Vec::new(),
+        });
+}
+
+pub fn with_series_buffers<F, R>(f: F) -> R
+where
+    F: FnOnce(&mut SeriesBuffers) -> R,
+{
+    SERIES_BUFFERS.with(|buffers| f(&mut buffers.borrow_mut()))
+}
+
+/// Layout of an array whose shape and strides were passed over the FFI.
+///
+/// # Safety
+///
+/// `shape_ptr` and `strides_ptr` must each point to `ndim` values.
+pub unsafe fn layout_from_raw(
+    shape_ptr: *const usize,
+    strides_ptr: *const isize,
+    ndim: usize,
+    axis: usize,
+) -> StridedLayout {
+    assert!(!shape_ptr.is_null() && !strides_ptr.is_null());
+
+    StridedLayout::new(
+        std::slice::from_raw_parts(shape_ptr, ndim),
+        std::slice::from_raw_parts(strides_ptr, ndim),
+        axis,
+    )
+}
@@ -0,0 +1,369 @@
+//! Several smoothers run back to back on each series in one pass.
+//!
+//! Each series goes through every stage inside the worker task that owns
+//! it, from one per-thread buffer to the next, so the intermediate results
+//! are never gathered into batch sized arrays. Only the stages whose output
+//! is asked for are written out.
+
+use crate::gaussian_processes::engine::{GpScalar, RbfKernel};
+use crate::gaussian_processes::gp::fit_series;
+use crate::math_utils::banded::SymBandMatrix;
+use crate::math_utils::missing::mask_from_raw;
+use crate::parallel::pool::pool_for;
+use crate::parallel::profile::count;
+use crate::parallel::scheduler::{run_batch, series_range, SharedMutSlice};
+use crate::parallel::status::{SeriesStatus, StatusOutput};
+use crate::smoothers::sav_golay::{
+    half_window, sav_golay_coefficients, try_filter_series,
+};
+use crate::smoothers::whittaker::{check_series, smooth_series};
+
+use std::cell::RefCell;
+use std::sync::Arc;
+
+/// Number of parameters of each stage passed over the FFI, unused ones
+/// being ignored.
+pub const STAGE_PARAMETERS: usize = 6;
+
+thread_local! {
+    // Input and output of the stage being run, reused by every series a
+    // worker thread handles.
+    static BUFFERS: RefCell<PipelineBuffers> =
+        RefCell::new(PipelineBuffers::default());
+}
+
+/// One step of a pipeline.
+pub enum Stage {
+    /// `smooth_series` with unit weights, on the x values if there are any.
+    Whittaker { lambda: f64, d: usize },
+    /// A Savitzky-Golay filter, see `filter_series`.
+    SavGolay {
+        coefficients: Arc<Vec<f64>>,
+        half_window: usize,
+        order: usize,
+        deriv: usize,
+        delta: f64,
+    },
+    /// The posterior mean of an RBF kernel GP at the x values and at
+    /// `forecast_amount` points after the last one, see `fit_series`. Only
+    /// allowed as the last stage.
+    Gp {
+        kernel: RbfKernel<f64>,
+        noise: f64,
+        forecast_spacing: i64,
+        forecast_amount: usize,
+        inducing_points: usize,
+    },
+}
+
+impl Stage {
+    /// Decode stage `kind` from its parameters: 0 is a Whittaker of
+    /// `[lambda, d]`, 1 a Savitzky-Golay filter of `[window_size, order,
+    /// deriv, delta]` and 2 a GP of `[length_scale, amplitude, noise,
+    /// forecast_spacing, forecast_amount, inducing_points]`.
+    pub fn from_parameters(kind: i64, parameters: &[f64]) -> Stage {
+        let p = parameters;
+        match kind {
+            0 => Stage::Whittaker {
+                lambda: p[0],
+                d: p[1] as usize,
+            },
+            1 => Stage::SavGolay {
+                coefficients: sav_golay_coefficients(
+                    p[0] as i64,
+                    p[1] as i64,
+                    p[2] as i64,
+                    p[3],
+                ),
+                half_window: half_window(p[0] as i64),
+                order: p[1] as usize,
+                deriv: p[2] as usize,
+                delta: p[3],
+            },
+            2 => Stage::Gp {
+                kernel: RbfKernel::new(p[0], p[1]),
+                noise: p[2],
+                forecast_spacing: p[3] as i64,
+                forecast_amount: p[4] as usize,
+                inducing_points: p[5].max(0_f64) as usize,
+            },
+            _ => panic!("Unknown pipeline stage {}.", kind),
+        }
+    }
+
+    /// Number of values added to the end of each series.
+    pub fn extension(&self) -> usize {
+        match self {
+            Stage::Gp {
+                forecast_amount, ..
+            } => *forecast_amount,
+            _ => 0,
+        }
+    }
+
+    /// Run the stage on one series and return its status. `x_input` holds
+    /// its x values, and `mask` the validity of `y_input` when it is the
+    /// raw data. A series the stage cannot process is all NaN.
+    pub fn run(
+        &self,
+        x_input: &[f64],
+        irregular: bool,
+        y_input: &[f64],
+        mask: Option<&[u8]>,
+        buffers: &mut PipelineBuffers,
+        output: &mut [f64],
+    ) -> SeriesStatus {
+        match self {
+            Stage::Whittaker { lambda, d } => {
+                buffers.weights.clear();
+                buffers.weights.resize(y_input.len(), 1_f64);
+                let x = if irregular { Some(x_input) } else { None };
+
+                let status =
+                    match check_series(x, y_input, &buffers.weights, mask, *d)
+                    {
+                        SeriesStatus::Ok => match smooth_series(
+                            x,
+                            y_input,
+                            &buffers.weights,
+                            mask,
+                            *lambda,
+                            *d,
+                            &mut buffers.system,
+                            output,
+                        ) {
+                            Ok(()) => SeriesStatus::Ok,
+                            Err(_) => SeriesStatus::SolverFailure,
+                        },
+                        status => status,
+                    };
+
+                if status != SeriesStatus::Ok {
+                    output.iter_mut().for_each(|out| *out = f64::NAN);
+                }
+
+                status
+            }
+            Stage::SavGolay {
+                coefficients,
+                half_window,
+                order,
+                deriv,
+                delta,
+            } => try_filter_series(
+                coefficients,
+                *half_window,
+                *order,
+                *deriv,
+                *delta,
+                y_input,
+                mask,
+                output,
+            ),
+            Stage::Gp {
+                kernel,
+                noise,
+                forecast_spacing,
+                inducing_points,
+                ..
+            } => f64::with_buffers(|gp| {
+                fit_series(
+                    x_input,
+                    y_input,
+                    mask,
+                    *forecast_spacing,
+                    *kernel,
+                    *noise,
+                    *inducing_points,
+                    None,
+                    0,
+                    &mut gp.workspace,
+                    output,
+                )
+            }),
+        }
+    }
+}
+
+/// Per-thread buffers of a pipeline.
+#[derive(Default)]
+pub struct PipelineBuffers {
+    current: Vec<f64>,
+    next: Vec<f64>,
+    x: Vec<f64>,
+    weights: Vec<f64>,
+    system: SymBandMatrix,
+}
+
+/// Run the `n_stages` stages of `stage_kinds_ptr`, with `STAGE_PARAMETERS`
+/// parameters each at `stage_parameters_ptr`, on every series of a ragged
+/// batch, see `Stage::from_parameters`.
+///
+/// Stage `k` writes its results to `outputs_ptr[k]` unless that is null,
+/// laid out like the input, except that a GP stage adds its forecasts
+/// after each series as `multiple_gps` does. A null `x_input_ptr` uses the
+/// index of each value within its series as x, which the Whittaker then
+/// treats as evenly spaced. Missing values of the input, either non-finite
+/// or zero in the optional mask, are handled by the first stage as it
+/// would on its own, and the later stages see its output.
+///
+/// A series that a stage cannot process is NaN from that stage on, and the
+/// status of its first failing stage is written to `status_ptr` unless it
+/// is null, see `Stage::run`.
+pub fn multiple_pipelines(
+    x_input_ptr: *mut f64,
+    y_input_ptr: *mut f64,
+    mask_ptr: *mut u8,
+    input_indices_ptr: *mut usize,
+    input_indices_size: usize,
+    data_length: usize,
+    stage_kinds_ptr: *mut i64,
+    stage_parameters_ptr: *mut f64,
+    n_stages: usize,
+    outputs_ptr: *mut *mut f64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    let pool = pool_for(n_threads);
+
+    let x_input: Option<&[f64]> = if x_input_ptr.is_null() {
+        None
+    } else {
+        Some(unsafe { std::slice::from_raw_parts(x_input_ptr, data_length) })
+    };
+
+    let y_input: &[f64] = unsafe {
+        assert!(!y_input_ptr.is_null());
+        std::slice::from_raw_parts(y_input_ptr, data_length)
+    };
+
+    let mask = unsafe { mask_from_raw(mask_ptr, data_length) };
+
+    let input_indices: &[usize] = unsafe {
+        assert!(!input_indices_ptr.is_null());
+        std::slice::from_raw_parts(input_indices_ptr, input_indices_size)
+    };
+
+    let (kinds, parameters, outputs) = unsafe {
+        assert!(!stage_kinds_ptr.is_null());
+        assert!(!stage_parameters_ptr.is_null());
+        assert!(!outputs_ptr.is_null());
+        (
+            std::slice::from_raw_parts(stage_kinds_ptr, n_stages),
+            std::slice::from_raw_parts(
+                stage_parameters_ptr,
+                n_stages * STAGE_PARAMETERS,
+            ),
+            std::slice::from_raw_parts(outputs_ptr, n_stages),
+        )
+    };
+
+    let stages: Vec<Stage> = kinds
+        .iter()
+        .zip(parameters.chunks(STAGE_PARAMETERS))
+        .map(|(kind, parameters)| Stage::from_parameters(*kind, parameters))
+        .collect();
+
+    assert!(
+        stages[..n_stages.saturating_sub(1)]
+            .iter()
+            .all(|stage| stage.extension() == 0),
+        "Only the last stage of a pipeline can forecast."
+    );
+
+    let outputs: Vec<Option<SharedMutSlice<f64>>> = outputs
+        .iter()
+        .zip(&stages)
+        .map(|(ptr, stage)| {
+            if ptr.is_null() {
+                None
+            } else {
+                let length =
+                    data_length + input_indices_size * stage.extension();
+                Some(SharedMutSlice::new(unsafe {
+                    std::slice::from_raw_parts_mut(*ptr, length)
+                }))
+            }
+        })
+        .collect();
+
+    let statuses =
+        unsafe { StatusOutput::from_raw(status_ptr, input_indices_size) };
+
+    let has_gp = stages.iter().any(|stage| match stage {
+        Stage::Gp { .. } => true,
+        _ => false,
+    });
+
+    let costs: Vec<f64> = (0..input_indices_size)
+        .map(|i| {
+            let (start, end) = series_range(input_indices, data_length, i);
+            let n = (end - start) as f64;
+            n * n_stages as f64 + if has_gp { n * n * n } else { 0_f64 }
+        })
+        .collect();
+
+    run_batch(&pool, &costs, chunk_size, |i| {
+        let (start, end) = series_range(input_indices, data_length, i);
+        count("points", (end - start) as u64);
+
+        BUFFERS.with(|buffers| {
+            let buffers = &mut *buffers.borrow_mut();
+
+            let mut x = std::mem::take(&mut buffers.x);
+            x.clear();
+            match x_input {
+                Some(x_input) => x.extend_from_slice(&x_input[start..end]),
+                None => x.extend((0..end - start).map(|k| k as f64)),
+            }
+
+            let mut current = std::mem::take(&mut buffers.current);
+            let mut next = std::mem::take(&mut buffers.next);
+            current.clear();
+            current.extend_from_slice(&y_input[start..end]);
+
+            let mut status = SeriesStatus::Ok;
+
+            for (k, stage) in stages.iter().enumerate() {
+                let extension = stage.extension();
+                next.resize(end - start + extension, 0_f64);
+
+                // Only the first stage sees the raw data and its mask.
+                let stage_mask = match k {
+                    0 => mask.map(|mask| &mask[start..end]),
+                    _ => None,
+                };
+                let stage_status = stage.run(
+                    &x,
+                    x_input.is_some(),
+                    &current,
+                    stage_mask,
+                    buffers,
+                    &mut next,
+                );
+                if status == SeriesStatus::Ok {
+                    status = stage_status;
+                }
+
+                if let Some(output) = &outputs[k] {
+                    // Every series owns a distinct range of the outputs.
+                    let output_start = start + i * extension;
+                    unsafe {
+                        output
+                            .range_mut(output_start, output_start + next.len())
+                            .copy_from_slice(&next)
+                    };
+                }
+
+                std::mem::swap(&mut current, &mut next);
+            }
+
+            buffers.x = x;
+            buffers.current = current;
+            buffers.next = next;
+
+            unsafe { statuses.set(i, status) };
+        });
+    });
+}
@@ -0,0 +1 @@
+pub mod fused;
@@ -1,4 +1,3 @@
+pub mod online_whittaker;
 pub mod sav_golay;
 pub mod whittaker;
-
-
@@ -0,0 +1,355 @@
+use crate::math_utils::banded::difference_row;
+use crate::math_utils::missing::{is_valid, mask_from_raw};
+use crate::parallel::pool::pool_for;
+use crate::parallel::scheduler::{run_batch, SharedMutSlice};
+use crate::parallel::status::{SeriesStatus, StatusOutput};
+
+use std::cell::RefCell;
+
+thread_local! {
+    // Scratch space reused by every pixel a worker thread updates.
+    static BUFFERS: RefCell<TailBuffers> =
+        RefCell::new(TailBuffers::default());
+}
+
+/// The Whittaker fit of one pixel, kept as the tail of the banded Cholesky
+/// factorisation of `(W + lambda DᵀD) z = W y` over its whole history.
+///
+/// Appending a value adds one row to the system and one difference row to
+/// the penalty, which only touches the last `d + 1` rows. Every earlier row
+/// of the factor `L` and of the forward solution `L⁻¹ W y` is final, so an
+/// update only refactorises those `d + 1` rows, and the back substitution
+/// from the newest value gives the last `window` smoothed values exactly.
+///
+/// `factor` and `forward` hold the last `window` rows of `L`, in band
+/// storage as in `SymBandMatrix`, and of the forward solution, oldest
+/// first. `pending` and `rhs` hold the rows of the system and right hand
+/// side of the last `d` values, which the next difference row still
+/// changes, and `weight_total` the summed weights seen so far.
+pub struct OnlineSeries<'a> {
+    pub factor: &'a mut [f64],
+    pub forward: &'a mut [f64],
+    pub pending: &'a mut [f64],
+    pub rhs: &'a mut [f64],
+    pub weight_total: &'a mut f64,
+}
+
+/// Scratch space of `OnlineSeries::push`.
+#[derive(Default)]
+pub struct TailBuffers {
+    rows: Vec<f64>,
+    rhs: Vec<f64>,
+    coefficients: Vec<f64>,
+    scratch: Vec<f64>,
+}
+
+impl<'a> OnlineSeries<'a> {
+    /// Add value number `count` of the series. `x_input`, if given, holds
+    /// the x values of values `count - d` to `count`, or from 0 while
+    /// `count < d`. O(d³ + window d).
+    pub fn push(
+        &mut self,
+        count: usize,
+        x_input: Option<&[f64]>,
+        y: f64,
+        weight: f64,
+        lambda: f64,
+        d: usize,
+        buffers: &mut TailBuffers,
+    ) {
+        let width = d + 1;
+        let window = self.forward.len();
+        let n = count;
+        let pending = std::cmp::min(n, d);
+
+        // Rows n - pending to n of the system.
+        buffers.rows.clear();
+        buffers
+            .rows
+            .extend_from_slice(&self.pending[..pending * width]);
+        buffers.rows.resize((pending + 1) * width, 0_f64);
+        buffers.rows[pending * width] = weight;
+        buffers.rhs.clear();
+        buffers.rhs.extend_from_slice(&self.rhs[..pending]);
+        buffers
+            .rhs
+            .push(if weight == 0_f64 { 0_f64 } else { weight * y });
+        *self.weight_total += weight.abs();
+
+        if n >= d {
+            buffers.coefficients.clear();
+            buffers.coefficients.resize(width, 0_f64);
+            difference_row(
+                x_input,
+                0,
+                d,
+                &mut buffers.scratch,
+                &mut buffers.coefficients,
+            );
+
+            let c = &buffers.coefficients;
+            for a in 0..width {
+                for b in 0..a + 1 {
+                    buffers.rows[a * width + (a - b)] += lambda * c[a] * c[b];
+                }
+            }
+        }
+
+        // Make room for the new value, dropping the oldest final row.
+        let stored = std::cmp::min(n, window);
+        if stored == window {
+            self.factor.copy_within(width.., 0);
+            self.forward.copy_within(1.., 0);
+        }
+        let first_stored = n + 1 - std::cmp::min(n + 1, window);
+        let slot = |i: usize| (i - first_stored) * width;
+
+        let mut failed = false;
+        for t in 0..pending + 1 {
+            let i = n - pending + t;
+            let first = i.saturating_sub(d);
+
+            for j in first..i + 1 {
+                let mut sum = buffers.rows[t * width + (i - j)];
+                for k in first..j {
+                    sum -= self.factor[slot(i) + (i - k)]
+                        * self.factor[slot(j) + (j - k)];
+                }
+
+                if i == j {
+                    failed |= !(sum > 0_f64) || !sum.is_finite();
+                    self.factor[slot(i)] =
+                        if failed { f64::NAN } else { sum.sqrt() };
+                } else {
+                    self.factor[slot(i) + (i - j)] =
+                        sum / self.factor[slot(j)];
+                }
+            }
+
+            let mut sum = buffers.rhs[t];
+            for k in first..i {
+                sum -= self.factor[slot(i) + (i - k)]
+                    * self.forward[slot(k) / width];
+            }
+            self.forward[slot(i) / width] = sum / self.factor[slot(i)];
+        }
+
+        // The oldest row is final once the next difference row is in.
+        let keep = std::cmp::min(n + 1, d);
+        let skip = pending + 1 - keep;
+        self.pending[..keep * width]
+            .copy_from_slice(&buffers.rows[skip * width..]);
+        self.rhs[..keep].copy_from_slice(&buffers.rhs[skip..]);
+    }
+
+    /// Back substitute the stored rows of a series of `count` values into
+    /// the smoothed values of the last `window` of them, oldest first, and
+    /// return the status of the series. Slots past the stored values are
+    /// NaN, and so is everything without weighted values or with a failed
+    /// factorisation, which stays failed for every later value.
+    pub fn smoothed(
+        &self,
+        count: usize,
+        d: usize,
+        output: &mut [f64],
+    ) -> SeriesStatus {
+        let width = d + 1;
+        let stored = std::cmp::min(count, self.forward.len());
+
+        output.iter_mut().for_each(|out| *out = f64::NAN);
+
+        if *self.weight_total == 0_f64 {
+            return SeriesStatus::NonFinite;
+        }
+
+        for s in (0..stored).rev() {
+            let last = std::cmp::min(stored, s + width);
+            let mut sum = self.forward[s];
+            for k in s + 1..last {
+                sum -= self.factor[k * width + (k - s)] * output[k];
+            }
+            output[s] = sum / self.factor[s * width];
+        }
+
+        if output[..stored].iter().all(|out| out.is_finite()) {
+            SeriesStatus::Ok
+        } else {
+            output.iter_mut().for_each(|out| *out = f64::NAN);
+            SeriesStatus::SolverFailure
+        }
+    }
+}
+
+/// Append `new_count` values to the online Whittaker state of `n_pixels`
+/// pixels that have `count` values so far, and write the last `window`
+/// smoothed values of each.
+///
+/// The smoothed values are the same as those of smoothing each whole
+/// history again, at O(d³ + window d) per new value instead of O(n d²).
+/// The state of pixel `p` is in `factor[p * window * (d + 1)..]`,
+/// `forward[p * window..]`, `pending[p * d * (d + 1)..]`, `rhs[p * d..]`
+/// and `weight_totals[p]`, see `OnlineSeries`. A null `x_tail_ptr` smooths
+/// evenly spaced values, otherwise it holds the x values of the last
+/// `min(count, d)` values and `new_x_ptr` those of the new values. A null
+/// weights pointer gives every value a weight of one, and missing values,
+/// either non-finite or zero in the optional mask, get a weight of zero.
+///
+/// The status of every pixel is written to `status_ptr` unless it is null:
+/// `SeriesStatus::NonFinite` without any weighted value or with non-finite
+/// x values, and `SeriesStatus::SolverFailure` once its factorisation has
+/// failed. Either way its output is all NaN.
+pub fn online_whittakers(
+    x_tail_ptr: *mut f64,
+    count: usize,
+    factor_ptr: *mut f64,
+    forward_ptr: *mut f64,
+    pending_ptr: *mut f64,
+    rhs_ptr: *mut f64,
+    weight_totals_ptr: *mut f64,
+    n_pixels: usize,
+    window: usize,
+    new_x_ptr: *mut f64,
+    new_y_ptr: *mut f64,
+    weights_ptr: *mut f64,
+    mask_ptr: *mut u8,
+    new_count: usize,
+    output_ptr: *mut f64,
+    lambda: f64,
+    d: i64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    let pool = pool_for(n_threads);
+
+    let d = d as usize;
+    let width = d + 1;
+    assert!(window > 2 * d, "The window must be longer than 2 * d.");
+
+    let tail = std::cmp::min(count, d);
+
+    // x values of the values from count - tail on.
+    let x_input: Option<Vec<f64>> = if x_tail_ptr.is_null() {
+        None
+    } else {
+        assert!(!new_x_ptr.is_null());
+        let (x_tail, new_x) = unsafe {
+            (
+                std::slice::from_raw_parts(x_tail_ptr, tail),
+                std::slice::from_raw_parts(new_x_ptr, new_count),
+            )
+        };
+        Some(x_tail.iter().chain(new_x).copied().collect())
+    };
+
+    let factor: &mut [f64] = unsafe {
+        assert!(!factor_ptr.is_null());
+        std::slice::from_raw_parts_mut(factor_ptr, n_pixels * window * width)
+    };
+
+    let forward: &mut [f64] = unsafe {
+        assert!(!forward_ptr.is_null());
+        std::slice::from_raw_parts_mut(forward_ptr, n_pixels * window)
+    };
+
+    let pending: &mut [f64] = unsafe {
+        assert!(!pending_ptr.is_null());
+        std::slice::from_raw_parts_mut(pending_ptr, n_pixels * d * width)
+    };
+
+    let rhs: &mut [f64] = unsafe {
+        assert!(!rhs_ptr.is_null());
+        std::slice::from_raw_parts_mut(rhs_ptr, n_pixels * d)
+    };
+
+    let weight_totals: &mut [f64] = unsafe {
+        assert!(!weight_totals_ptr.is_null());
+        std::slice::from_raw_parts_mut(weight_totals_ptr, n_pixels)
+    };
+
+    let new_y: &[f64] = unsafe {
+        assert!(!new_y_ptr.is_null());
+        std::slice::from_raw_parts(new_y_ptr, n_pixels * new_count)
+    };
+
+    let weights: Option<&[f64]> = if weights_ptr.is_null() {
+        None
+    } else {
+        Some(unsafe {
+            std::slice::from_raw_parts(weights_ptr, n_pixels * new_count)
+        })
+    };
+
+    let mask = unsafe { mask_from_raw(mask_ptr, n_pixels * new_count) };
+
+    let output: &mut [f64] = unsafe {
+        assert!(!output_ptr.is_null());
+        std::slice::from_raw_parts_mut(output_ptr, n_pixels * window)
+    };
+
+    let costs = vec![(new_count * width * width + window) as f64; n_pixels];
+
+    let factor = SharedMutSlice::new(factor);
+    let forward = SharedMutSlice::new(forward);
+    let pending = SharedMutSlice::new(pending);
+    let rhs = SharedMutSlice::new(rhs);
+    let weight_totals = SharedMutSlice::new(weight_totals);
+    let output = SharedMutSlice::new(output);
+    let statuses = unsafe { StatusOutput::from_raw(status_ptr, n_pixels) };
+
+    // Non-finite x values break the factor of every pixel alike.
+    let x_finite = x_input
+        .as_ref()
+        .map_or(true, |x| x.iter().all(|x| x.is_finite()));
+
+    run_batch(&pool, &costs, chunk_size, |p| {
+        // Every pixel owns a distinct range of the state and output.
+        let mut series = unsafe {
+            OnlineSeries {
+                factor: factor
+                    .range_mut(p * window * width, (p + 1) * window * width),
+                forward: forward.range_mut(p * window, (p + 1) * window),
+                pending: pending.range_mut(p * d * width, (p + 1) * d * width),
+                rhs: rhs.range_mut(p * d, (p + 1) * d),
+                weight_total: &mut weight_totals.range_mut(p, p + 1)[0],
+            }
+        };
+        let output = unsafe { output.range_mut(p * window, (p + 1) * window) };
+
+        let start = p * new_count;
+        let mask = mask.map(|mask| &mask[start..start + new_count]);
+        BUFFERS.with(|buffers| {
+            let buffers = &mut *buffers.borrow_mut();
+
+            for i in 0..new_count {
+                let y = new_y[start + i];
+                let weight =
+                    weights.map_or(1_f64, |weights| weights[start + i]);
+                let weight = if is_valid(y, mask, i) && weight.is_finite() {
+                    weight
+                } else {
+                    0_f64
+                };
+
+                // x values from value n - d on, which start at index
+                // n - (count - tail) of x_input.
+                let n = count + i;
+                let x_window = x_input.as_ref().map(|x| {
+                    let first = n.saturating_sub(d) + tail - count;
+                    &x[first..first + std::cmp::min(n, d) + 1]
+                });
+
+                series.push(n, x_window, y, weight, lambda, d, buffers);
+            }
+        });
+
+        let status = match series.smoothed(count + new_count, d, output) {
+            SeriesStatus::SolverFailure if !x_finite => {
+                SeriesStatus::NonFinite
+            }
+            status => status,
+        };
+
+        unsafe { statuses.set(p, status) };
+    });
+}
@@ -1,12 +1,54 @@
 use nalgebra::DMatrix;
 
-use crate::math_utils::convolve::{convolve_1d, ConvType};
+use crate::math_utils::convolve::{convolve_1d_into, ConvType};
+use crate::math_utils::missing::{is_valid, mask_from_raw};
+
+use crate::parallel::encoded::{EncodedArray, Encoding};
+use crate::parallel::pool::pool_for;
+use crate::parallel::profile::{count, span};
+use crate::parallel::scheduler::{run_batch, series_range, SharedMutSlice};
+use crate::parallel::status::{SeriesStatus, StatusOutput};
+use crate::parallel::strided::{
+    layout_from_raw, with_series_buffers, ArrayPtr,
+};
+
+use std::cell::RefCell;
+use std::sync::{Arc, Mutex};
+
+/// Number of distinct filters kept by the coefficient cache.
+pub const COEFFICIENT_CACHE_CAPACITY: usize = 32;
+
+type CoefficientKey = (i64, i64, i64, u64);
+
+struct CoefficientCache {
+    // Most recently used entry first.
+    entries: Vec<(CoefficientKey, Arc<Vec<f64>>)>,
+    hits: u64,
+    misses: u64,
+}
 
-use tokio::runtime::{self};
-use tokio::task::JoinHandle;
+thread_local! {
+    // Reflection padded copy of the series being filtered, reused by every
+    // series a worker thread handles.
+    static PADDED: RefCell<Vec<f64>> = RefCell::new(Vec::new());
+}
 
+static COEFFICIENT_CACHE: Mutex<CoefficientCache> =
+    Mutex::new(CoefficientCache {
+        entries: Vec::new(),
+        hits: 0,
+        misses: 0,
+    });
+
+/// Filter every series of a ragged batch. Missing values, either
+/// non-finite or zero in the optional mask, are left out of the fits.
+///
+/// A series too short for the window or without any valid value is all
+/// NaN, and its `SeriesStatus` is written to `status_ptr` unless it is
+/// null.
 pub fn multiple_sav_golays(
     y_input_ptr: *mut f64,
+    mask_ptr: *mut u8,
     input_indices_ptr: *mut usize,
     input_indices_size: usize,
     output_ptr: *mut f64,
@@ -15,30 +57,19 @@ pub fn multiple_sav_golays(
     order: i64,
     deriv: i64,
     delta: f64,
+    status_ptr: *mut u8,
     n_threads: i64,
+    chunk_size: i64,
 ) {
-    let rt = if n_threads < 0 {
-        runtime::Builder::new_multi_thread()
-            .build()
-            .expect("Could not build Tokio runtime.")
-    } else {
-        runtime::Builder::new_multi_thread()
-            .worker_threads(n_threads as usize)
-            .build()
-            .expect(
-                format!(
-                    "Could not build Tokio runtime with {} threads",
-                    n_threads
-                )
-                .as_str(),
-            )
-    };
+    let pool = pool_for(n_threads);
 
     let y_input: &mut [f64] = unsafe {
         assert!(!y_input_ptr.is_null());
         std::slice::from_raw_parts_mut(y_input_ptr, data_length)
     };
 
+    let mask = unsafe { mask_from_raw(mask_ptr, data_length) };
+
     let input_indices: &mut [usize] = unsafe {
         assert!(!input_indices_ptr.is_null());
         std::slice::from_raw_parts_mut(input_indices_ptr, input_indices_size)
@@ -49,83 +80,140 @@ pub fn multiple_sav_golays(
         std::slice::from_raw_parts_mut(output_ptr, data_length)
     };
 
-    let mut handles: Vec<JoinHandle<Vec<f64>>> =
-        Vec::with_capacity(data_length);
+    // The filter only depends on the window, so it is shared by every
+    // series in the batch.
+    let coefficients =
+        sav_golay_coefficients(window_size, order, deriv, delta);
 
-    for i in 0..input_indices_size {
-        let y_input_slice = if i + 1_usize >= input_indices_size {
-            &y_input[input_indices[i]..]
-        } else {
-            &y_input[input_indices[i]..input_indices[i + 1]]
-        };
+    let half_window = half_window(window_size);
 
-        handles.push(rt.spawn(async move {
-            let slice_length = y_input_slice.len();
+    let statuses =
+        unsafe { StatusOutput::from_raw(status_ptr, input_indices_size) };
 
-            let half_window =
-                ((window_size as f64 - 1_f64) / 2_f64).floor() as i64;
+    let costs: Vec<f64> = (0..input_indices_size)
+        .map(|i| {
+            let (start, end) = series_range(input_indices, data_length, i);
+            (end - start) as f64
+        })
+        .collect();
 
-            let mut b_vec = Vec::with_capacity(
-                (((half_window * 2) + 1) * (order + 1)) as usize,
-            );
+    let output = SharedMutSlice::new(output);
 
-            for k in -half_window..half_window + 1 {
-                for i in 0..(order + 1) {
-                    b_vec.push((k as f64).powf(i as f64));
-                }
-            }
+    run_batch(&pool, &costs, chunk_size, |i| {
+        let (start, end) = series_range(input_indices, data_length, i);
+        count("points", (end - start) as u64);
 
-            let b = DMatrix::from_vec(
-                (order + 1) as usize,
-                ((half_window * 2) + 1) as usize,
-                b_vec,
-            )
-            .transpose();
+        // Every series owns a distinct range of the output.
+        let output_slice = unsafe { output.range_mut(start, end) };
 
-            let inverse_b = b.pseudo_inverse(1e-15).unwrap();
+        let status = try_filter_series(
+            &coefficients,
+            half_window,
+            order as usize,
+            deriv as usize,
+            delta,
+            &y_input[start..end],
+            mask.map(|mask| &mask[start..end]),
+            output_slice,
+        );
 
-            let mut row = (inverse_b.row(deriv as usize)
-                * (delta.powf(deriv as f64))
-                * factorial(deriv) as f64)
-                .as_slice()
-                .to_vec();
+        unsafe { statuses.set(i, status) };
+    });
+}
 
-            let mut first_vals: Vec<f64> = y_input_slice
-                [(1 as usize)..((half_window + 1) as usize)]
-                .iter()
-                .rev()
-                .map(|x| y_input_slice[0] - (x - y_input_slice[0]).abs())
-                .collect();
+/// Filter every series along `axis` of an N-dimensional array with any
+/// strides. A null mask pointer treats every finite value as valid.
+///
+/// Series that cannot be filtered are NaN as in `multiple_sav_golays`, and
+/// the status of every series, in C order over the remaining axes, is
+/// written to `status_ptr` unless it is null.
+pub fn cube_sav_golays(
+    y_input_ptr: *mut u8,
+    y_encoding: Encoding,
+    y_strides_ptr: *mut isize,
+    mask_ptr: *mut u8,
+    mask_strides_ptr: *mut isize,
+    output_ptr: *mut u8,
+    output_encoding: Encoding,
+    output_strides_ptr: *mut isize,
+    shape_ptr: *mut usize,
+    ndim: usize,
+    axis: usize,
+    window_size: i64,
+    order: i64,
+    deriv: i64,
+    delta: f64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    let pool = pool_for(n_threads);
 
-            let last_vals = y_input_slice
-                [(slice_length - half_window as usize - 1)..slice_length - 1]
-                .iter()
-                .rev()
-                .map(|x| {
-                    y_input_slice[slice_length - 1]
-                        + (x - y_input_slice[slice_length - 1]).abs()
-                });
+    assert!(!y_input_ptr.is_null());
+    assert!(!output_ptr.is_null());
 
-            first_vals.extend(y_input_slice.iter());
-            first_vals.extend(last_vals);
+    let y_layout =
+        unsafe { layout_from_raw(shape_ptr, y_strides_ptr, ndim, axis) };
 
-            row.reverse();
+    let mask_layout = if mask_ptr.is_null() {
+        None
+    } else {
+        Some(unsafe {
+            layout_from_raw(shape_ptr, mask_strides_ptr, ndim, axis)
+        })
+    };
 
-            let result = convolve_1d(&row, &first_vals, ConvType::Valid);
+    let output_layout =
+        unsafe { layout_from_raw(shape_ptr, output_strides_ptr, ndim, axis) };
 
-            return result;
-        }));
-    }
+    let y_input = EncodedArray::new(y_input_ptr, y_encoding);
+    let mask_input = ArrayPtr(mask_ptr);
+    let output = EncodedArray::new(output_ptr, output_encoding);
 
-    // TODO There will probably be a more efficient way of doing this.
-    for i in 0..input_indices_size {
-        let result = rt.block_on(&mut handles[i]).unwrap();
+    let coefficients =
+        sav_golay_coefficients(window_size, order, deriv, delta);
 
-        let this_index = input_indices[i];
-        for result_index in 0..result.len() {
-            output[this_index + result_index] = result[result_index];
-        }
-    }
+    let half_window = half_window(window_size);
+
+    let series_length = y_layout.series_length();
+    let costs = vec![series_length as f64; y_layout.n_series()];
+    let statuses =
+        unsafe { StatusOutput::from_raw(status_ptr, y_layout.n_series()) };
+
+    run_batch(&pool, &costs, chunk_size, |series| {
+        with_series_buffers(|buffers| {
+            unsafe { y_input.gather(&y_layout, series, &mut buffers.input) };
+
+            let mask = match &mask_layout {
+                Some(layout) => {
+                    unsafe {
+                        layout.gather(mask_input.0, series, &mut buffers.mask)
+                    };
+                    Some(&buffers.mask[..])
+                }
+                None => None,
+            };
+
+            buffers.output.resize(series_length, 0_f64);
+
+            let status = try_filter_series(
+                &coefficients,
+                half_window,
+                order as usize,
+                deriv as usize,
+                delta,
+                &buffers.input,
+                mask,
+                &mut buffers.output,
+            );
+
+            // Every series is written by exactly one worker.
+            unsafe {
+                output.scatter(&output_layout, series, &buffers.output);
+                statuses.set(series, status);
+            }
+        })
+    });
 }
 
 pub fn single_sav_golay(
@@ -146,7 +234,86 @@ pub fn single_sav_golay(
         std::slice::from_raw_parts_mut(output_ptr, data_length)
     };
 
-    let half_window = ((window_size as f64 - 1_f64) / 2_f64).floor() as i64;
+    let coefficients =
+        sav_golay_coefficients(window_size, order, deriv, delta);
+
+    filter_series(
+        &coefficients,
+        half_window(window_size),
+        order as usize,
+        deriv as usize,
+        delta,
+        y_input,
+        None,
+        output,
+    );
+}
+
+/// Convolution kernel of the filter, already reversed. Looked up in the
+/// process-wide cache so the pseudo-inverse is only computed once for each
+/// `(window_size, order, deriv, delta)`.
+pub fn sav_golay_coefficients(
+    window_size: i64,
+    order: i64,
+    deriv: i64,
+    delta: f64,
+) -> Arc<Vec<f64>> {
+    let key = (window_size, order, deriv, delta.to_bits());
+
+    {
+        let mut cache = COEFFICIENT_CACHE.lock().unwrap();
+
+        if let Some(position) =
+            cache.entries.iter().position(|(k, _)| *k == key)
+        {
+            cache.hits += 1;
+            let entry = cache.entries.remove(position);
+            let coefficients = entry.1.clone();
+            cache.entries.insert(0, entry);
+            return coefficients;
+        }
+        cache.misses += 1;
+    }
+
+    // Computed without holding the lock. Two threads missing on the same
+    // key at once both do the work, which is harmless.
+    let coefficients =
+        Arc::new(compute_coefficients(window_size, order, deriv, delta));
+
+    let mut cache = COEFFICIENT_CACHE.lock().unwrap();
+    if !cache.entries.iter().any(|(k, _)| *k == key) {
+        cache.entries.insert(0, (key, coefficients.clone()));
+        cache.entries.truncate(COEFFICIENT_CACHE_CAPACITY);
+    }
+
+    coefficients
+}
+
+/// Hits, misses, capacity and current size of the coefficient cache.
+pub fn coefficient_cache_info() -> [u64; 4] {
+    let cache = COEFFICIENT_CACHE.lock().unwrap();
+    [
+        cache.hits,
+        cache.misses,
+        COEFFICIENT_CACHE_CAPACITY as u64,
+        cache.entries.len() as u64,
+    ]
+}
+
+pub fn clear_coefficient_cache() {
+    let mut cache = COEFFICIENT_CACHE.lock().unwrap();
+    cache.entries.clear();
+    cache.hits = 0;
+    cache.misses = 0;
+}
+
+fn compute_coefficients(
+    window_size: i64,
+    order: i64,
+    deriv: i64,
+    delta: f64,
+) -> Vec<f64> {
+    let half_window = half_window(window_size) as i64;
 
     let mut b_vec =
         Vec::with_capacity((((half_window * 2) + 1) * (order + 1)) as usize);
@@ -172,32 +339,246 @@ pub fn single_sav_golay(
         .as_slice()
         .to_vec();
 
-    let mut first_vals: Vec<f64> = y_input
-        [(1 as usize)..((half_window + 1) as usize)]
-        .iter()
-        .rev()
-        .map(|x| y_input[0] - (x - y_input[0]).abs())
-        .collect();
+    row.reverse();
 
-    let last_vals = y_input
-        [(data_length - half_window as usize - 1)..data_length - 1]
-        .iter()
-        .rev()
-        .map(|x| {
-            y_input[data_length - 1] + (x - y_input[data_length - 1]).abs()
-        });
+    row
+}
 
-    first_vals.extend(y_input.iter());
-    first_vals.extend(last_vals);
+pub fn half_window(window_size: i64) -> usize {
+    ((window_size as f64 - 1_f64) / 2_f64).floor() as usize
+}
 
-    row.reverse();
+/// Pad a series by reflecting it about its end points and apply the filter.
+///
+/// Missing values, either non-finite or zero in `mask`, are left out:
+/// windows that contain any are replaced by a least squares polynomial fit
+/// to the valid samples they do contain, evaluated at the window centre.
+/// Windows with too few valid samples for the fit give NaN.
+pub fn filter_series(
+    coefficients: &[f64],
+    half_window: usize,
+    order: usize,
+    deriv: usize,
+    delta: f64,
+    y_input: &[f64],
+    mask: Option<&[u8]>,
+    output: &mut [f64],
+) {
+    let _span = span("filter");
 
-    let result = convolve_1d(&row, &first_vals, ConvType::Valid);
-    for i in 0..data_length {
-        output[i] = result[i]
+    let data_length = y_input.len();
+
+    let value = |i: usize| {
+        if is_valid(y_input[i], mask, i) {
+            y_input[i]
+        } else {
+            f64::NAN
+        }
+    };
+
+    PADDED.with(|padded| {
+        let mut padded = padded.borrow_mut();
+        padded.clear();
+
+        let first = value(0);
+        let last = value(data_length - 1);
+
+        padded.extend(
+            (1..(half_window + 1))
+                .rev()
+                .map(|i| first - (value(i) - first).abs()),
+        );
+
+        padded.extend((0..data_length).map(value));
+
+        padded.extend(
+            ((data_length - half_window - 1)..data_length - 1)
+                .rev()
+                .map(|i| last + (value(i) - last).abs()),
+        );
+
+        if padded.iter().all(|y| y.is_finite()) {
+            convolve_1d_into(coefficients, &padded, ConvType::Valid, output);
+            return;
+        }
+
+        let window = coefficients.len();
+        let mut fit = LocalFit::new(order, half_window);
+
+        for (i, out) in output.iter_mut().enumerate() {
+            let samples = &padded[i..i + window];
+
+            *out = if samples.iter().all(|y| y.is_finite()) {
+                samples
+                    .iter()
+                    .zip(coefficients.iter().rev())
+                    .map(|(y, c)| y * c)
+                    .sum()
+            } else {
+                fit.derivative_at_centre(samples, deriv, delta)
+            };
+        }
+    });
+}
+
+/// `filter_series`, unless the series is too short for the reflection
+/// padding of the window or has no valid value, in which case it is all
+/// NaN.
+pub fn try_filter_series(
+    coefficients: &[f64],
+    half_window: usize,
+    order: usize,
+    deriv: usize,
+    delta: f64,
+    y_input: &[f64],
+    mask: Option<&[u8]>,
+    output: &mut [f64],
+) -> SeriesStatus {
+    let status = if y_input.len() <= half_window {
+        SeriesStatus::TooShort
+    } else if !(0..y_input.len()).any(|i| is_valid(y_input[i], mask, i)) {
+        SeriesStatus::NonFinite
+    } else {
+        SeriesStatus::Ok
+    };
+
+    if status == SeriesStatus::Ok {
+        filter_series(
+            coefficients,
+            half_window,
+            order,
+            deriv,
+            delta,
+            y_input,
+            mask,
+            output,
+        );
+    } else {
+        output.iter_mut().for_each(|out| *out = f64::NAN);
+    }
+
+    status
+}
+
+/// Least squares polynomial fit to the valid samples of one window, used
+/// where the precomputed filter cannot be applied.
+struct LocalFit {
+    order: usize,
+    half_window: usize,
+    normal: Vec<f64>,
+    rhs: Vec<f64>,
+    powers: Vec<f64>,
+}
+
+impl LocalFit {
+    fn new(order: usize, half_window: usize) -> LocalFit {
+        LocalFit {
+            order,
+            half_window,
+            normal: vec![0_f64; (order + 1) * (order + 1)],
+            rhs: vec![0_f64; order + 1],
+            powers: vec![0_f64; 2 * order + 1],
+        }
+    }
+
+    /// Fit the finite values of `samples` and return the `deriv`-th
+    /// derivative of the fit at the centre, scaled like the filter
+    /// coefficients.
+    fn derivative_at_centre(
+        &mut self,
+        samples: &[f64],
+        deriv: usize,
+        delta: f64,
+    ) -> f64 {
+        let p = self.order + 1;
+
+        if deriv > self.order {
+            return 0_f64;
+        }
+
+        // Positions are scaled into [-1, 1] to keep the normal equations
+        // well conditioned.
+        let scale = self.half_window.max(1) as f64;
+
+        self.normal.iter_mut().for_each(|a| *a = 0_f64);
+        self.rhs.iter_mut().for_each(|b| *b = 0_f64);
+
+        let mut n_valid = 0;
+
+        for (j, y) in samples.iter().enumerate() {
+            if !y.is_finite() {
+                continue;
+            }
+            n_valid += 1;
+
+            let s = (j as f64 - self.half_window as f64) / scale;
+
+            let mut power = 1_f64;
+            for k in 0..(2 * self.order + 1) {
+                self.powers[k] = power;
+                power *= s;
+            }
+
+            for r in 0..p {
+                self.rhs[r] += self.powers[r] * y;
+                for c in 0..p {
+                    self.normal[r * p + c] += self.powers[r + c];
+                }
+            }
+        }
+
+        if n_valid < p || !solve_dense(&mut self.normal, &mut self.rhs, p) {
+            return f64::NAN;
+        }
+
+        self.rhs[deriv]
+            * factorial(deriv as i64) as f64
+            * delta.powi(deriv as i32)
+            / scale.powi(deriv as i32)
     }
 }
 
+/// Solve the dense `n` by `n` system `a x = b` in place by Gaussian
+/// elimination with partial pivoting. Returns false if `a` is singular.
+fn solve_dense(a: &mut [f64], b: &mut [f64], n: usize) -> bool {
+    for col in 0..n {
+        let pivot = (col..n)
+            .max_by(|&i, &j| {
+                a[i * n + col]
+                    .abs()
+                    .partial_cmp(&a[j * n + col].abs())
+                    .unwrap()
+            })
+            .unwrap();
+
+        if a[pivot * n + col].abs() < 1e-12 {
+            return false;
+        }
+
+        if pivot != col {
+            for k in 0..n {
+                a.swap(pivot * n + k, col * n + k);
+            }
+            b.swap(pivot, col);
+        }
+
+        for row in (col + 1)..n {
+            let factor = a[row * n + col] / a[col * n + col];
+            for k in col..n {
+                a[row * n + k] -= factor * a[col * n + k];
+            }
+            b[row] -= factor * b[col];
+        }
+    }
+
+    for row in (0..n).rev() {
+        let tail: f64 = ((row + 1)..n).map(|k| a[row * n + k] * b[k]).sum();
+        b[row] = (b[row] - tail) / a[row * n + row];
+    }
+
+    true
+}
+
 fn factorial(num: i64) -> i64 {
     (1..=num).product()
 }
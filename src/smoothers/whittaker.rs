@@ -2,37 +2,258 @@ use sprs::{CsMat, TriMatBase};
 use sprs::{DontCheckSymmetry, FillInReduction::ReverseCuthillMcKee};
 use sprs_ldl::Ldl;
 
-use tokio::runtime::{self};
-use tokio::task::JoinHandle;
+use crate::math_utils::banded::{
+    difference_penalty, NotPositiveDefinite, SymBandMatrix,
+};
+use crate::math_utils::missing::{is_valid, mask_from_raw};
+use crate::parallel::encoded::{EncodedArray, Encoding};
+use crate::parallel::pool::pool_for;
+use crate::parallel::profile::count;
+use crate::parallel::scheduler::{run_batch, series_range, SharedMutSlice};
+use crate::parallel::status::{SeriesStatus, StatusOutput};
+use crate::parallel::strided::{
+    layout_from_raw, with_series_buffers, ArrayPtr,
+};
 
+use std::cell::RefCell;
+
+thread_local! {
+    // Banded system of the series being smoothed, reused by every series a
+    // worker thread handles.
+    static SYSTEM: RefCell<SymBandMatrix> =
+        RefCell::new(SymBandMatrix::default());
+
+    // Scratch space of the automatic choice of lambda.
+    static SELECTION: RefCell<SelectionBuffers> =
+        RefCell::new(SelectionBuffers::default());
+
+    // Scratch space of the reweighted fits.
+    static ROBUST: RefCell<RobustBuffers> =
+        RefCell::new(RobustBuffers::default());
+}
+
+/// How the smoothing parameter of each series is chosen.
+#[derive(Clone, Copy, Debug)]
+pub enum Smoothing<'a> {
+    /// The same lambda for every series.
+    Fixed(f64),
+    /// The lambda of `grid` that scores best by `criterion`, per series.
+    Auto {
+        grid: &'a [f64],
+        criterion: Criterion,
+    },
+    /// The same lambda for every series, refitted with weights updated from
+    /// the residuals, see `smooth_series_robust`.
+    Robust {
+        lambda: f64,
+        reweighting: Reweighting,
+        iterations: usize,
+        tolerance: f64,
+    },
+}
+
+/// Score of a candidate lambda, see `smooth_series_auto`.
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub enum Criterion {
+    Gcv,
+    VCurve,
+}
+
+/// How `smooth_series_robust` updates the weights from the residuals
+/// `r = y - z` of the last fit. The new weights multiply the given ones.
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub enum Reweighting {
+    /// `p` above the fit and `1 - p` below it, the asymmetric least
+    /// squares of Eilers and Boelens (2005). `p` close to one follows the
+    /// upper envelope.
+    Asymmetric(f64),
+    /// One at or above the fit, falling linearly to zero for the value the
+    /// furthest below it, as in Chen et al. (2004).
+    Envelope,
+    /// Tukey's bisquare of `r / (4.685 s)`, with `s` the median absolute
+    /// residual scaled by 1.4826, which drops outliers on both sides.
+    Bisquare,
+}
+
+/// Where the difference penalty of a series comes from.
+#[derive(Clone, Copy, Debug)]
+pub enum Spacing<'a> {
+    /// Plain differences of evenly spaced values.
+    Even,
+    /// Divided differences of these x values.
+    Irregular(&'a [f64]),
+    /// `DᵀD` built beforehand by `difference_penalty`, shared by every
+    /// series with the same x values.
+    Penalty(&'a SymBandMatrix),
+}
+
+/// Smooth every series of a ragged batch. Missing values, either non-finite
+/// or zero in the optional mask, get a weight of zero.
+///
+/// A null `x_input_ptr` smooths evenly spaced series. Otherwise the penalty
+/// uses divided differences of the x values, which are either laid out like
+/// `y_input`, or with `x_shared` one series of x values that every series,
+/// all of that length, shares. The shared penalty `DᵀD` is built once and
+/// reused by every series.
+///
+/// A series shorter than `d + 1` values, without any weighted value, with
+/// non-finite x values or whose system cannot be factorised is all NaN,
+/// and its `SeriesStatus` is written to `status_ptr` unless it is null.
 pub fn multiple_whittakers(
+    x_input_ptr: *mut f64,
+    x_shared: bool,
     y_input_ptr: *mut f64,
     weights_input_ptr: *mut f64,
+    mask_ptr: *mut u8,
     input_indices_ptr: *mut usize,
     input_indices_size: usize,
     output_ptr: *mut f64,
     data_length: usize,
     lambda: f64,
     d: i64,
+    status_ptr: *mut u8,
     n_threads: i64,
+    chunk_size: i64,
 ) {
-    let rt = if n_threads < 0 {
-        runtime::Builder::new_multi_thread()
-            .build()
-            .expect("Could not build Tokio runtime.")
-    } else {
-        runtime::Builder::new_multi_thread()
-            .worker_threads(n_threads as usize)
-            .build()
-            .expect(
-                format!(
-                    "Could not build Tokio runtime with {} threads",
-                    n_threads
-                )
-                .as_str(),
-            )
+    smooth_batch(
+        x_input_ptr,
+        x_shared,
+        y_input_ptr,
+        weights_input_ptr,
+        mask_ptr,
+        input_indices_ptr,
+        input_indices_size,
+        output_ptr,
+        data_length,
+        Smoothing::Fixed(lambda),
+        std::ptr::null_mut(),
+        std::ptr::null_mut(),
+        d,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    );
+}
+
+/// `multiple_whittakers` choosing lambda per series among the
+/// `lambda_grid_size` values at `lambda_grid_ptr`, and writing the chosen
+/// ones to `lambdas_ptr`. Series without weighted values get NaN.
+pub fn multiple_whittakers_auto(
+    x_input_ptr: *mut f64,
+    x_shared: bool,
+    y_input_ptr: *mut f64,
+    weights_input_ptr: *mut f64,
+    mask_ptr: *mut u8,
+    input_indices_ptr: *mut usize,
+    input_indices_size: usize,
+    output_ptr: *mut f64,
+    data_length: usize,
+    lambda_grid_ptr: *mut f64,
+    lambda_grid_size: usize,
+    criterion: Criterion,
+    lambdas_ptr: *mut f64,
+    d: i64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    let grid: &[f64] = unsafe {
+        assert!(!lambda_grid_ptr.is_null());
+        std::slice::from_raw_parts(lambda_grid_ptr, lambda_grid_size)
     };
 
+    assert!(!lambdas_ptr.is_null());
+    assert!(!grid.is_empty(), "The lambda grid is empty.");
+
+    smooth_batch(
+        x_input_ptr,
+        x_shared,
+        y_input_ptr,
+        weights_input_ptr,
+        mask_ptr,
+        input_indices_ptr,
+        input_indices_size,
+        output_ptr,
+        data_length,
+        Smoothing::Auto { grid, criterion },
+        lambdas_ptr,
+        std::ptr::null_mut(),
+        d,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    );
+}
+
+/// `multiple_whittakers` refitting each series up to `iterations` times
+/// with weights updated by `reweighting`, until the relative change of the
+/// fit drops to `tolerance`, see `smooth_series_robust`. The number of fits
+/// of each series is written to `passes_ptr` unless it is null.
+pub fn multiple_whittakers_robust(
+    x_input_ptr: *mut f64,
+    x_shared: bool,
+    y_input_ptr: *mut f64,
+    weights_input_ptr: *mut f64,
+    mask_ptr: *mut u8,
+    input_indices_ptr: *mut usize,
+    input_indices_size: usize,
+    output_ptr: *mut f64,
+    data_length: usize,
+    lambda: f64,
+    d: i64,
+    reweighting: Reweighting,
+    iterations: i64,
+    tolerance: f64,
+    passes_ptr: *mut u64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    smooth_batch(
+        x_input_ptr,
+        x_shared,
+        y_input_ptr,
+        weights_input_ptr,
+        mask_ptr,
+        input_indices_ptr,
+        input_indices_size,
+        output_ptr,
+        data_length,
+        Smoothing::Robust {
+            lambda,
+            reweighting,
+            iterations: iterations.max(1) as usize,
+            tolerance,
+        },
+        std::ptr::null_mut(),
+        passes_ptr,
+        d,
+        status_ptr,
+        n_threads,
+        chunk_size,
+    );
+}
+
+fn smooth_batch(
+    x_input_ptr: *mut f64,
+    x_shared: bool,
+    y_input_ptr: *mut f64,
+    weights_input_ptr: *mut f64,
+    mask_ptr: *mut u8,
+    input_indices_ptr: *mut usize,
+    input_indices_size: usize,
+    output_ptr: *mut f64,
+    data_length: usize,
+    smoothing: Smoothing,
+    lambdas_ptr: *mut f64,
+    passes_ptr: *mut u64,
+    d: i64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    let pool = pool_for(n_threads);
+
     let y_input: &mut [f64] = unsafe {
         assert!(!y_input_ptr.is_null());
         std::slice::from_raw_parts_mut(y_input_ptr, data_length)
@@ -43,6 +264,8 @@ pub fn multiple_whittakers(
         std::slice::from_raw_parts_mut(weights_input_ptr, data_length)
     };
 
+    let mask = unsafe { mask_from_raw(mask_ptr, data_length) };
+
     let input_indices: &mut [usize] = unsafe {
         assert!(!input_indices_ptr.is_null());
         std::slice::from_raw_parts_mut(input_indices_ptr, input_indices_size)
@@ -53,69 +276,273 @@ pub fn multiple_whittakers(
         std::slice::from_raw_parts_mut(output_ptr, data_length)
     };
 
-    let mut handles: Vec<JoinHandle<Vec<f64>>> =
-        Vec::with_capacity(data_length);
+    // x values of each series, or of all of them with x_shared.
+    let x_input: Option<&[f64]> = if x_input_ptr.is_null() {
+        None
+    } else if x_shared {
+        let length = match input_indices_size {
+            0 => 0,
+            _ => {
+                let (start, end) = series_range(input_indices, data_length, 0);
+                end - start
+            }
+        };
+        for i in 0..input_indices_size {
+            let (start, end) = series_range(input_indices, data_length, i);
+            assert_eq!(
+                end - start,
+                length,
+                "Series sharing x values must all have their length."
+            );
+        }
+        Some(unsafe { std::slice::from_raw_parts(x_input_ptr, length) })
+    } else {
+        Some(unsafe { std::slice::from_raw_parts(x_input_ptr, data_length) })
+    };
+
+    let shared_penalty = match x_input {
+        Some(x) if x_shared => {
+            let mut penalty = SymBandMatrix::default();
+            difference_penalty(Some(x), x.len(), d as usize, &mut penalty);
+            Some(penalty)
+        }
+        _ => None,
+    };
 
-    for i in 0..input_indices_size {
-        let (y_input_slice, weights_input_slice) =
-            if i + 1_usize >= input_indices_size {
-                (
-                    &y_input[input_indices[i]..],
-                    &weights_input[input_indices[i]..],
-                )
-            } else {
-                (
-                    &y_input[input_indices[i]..input_indices[i + 1]],
-                    &weights_input[input_indices[i]..input_indices[i + 1]],
-                )
-            };
+    let lambdas = if lambdas_ptr.is_null() {
+        None
+    } else {
+        Some(SharedMutSlice::new(unsafe {
+            std::slice::from_raw_parts_mut(lambdas_ptr, input_indices_size)
+        }))
+    };
+
+    let passes = if passes_ptr.is_null() {
+        None
+    } else {
+        Some(SharedMutSlice::new(unsafe {
+            std::slice::from_raw_parts_mut(passes_ptr, input_indices_size)
+        }))
+    };
 
-        handles.push(rt.spawn(async move {
-            let slice_length = y_input_slice.len();
-            let e: CsMat<f64> = CsMat::eye(slice_length);
+    let statuses =
+        unsafe { StatusOutput::from_raw(status_ptr, input_indices_size) };
 
-            let diff_mat = dif_no_ddmat(&e, d);
+    let candidates = match smoothing {
+        Smoothing::Fixed(_) => 1,
+        Smoothing::Auto { grid, .. } => grid.len() + 1,
+        Smoothing::Robust { iterations, .. } => iterations,
+    };
 
-            let diags = (0..slice_length).collect::<Vec<usize>>();
+    let costs: Vec<f64> = (0..input_indices_size)
+        .map(|i| {
+            let (start, end) = series_range(input_indices, data_length, i);
+            ((end - start) * candidates) as f64
+        })
+        .collect();
 
-            let weights_matrix = TriMatBase::from_triplets(
-                (slice_length, slice_length),
-                diags.clone(),
-                diags,
-                weights_input_slice.to_vec(),
-            )
-            .to_csc();
+    let output = SharedMutSlice::new(output);
 
-            let to_solve: CsMat<f64> = &weights_matrix
-                + &(&(&diff_mat.transpose_view() * &diff_mat) * lambda);
+    run_batch(&pool, &costs, chunk_size, |i| {
+        let (start, end) = series_range(input_indices, data_length, i);
+        count("points", (end - start) as u64);
 
-            let ldl = Ldl::new()
-                .fill_in_reduction(ReverseCuthillMcKee)
-                .check_symmetry(DontCheckSymmetry)
-                .numeric(to_solve.view())
-                .expect("Could not create solver.");
+        // Every series owns a distinct range of the outputs.
+        let output_slice = unsafe { output.range_mut(start, end) };
 
-            let smoothed_y = ldl.solve(
-                weights_input_slice
-                    .iter()
-                    .zip(y_input_slice)
-                    .map(|(a, b)| *a * *b)
-                    .collect::<Vec<f64>>(),
-            );
+        let spacing = match (&shared_penalty, x_input) {
+            (Some(penalty), _) => Spacing::Penalty(penalty),
+            (None, Some(x)) => Spacing::Irregular(&x[start..end]),
+            (None, None) => Spacing::Even,
+        };
 
-            return smoothed_y;
-        }));
-    }
+        let y_slice = &y_input[start..end];
+        let weights_slice = &weights_input[start..end];
+        let mask_slice = mask.map(|mask| &mask[start..end]);
+
+        let x_slice = match x_input {
+            Some(x) if x_shared => Some(x),
+            Some(x) => Some(&x[start..end]),
+            None => None,
+        };
+
+        let status = match check_series(
+            x_slice,
+            y_slice,
+            weights_slice,
+            mask_slice,
+            d as usize,
+        ) {
+            SeriesStatus::Ok => match smooth_with(
+                spacing,
+                y_slice,
+                weights_slice,
+                mask_slice,
+                smoothing,
+                d as usize,
+                output_slice,
+            ) {
+                Ok((lambda, fits)) => {
+                    if let Some(lambdas) = &lambdas {
+                        unsafe { lambdas.range_mut(i, i + 1)[0] = lambda };
+                    }
+
+                    if let Some(passes) = &passes {
+                        unsafe { passes.range_mut(i, i + 1)[0] = fits as u64 };
+                    }
+
+                    SeriesStatus::Ok
+                }
+                Err(_) => SeriesStatus::SolverFailure,
+            },
+            status => status,
+        };
 
-    // TODO There will probably be a more efficient way of doing this.
-    for i in 0..input_indices_size {
-        let result = rt.block_on(&mut handles[i]).unwrap().to_vec();
+        if status != SeriesStatus::Ok {
+            output_slice.iter_mut().for_each(|out| *out = f64::NAN);
 
-        let this_index = input_indices[i];
-        for result_index in 0..result.len() {
-            output[this_index + result_index] = result[result_index];
+            if let Some(lambdas) = &lambdas {
+                unsafe { lambdas.range_mut(i, i + 1)[0] = f64::NAN };
+            }
+
+            if let Some(passes) = &passes {
+                unsafe { passes.range_mut(i, i + 1)[0] = 0 };
+            }
         }
-    }
+
+        unsafe { statuses.set(i, status) };
+    });
+}
+
+/// Smooth every series along `axis` of an N-dimensional array in place of
+/// a list of series. Inputs may have any strides, a null weights pointer
+/// gives every value a weight of one and a null mask pointer treats every
+/// finite value as valid.
+///
+/// Series that cannot be smoothed are NaN as in `multiple_whittakers`, and
+/// the status of every series, in C order over the remaining axes, is
+/// written to `status_ptr` unless it is null.
+pub fn cube_whittakers(
+    y_input_ptr: *mut u8,
+    y_encoding: Encoding,
+    y_strides_ptr: *mut isize,
+    weights_input_ptr: *mut f64,
+    weights_strides_ptr: *mut isize,
+    mask_ptr: *mut u8,
+    mask_strides_ptr: *mut isize,
+    output_ptr: *mut u8,
+    output_encoding: Encoding,
+    output_strides_ptr: *mut isize,
+    shape_ptr: *mut usize,
+    ndim: usize,
+    axis: usize,
+    lambda: f64,
+    d: i64,
+    status_ptr: *mut u8,
+    n_threads: i64,
+    chunk_size: i64,
+) {
+    let pool = pool_for(n_threads);
+
+    assert!(!y_input_ptr.is_null());
+    assert!(!output_ptr.is_null());
+
+    let y_layout =
+        unsafe { layout_from_raw(shape_ptr, y_strides_ptr, ndim, axis) };
+
+    let weights_layout = if weights_input_ptr.is_null() {
+        None
+    } else {
+        Some(unsafe {
+            layout_from_raw(shape_ptr, weights_strides_ptr, ndim, axis)
+        })
+    };
+
+    let mask_layout = if mask_ptr.is_null() {
+        None
+    } else {
+        Some(unsafe {
+            layout_from_raw(shape_ptr, mask_strides_ptr, ndim, axis)
+        })
+    };
+
+    let output_layout =
+        unsafe { layout_from_raw(shape_ptr, output_strides_ptr, ndim, axis) };
+
+    let y_input = EncodedArray::new(y_input_ptr, y_encoding);
+    let weights_input = ArrayPtr(weights_input_ptr);
+    let mask_input = ArrayPtr(mask_ptr);
+    let output = EncodedArray::new(output_ptr, output_encoding);
+
+    let series_length = y_layout.series_length();
+    let costs = vec![series_length as f64; y_layout.n_series()];
+    let statuses =
+        unsafe { StatusOutput::from_raw(status_ptr, y_layout.n_series()) };
+
+    run_batch(&pool, &costs, chunk_size, |series| {
+        with_series_buffers(|buffers| {
+            unsafe { y_input.gather(&y_layout, series, &mut buffers.input) };
+
+            match &weights_layout {
+                Some(layout) => unsafe {
+                    layout.gather(
+                        weights_input.0,
+                        series,
+                        &mut buffers.weights,
+                    )
+                },
+                None => {
+                    buffers.weights.clear();
+                    buffers.weights.resize(series_length, 1_f64);
+                }
+            }
+
+            let mask = match &mask_layout {
+                Some(layout) => {
+                    unsafe {
+                        layout.gather(mask_input.0, series, &mut buffers.mask)
+                    };
+                    Some(&buffers.mask[..])
+                }
+                None => None,
+            };
+
+            buffers.output.resize(series_length, 0_f64);
+
+            let (input, weights) = (&buffers.input, &buffers.weights);
+            let series_output = &mut buffers.output;
+
+            let status =
+                match check_series(None, input, weights, mask, d as usize) {
+                    SeriesStatus::Ok => SYSTEM.with(|system| {
+                        match smooth_series(
+                            None,
+                            input,
+                            weights,
+                            mask,
+                            lambda,
+                            d as usize,
+                            &mut system.borrow_mut(),
+                            series_output,
+                        ) {
+                            Ok(()) => SeriesStatus::Ok,
+                            Err(_) => SeriesStatus::SolverFailure,
+                        }
+                    }),
+                    status => status,
+                };
+
+            if status != SeriesStatus::Ok {
+                series_output.iter_mut().for_each(|out| *out = f64::NAN);
+            }
+
+            // Every series is written by exactly one worker.
+            unsafe {
+                output.scatter(&output_layout, series, &buffers.output);
+                statuses.set(series, status);
+            }
+        })
+    });
 }
 
 pub fn single_whittaker(
@@ -127,6 +554,57 @@ pub fn single_whittaker(
     lambda: f64,
     d: i64,
 ) {
+    single_smooth(
+        x_input_ptr,
+        y_input_ptr,
+        weights_input_ptr,
+        output_ptr,
+        data_length,
+        Smoothing::Fixed(lambda),
+        d,
+    );
+}
+
+/// `single_whittaker` choosing lambda among the `lambda_grid_size` values at
+/// `lambda_grid_ptr`, and returning it.
+pub fn single_whittaker_auto(
+    x_input_ptr: *mut f64,
+    y_input_ptr: *mut f64,
+    weights_input_ptr: *mut f64,
+    output_ptr: *mut f64,
+    data_length: usize,
+    lambda_grid_ptr: *mut f64,
+    lambda_grid_size: usize,
+    criterion: Criterion,
+    d: i64,
+) -> f64 {
+    let grid: &[f64] = unsafe {
+        assert!(!lambda_grid_ptr.is_null());
+        std::slice::from_raw_parts(lambda_grid_ptr, lambda_grid_size)
+    };
+
+    assert!(!grid.is_empty(), "The lambda grid is empty.");
+
+    single_smooth(
+        x_input_ptr,
+        y_input_ptr,
+        weights_input_ptr,
+        output_ptr,
+        data_length,
+        Smoothing::Auto { grid, criterion },
+        d,
+    )
+}
+
+fn single_smooth(
+    x_input_ptr: *mut f64,
+    y_input_ptr: *mut f64,
+    weights_input_ptr: *mut f64,
+    output_ptr: *mut f64,
+    data_length: usize,
+    smoothing: Smoothing,
+    d: i64,
+) -> f64 {
     let x_input: &mut [f64] = unsafe {
         assert!(!x_input_ptr.is_null());
         std::slice::from_raw_parts_mut(x_input_ptr, data_length)
@@ -147,7 +625,519 @@ pub fn single_whittaker(
         std::slice::from_raw_parts_mut(output_ptr, data_length)
     };
 
-    let diff_mat = ddmat(&x_input.to_vec(), data_length, d as usize);
+    smooth_with(
+        Spacing::Irregular(x_input),
+        y_input,
+        weights,
+        None,
+        smoothing,
+        d as usize,
+        output,
+    )
+    .expect("Could not create solver.")
+    .0
+}
+
+/// `smooth_series`, `smooth_series_auto` or `smooth_series_robust` with the
+/// buffers of this thread, returning the lambda used and the number of
+/// fits.
+fn smooth_with(
+    spacing: Spacing,
+    y_input: &[f64],
+    weights: &[f64],
+    mask: Option<&[u8]>,
+    smoothing: Smoothing,
+    d: usize,
+    output: &mut [f64],
+) -> Result<(f64, usize), NotPositiveDefinite> {
+    SYSTEM.with(|system| {
+        let system = &mut system.borrow_mut();
+
+        match smoothing {
+            Smoothing::Fixed(lambda) => {
+                match spacing {
+                    Spacing::Penalty(penalty) => {
+                        system.assign_scaled(penalty, lambda)
+                    }
+                    Spacing::Irregular(x) => {
+                        difference_penalty(Some(x), y_input.len(), d, system);
+                        system.scale(lambda);
+                    }
+                    Spacing::Even => {
+                        difference_penalty(None, y_input.len(), d, system);
+                        system.scale(lambda);
+                    }
+                }
+                solve_penalised(y_input, weights, mask, system, output)?;
+                Ok((lambda, 1))
+            }
+            Smoothing::Auto { grid, criterion } => SELECTION.with(|buffers| {
+                smooth_series_auto(
+                    spacing,
+                    y_input,
+                    weights,
+                    mask,
+                    grid,
+                    criterion,
+                    d,
+                    system,
+                    &mut buffers.borrow_mut(),
+                    output,
+                )
+                .map(|lambda| (lambda, grid.len() + 1))
+            }),
+            Smoothing::Robust {
+                lambda,
+                reweighting,
+                iterations,
+                tolerance,
+            } => ROBUST.with(|buffers| {
+                smooth_series_robust(
+                    spacing,
+                    y_input,
+                    weights,
+                    mask,
+                    lambda,
+                    reweighting,
+                    iterations,
+                    tolerance,
+                    d,
+                    system,
+                    &mut buffers.borrow_mut(),
+                    output,
+                )
+                .map(|fits| (lambda, fits))
+            }),
+        }
+    })
+}
+
+/// Solve `(W + lambda DᵀD) z = W y` for one series and write z to `output`.
+///
+/// The system is symmetric with bandwidth `d`, so it is factorised with a
+/// banded Cholesky in O(n d²). `system` is only used as workspace. Missing
+/// values and non-finite weights get a weight of zero, so the smoother
+/// interpolates over them. A series without any weighted value is all NaN.
+pub fn smooth_series(
+    x_input: Option<&[f64]>,
+    y_input: &[f64],
+    weights: &[f64],
+    mask: Option<&[u8]>,
+    lambda: f64,
+    d: usize,
+    system: &mut SymBandMatrix,
+    output: &mut [f64],
+) -> Result<(), NotPositiveDefinite> {
+    difference_penalty(x_input, y_input.len(), d, system);
+
+    system.scale(lambda);
+
+    solve_penalised(y_input, weights, mask, system, output)
+}
+
+/// Add the weights to `system`, which holds `lambda DᵀD`, and solve it as
+/// in `smooth_series`.
+fn solve_penalised(
+    y_input: &[f64],
+    weights: &[f64],
+    mask: Option<&[u8]>,
+    system: &mut SymBandMatrix,
+    output: &mut [f64],
+) -> Result<(), NotPositiveDefinite> {
+    let mut total_weight = 0_f64;
+
+    for (i, (w, y)) in weights.iter().zip(y_input).enumerate() {
+        let w = if is_valid(*y, mask, i) && w.is_finite() {
+            *w
+        } else {
+            0_f64
+        };
+
+        system.add(i, i, w);
+        output[i] = if w == 0_f64 { 0_f64 } else { w * y };
+        total_weight += w.abs();
+    }
+
+    if total_weight == 0_f64 {
+        output.iter_mut().for_each(|out| *out = f64::NAN);
+        return Ok(());
+    }
+
+    system.factorize()?;
+    system.solve(output);
+
+    Ok(())
+}
+
+/// Whether a series can be smoothed: `SeriesStatus::TooShort` with fewer
+/// than `d + 1` values, `SeriesStatus::NonFinite` with non-finite x values
+/// or without any valid value of finite, non-zero weight, and
+/// `SeriesStatus::Ok` otherwise.
+pub fn check_series(
+    x_input: Option<&[f64]>,
+    y_input: &[f64],
+    weights: &[f64],
+    mask: Option<&[u8]>,
+    d: usize,
+) -> SeriesStatus {
+    let weighted = |(i, (w, y)): (usize, (&f64, &f64))| {
+        is_valid(*y, mask, i) && w.is_finite() && *w != 0_f64
+    };
+
+    if y_input.len() <= d {
+        SeriesStatus::TooShort
+    } else if !x_input.map_or(true, |x| x.iter().all(|x| x.is_finite()))
+        || !weights.iter().zip(y_input).enumerate().any(weighted)
+    {
+        SeriesStatus::NonFinite
+    } else {
+        SeriesStatus::Ok
+    }
+}
+
+/// Scratch space of `smooth_series_auto`.
+#[derive(Default)]
+pub struct SelectionBuffers {
+    penalty: SymBandMatrix,
+    inverse: SymBandMatrix,
+    weights: Vec<f64>,
+    scores: Vec<(f64, f64)>,
+}
+
+/// Smooth one series with the lambda of `grid` that minimises `criterion`,
+/// and return that lambda.
+///
+/// The penalty `DᵀD` is built once and every candidate only adds the
+/// weights, factorises and solves the banded system. `Criterion::Gcv`
+/// minimises `m |W½(y - z)|² / (m - tr H)²` over the `m` weighted values,
+/// where the leverages of the hat matrix `H = (W + lambda DᵀD)⁻¹ W` are
+/// `w_i` times the diagonal of the inverse, which `inverse_band` gives from
+/// the same factor in O(n d²). `Criterion::VCurve` takes the geometric mean
+/// of the two neighbouring lambdas between which the curve of
+/// `(log |W½(y - z)|², log |Dz|²)` moves the least (Frasso and Eilers,
+/// 2015). A series without any weighted value is all NaN, with a NaN
+/// lambda.
+pub fn smooth_series_auto(
+    spacing: Spacing,
+    y_input: &[f64],
+    weights: &[f64],
+    mask: Option<&[u8]>,
+    grid: &[f64],
+    criterion: Criterion,
+    d: usize,
+    system: &mut SymBandMatrix,
+    buffers: &mut SelectionBuffers,
+    output: &mut [f64],
+) -> Result<f64, NotPositiveDefinite> {
+    let SelectionBuffers {
+        penalty,
+        inverse,
+        weights: valid_weights,
+        scores,
+    } = buffers;
+
+    let penalty: &SymBandMatrix = match spacing {
+        Spacing::Penalty(shared) => shared,
+        Spacing::Irregular(x) => {
+            difference_penalty(Some(x), y_input.len(), d, penalty);
+            penalty
+        }
+        Spacing::Even => {
+            difference_penalty(None, y_input.len(), d, penalty);
+            penalty
+        }
+    };
+
+    valid_weights.clear();
+    valid_weights.extend(weights.iter().zip(y_input).enumerate().map(
+        |(i, (w, y))| {
+            if is_valid(*y, mask, i) && w.is_finite() {
+                *w
+            } else {
+                0_f64
+            }
+        },
+    ));
+
+    let weighted = valid_weights.iter().filter(|w| **w != 0_f64).count();
+    if weighted == 0 {
+        output.iter_mut().for_each(|out| *out = f64::NAN);
+        return Ok(f64::NAN);
+    }
+    let weighted = weighted as f64;
+
+    scores.clear();
+    for lambda in grid {
+        system.assign_scaled(penalty, *lambda);
+        system.add_diagonal(valid_weights);
+        system.factorize()?;
+
+        for ((out, w), y) in
+            output.iter_mut().zip(&*valid_weights).zip(y_input)
+        {
+            *out = if *w == 0_f64 { 0_f64 } else { w * y };
+        }
+        system.solve(output);
+
+        let fit: f64 = output
+            .iter()
+            .zip(&*valid_weights)
+            .zip(y_input)
+            .filter(|(_, y)| y.is_finite())
+            .map(|((z, w), y)| w * (y - z) * (y - z))
+            .sum();
+
+        scores.push(match criterion {
+            Criterion::Gcv => {
+                system.inverse_band(inverse);
+                let trace: f64 = valid_weights
+                    .iter()
+                    .enumerate()
+                    .map(|(i, w)| w * inverse.get(i, i))
+                    .sum();
+                let residual_dof = weighted - trace;
+                (weighted * fit / (residual_dof * residual_dof), 0_f64)
+            }
+            Criterion::VCurve => {
+                (fit.ln(), penalty.quadratic_form(output).ln())
+            }
+        });
+    }
+
+    let lambda =
+        match criterion {
+            Criterion::Gcv => {
+                argmin(scores.iter().map(|score| score.0)).map(|k| grid[k])
+            }
+            Criterion::VCurve if grid.len() == 1 => Some(grid[0]),
+            Criterion::VCurve => argmin(scores.windows(2).map(|pair| {
+                (pair[1].0 - pair[0].0).hypot(pair[1].1 - pair[0].1)
+            }))
+            .map(|k| (grid[k] * grid[k + 1]).sqrt()),
+        };
+
+    // Without a finite score, fall back on the middle of the grid.
+    let lambda = lambda.unwrap_or(grid[grid.len() / 2]);
+
+    system.assign_scaled(penalty, lambda);
+    solve_penalised(y_input, weights, mask, system, output)?;
+
+    Ok(lambda)
+}
+
+/// Scratch space of `smooth_series_robust`.
+#[derive(Default)]
+pub struct RobustBuffers {
+    penalty: SymBandMatrix,
+    base: Vec<f64>,
+    weights: Vec<f64>,
+    previous: Vec<f64>,
+    residuals: Vec<f64>,
+}
+
+/// Smooth one series, then refit it with weights updated from the
+/// residuals by `reweighting`, and return the number of fits.
+///
+/// Only the diagonal `W` of `W + lambda DᵀD` changes between fits, so the
+/// penalty is built once and each fit only adds the new weights to a copy
+/// of it before factorising. The fits stop after `iterations`, or once
+/// `|z - z_previous| <= tolerance |z_previous|`, or when the weights would
+/// all be zero, in which case the last fit is kept. A series without any
+/// weighted value is all NaN.
+pub fn smooth_series_robust(
+    spacing: Spacing,
+    y_input: &[f64],
+    weights: &[f64],
+    mask: Option<&[u8]>,
+    lambda: f64,
+    reweighting: Reweighting,
+    iterations: usize,
+    tolerance: f64,
+    d: usize,
+    system: &mut SymBandMatrix,
+    buffers: &mut RobustBuffers,
+    output: &mut [f64],
+) -> Result<usize, NotPositiveDefinite> {
+    let RobustBuffers {
+        penalty,
+        base,
+        weights: current,
+        previous,
+        residuals,
+    } = buffers;
+
+    let penalty: &SymBandMatrix = match spacing {
+        Spacing::Penalty(shared) => shared,
+        Spacing::Irregular(x) => {
+            difference_penalty(Some(x), y_input.len(), d, penalty);
+            penalty
+        }
+        Spacing::Even => {
+            difference_penalty(None, y_input.len(), d, penalty);
+            penalty
+        }
+    };
+
+    base.clear();
+    base.extend(weights.iter().zip(y_input).enumerate().map(|(i, (w, y))| {
+        if is_valid(*y, mask, i) && w.is_finite() {
+            *w
+        } else {
+            0_f64
+        }
+    }));
+
+    if base.iter().all(|w| *w == 0_f64) {
+        output.iter_mut().for_each(|out| *out = f64::NAN);
+        return Ok(0);
+    }
+
+    current.clear();
+    current.extend_from_slice(base);
+
+    let mut fits = 0;
+
+    loop {
+        system.assign_scaled(penalty, lambda);
+        system.add_diagonal(current);
+        system.factorize()?;
+
+        for ((out, w), y) in output.iter_mut().zip(&*current).zip(y_input) {
+            *out = if *w == 0_f64 { 0_f64 } else { w * y };
+        }
+        system.solve(output);
+        fits += 1;
+
+        if fits > 1 {
+            let (change, size) = output.iter().zip(&*previous).fold(
+                (0_f64, 0_f64),
+                |(change, size), (z, p)| {
+                    (change + (z - p) * (z - p), size + p * p)
+                },
+            );
+            if change.sqrt() <= tolerance * size.sqrt() {
+                break;
+            }
+        }
+
+        if fits == iterations {
+            break;
+        }
+
+        reweight(reweighting, y_input, base, output, residuals, current);
+
+        if current.iter().all(|w| *w == 0_f64) {
+            break;
+        }
+
+        previous.clear();
+        previous.extend_from_slice(output);
+    }
+
+    Ok(fits)
+}
+
+/// Weights of the next robust fit from the fit `z`, see `Reweighting`.
+fn reweight(
+    reweighting: Reweighting,
+    y_input: &[f64],
+    base: &[f64],
+    z: &[f64],
+    residuals: &mut Vec<f64>,
+    weights: &mut [f64],
+) {
+    let weighted = || {
+        base.iter()
+            .zip(y_input.iter().zip(z))
+            .filter(|(w, _)| **w != 0_f64)
+            .map(|(_, (y, z))| y - z)
+    };
+
+    let scale = match reweighting {
+        Reweighting::Asymmetric(_) => 0_f64,
+        Reweighting::Envelope => {
+            weighted().fold(0_f64, |largest, r| largest.max(-r))
+        }
+        Reweighting::Bisquare => {
+            residuals.clear();
+            residuals.extend(weighted().map(f64::abs));
+            let middle = residuals.len() / 2;
+            residuals.select_nth_unstable_by(middle, |a, b| {
+                a.partial_cmp(b).unwrap()
+            });
+            4.685 * 1.4826 * residuals[middle]
+        }
+    };
+
+    for (((weight, base), y), z) in
+        weights.iter_mut().zip(base).zip(y_input).zip(z)
+    {
+        if *base == 0_f64 {
+            *weight = 0_f64;
+            continue;
+        }
+
+        let r = y - z;
+        let factor = match reweighting {
+            Reweighting::Asymmetric(p) => {
+                if r > 0_f64 {
+                    p
+                } else {
+                    1_f64 - p
+                }
+            }
+            Reweighting::Envelope => {
+                if r >= 0_f64 || scale == 0_f64 {
+                    1_f64
+                } else {
+                    1_f64 + r / scale
+                }
+            }
+            Reweighting::Bisquare => {
+                if scale == 0_f64 {
+                    1_f64
+                } else {
+                    let u = r / scale;
+                    if u.abs() < 1_f64 {
+                        (1_f64 - u * u) * (1_f64 - u * u)
+                    } else {
+                        0_f64
+                    }
+                }
+            }
+        };
+
+        *weight = base * factor;
+    }
+}
+
+/// Index of the smallest finite value, if there is one.
+fn argmin(values: impl Iterator<Item = f64>) -> Option<usize> {
+    values
+        .enumerate()
+        .filter(|(_, value)| value.is_finite())
+        .fold(None, |best: Option<(usize, f64)>, (k, value)| match best {
+            Some((_, lowest)) if lowest <= value => best,
+            _ => Some((k, value)),
+        })
+        .map(|(k, _)| k)
+}
+
+/// The original general sparse LDL implementation of the smoother, kept as
+/// a reference for testing the banded solver.
+pub fn whittaker_sparse_reference(
+    x_input: Option<&[f64]>,
+    y_input: &[f64],
+    weights: &[f64],
+    lambda: f64,
+    d: i64,
+) -> Vec<f64> {
+    let data_length = y_input.len();
+
+    let diff_mat = match x_input {
+        Some(x_input) => ddmat(&x_input.to_vec(), data_length, d as usize),
+        None => dif_no_ddmat(&CsMat::eye(data_length), d),
+    };
 
     let diags = (0..data_length).collect::<Vec<usize>>();
     let weights_matrix = TriMatBase::from_triplets(
@@ -167,17 +1157,13 @@ pub fn single_whittaker(
         .numeric(to_solve.view())
         .expect("Could not create solver.");
 
-    let smoothed_y = ldl.solve(
+    ldl.solve(
         weights
             .iter()
             .zip(y_input)
             .map(|(a, b)| *a * *b)
             .collect::<Vec<f64>>(),
-    );
-
-    for i in 0..data_length {
-        output[i] = smoothed_y[i]
-    }
+    )
 }
 
 fn ddmat(x: &Vec<f64>, size: usize, d: usize) -> CsMat<f64> {
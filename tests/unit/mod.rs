@@ -3,3 +3,21 @@ pub mod test_smoothers;
 
 #[cfg(test)]
 pub mod test_convolve;
+
+#[cfg(test)]
+pub mod test_scheduler;
+
+#[cfg(test)]
+pub mod test_strided;
+
+#[cfg(test)]
+pub mod test_dense;
+
+#[cfg(test)]
+pub mod test_gp;
+
+#[cfg(test)]
+pub mod test_ndvi;
+
+#[cfg(test)]
+pub mod test_pipeline;
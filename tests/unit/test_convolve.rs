@@ -1,4 +1,6 @@
-use EOkit::math_utils::convolve::{convolve_1d, ConvType};
+use EOkit::math_utils::convolve::{
+    convolve_1d, convolve_1d_with, output_length, ConvMethod, ConvType,
+};
 
 #[test]
 fn test_1d_convolve() {
@@ -16,3 +18,58 @@ fn test_1d_convolve() {
     assert!(actual_z_valid.iter().eq(z_valid.iter()));
     assert!(actual_z_full.iter().eq(z_full.iter()));
 }
+
+#[test]
+fn test_1d_convolve_same() {
+    let x: Vec<f64> = vec![1., 2., 3., 4., 5., 6., 7., 8., 9., 10.];
+
+    let z_same_even = convolve_1d(&x, &vec![1., 2., 3., 4.], ConvType::Same);
+    let z_same_odd = convolve_1d(&vec![1., 2., 3.], &x, ConvType::Same);
+
+    // From numpy.convolve(..., mode="same").
+    let actual_z_same_even =
+        vec![4., 10., 20., 30., 40., 50., 60., 70., 80., 79.];
+    let actual_z_same_odd =
+        vec![4., 10., 16., 22., 28., 34., 40., 46., 52., 47.];
+
+    assert!(actual_z_same_even.iter().eq(z_same_even.iter()));
+    assert!(actual_z_same_odd.iter().eq(z_same_odd.iter()));
+}
+
+#[test]
+fn test_1d_convolve_fft_matches_direct() {
+    let kernel: Vec<f64> =
+        (0..301).map(|i| ((i as f64) * 0.11).cos() / 301.).collect();
+
+    // One FFT block and several overlap-add blocks.
+    for signal_len in [3000, 20000].iter() {
+        let signal: Vec<f64> = (0..*signal_len)
+            .map(|i| ((i as f64) * 0.37).sin() + 0.5)
+            .collect();
+
+        for conv in [ConvType::Full, ConvType::Valid, ConvType::Same].iter() {
+            let n = output_length(signal.len(), kernel.len(), conv);
+            let mut direct = vec![0.; n];
+            let mut fft = vec![0.; n];
+
+            convolve_1d_with(
+                &signal,
+                &kernel,
+                *conv,
+                ConvMethod::Direct,
+                &mut direct,
+            );
+            convolve_1d_with(
+                &signal,
+                &kernel,
+                *conv,
+                ConvMethod::Fft,
+                &mut fft,
+            );
+
+            for (d, f) in direct.iter().zip(fft.iter()) {
+                assert!((d - f).abs() < 1e-10);
+            }
+        }
+    }
+}
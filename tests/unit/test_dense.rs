@@ -0,0 +1,104 @@
+use EOkit::math_utils::dense::{cholesky, cholesky_solve, gemm};
+
+fn naive_product(
+    a: &[f64],
+    b: &[f64],
+    rows: usize,
+    inner: usize,
+    cols: usize,
+) -> Vec<f64> {
+    let mut c = vec![0.; rows * cols];
+    for r in 0..rows {
+        for k in 0..inner {
+            for j in 0..cols {
+                c[r * cols + j] += a[r * inner + k] * b[k * cols + j];
+            }
+        }
+    }
+    c
+}
+
+#[test]
+fn test_gemm_matches_naive_product() {
+    // Sizes that do not divide the tiles.
+    let (rows, inner, cols) = (7, 300, 261);
+
+    let a: Vec<f64> = (0..rows * inner)
+        .map(|i| ((i * 31) % 17) as f64 - 8.)
+        .collect();
+    let b: Vec<f64> = (0..inner * cols)
+        .map(|i| ((i * 7) % 13) as f64 * 0.25)
+        .collect();
+
+    let mut c = vec![f64::NAN; rows * cols];
+    gemm(&a, &b, &mut c, rows, inner, cols);
+
+    for (fast, slow) in c.iter().zip(naive_product(&a, &b, rows, inner, cols))
+    {
+        assert!((fast - slow).abs() < 1e-9);
+    }
+}
+
+#[test]
+fn test_cholesky_solve_recovers_solution() {
+    let n = 30;
+    let cols = 4;
+
+    // Kernel matrix with noise on the diagonal, as used by the GPs.
+    let mut a = vec![0.; n * n];
+    for i in 0..n {
+        for j in 0..n {
+            let d = (i as f64 - j as f64) * 0.4;
+            a[i * n + j] = (-d * d / 2.).exp();
+        }
+        a[i * n + i] += 0.1;
+    }
+
+    let x: Vec<f64> = (0..n * cols).map(|i| (i as f64 * 0.7).sin()).collect();
+    let mut b = naive_product(&a, &x, n, n, cols);
+
+    let mut l = a.clone();
+    cholesky(&mut l, n).unwrap();
+    cholesky_solve(&l, n, &mut b, cols);
+
+    for (solved, expected) in b.iter().zip(x.iter()) {
+        assert!((solved - expected).abs() < 1e-8);
+    }
+
+    let mut singular = vec![1.; 4];
+    assert!(cholesky(&mut singular, 2).is_err());
+}
+
+#[test]
+fn test_blocked_cholesky_matches_reconstruction() {
+    // Spans several panels, with a partial one at the end.
+    let n = 150;
+
+    let mut a = vec![0.; n * n];
+    for i in 0..n {
+        for j in 0..n {
+            let d = (i as f64 - j as f64) * 0.2;
+            a[i * n + j] = 0.5 * (-d * d / 2.).exp();
+        }
+        a[i * n + i] += 0.05;
+    }
+
+    let mut l = a.clone();
+    cholesky(&mut l, n).unwrap();
+
+    for i in 0..n {
+        for j in 0..n {
+            let product: f64 =
+                (0..n).map(|k| l[i * n + k] * l[j * n + k]).sum();
+            assert!((product - a[i * n + j]).abs() < 1e-10);
+        }
+    }
+
+    let x: Vec<f64> = (0..n).map(|i| (i as f64 * 0.3).cos()).collect();
+    let mut b = naive_product(&a, &x, n, n, 1);
+    cholesky_solve(&l, n, &mut b, 1);
+
+    for (solved, expected) in b.iter().zip(x.iter()) {
+        assert!((solved - expected).abs() < 1e-7);
+    }
+}
@@ -0,0 +1,512 @@
+use rusty_machine::learning::gp::{ConstMean, GaussianProcess};
+use rusty_machine::learning::{toolkit::kernel, SupModel};
+use rusty_machine::linalg::{Matrix, Vector};
+
+use EOkit::gaussian_processes::engine::{
+    predict_sparse, RbfKernel, SparseBuffers, Workspace,
+};
+use EOkit::gaussian_processes::hyperparameters::{
+    fit_multiple_gps, log_marginal_likelihood, maximise, LikelihoodWorkspace,
+};
+use EOkit::gaussian_processes::online::{online_gps, packed_size};
+use EOkit::math_utils::dense::{cholesky, cholesky_solve};
+use EOkit::parallel::status::SeriesStatus;
+
+fn ndvi_like(n: usize) -> (Vec<f64>, Vec<f64>) {
+    let x: Vec<f64> = (0..n).map(|i| i as f64 * 5.).collect();
+    let y: Vec<f64> = (0..n)
+        .map(|i| {
+            0.3 * (i as f64 * 2. * std::f64::consts::PI / 73.).sin()
+                + ((i * 7919) % 101) as f64 * 0.001
+                - 0.05
+        })
+        .collect();
+    (x, y)
+}
+
+fn rusty_machine_predict(
+    x: &[f64],
+    y: &[f64],
+    forecast_spacing: i64,
+    forecast_amount: i64,
+    length_scale: f64,
+    amplitude: f64,
+    noise: f64,
+) -> Vec<f64> {
+    let ker = kernel::SquaredExp::new(length_scale, amplitude);
+    let mut gp = GaussianProcess::new(ker, ConstMean::default(), noise);
+    gp.train(&Matrix::new(x.len(), 1, x), &Vector::new(y))
+        .unwrap();
+
+    let mut points = x.to_vec();
+    let last = *x.last().unwrap();
+    points.extend(
+        (1..forecast_amount + 1).map(|i| (i * forecast_spacing) as f64 + last),
+    );
+
+    gp.predict(&Matrix::new(points.len(), 1, points))
+        .unwrap()
+        .into_vec()
+}
+
+#[test]
+fn test_engine_matches_rusty_machine() {
+    // Lengths either side of the Cholesky block size.
+    for n in [10, 64, 150].iter() {
+        let (x, y) = ndvi_like(*n);
+        let expected = rusty_machine_predict(&x, &y, 8, 4, 30., 0.5, 0.1);
+
+        let mut output = vec![0.; n + 4];
+        Workspace::default()
+            .predict(
+                RbfKernel::new(30., 0.5),
+                0.1,
+                0,
+                &x,
+                &y,
+                &x,
+                8,
+                &mut output,
+            )
+            .unwrap();
+
+        for (ours, theirs) in output.iter().zip(expected.iter()) {
+            assert!((ours - theirs).abs() < 1e-8);
+        }
+    }
+}
+
+#[test]
+fn test_engine_f32_close_to_f64() {
+    let (x, y) = ndvi_like(120);
+
+    let mut output = vec![0.; 123];
+    Workspace::default()
+        .predict(RbfKernel::new(30., 0.5), 0.1, 0, &x, &y, &x, 8, &mut output)
+        .unwrap();
+
+    let x_f32: Vec<f32> = x.iter().map(|x| *x as f32).collect();
+    let y_f32: Vec<f32> = y.iter().map(|y| *y as f32).collect();
+
+    let mut output_f32 = vec![0_f32; 123];
+    Workspace::default()
+        .predict(
+            RbfKernel::new(30., 0.5),
+            0.1,
+            0,
+            &x_f32,
+            &y_f32,
+            &x_f32,
+            8,
+            &mut output_f32,
+        )
+        .unwrap();
+
+    for (single, double) in output_f32.iter().zip(output.iter()) {
+        assert!((*single as f64 - double).abs() < 1e-4);
+    }
+}
+
+#[test]
+fn test_sparse_with_every_point_matches_exact() {
+    // Inducing points at the training points make DTC exact, up to the
+    // jitter on the inducing kernel matrix.
+    let (x, y) = ndvi_like(80);
+
+    let mut exact = vec![0.; 83];
+    let mut workspace = Workspace::default();
+    workspace
+        .predict(RbfKernel::new(30., 0.5), 0.1, 0, &x, &y, &x, 8, &mut exact)
+        .unwrap();
+
+    let mut sparse = vec![0.; 83];
+    let (mut system, mut alpha, mut inducing, mut factor, mut cross) =
+        (vec![], vec![], vec![], vec![], vec![]);
+    predict_sparse(
+        RbfKernel::new(30., 0.5),
+        0.1,
+        80,
+        &x,
+        &y,
+        &x,
+        8,
+        SparseBuffers {
+            system: &mut system,
+            alpha: &mut alpha,
+            inducing: &mut inducing,
+            factor: &mut factor,
+            cross: &mut cross,
+        },
+        &mut sparse,
+    )
+    .unwrap();
+
+    for (s, e) in sparse.iter().zip(exact.iter()) {
+        assert!((s - e).abs() < 1e-5);
+    }
+}
+
+#[test]
+fn test_sparse_converges_to_exact() {
+    let (x, y) = ndvi_like(600);
+
+    let mut workspace = Workspace::default();
+    let mut exact = vec![0.; 600];
+    workspace
+        .predict(RbfKernel::new(30., 0.5), 0.1, 0, &x, &y, &x, 8, &mut exact)
+        .unwrap();
+
+    let max_error = |inducing_points: usize| {
+        let mut sparse = vec![0.; 600];
+        Workspace::default()
+            .predict(
+                RbfKernel::new(30., 0.5),
+                0.1,
+                inducing_points,
+                &x,
+                &y,
+                &x,
+                8,
+                &mut sparse,
+            )
+            .unwrap();
+
+        sparse
+            .iter()
+            .zip(exact.iter())
+            .map(|(s, e)| (s - e).abs())
+            .fold(0., f64::max)
+    };
+
+    let coarse = max_error(40);
+    let fine = max_error(150);
+
+    assert!(fine < coarse);
+    assert!(fine < 1e-3);
+}
+
+fn direct_std(x: &[f64], points: &[f64], kernel: RbfKernel<f64>) -> Vec<f64> {
+    let n = x.len();
+    let mut system = vec![0.; n * n];
+    for i in 0..n {
+        for j in 0..n {
+            system[i * n + j] = kernel.eval(x[i], x[j]);
+        }
+        system[i * n + i] += 0.1;
+    }
+    cholesky(&mut system, n).unwrap();
+
+    points
+        .iter()
+        .map(|point| {
+            let k: Vec<f64> =
+                x.iter().map(|x| kernel.eval(*x, *point)).collect();
+            let mut solved = k.clone();
+            cholesky_solve(&system, n, &mut solved, 1);
+            let explained: f64 =
+                k.iter().zip(&solved).map(|(a, b)| a * b).sum();
+            (kernel.eval(*point, *point) - explained).sqrt()
+        })
+        .collect()
+}
+
+#[test]
+fn test_predictive_std_matches_direct_formula() {
+    let (x, y) = ndvi_like(100);
+    let kernel = RbfKernel::new(30., 0.5);
+
+    let mut points = x.clone();
+    points.extend((1..4).map(|i| 495. + (i * 8) as f64));
+    let expected = direct_std(&x, &points, kernel);
+
+    let mut workspace = Workspace::default();
+    let mut mean = vec![0.; 103];
+    workspace
+        .predict(kernel, 0.1, 0, &x, &y, &x, 8, &mut mean)
+        .unwrap();
+
+    let mut std = vec![0.; 103];
+    workspace.predictive_std(kernel, 0.1, 0, &x, &x, 8, 0, &mut std);
+    for (ours, direct) in std.iter().zip(expected.iter()) {
+        assert!((ours - direct).abs() < 1e-10);
+    }
+
+    // Only the forecasts, which grow more uncertain with the horizon.
+    let mut forecasts = vec![0.; 3];
+    workspace.predictive_std(kernel, 0.1, 0, &x, &x, 8, 100, &mut forecasts);
+    assert_eq!(forecasts, std[100..]);
+    assert!(forecasts[0] < forecasts[1] && forecasts[1] < forecasts[2]);
+
+    // The sparse deviations approach the exact ones with enough inducing
+    // points.
+    workspace
+        .predict(kernel, 0.1, 60, &x, &y, &x, 8, &mut mean)
+        .unwrap();
+    workspace.predictive_std(kernel, 0.1, 60, &x, &x, 8, 0, &mut std);
+    for (sparse, direct) in std.iter().zip(expected.iter()) {
+        assert!((sparse - direct).abs() < 1e-3);
+    }
+}
+
+#[test]
+fn test_likelihood_gradient_matches_finite_differences() {
+    let (x, y) = ndvi_like(40);
+    let mut workspace = LikelihoodWorkspace::default();
+
+    let point = [30_f64.ln(), 0.5_f64.ln(), 0.01_f64.ln()];
+    let (_, gradient) =
+        log_marginal_likelihood(&x, &y, &point, &mut workspace).unwrap();
+
+    let h = 1e-5;
+    for i in 0..3 {
+        let (mut up, mut down) = (point, point);
+        up[i] += h;
+        down[i] -= h;
+
+        let (value_up, _) =
+            log_marginal_likelihood(&x, &y, &up, &mut workspace).unwrap();
+        let (value_down, _) =
+            log_marginal_likelihood(&x, &y, &down, &mut workspace).unwrap();
+
+        let numerical = (value_up - value_down) / (2. * h);
+        assert!(
+            (numerical - gradient[i]).abs() < 1e-4 * (1. + numerical.abs())
+        );
+    }
+}
+
+#[test]
+fn test_fit_recovers_noise_and_improves_likelihood() {
+    let n = 150;
+    let x: Vec<f64> = (0..n).map(|i| i as f64 * 2.).collect();
+
+    // A smooth curve plus deterministic noise of standard deviation ~0.05.
+    let y: Vec<f64> = (0..n)
+        .map(|i| {
+            let noise = (((i * 7919) % 101) as f64 / 100. - 0.5) * 0.17;
+            0.3 * (x[i] / 25.).sin() + noise
+        })
+        .collect();
+    let mean = y.iter().sum::<f64>() / n as f64;
+    let y: Vec<f64> = y.iter().map(|y| y - mean).collect();
+
+    let mut workspace = LikelihoodWorkspace::default();
+    let start = [100_f64.ln(), 1_f64.ln(), 1_f64.ln()];
+
+    let fitted = maximise(
+        |p| log_marginal_likelihood(&x, &y, p, &mut workspace).ok(),
+        start,
+        100,
+    );
+
+    let (start_value, _) =
+        log_marginal_likelihood(&x, &y, &start, &mut workspace).unwrap();
+    let (fitted_value, gradient) =
+        log_marginal_likelihood(&x, &y, &fitted, &mut workspace).unwrap();
+
+    assert!(fitted_value > start_value);
+    assert!(gradient.iter().all(|g| g.abs() < 1e-2));
+
+    // The noise variance of the added term is about 0.0024.
+    let noise = fitted[2].exp();
+    assert!(noise > 0.001 && noise < 0.005);
+}
+
+#[test]
+fn test_online_gp_matches_refit_on_window() {
+    let (n_pixels, n, window, forecasts) = (2, 40, 10, 3);
+    let (x, y) = ndvi_like(n_pixels * n);
+    let x = &x[..n];
+    let mut y = y;
+    y[5] = f64::NAN;
+    y[n + 38] = f64::NAN;
+
+    let mut stored_x = vec![f64::NAN; n_pixels * window];
+    let mut stored_y = vec![f64::NAN; n_pixels * window];
+    let mut factor = vec![0.; n_pixels * packed_size(window)];
+    let mut lengths = vec![0_usize; n_pixels];
+    let mut output = vec![0.; n_pixels * (window + forecasts)];
+
+    for count in 1..n + 1 {
+        let mut new_x = vec![x[count - 1]];
+        let mut new_y: Vec<f64> =
+            (0..n_pixels).map(|p| y[p * n + count - 1]).collect();
+
+        online_gps(
+            stored_x.as_mut_ptr(),
+            stored_y.as_mut_ptr(),
+            factor.as_mut_ptr(),
+            lengths.as_mut_ptr(),
+            n_pixels,
+            window,
+            new_x.as_mut_ptr(),
+            new_y.as_mut_ptr(),
+            std::ptr::null_mut(),
+            1,
+            output.as_mut_ptr(),
+            8,
+            forecasts as i64,
+            30.,
+            0.5,
+            0.1,
+            std::ptr::null_mut(),
+            1,
+            -1,
+        );
+    }
+
+    for p in 0..n_pixels {
+        // The last window valid values, fitted from scratch.
+        let valid: Vec<(f64, f64)> = x
+            .iter()
+            .zip(&y[p * n..(p + 1) * n])
+            .filter(|(_, y)| y.is_finite())
+            .map(|(x, y)| (*x, *y))
+            .collect();
+        let valid = &valid[valid.len() - window..];
+        let train_x: Vec<f64> = valid.iter().map(|v| v.0).collect();
+        let mean = valid.iter().map(|v| v.1).sum::<f64>() / window as f64;
+        let train_y: Vec<f64> = valid.iter().map(|v| v.1 - mean).collect();
+
+        let mut points = train_x.clone();
+        points.extend((1..forecasts + 1).map(|j| x[n - 1] + (8 * j) as f64));
+
+        let mut expected = vec![0.; window + forecasts];
+        Workspace::default()
+            .predict(
+                RbfKernel::new(30., 0.5),
+                0.1,
+                0,
+                &train_x,
+                &train_y,
+                &points,
+                0,
+                &mut expected,
+            )
+            .unwrap();
+
+        assert_eq!(lengths[p], window);
+        let online = &output[p * (window + forecasts)..];
+        for (ours, refit) in online.iter().zip(expected.iter()) {
+            assert!((ours - (refit + mean)).abs() < 1e-9);
+        }
+    }
+}
+
+#[test]
+fn test_shared_fit_leaves_out_failing_series() {
+    let (x, y) = ndvi_like(40);
+    let n_good = 3;
+
+    // Shared fit of the good series alone, then with one whose kernel
+    // matrix cannot be built.
+    let fit = |n_series: usize| {
+        let mut x_input = x.repeat(n_series);
+        let mut y_input = y.repeat(n_series);
+        if n_series > n_good {
+            x_input[n_good * 40 + 7] = f64::NAN;
+        }
+        let mut indices: Vec<usize> = (0..n_series).map(|s| s * 40).collect();
+        let mut output = vec![0.; 40 * n_series];
+        let mut parameters = vec![vec![0.; n_series]; 3];
+        let mut statuses = vec![255u8; n_series];
+
+        fit_multiple_gps(
+            x_input.as_mut_ptr(),
+            y_input.as_mut_ptr(),
+            std::ptr::null_mut(),
+            x_input.len(),
+            indices.as_mut_ptr(),
+            n_series,
+            output.as_mut_ptr(),
+            output.len(),
+            5,
+            0,
+            30.,
+            0.5,
+            0.1,
+            parameters[0].as_mut_ptr(),
+            parameters[1].as_mut_ptr(),
+            parameters[2].as_mut_ptr(),
+            true,
+            50,
+            statuses.as_mut_ptr(),
+            2,
+            -1,
+        );
+
+        (parameters[0][0], output, statuses)
+    };
+
+    let (expected, _, _) = fit(n_good);
+    let (length_scale, output, statuses) = fit(n_good + 1);
+
+    assert!((length_scale - 30.).abs() > 1e-3);
+    assert!((length_scale - expected).abs() < 1e-9 * expected);
+    assert!(output[..n_good * 40].iter().all(|v| v.is_finite()));
+    assert!(output[n_good * 40..].iter().all(|v| v.is_nan()));
+    assert_eq!(statuses, vec![0, 0, 0, SeriesStatus::NonFinite as u8],);
+}
+
+#[test]
+fn test_online_gp_reports_pixels_it_cannot_update() {
+    let (n_pixels, window) = (3, 4);
+    let mut stored_x = vec![f64::NAN; n_pixels * window];
+    let mut stored_y = vec![f64::NAN; n_pixels * window];
+    let mut factor = vec![0.; n_pixels * packed_size(window)];
+    let mut lengths = vec![0_usize; n_pixels];
+    let mut output = vec![0.; n_pixels * window];
+    let mut statuses = vec![255u8; n_pixels];
+
+    // Without noise a repeated date makes the kernel matrix singular. The
+    // second pixel sees it twice, the third has no valid value.
+    let mut update = |x: f64, y: [f64; 3]| {
+        let (mut new_x, mut new_y) = (vec![x], y.to_vec());
+        online_gps(
+            stored_x.as_mut_ptr(),
+            stored_y.as_mut_ptr(),
+            factor.as_mut_ptr(),
+            lengths.as_mut_ptr(),
+            n_pixels,
+            window,
+            new_x.as_mut_ptr(),
+            new_y.as_mut_ptr(),
+            std::ptr::null_mut(),
+            1,
+            output.as_mut_ptr(),
+            8,
+            0,
+            30.,
+            1.,
+            0.,
+            statuses.as_mut_ptr(),
+            1,
+            -1,
+        );
+        (output.clone(), statuses.clone(), lengths.clone())
+    };
+
+    update(0., [0.1, 0.2, f64::NAN]);
+    update(10., [0.2, f64::NAN, f64::NAN]);
+    let (output, statuses, lengths) = update(0., [f64::NAN, 0.3, f64::NAN]);
+
+    let expected = [
+        SeriesStatus::Ok as u8,
+        SeriesStatus::SolverFailure as u8,
+        SeriesStatus::NonFinite as u8,
+    ];
+    assert_eq!(statuses, expected);
+    assert_eq!(lengths, vec![2, 1, 0]);
+    assert!(output[..2].iter().all(|v| v.is_finite()));
+    assert!(output[window..].iter().all(|v| v.is_nan()));
+
+    // The failed value was not stored, so the pixel takes later ones.
+    let (output, statuses, lengths) = update(f64::NAN, [0.3, 0.3, 0.3]);
+    assert_eq!(statuses, vec![2, 2, 2]);
+    assert_eq!(lengths, vec![2, 1, 0]);
+    assert!(output.iter().all(|v| v.is_nan()));
+
+    let (_, statuses, lengths) = update(20., [0.3, 0.3, 0.3]);
+    assert_eq!(statuses, vec![0, 0, 0]);
+    assert_eq!(lengths, vec![3, 2, 1]);
+}
@@ -0,0 +1,93 @@
+use EOkit::ndvi::chen::{cube_chens, multiple_chens};
+use EOkit::parallel::encoded::Encoding;
+use EOkit::parallel::status::SeriesStatus;
+
+fn seasonal(i: usize) -> f64 {
+    0.5 + 0.3 * (i as f64 * 2. * std::f64::consts::PI / 36.).sin()
+}
+
+#[test]
+fn test_chen_lifts_cloud_dips_to_the_envelope() {
+    let n = 72;
+    let clouds = [5, 17, 30, 31, 50, 63];
+
+    let mut y: Vec<f64> = (0..n).map(seasonal).collect();
+    for i in clouds.iter() {
+        y[*i] -= 0.25;
+    }
+    y[40] = f64::NAN;
+    let mut indices = vec![0];
+    let mut output = vec![0.; n];
+    let mut iterations = vec![0_u64; 1];
+
+    multiple_chens(
+        y.as_mut_ptr(),
+        std::ptr::null_mut(),
+        indices.as_mut_ptr(),
+        1,
+        output.as_mut_ptr(),
+        n,
+        iterations.as_mut_ptr(),
+        9,
+        2,
+        9,
+        4,
+        10,
+        std::ptr::null_mut(),
+        1,
+        -1,
+    );
+
+    assert!(iterations[0] >= 1 && iterations[0] <= 10);
+    assert!(output.iter().all(|z| z.is_finite()));
+
+    // Every dip ends up much closer to the clear sky curve.
+    for i in clouds.iter() {
+        assert!(
+            (output[*i] - seasonal(*i)).abs() < 0.03,
+            "{}: {} vs {}",
+            i,
+            output[*i],
+            seasonal(*i)
+        );
+    }
+
+    // The same series in a (time, pixels) cube, next to an empty pixel.
+    let mut cube: Vec<f64> =
+        y.iter().flat_map(|value| vec![*value, f64::NAN]).collect();
+    let mut cube_output = vec![0.; 2 * n];
+    let mut shape = vec![n, 2];
+    let mut strides = vec![2_isize, 1];
+    let mut statuses = vec![u8::MAX; 2];
+
+    cube_chens(
+        cube.as_mut_ptr() as *mut u8,
+        Encoding::f64(),
+        strides.as_mut_ptr(),
+        std::ptr::null_mut(),
+        strides.as_mut_ptr(),
+        cube_output.as_mut_ptr() as *mut u8,
+        Encoding::f64(),
+        strides.as_mut_ptr(),
+        shape.as_mut_ptr(),
+        2,
+        0,
+        9,
+        2,
+        9,
+        4,
+        10,
+        statuses.as_mut_ptr(),
+        2,
+        -1,
+    );
+
+    for i in 0..n {
+        assert_eq!(cube_output[2 * i], output[i]);
+        assert!(cube_output[2 * i + 1].is_nan());
+    }
+    assert_eq!(
+        statuses,
+        vec![SeriesStatus::Ok as u8, SeriesStatus::NonFinite as u8]
+    );
+}
@@ -0,0 +1,119 @@
+use EOkit::gaussian_processes::gp::multiple_gps;
+use EOkit::pipeline::fused::{multiple_pipelines, STAGE_PARAMETERS};
+use EOkit::smoothers::sav_golay::multiple_sav_golays;
+use EOkit::smoothers::whittaker::multiple_whittakers;
+
+#[test]
+fn test_pipeline_matches_the_stages_run_one_by_one() {
+    let lengths = [30, 45];
+    let total: usize = lengths.iter().sum();
+    let mut indices = vec![0, lengths[0]];
+
+    let mut y: Vec<f64> = (0..total)
+        .map(|k| (k as f64 / 5.).sin() + 0.1 * ((k * 13) % 7) as f64)
+        .collect();
+    y[12] = f64::NAN;
+    y[50] = f64::NAN;
+    let mut weights = vec![1.; total];
+
+    // Whittaker, then a first derivative, then a GP with 4 forecasts.
+    let mut kinds = vec![0_i64, 1, 2];
+    let mut parameters = vec![0.; 3 * STAGE_PARAMETERS];
+    parameters[..2].copy_from_slice(&[8., 2.]);
+    parameters[STAGE_PARAMETERS..STAGE_PARAMETERS + 4]
+        .copy_from_slice(&[7., 2., 1., 1.]);
+    parameters[2 * STAGE_PARAMETERS..2 * STAGE_PARAMETERS + 6]
+        .copy_from_slice(&[30., 0.5, 0.1, 10., 4., 0.]);
+
+    let mut smoothed = vec![0.; total];
+    let mut forecast = vec![0.; total + 2 * 4];
+    let mut outputs = vec![
+        smoothed.as_mut_ptr(),
+        std::ptr::null_mut(),
+        forecast.as_mut_ptr(),
+    ];
+
+    multiple_pipelines(
+        std::ptr::null_mut(),
+        y.as_mut_ptr(),
+        std::ptr::null_mut(),
+        indices.as_mut_ptr(),
+        2,
+        total,
+        kinds.as_mut_ptr(),
+        parameters.as_mut_ptr(),
+        3,
+        outputs.as_mut_ptr(),
+        std::ptr::null_mut(),
+        2,
+        -1,
+    );
+
+    let mut expected_smoothed = vec![0.; total];
+    multiple_whittakers(
+        std::ptr::null_mut(),
+        false,
+        y.as_mut_ptr(),
+        weights.as_mut_ptr(),
+        std::ptr::null_mut(),
+        indices.as_mut_ptr(),
+        2,
+        expected_smoothed.as_mut_ptr(),
+        total,
+        8.,
+        2,
+        std::ptr::null_mut(),
+        1,
+        -1,
+    );
+    assert_eq!(smoothed, expected_smoothed);
+
+    let mut derivative = vec![0.; total];
+    multiple_sav_golays(
+        expected_smoothed.as_mut_ptr(),
+        std::ptr::null_mut(),
+        indices.as_mut_ptr(),
+        2,
+        derivative.as_mut_ptr(),
+        total,
+        7,
+        2,
+        1,
+        1.,
+        std::ptr::null_mut(),
+        1,
+        -1,
+    );
+
+    // Without x the GP runs on the index of each value.
+    let mut x: Vec<f64> = lengths
+        .iter()
+        .flat_map(|n| (0..*n).map(|k| k as f64))
+        .collect();
+    let mut expected_forecast = vec![0.; total + 2 * 4];
+    multiple_gps(
+        x.as_mut_ptr(),
+        derivative.as_mut_ptr(),
+        std::ptr::null_mut(),
+        total,
+        indices.as_mut_ptr(),
+        2,
+        expected_forecast.as_mut_ptr(),
+        total + 2 * 4,
+        10,
+        4,
+        30.,
+        0.5,
+        0.1,
+        0,
+        std::ptr::null_mut(),
+        false,
+        std::ptr::null_mut(),
+        1,
+        1,
+    );
+
+    for (a, b) in forecast.iter().zip(&expected_forecast) {
+        assert!((a - b).abs() < 1e-9, "{} != {}", a, b);
+    }
+}
@@ -0,0 +1,120 @@
+use EOkit::parallel::control::{attach_control, CONTROL_SIZE};
+use EOkit::parallel::pool::{get_num_threads, pool_for};
+use EOkit::parallel::profile::{count, report, reset, set_level, Level};
+use EOkit::parallel::scheduler::{run_batch, Schedule};
+
+use std::sync::atomic::{AtomicUsize, Ordering};
+
+#[test]
+fn test_schedule_covers_every_series_once() {
+    let costs: Vec<f64> = (0..100).map(|i| ((i * 37) % 11) as f64).collect();
+
+    for chunk_size in [-1_i64, 1, 7, 100, 1000].iter() {
+        let schedule = Schedule::new(&costs, 4, *chunk_size);
+
+        let mut seen: Vec<usize> = (0..schedule.n_chunks())
+            .flat_map(|chunk| schedule.chunk(chunk).to_vec())
+            .collect();
+
+        if *chunk_size > 0 {
+            for chunk in 0..schedule.n_chunks() {
+                assert!(schedule.chunk(chunk).len() <= *chunk_size as usize);
+            }
+        }
+
+        seen.sort();
+        assert!(seen.iter().eq((0..100).collect::<Vec<usize>>().iter()));
+    }
+}
+
+#[test]
+fn test_schedule_starts_with_most_expensive() {
+    let costs = vec![1., 1000., 1., 1., 8., 1.];
+
+    let schedule = Schedule::new(&costs, 2, -1);
+
+    assert_eq!(schedule.chunk(0)[0], 1);
+    assert_eq!(schedule.chunk(0).len(), 1);
+}
+
+#[test]
+fn test_sized_pools_are_not_kept_for_every_size() {
+    let n_threads = get_num_threads() as i64;
+
+    let first = pool_for(n_threads + 1);
+    assert_eq!(first.current_num_threads(), n_threads as usize + 1);
+
+    let second = pool_for(n_threads + 2);
+    assert_eq!(second.current_num_threads(), n_threads as usize + 2);
+
+    // Only this test still holds the pool of the first size.
+    assert_eq!(std::sync::Arc::strong_count(&first), 1);
+}
+
+#[test]
+fn test_run_batch_reports_progress_and_cancels() {
+    let pool = pool_for(2);
+    let costs = vec![1.; 50];
+    let mut counters = vec![0_u64; CONTROL_SIZE];
+    let runs = AtomicUsize::new(0);
+
+    unsafe { attach_control(counters.as_mut_ptr()) };
+    run_batch(&pool, &costs, 5, |_| {
+        runs.fetch_add(1, Ordering::Relaxed);
+    });
+    assert_eq!(runs.load(Ordering::Relaxed), 50);
+    assert_eq!(counters[..2], [50, 50]);
+
+    // A cancelled batch skips every series, but still counts them.
+    counters[2] = 1;
+    run_batch(&pool, &costs, 5, |_| {
+        runs.fetch_add(1, Ordering::Relaxed);
+    });
+    unsafe { attach_control(std::ptr::null_mut()) };
+
+    assert_eq!(runs.load(Ordering::Relaxed), 50);
+    assert_eq!(counters[..2], [50, 100]);
+
+    // Detached, batches run as usual.
+    run_batch(&pool, &costs, 5, |_| {
+        runs.fetch_add(1, Ordering::Relaxed);
+    });
+    assert_eq!(runs.load(Ordering::Relaxed), 100);
+}
+
+#[test]
+fn test_run_batch_profiles_workers() {
+    let pool = pool_for(2);
+    let costs = vec![1.; 50];
+
+    set_level(Level::Trace);
+    run_batch(&pool, &costs, 5, |i| {
+        std::hint::black_box((0..1000 * i).sum::<usize>());
+    });
+    let json = report(true);
+    set_level(Level::Off);
+
+    assert!(json.starts_with("{\"level\":2,"));
+    assert!(json.contains("\"busy\":{\"calls\":"));
+    assert!(json.contains("\"schedule\":{\"calls\":1,"));
+    assert!(json.contains("\"counters\":{\"series\":"));
+    assert!(json.contains("[\"busy\","));
+
+    // Off, nothing more is recorded, and the events can be left out.
+    run_batch(&pool, &costs, 5, |_| {});
+    assert!(report(false).contains("\"schedule\":{\"calls\":1,"));
+    assert!(!report(false).contains("[\"busy\","));
+
+    // The record of a thread that has exited goes at the next reset.
+    set_level(Level::Stats);
+    std::thread::Builder::new()
+        .name("eokit-exited".to_string())
+        .spawn(|| count("series", 1))
+        .unwrap()
+        .join()
+        .unwrap();
+    assert!(report(false).contains("\"name\":\"eokit-exited\""));
+    reset();
+    assert!(!report(false).contains("\"name\":\"eokit-exited\""));
+    set_level(Level::Off);
+}
@@ -1,4 +1,16 @@
-use EOkit::smoothers::sav_golay::single_sav_golay;
+use std::sync::Arc;
+use EOkit::math_utils::banded::{difference_penalty, SymBandMatrix};
+use EOkit::math_utils::dense::{cholesky, cholesky_solve};
+use EOkit::parallel::status::SeriesStatus;
+use EOkit::smoothers::online_whittaker::online_whittakers;
+use EOkit::smoothers::sav_golay::{
+    multiple_sav_golays, sav_golay_coefficients, single_sav_golay,
+};
+use EOkit::smoothers::whittaker::{
+    multiple_whittakers, multiple_whittakers_robust, smooth_series,
+    smooth_series_auto, whittaker_sparse_reference, Criterion, Reweighting,
+    SelectionBuffers, Spacing,
+};
 
 #[test]
 fn test_sav_golay_filter() {
@@ -49,3 +61,705 @@ fn test_sav_golay_filter() {
         assert!((res - sci).abs() < 1e-8)
     }
 }
+
+#[test]
+fn test_sav_golay_coefficients_are_cached() {
+    let first = sav_golay_coefficients(9, 2, 1, 0.123);
+    let second = sav_golay_coefficients(9, 2, 1, 0.123);
+    let other = sav_golay_coefficients(9, 2, 1, 0.5);
+
+    assert!(Arc::ptr_eq(&first, &second));
+    assert!(!Arc::ptr_eq(&first, &other));
+    assert_eq!(first.len(), 9);
+}
+
+#[test]
+fn test_banded_whittaker_matches_sparse_reference() {
+    let n = 120;
+
+    let x_input: Vec<f64> = (0..n)
+        .map(|i| (i * 5) as f64 + ((i * 7) % 3) as f64)
+        .collect();
+    let y_input: Vec<f64> = (0..n)
+        .map(|i| (i as f64 * 0.15).sin() + ((i * 13) % 7) as f64 * 0.05)
+        .collect();
+    let weights: Vec<f64> =
+        (0..n).map(|i| if i % 9 == 0 { 0. } else { 1. }).collect();
+
+    let mut system = SymBandMatrix::default();
+    let mut output = vec![0.; n];
+
+    for d in 1..4 {
+        for x in [None, Some(&x_input[..])].iter() {
+            let reference =
+                whittaker_sparse_reference(*x, &y_input, &weights, 50., d);
+
+            smooth_series(
+                *x,
+                &y_input,
+                &weights,
+                None,
+                50.,
+                d as usize,
+                &mut system,
+                &mut output,
+            )
+            .unwrap();
+
+            for (banded, sparse) in output.iter().zip(reference.iter()) {
+                assert!((banded - sparse).abs() < 1e-8);
+            }
+        }
+    }
+}
+
+#[test]
+fn test_sav_golay_fits_around_missing_values() {
+    let n = 40;
+
+    // A cubic is reproduced exactly by any local cubic fit, so dropping
+    // samples must not change the filtered values.
+    let complete: Vec<f64> = (0..n)
+        .map(|i| {
+            let x = i as f64 * 0.1;
+            x * x * x - 2. * x + 1.
+        })
+        .collect();
+
+    let mut gappy = complete.clone();
+    gappy[15] = f64::NAN;
+    gappy[22] = f64::INFINITY;
+    gappy[23] = f64::NAN;
+
+    for deriv in 0..3 {
+        let mut expected = vec![0.; n];
+        let mut output = vec![0.; n];
+
+        single_sav_golay(
+            complete.clone().as_mut_ptr(),
+            expected.as_mut_ptr(),
+            n,
+            9,
+            3,
+            deriv,
+            0.5,
+        );
+        single_sav_golay(
+            gappy.as_mut_ptr(),
+            output.as_mut_ptr(),
+            n,
+            9,
+            3,
+            deriv,
+            0.5,
+        );
+
+        for (out, exp) in output.iter().zip(expected.iter()) {
+            assert!((out - exp).abs() < 1e-8 * exp.abs().max(1.));
+        }
+    }
+}
+
+#[test]
+fn test_whittaker_gives_missing_values_zero_weight() {
+    let n = 60;
+
+    let y_input: Vec<f64> = (0..n).map(|i| (i as f64 * 0.2).sin()).collect();
+    let missing = [0, 7, 8, 31, 59];
+
+    let mut gappy = y_input.clone();
+    let mut mask = vec![1_u8; n];
+    let mut zero_weights = vec![1.; n];
+
+    for &i in missing.iter() {
+        gappy[i] = f64::NAN;
+        mask[i] = 0;
+        zero_weights[i] = 0.;
+    }
+
+    let mut system = SymBandMatrix::default();
+    let mut expected = vec![0.; n];
+    let mut from_nans = vec![0.; n];
+    let mut from_mask = vec![0.; n];
+
+    smooth_series(
+        None,
+        &y_input,
+        &zero_weights,
+        None,
+        20.,
+        2,
+        &mut system,
+        &mut expected,
+    )
+    .unwrap();
+    smooth_series(
+        None,
+        &gappy,
+        &vec![1.; n],
+        None,
+        20.,
+        2,
+        &mut system,
+        &mut from_nans,
+    )
+    .unwrap();
+    smooth_series(
+        None,
+        &y_input,
+        &vec![1.; n],
+        Some(&mask),
+        20.,
+        2,
+        &mut system,
+        &mut from_mask,
+    )
+    .unwrap();
+
+    for i in 0..n {
+        assert!(expected[i].is_finite());
+        assert!((from_nans[i] - expected[i]).abs() < 1e-10);
+        assert!((from_mask[i] - expected[i]).abs() < 1e-10);
+    }
+}
+
+#[test]
+fn test_online_whittaker_matches_full_smoothing() {
+    let (n_pixels, n, window) = (3, 70, 12);
+
+    let x_input: Vec<f64> = (0..n)
+        .map(|i| (i * 5) as f64 + ((i * 7) % 3) as f64)
+        .collect();
+    let mut y_input: Vec<f64> = (0..n_pixels * n)
+        .map(|i| (i as f64 * 0.15).sin() + ((i * 13) % 7) as f64 * 0.05)
+        .collect();
+    // A leading gap, and gaps that straddle the batches below.
+    for &i in [0, 1, 30, 31, n + 40, 2 * n + 69].iter() {
+        y_input[i] = f64::NAN;
+    }
+
+    let mut system = SymBandMatrix::default();
+    let mut expected = vec![0.; n];
+
+    for d in 1..4 {
+        for irregular in [false, true].iter() {
+            let width = d + 1;
+            let mut factor = vec![0.; n_pixels * window * width];
+            let mut forward = vec![0.; n_pixels * window];
+            let mut pending = vec![0.; n_pixels * d * width];
+            let mut rhs = vec![0.; n_pixels * d];
+            let mut weight_totals = vec![0.; n_pixels];
+            let mut output = vec![0.; n_pixels * window];
+
+            // Batches of one, of several values, and up to the end.
+            let mut count = 0;
+            for &end in [1, 2, 9, 31, 32, n].iter() {
+                let new_count = end - count;
+                let mut new_y: Vec<f64> = (0..n_pixels)
+                    .flat_map(|p| y_input[p * n + count..p * n + end].to_vec())
+                    .collect();
+                let tail = std::cmp::min(count, d);
+                let mut x_tail = x_input[count - tail..count].to_vec();
+                let mut new_x = x_input[count..end].to_vec();
+                let (x_tail_ptr, new_x_ptr) = if *irregular {
+                    (x_tail.as_mut_ptr(), new_x.as_mut_ptr())
+                } else {
+                    (std::ptr::null_mut(), std::ptr::null_mut())
+                };
+
+                online_whittakers(
+                    x_tail_ptr,
+                    count,
+                    factor.as_mut_ptr(),
+                    forward.as_mut_ptr(),
+                    pending.as_mut_ptr(),
+                    rhs.as_mut_ptr(),
+                    weight_totals.as_mut_ptr(),
+                    n_pixels,
+                    window,
+                    new_x_ptr,
+                    new_y.as_mut_ptr(),
+                    std::ptr::null_mut(),
+                    std::ptr::null_mut(),
+                    new_count,
+                    output.as_mut_ptr(),
+                    50.,
+                    d as i64,
+                    std::ptr::null_mut(),
+                    1,
+                    -1,
+                );
+                count = end;
+
+                if count <= d {
+                    continue;
+                }
+
+                let stored = std::cmp::min(count, window);
+                for p in 0..n_pixels {
+                    smooth_series(
+                        if *irregular {
+                            Some(&x_input[..count])
+                        } else {
+                            None
+                        },
+                        &y_input[p * n..p * n + count],
+                        &vec![1.; count],
+                        None,
+                        50.,
+                        d,
+                        &mut system,
+                        &mut expected[..count],
+                    )
+                    .unwrap();
+
+                    let online = &output[p * window..(p + 1) * window];
+                    for (ours, full) in online[..stored]
+                        .iter()
+                        .zip(expected[count - stored..count].iter())
+                    {
+                        // Both are NaN before the first valid value.
+                        assert!(
+                            (ours - full).abs() < 1e-8
+                                || (ours.is_nan() && full.is_nan())
+                        );
+                    }
+                    assert!(online[stored..].iter().all(|v| v.is_nan()));
+                }
+            }
+        }
+    }
+}
+
+#[test]
+fn test_online_whittaker_reports_pixels_without_values() {
+    let (n_pixels, n, window, d) = (2, 10, 8, 2);
+    let width = d + 1;
+
+    // The second pixel has no valid value at all.
+    let mut new_y: Vec<f64> = (0..n)
+        .map(|i| (i as f64 * 0.3).sin())
+        .chain(vec![f64::NAN; n])
+        .collect();
+    let mut factor = vec![0.; n_pixels * window * width];
+    let mut forward = vec![0.; n_pixels * window];
+    let mut pending = vec![0.; n_pixels * d * width];
+    let mut rhs = vec![0.; n_pixels * d];
+    let mut weight_totals = vec![0.; n_pixels];
+    let mut output = vec![0.; n_pixels * window];
+    let mut statuses = vec![u8::MAX; n_pixels];
+
+    online_whittakers(
+        std::ptr::null_mut(),
+        0,
+        factor.as_mut_ptr(),
+        forward.as_mut_ptr(),
+        pending.as_mut_ptr(),
+        rhs.as_mut_ptr(),
+        weight_totals.as_mut_ptr(),
+        n_pixels,
+        window,
+        std::ptr::null_mut(),
+        new_y.as_mut_ptr(),
+        std::ptr::null_mut(),
+        std::ptr::null_mut(),
+        n,
+        output.as_mut_ptr(),
+        10.,
+        d as i64,
+        statuses.as_mut_ptr(),
+        1,
+        -1,
+    );
+
+    assert_eq!(
+        statuses,
+        vec![SeriesStatus::Ok as u8, SeriesStatus::NonFinite as u8]
+    );
+    assert!(output[..window].iter().all(|v| v.is_finite()));
+    assert!(output[window..].iter().all(|v| v.is_nan()));
+}
+
+/// Dense `(W + lambda DᵀD)⁻¹`, row-major.
+fn dense_inverse(
+    x_input: Option<&[f64]>,
+    weights: &[f64],
+    lambda: f64,
+    d: usize,
+) -> Vec<f64> {
+    let n = weights.len();
+    let mut penalty = SymBandMatrix::default();
+    difference_penalty(x_input, n, d, &mut penalty);
+
+    let mut system = vec![0.; n * n];
+    for i in 0..n {
+        for j in 0..n {
+            system[i * n + j] = lambda * penalty.get(i, j);
+        }
+        system[i * n + i] += weights[i];
+    }
+    cholesky(&mut system, n).unwrap();
+
+    let mut inverse = vec![0.; n * n];
+    for i in 0..n {
+        inverse[i * n + i] = 1.;
+    }
+    cholesky_solve(&system, n, &mut inverse, n);
+    inverse
+}
+
+#[test]
+fn test_inverse_band_matches_dense_inverse() {
+    let n = 50;
+    let x_input: Vec<f64> = (0..n).map(|i| (i * i) as f64 * 0.1).collect();
+    let weights: Vec<f64> =
+        (0..n).map(|i| if i % 4 == 0 { 0. } else { 1. }).collect();
+
+    for d in 1..4 {
+        let expected = dense_inverse(Some(&x_input), &weights, 3., d);
+
+        let mut system = SymBandMatrix::default();
+        difference_penalty(Some(&x_input), n, d, &mut system);
+        system.scale(3.);
+        system.add_diagonal(&weights);
+        system.factorize().unwrap();
+
+        let mut inverse = SymBandMatrix::default();
+        system.inverse_band(&mut inverse);
+
+        for i in 0..n {
+            for j in i.saturating_sub(d)..i + 1 {
+                let dense = expected[i * n + j];
+                assert!(
+                    (inverse.get(i, j) - dense).abs()
+                        < 1e-8 * dense.abs().max(1.)
+                );
+            }
+        }
+    }
+}
+
+#[test]
+fn test_gcv_picks_the_dense_gcv_minimum() {
+    let n = 80;
+    let mut y_input: Vec<f64> = (0..n)
+        .map(|i| {
+            (i as f64 * 0.1).sin() + ((i * 7919) % 23) as f64 * 0.02 - 0.2
+        })
+        .collect();
+    y_input[10] = f64::NAN;
+    let weights = vec![1.; n];
+    let valid: Vec<f64> = y_input
+        .iter()
+        .map(|y| if y.is_finite() { 1. } else { 0. })
+        .collect();
+    let grid: Vec<f64> =
+        (0..25).map(|k| 10_f64.powf(-2. + 0.3 * k as f64)).collect();
+
+    // GCV from the dense hat matrix of every candidate.
+    let scores: Vec<f64> = grid
+        .iter()
+        .map(|lambda| {
+            let inverse = dense_inverse(None, &valid, *lambda, 2);
+            let z: Vec<f64> = (0..n)
+                .map(|i| {
+                    (0..n)
+                        .filter(|j| y_input[*j].is_finite())
+                        .map(|j| inverse[i * n + j] * y_input[j])
+                        .sum()
+                })
+                .collect();
+            let fit: f64 = (0..n)
+                .filter(|i| y_input[*i].is_finite())
+                .map(|i| (y_input[i] - z[i]).powi(2))
+                .sum();
+            let trace: f64 =
+                (0..n).map(|i| valid[i] * inverse[i * n + i]).sum();
+            79. * fit / (79. - trace).powi(2)
+        })
+        .collect();
+    let best = (0..grid.len())
+        .min_by(|a, b| scores[*a].partial_cmp(&scores[*b]).unwrap())
+        .unwrap();
+
+    let mut system = SymBandMatrix::default();
+    let mut buffers = SelectionBuffers::default();
+    let mut output = vec![0.; n];
+    let lambda = smooth_series_auto(
+        Spacing::Even,
+        &y_input,
+        &weights,
+        None,
+        &grid,
+        Criterion::Gcv,
+        2,
+        &mut system,
+        &mut buffers,
+        &mut output,
+    )
+    .unwrap();
+
+    assert_eq!(lambda, grid[best]);
+
+    let mut expected = vec![0.; n];
+    smooth_series(
+        None,
+        &y_input,
+        &weights,
+        None,
+        lambda,
+        2,
+        &mut system,
+        &mut expected,
+    )
+    .unwrap();
+    assert_eq!(output, expected);
+
+    // The V-curve settles between two candidates, away from both ends.
+    let lambda = smooth_series_auto(
+        Spacing::Even,
+        &y_input,
+        &weights,
+        None,
+        &grid,
+        Criterion::VCurve,
+        2,
+        &mut system,
+        &mut buffers,
+        &mut output,
+    )
+    .unwrap();
+    assert!(lambda > grid[0] && lambda < grid[grid.len() - 1]);
+    assert!(!grid.contains(&lambda));
+}
+
+#[test]
+fn test_multiple_whittakers_with_shared_and_per_series_x() {
+    let (n, n_series) = (40, 6);
+    let x: Vec<f64> = (0..n)
+        .map(|i| i as f64 * 4. + ((i * 7) % 5) as f64)
+        .collect();
+    let mut y: Vec<f64> = (0..n * n_series)
+        .map(|k| (x[k % n] / 20. + (k / n) as f64).sin() + 0.01 * k as f64)
+        .collect();
+    let mut weights = vec![1.; n * n_series];
+    let mut indices: Vec<usize> = (0..n_series).map(|s| s * n).collect();
+    let mut x_flat: Vec<f64> = x.repeat(n_series);
+    let mut x_shared = x.clone();
+
+    let mut expected = vec![0.; n * n_series];
+    let mut system = SymBandMatrix::default();
+    for s in 0..n_series {
+        smooth_series(
+            Some(&x),
+            &y[s * n..(s + 1) * n],
+            &weights[s * n..(s + 1) * n],
+            None,
+            10.,
+            2,
+            &mut system,
+            &mut expected[s * n..(s + 1) * n],
+        )
+        .unwrap();
+    }
+
+    for (x_ptr, shared) in
+        vec![(x_flat.as_mut_ptr(), false), (x_shared.as_mut_ptr(), true)]
+    {
+        let mut output = vec![0.; n * n_series];
+        multiple_whittakers(
+            x_ptr,
+            shared,
+            y.as_mut_ptr(),
+            weights.as_mut_ptr(),
+            std::ptr::null_mut(),
+            indices.as_mut_ptr(),
+            n_series,
+            output.as_mut_ptr(),
+            n * n_series,
+            10.,
+            2,
+            std::ptr::null_mut(),
+            2,
+            -1,
+        );
+
+        for (a, b) in output.iter().zip(&expected) {
+            assert!((a - b).abs() < 1e-12, "{} != {}", a, b);
+        }
+    }
+}
+
+#[test]
+fn test_robust_whittaker_matches_refits_from_python() {
+    let n = 60;
+    let truth = |i: usize| 0.5 + 0.3 * (i as f64 / 6.).sin();
+    // Clear values with a little noise, and some cloud dips.
+    let mut y: Vec<f64> = (0..n)
+        .map(|i| truth(i) + 0.02 * (((i * 37) % 11) as f64 / 5. - 1.))
+        .collect();
+    for i in [7, 8, 21, 40, 41, 52].iter() {
+        y[*i] -= 0.3;
+    }
+    y[15] = f64::NAN;
+    let mut weights = vec![1.; n];
+    let mut indices = vec![0];
+
+    // The asymmetric fit as it was run from Python, one smoother call per
+    // iteration with the weights rebuilt in between.
+    let mut expected = vec![0.; n];
+    let mut current = weights.clone();
+    let mut system = SymBandMatrix::default();
+    for pass in 0..4 {
+        smooth_series(
+            None,
+            &y,
+            &current,
+            None,
+            20.,
+            2,
+            &mut system,
+            &mut expected,
+        )
+        .unwrap();
+        if pass < 3 {
+            for i in 0..n {
+                current[i] = if y[i] > expected[i] { 0.95 } else { 0.05 };
+            }
+        }
+    }
+
+    let mut output = vec![0.; n];
+    let mut passes = vec![0_u64];
+    multiple_whittakers_robust(
+        std::ptr::null_mut(),
+        false,
+        y.as_mut_ptr(),
+        weights.as_mut_ptr(),
+        std::ptr::null_mut(),
+        indices.as_mut_ptr(),
+        1,
+        output.as_mut_ptr(),
+        n,
+        20.,
+        2,
+        Reweighting::Asymmetric(0.95),
+        4,
+        0.,
+        passes.as_mut_ptr(),
+        std::ptr::null_mut(),
+        1,
+        -1,
+    );
+
+    assert_eq!(passes[0], 4);
+    for (a, b) in output.iter().zip(&expected) {
+        assert!((a - b).abs() < 1e-12, "{} != {}", a, b);
+    }
+
+    // The envelope and bisquare fits both end up close to the clear values
+    // at the dips, and stop early once the fit settles.
+    for reweighting in vec![Reweighting::Envelope, Reweighting::Bisquare] {
+        multiple_whittakers_robust(
+            std::ptr::null_mut(),
+            false,
+            y.as_mut_ptr(),
+            weights.as_mut_ptr(),
+            std::ptr::null_mut(),
+            indices.as_mut_ptr(),
+            1,
+            output.as_mut_ptr(),
+            n,
+            5.,
+            2,
+            reweighting,
+            50,
+            1e-6,
+            passes.as_mut_ptr(),
+            std::ptr::null_mut(),
+            1,
+            -1,
+        );
+
+        assert!(passes[0] > 1 && passes[0] < 50, "{}", passes[0]);
+        for i in [7, 21, 40, 52].iter() {
+            assert!(
+                (output[*i] - truth(*i)).abs() < 0.05,
+                "{:?} at {}: {} vs {}",
+                reweighting,
+                i,
+                output[*i],
+                truth(*i)
+            );
+        }
+    }
+}
+
+#[test]
+fn test_batches_report_failed_series() {
+    // Too short, nothing valid, then a series that can be smoothed.
+    let lengths = [2, 12, 30];
+    let mut indices = vec![0, 2, 14];
+    let n: usize = lengths.iter().sum();
+    let mut y: Vec<f64> = (0..n).map(|i| (i as f64 / 4.).sin()).collect();
+    y[2..14].iter_mut().for_each(|v| *v = f64::NAN);
+    let mut weights = vec![1.; n];
+
+    let mut output = vec![0.; n];
+    let mut statuses = vec![255u8; 3];
+    multiple_sav_golays(
+        y.as_mut_ptr(),
+        std::ptr::null_mut(),
+        indices.as_mut_ptr(),
+        3,
+        output.as_mut_ptr(),
+        n,
+        5,
+        2,
+        0,
+        1.,
+        statuses.as_mut_ptr(),
+        2,
+        -1,
+    );
+    assert_eq!(
+        statuses,
+        vec![
+            SeriesStatus::TooShort as u8,
+            SeriesStatus::NonFinite as u8,
+            SeriesStatus::Ok as u8
+        ]
+    );
+    assert!(output[..14].iter().all(|v| v.is_nan()));
+    assert!(output[14..].iter().all(|v| v.is_finite()));
+
+    // Negative weights make the last system indefinite.
+    let mut output = vec![0.; n];
+    let mut statuses = vec![255u8; 3];
+    weights[14..].iter_mut().for_each(|w| *w = -1.);
+    multiple_whittakers(
+        std::ptr::null_mut(),
+        false,
+        y.as_mut_ptr(),
+        weights.as_mut_ptr(),
+        std::ptr::null_mut(),
+        indices.as_mut_ptr(),
+        3,
+        output.as_mut_ptr(),
+        n,
+        10.,
+        2,
+        statuses.as_mut_ptr(),
+        2,
+        -1,
+    );
+    assert_eq!(
+        statuses,
+        vec![
+            SeriesStatus::TooShort as u8,
+            SeriesStatus::NonFinite as u8,
+            SeriesStatus::SolverFailure as u8
+        ]
+    );
+    assert!(output.iter().all(|v| v.is_nan()));
+}
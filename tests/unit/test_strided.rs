@@ -0,0 +1,75 @@
+use EOkit::parallel::encoded::{EncodedArray, Encoding};
+use EOkit::parallel::strided::StridedLayout;
+
+#[test]
+fn test_strided_layout_offsets() {
+    // A C contiguous (time, y, x) = (4, 2, 3) cube, smoothed along time.
+    let layout = StridedLayout::new(&[4, 2, 3], &[6, 3, 1], 0);
+
+    assert_eq!(layout.n_series(), 6);
+    assert_eq!(layout.series_length(), 4);
+
+    let offsets: Vec<isize> =
+        (0..6).map(|series| layout.series_offset(series)).collect();
+    assert_eq!(offsets, vec![0, 1, 2, 3, 4, 5]);
+
+    // The same cube reversed along x, as from cube[:, :, ::-1].
+    let reversed = StridedLayout::new(&[4, 2, 3], &[6, 3, -1], 0);
+    let offsets: Vec<isize> = (0..6)
+        .map(|series| reversed.series_offset(series))
+        .collect();
+    assert_eq!(offsets, vec![0, -1, -2, 3, 2, 1]);
+}
+
+#[test]
+fn test_strided_gather_scatter() {
+    // (pixels, time) = (2, 3), smoothed along time.
+    let values: Vec<f64> = vec![0., 1., 2., 10., 11., 12.];
+    let layout = StridedLayout::new(&[2, 3], &[3, 1], 1);
+
+    let mut series = Vec::new();
+    unsafe { layout.gather(values.as_ptr(), 1, &mut series) };
+    assert_eq!(series, vec![10., 11., 12.]);
+
+    // Write it transposed into a (time, pixels) buffer.
+    let mut output = vec![0.; 6];
+    let transposed = StridedLayout::new(&[3, 2], &[2, 1], 0);
+    unsafe { transposed.scatter(output.as_mut_ptr(), 1, &series) };
+    assert_eq!(output, vec![0., 10., 0., 11., 0., 12.]);
+}
+
+#[test]
+fn test_encoded_gather_scatter() {
+    // (pixels, time) = (2, 3) of NDVI stored as int16 with a scale of 1e-4
+    // and -3000 for nodata.
+    let mut values: Vec<i16> = vec![1000, -3000, 5000, 2500, 9000, -3000];
+    let layout = StridedLayout::new(&[2, 3], &[3, 1], 1);
+    let encoding = Encoding::from_raw(2, 1e-4, 0., -3000.);
+    let array = EncodedArray::new(values.as_mut_ptr() as *mut u8, encoding);
+
+    let mut series: Vec<f64> = Vec::new();
+    unsafe { array.gather(&layout, 0, &mut series) };
+    assert!((series[0] - 0.1).abs() < 1e-12);
+    assert!(series[1].is_nan());
+    assert!((series[2] - 0.5).abs() < 1e-12);
+
+    // Values are rounded, clamped and missing ones become nodata again.
+    unsafe { array.scatter(&layout, 1, &[0.12346, 4., f64::NAN]) };
+    assert_eq!(values[3..], [1235, i16::MAX, -3000]);
+
+    // float32 in, float32 out, through a float32 series.
+    let mut singles: Vec<f32> = vec![0.25, f32::NAN];
+    let single_layout = StridedLayout::new(&[2], &[1], 0);
+    let singles_array = EncodedArray::new(
+        singles.as_mut_ptr() as *mut u8,
+        Encoding::from_raw(1, 1., 0., f64::NAN),
+    );
+
+    let mut single_series: Vec<f32> = Vec::new();
+    unsafe { singles_array.gather(&single_layout, 0, &mut single_series) };
+    assert_eq!(single_series[0], 0.25);
+    assert!(single_series[1].is_nan());
+
+    unsafe { singles_array.scatter(&single_layout, 0, &[0.5_f32, 1.5]) };
+    assert_eq!(singles, vec![0.5, 1.5]);
+}